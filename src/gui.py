@@ -27,12 +27,12 @@ def main():
     context.setContextProperty('dpManager', dpmanager)
     idsmanager = TwoStageIDSManager()
     context.setContextProperty('idsManager', idsmanager)
-    reportmanager = ReportManager()
+    baselogmodel = BaseOutputLogModel()
+    reportmanager = ReportManager(idsmanager, baselogmodel)
     context.setContextProperty('reportManager', reportmanager)
     simulationmanager = SimulationManager(idsmanager)
     context.setContextProperty('simManager', simulationmanager)
 
-    baselogmodel = BaseOutputLogModel()
     outputlogmodel = OutputLogModel()
     outputlogmodel.setDynamicSortFilter(True)
     outputlogmodel.setSourceModel(baselogmodel)
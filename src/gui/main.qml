@@ -474,11 +474,17 @@ ApplicationWindow {
                                     }
                                 }
 
+                                CheckBox {
+                                    id: rulesIncremental
+                                    text: qsTr("Add to Existing Rules")
+                                    enabled: idsManager.parameters["Rules Trained"]
+                                }
+
                                 Button {
                                     text: qsTr("Train")
                                     enabled: idsManager.parameters["Model Name"] !== "No Model" && rulesTrainingDataset.currentText
                                     onClicked: {
-                                        idsManager.train_rules(rulesTrainingDataset.currentText)
+                                        idsManager.train_rules(rulesTrainingDataset.currentText, rulesIncremental.checked && rulesIncremental.enabled)
                                     }
                                 }
                             }
@@ -508,11 +514,17 @@ ApplicationWindow {
                                     }
                                 }
 
+                                CheckBox {
+                                    id: dnnIncremental
+                                    text: qsTr("Only New Data (Fine-Tune)")
+                                    enabled: idsManager.parameters["DNN Trained"]
+                                }
+
                                 Button {
                                     text: qsTr("Train")
                                     enabled: (idsManager.parameters["Model Name"] !== "No Model") && dnnTrainingDataset.currentText && dnnTrainingNumSteps.field.acceptableInput
                                     onClicked: {
-                                        idsManager.train_dnn(rulesTrainingDataset.currentText, dnnTrainingNumSteps.text)
+                                        idsManager.train_dnn(dnnTrainingDataset.currentText, dnnTrainingNumSteps.text, dnnIncremental.checked && dnnIncremental.enabled)
                                     }
                                 }
                             }
@@ -840,6 +852,89 @@ ApplicationWindow {
                                     }
                                 }
 
+                                Text {
+                                    text: qsTr("Per Second: frames (bars), malicious caught (line)")
+                                }
+
+                                Canvas {
+                                    id: rollingChart
+                                    width: 285
+                                    height: 80
+                                    property var rolling: reportManager.rollingMetrics
+                                    onRollingChanged: requestPaint()
+
+                                    onPaint: {
+                                        var ctx = getContext("2d")
+                                        ctx.clearRect(0, 0, width, height)
+                                        var frames = rolling.frames
+                                        if (!frames || frames.length === 0) {
+                                            return
+                                        }
+                                        var maxFrames = Math.max.apply(null, frames.concat([1]))
+                                        var step = width / frames.length
+                                        ctx.fillStyle = "#b0b0b0"
+                                        for (var i = 0; i < frames.length; i++) {
+                                            var barHeight = frames[i] / maxFrames * height
+                                            ctx.fillRect(i * step, height - barHeight, Math.max(step - 1, 1), barHeight)
+                                        }
+                                        ctx.strokeStyle = "#c0392b"
+                                        ctx.lineWidth = 2
+                                        ctx.beginPath()
+                                        for (var j = 0; j < frames.length; j++) {
+                                            var y = height - rolling.recall[j] * height
+                                            if (j === 0) {
+                                                ctx.moveTo(j * step + step / 2, y)
+                                            } else {
+                                                ctx.lineTo(j * step + step / 2, y)
+                                            }
+                                        }
+                                        ctx.stroke()
+                                    }
+                                }
+
+                                Button {
+                                    text: qsTr("Save Rolling Metrics")
+                                    onClicked: saveRollingFileDialog.open()
+                                }
+
+                                FileDialog {
+                                    id: saveRollingFileDialog
+                                    title: qsTr("Save Rolling Metrics")
+                                    selectMultiple: false
+                                    selectExisting: false
+                                    nameFilters: ["CSV files (*.csv)"]
+                                    onAccepted: reportManager.save_rolling_metrics(fileUrl)
+                                }
+
+                                Row {
+                                    spacing: 5
+
+                                    ComboBox {
+                                        id: evaluationDataset
+                                        model: dpManager.availableDatasets
+                                    }
+
+                                    Button {
+                                        text: qsTr("Evaluate Dataset")
+                                        enabled: idsManager.parameters["Rules Trained"] && idsManager.parameters["DNN Trained"] && evaluationDataset.currentText && startButton.enabled
+                                        onClicked: reportManager.evaluate_dataset(evaluationDataset.currentText)
+                                    }
+                                }
+
+                                Button {
+                                    text: qsTr("Load Evaluation")
+                                    onClicked: loadEvaluationFileDialog.open()
+                                }
+
+                                FileDialog {
+                                    id: loadEvaluationFileDialog
+                                    title: qsTr("Load Evaluation")
+                                    selectMultiple: false
+                                    selectExisting: true
+                                    nameFilters: ["JSON files (*.json)"]
+                                    onAccepted: reportManager.load_evaluation(fileUrl)
+                                }
+
                                 Dialog {
                                     id: saveReportDialog
                                     title: qsTr("Save Report?")
@@ -855,6 +950,47 @@ ApplicationWindow {
                                             id: saveCANLog
                                             text: qsTr("Save CAN Log with Results")
                                         }
+
+                                        Row {
+                                            spacing: 5
+
+                                            CheckBox {
+                                                id: saveVerdictFile
+                                                text: qsTr("Save Verdict File")
+                                            }
+
+                                            ComboBox {
+                                                id: verdictFileCompression
+                                                enabled: saveVerdictFile.checked
+                                                model: ["none", "gzip", "lzma"]
+                                            }
+                                        }
+
+                                        Row {
+                                            spacing: 5
+
+                                            Text {
+                                                anchors.verticalCenter: parent.verticalCenter
+                                                text: qsTr("Only frames from (s)")
+                                            }
+
+                                            TextField {
+                                                id: saveReportStart
+                                                width: 60
+                                                validator: DoubleValidator { bottom: 0 }
+                                            }
+
+                                            Text {
+                                                anchors.verticalCenter: parent.verticalCenter
+                                                text: qsTr("to (s)")
+                                            }
+
+                                            TextField {
+                                                id: saveReportStop
+                                                width: 60
+                                                validator: DoubleValidator { bottom: 0 }
+                                            }
+                                        }
                                     }
 
                                     onYes: {
@@ -869,26 +1005,57 @@ ApplicationWindow {
                                     selectExisting: false
                                     // When the user clicks OK to select the files...
                                     onAccepted: {
-                                        if (saveCANLog.checked) {
-                                            var outputLogText = []
-                                            for (var i = 0; i < outputLogModel.count; i++) {
-                                                var result = outputLogModel.get(i)
-                                                outputLogText.push(
-                                                    outputLogView.getText(
-                                                        result["Label"],
-                                                        result["Frame"],
-                                                        result["Judgement"],
-                                                        result["Reason"]
-                                                    )
-                                                )
-                                            }
-                                            reportManager.save_report(fileUrl, outputLogText)
-                                        }
-                                        else {
-                                            reportManager.save_report(fileUrl, null)
-                                        }
+                                        reportManager.save_report(fileUrl, saveCANLog.checked, {
+                                            "start": saveReportStart.text,
+                                            "stop": saveReportStop.text,
+                                            "verdictFile": saveVerdictFile.checked,
+                                            "compression": verdictFileCompression.currentText
+                                        })
+                                    }
+                                }
+                            }
+                        }
+
+                        //Performance - live throughput and time taken by each stage of the IDS
+                        GroupBox {
+                            title: qsTr("Performance")
+
+                            Column {
+                                spacing: 5
+
+                                CheckBox {
+                                    id: profileStages
+                                    text: qsTr("Profile IDS Stages")
+                                    onCheckedChanged: simManager.set_profiling(checked)
+                                }
+
+                                Text {
+                                    visible: profileStages.checked
+                                    text: "Throughput: " + simManager.profile.frames_per_sec.toFixed(1) + " frames/s"
+                                }
+
+                                Repeater {
+                                    model: profileStages.checked ? simManager.profile.stages : []
+                                    delegate: Text {
+                                        text: modelData.stage + ": " + modelData.mean_ms.toFixed(3) + " ms avg, "
+                                              + modelData.max_ms.toFixed(3) + " ms max, "
+                                              + (modelData.share*100).toFixed(1) + "% of time"
                                     }
                                 }
+
+                                Button {
+                                    text: qsTr("Save Latency Report")
+                                    onClicked: saveLatencyFileDialog.open()
+                                }
+
+                                FileDialog {
+                                    id: saveLatencyFileDialog
+                                    title: qsTr("Save Latency Report")
+                                    selectMultiple: false
+                                    selectExisting: false
+                                    nameFilters: ["JSON files (*.json)"]
+                                    onAccepted: reportManager.save_latency_report(fileUrl)
+                                }
                             }
                         }
                     }
@@ -1463,16 +1630,6 @@ ApplicationWindow {
                                             model: outputLogModel
                                             delegate: outputLogDelegate
 
-                                            function getText(modelLabel, modelFrame, modelJudgement, modelReason) {
-                                                var text = ""
-                                                text += modelLabel.charAt(0).toUpperCase() + modelLabel.slice(1) + " Frame, "
-                                                text += "ID " + modelFrame["id"] + " "
-                                                text += "marked as " + (modelJudgement ? "malicious" : "benign")
-                                                text += (modelReason ? " by " + modelReason : "")
-                                                text += "."
-                                                return text
-                                            }
-
                                             ScrollBar.vertical: ScrollBar {
                                                 parent: outputLogView.parent
                                                 anchors.top: parent.top
@@ -1489,7 +1646,8 @@ ApplicationWindow {
                                         id: outputLogDelegate
 
                                         Text {
-                                            text: outputLogView.getText(label, frame, judgement, reason)
+                                            // Formatted by output_log_model.judgement_text
+                                            text: description
                                         }
                                     }
 
@@ -1,18 +1,44 @@
 from PyQt5.QtCore import QObject, pyqtSignal, pyqtSlot, pyqtProperty, QVariant, QSortFilterProxyModel, QModelIndex, QAbstractListModel, Qt
 from PyQt5.QtQml import QJSValue
 
+from ids.malicious import MaliciousGenerator
+
+
+def reason_text(reason):
+    if isinstance(reason, float):
+        return f'DNN Based IDS (confidence {reason})'
+    elif isinstance(reason, str):
+        return f'Rules Based IDS ({reason} rule)'
+    else:
+        return None
+
+
+# The line for a judgement in the output log, as shown in the GUI.
+def judgement_text(judgement):
+    label = judgement['Label'] or 'benign'
+    text = f"{label[:1].upper() + label[1:]} Frame, ID {judgement['Frame']['id']} "
+    text += 'marked as ' + ('malicious' if judgement['Judgement'] else 'benign')
+    reason = reason_text(judgement['Reason'])
+    if reason:
+        text += ' by ' + reason
+    return text + '.'
+
+
 # Based off of https://github.com/baoboa/pyqt5/tree/master/examples/quick/models/abstractitemmodel
 class BaseOutputLogModel(QAbstractListModel):
     FrameRole = Qt.UserRole + 1
     LabelRole = Qt.UserRole + 2
     JudgementRole = Qt.UserRole + 3
     ReasonRole = Qt.UserRole + 4
+    # The line shown for the judgement in the output log, see judgement_text.
+    DescriptionRole = Qt.UserRole + 5
 
     _roles = {
         FrameRole: b'frame',
         LabelRole: b'label',
         JudgementRole: b'judgement',
-        ReasonRole: b'reason'
+        ReasonRole: b'reason',
+        DescriptionRole: b'description'
     }
 
     def __init__(self, parent=None):
@@ -29,6 +55,12 @@ class BaseOutputLogModel(QAbstractListModel):
         self._judgements = []
         self.endRemoveRows()
 
+    # Iterate over the judgements a chunk at a time, without copying the
+    # whole log.
+    def chunks(self, chunk_size):
+        for start in range(0, len(self._judgements), chunk_size):
+            yield self._judgements[start:start + chunk_size]
+
     def rowCount(self, parent=QModelIndex()):
         return len(self._judgements)
 
@@ -49,13 +81,12 @@ class BaseOutputLogModel(QAbstractListModel):
         elif role == self.JudgementRole:
             return judgement['Judgement']
         elif role == self.ReasonRole:
-            reason = judgement['Reason']
-            if isinstance(reason, float):
-                return f'DNN Based IDS (confidence {reason})'
-            elif isinstance(reason, str):
-                return f'Rules Based IDS ({reason} rule)'
-            else:
+            reason = reason_text(judgement['Reason'])
+            if reason is None:
                 return QVariant()
+            return reason
+        elif role == self.DescriptionRole:
+            return judgement_text(judgement)
         else:
             return QVariant()
 
@@ -71,12 +102,11 @@ class OutputLogModel(QSortFilterProxyModel):
             'true_negative': True,
             'false_positive': True,
             'false_negative': True,
-            'benign': True,
-            'random': True,
-            'replay': True,
-            'spoof': True,
-            'flood': True
+            'benign': True
         }
+        # One filter for each attack in the roster of the malicious generator.
+        for label in MaliciousGenerator().labels[1:]:
+            self._filters[label] = True
 
     @pyqtSlot(str, bool)
     def change_filter(self, filter_name, value):
@@ -21,7 +21,8 @@ class DataPreprocessorManager(QObject):
         # extension).
         self._available_idprobs = []
         for filename in os.listdir(idprobs_dir):
-            if filename != '.gitignore':
+            # Skip the .npz raw ID count files stored next to each one.
+            if filename.endswith('.json'):
                 self._available_idprobs.append(filename.replace('.json', ''))
 
         # Enumerate all available dataset names.
@@ -55,28 +56,40 @@ class DataPreprocessorManager(QObject):
     # arguments. Here, list_of_can_files is a list of QUrl objects.
     @pyqtSlot(QVariant, str)
     def create_idprobs_file(self, list_of_can_files, idprobs_name):
-        canlist = []
-        # Here, each entry in `list_of_can_files` is a QUrl.
-        for file_url in list_of_can_files:
+        # The files are parsed and counted in parallel, and only the ID counts
+        # are sent back, so the frames of every file are never held at once.
+        dp.write_id_probs_from_files(self._file_paths(list_of_can_files),
+                                     idprobs_dir + '/' + idprobs_name + '.json')
+        # After writing the file, update the available ID probs files by
+        # appending to the list and then emitting the "notify" signal.
+        self._available_idprobs.append(idprobs_name)
+        self.get_availableIdprobs.emit()
+
+    # Add the IDs in more CAN frame files to an existing ID probabilities
+    # file, without having to count the files it was made from again.
+    @pyqtSlot(QVariant, str)
+    def update_idprobs_file(self, list_of_can_files, idprobs_name):
+        if idprobs_name not in self._available_idprobs:
+            raise ValueError(f'There is no ID probabilities file named {idprobs_name}.')
+        dp.write_id_probs_from_files(self._file_paths(list_of_can_files),
+                                     idprobs_dir + '/' + idprobs_name + '.json',
+                                     update=True)
+
+    @staticmethod
+    def _file_paths(list_of_file_urls):
+        file_paths = []
+        # Here, each entry in `list_of_file_urls` is a QUrl.
+        for file_url in list_of_file_urls:
             # toString() returns 'file://<actual file path>', so strip the
             # beginning and open the rest.
             if platform.system() == 'Windows':
                 file_path = file_url.toString()[8:]
             else:
                 file_path = file_url.toString()[7:]
-            if file_path.endswith('.traffic'):
-                canlist += dp.parse_traffic(file_path)
-            elif file_path.endswith('.csv'):
-                canlist += dp.parse_csv(file_path)
-            elif file_path.endswith('.json'):
-                canlist += dp.load_canlist(file_path)
-            else:
+            if not file_path.endswith(('.traffic', '.csv', '.json')):
                 raise ValueError(f'Unknown type of CAN frame file provided: {file_path}.')
-        dp.write_id_probs(canlist, idprobs_dir + '/' + idprobs_name + '.json')
-        # After writing the file, update the available ID probs files by
-        # appending to the list and then emitting the "notify" signal.
-        self._available_idprobs.append(idprobs_name)
-        self.get_availableIdprobs.emit()
+            file_paths.append(file_path)
+        return file_paths
 
     # Set up creation of a dataset, which involves writing the good CAN frame
     # file, CAN frame file with malicious frames injected, and the feature lists
@@ -99,7 +112,12 @@ class DataPreprocessorManager(QObject):
         else:
             raise ValueError(f'Unknown type of CAN frame file provided: {file_path}.')
 
-        idprobs = dp.load_id_probs(idprobs_dir + '/' + idprobs_name + '.json')
+        # Check the capture before doing any work with it.
+        columns, report = dp.validate_canlist(canlist)
+        if not report['valid']:
+            raise ValueError(dp.validation_summary(report))
+
+        idprobs = dp.load_id_prob_table(idprobs_dir + '/' + idprobs_name + '.json')
 
         # Create a folder under the 'datasets' folder with the name being the
         # name of the dataset. This is where all the relevant files for the
@@ -112,12 +130,16 @@ class DataPreprocessorManager(QObject):
         # Create the CAN frame file with malicious frames injected.
         malgen = MaliciousGenerator()
         malgen.adjust(malgen_probs)
-        bad_canlist, labels = dp.inject_malicious_packets(canlist, malgen)
+        bad_columns, label_codes = dp.inject_malicious_columns(
+            columns, malgen)
+        bad_canlist = dp.columns_to_canlist(bad_columns)
         dp.write_canlist(bad_canlist, dataset_folder + '/bad_canlist.json')
 
         # Create the feature lists/labels file.
         features = dp.generate_feature_lists(bad_canlist, idprobs)
-        dp.write_feature_lists(features, labels, dataset_folder + '/features_labels.json')
+        dp.write_feature_file(features, label_codes,
+                              dataset_folder + '/features_labels.bin',
+                              malgen.labels)
         # Update the available datasets.
         self._available_datasets.append(dataset_name)
         self.get_availableDatasets.emit()
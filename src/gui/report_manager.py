@@ -1,141 +1,170 @@
 from PyQt5.QtCore import QObject, pyqtSignal, pyqtSlot, pyqtProperty, QVariant, QUrl
 from PyQt5.QtQml import QJSValue
 
+import ids.evaluation
+import ids.preprocessor as dp
+from ids.evaluation import TIMESTAMPS_PER_SECOND
+from ids.malicious import MaliciousGenerator
+from ids.verdict_log import write_verdict_log
+from gui.output_log_model import judgement_text
+
+import json
+import os
 import platform
+import numpy as np
+
+# Set up directories.
+savedata_dir = os.path.dirname(os.path.abspath(__file__)) + '/../../savedata'
+datasets_dir = savedata_dir + '/datasets'
+
+# How many of the most recent per-second bins the GUI charts.
+ROLLING_CHART_BINS = 120
+# How many judgements of the output log are exported at a time.
+LOG_CHUNK_SIZE = 2**14
 
-# We will occasionally divide 0/0, in which case we want to return 0.
-def safe_div(num1, num2):
-    if num1 == 0 and num2 == 0:
-        return 0.0
+# The names the report gives the attacks of the malicious generator. Attacks
+# that are not listed here are named after their roster entry.
+attack_display_names = {
+    'random': 'Random Attack',
+    'replay': 'Replay Attack',
+    'flood': 'DoS Attack',
+    'spoof': 'Spoofing Attack'
+}
+
+
+def url_to_path(file_url):
+    if platform.system() == 'Windows':
+        return file_url.toString()[8:]
     else:
-        # There will never be a case where we divide <nonzero>/0, so this is safe.
-        return num1 / num2
+        return file_url.toString()[7:]
+
 
 class ReportManager(QObject):
-    def __init__(self):
+    def __init__(self, ids_manager=None, output_log=None):
         # Required line for anything that inherits from QObject.
         QObject.__init__(self)
 
-        self._statistics = {
-            'total': 0,
-            'total_benign': 0,
-            'total_malicious': 0,
-            'true_positive': 0,
-            'true_negative': 0,
-            'false_positive': 0,
-            'false_negative': 0,
-            'random': {
-                'total': 0,
-                'true_positive': 0
-            },
-            'replay': {
-                'total': 0,
-                'true_positive': 0
-            },
-            'flood': {
-                'total': 0,
-                'true_positive': 0
-            },
-            'spoof': {
-                'total': 0,
-                'true_positive': 0
-            }
-        }
+        # The TwoStageIDSManager whose latencies are included in reports.
+        self._ids_manager = ids_manager
+        # The BaseOutputLogModel holding the judgements of the simulation.
+        self._output_log = output_log
+
+        # The attack categories come from the roster of the malicious
+        # generator, indexed by label code.
+        self._roster_labels = MaliciousGenerator().labels
+        self._labels = self._roster_labels
+        self._label_codes = {label: code for code, label in enumerate(self._labels)}
+        # The number of frames of each label that were passed and that were
+        # judged malicious. See ids.evaluation.count_matrix.
+        self._counts = np.zeros((len(self._labels), 2), dtype=np.int64)
+        # Which stage of the IDS caught the frames, for evaluated datasets.
+        self._detections = None
+        # The metrics of each second of the simulated capture.
+        self._rolling = ids.evaluation.RollingMetrics(self._roster_labels)
 
     get_statistics = pyqtSignal()
+    get_rolling_metrics = pyqtSignal()
+
+    # The most recent per-second bins of the simulation, for the chart. Only
+    # updated when a new second starts.
+    @pyqtProperty(QVariant, notify=get_rolling_metrics)
+    def rollingMetrics(self):
+        return self._rolling.series(last=ROLLING_CHART_BINS)
+
+    @property
+    def evaluation(self):
+        results = ids.evaluation.summarize(self._counts, self._labels)
+        if self._detections is not None:
+            results['detections'] = self._detections
+        return results
 
     @pyqtProperty(QVariant, notify=get_statistics)
     def statistics(self):
-        stats = self._statistics
-        precision = safe_div(stats['true_positive'], stats['true_positive'] + stats['false_positive'])
-        recall = safe_div(stats['true_positive'], stats['total_malicious'])
-        return [
-            {
-                'stat': 'Accuracy',
-                'value': safe_div(stats['true_positive'] + stats['true_negative'], stats['total'])
-            },
-            {
-                'stat': 'Benign Passed',
-                'value': safe_div(stats['true_negative'], stats['total_benign'])
-            },
-            {
-                'stat': 'Malicious Caught',
-                'value': safe_div(stats['true_positive'], stats['total_malicious'])
-            },
-            {
-                'stat': 'False Positives',
-                'value': safe_div(stats['false_positive'], stats['total_benign'])
-            },
-            {
-                'stat': 'False Negatives',
-                'value': safe_div(stats['false_negative'], stats['total_malicious'])
-            },
-            {
-                'stat': 'Random Attack Caught',
-                'value': safe_div(stats['random']['true_positive'], stats['random']['total'])
-            },
-            {
-                'stat': 'Replay Attack Caught',
-                'value': safe_div(stats['replay']['true_positive'], stats['replay']['total'])
-            },
-            {
-                'stat': 'DoS Attack Caught',
-                'value': safe_div(stats['flood']['true_positive'], stats['flood']['total'])
-            },
-            {
-                'stat': 'Spoofing Attack Caught',
-                'value': safe_div(stats['spoof']['true_positive'], stats['spoof']['total'])
-            },
-            {
-                'stat': 'F1 Score',
-                'value': safe_div(2 * precision * recall, precision + recall)
-            }
+        results = self.evaluation
+        statistics = [
+            {'stat': 'Accuracy', 'value': results['accuracy']},
+            {'stat': 'Benign Passed', 'value': results['benign_passed']},
+            {'stat': 'Malicious Caught', 'value': results['recall']},
+            {'stat': 'False Positives', 'value': results['false_positive_rate']},
+            {'stat': 'False Negatives', 'value': results['false_negative_rate']}
         ]
+        for name, attack in results['attacks'].items():
+            display_name = attack_display_names.get(name, name.title() + ' Attack')
+            statistics.append({'stat': display_name + ' Caught', 'value': attack['recall']})
+        statistics.append({'stat': 'F1 Score', 'value': results['f1']})
+        return statistics
 
     @pyqtSlot()
     def reset_statistics(self):
-        for key in self._statistics.keys():
-            if isinstance(self._statistics[key], dict):
-                for sub_key in self._statistics[key]:
-                    self._statistics[key][sub_key] = 0
-            else:
-                self._statistics[key] = 0
+        self._labels = self._roster_labels
+        self._label_codes = {label: code for code, label in enumerate(self._labels)}
+        self._counts = np.zeros((len(self._labels), 2), dtype=np.int64)
+        self._detections = None
+        self._rolling = ids.evaluation.RollingMetrics(self._labels)
         self.get_statistics.emit()
+        self.get_rolling_metrics.emit()
 
     @pyqtSlot(QJSValue)
     def update_statistics(self, judgement_result):
         judgement_result = judgement_result.toVariant()
+        # The label is None for benign frames, else the name of the attack.
+        label_code = self._label_codes[judgement_result['Label'] or None]
+        self._counts[label_code, int(bool(judgement_result['Judgement']))] += 1
+        self.get_statistics.emit()
+        if self._rolling.record(int(judgement_result['Frame']['timestamp']), label_code,
+                                judgement_result['Judgement'], judgement_result.get('Latency')):
+            self.get_rolling_metrics.emit()
 
-        self._statistics['total'] += 1
-
-        label = judgement_result['Label']
-        is_malicious = bool(label) # False if label == None, True otherwise.
-        if is_malicious:
-            self._statistics['total_malicious'] += 1
-            self._statistics[label]['total'] += 1
+    # Judge a whole dataset at once with the loaded model, without running a
+    # simulation, and show the results.
+    @pyqtSlot(str)
+    def evaluate_dataset(self, dataset_name):
+        dataset_dir = datasets_dir + '/' + dataset_name
+        canlist = dp.load_canlist(dataset_dir + '/bad_canlist.json')
+        if os.path.exists(dataset_dir + '/features_labels.bin'):
+            features, label_codes = dp.load_feature_lists(dataset_dir + '/features_labels.bin')
         else:
-            self._statistics['total_benign'] += 1
-
-        judge_malicious = judgement_result['Judgement']
-        if not is_malicious and not judge_malicious:
-            self._statistics['true_negative'] += 1
-        elif is_malicious and judge_malicious:
-            self._statistics['true_positive'] += 1
-            self._statistics[label]['true_positive'] += 1
-        elif not is_malicious and judge_malicious:
-            self._statistics['false_positive'] += 1
-        elif is_malicious and not judge_malicious:
-            self._statistics['false_negative'] += 1
+            # Older datasets only have the JSON feature file, which holds the
+            # label names instead of label codes.
+            features, labels = dp.load_feature_lists(dataset_dir + '/features_labels.json')
+            label_codes = [self._roster_labels.index(label) for label in labels]
+        two_stage = self._ids_manager._ids
+        rule_names = list(two_stage.rules.roster)
+        verdicts, rule_codes, _ = ids.evaluation.verdict_codes(
+            two_stage.judge_dataset(canlist, features), rule_names)
+        self._set_evaluation(ids.evaluation.evaluate(
+            label_codes, verdicts, self._roster_labels, rule_codes, rule_names))
+        self._rolling.record_many([frame['timestamp'] for frame in canlist], label_codes, verdicts)
+        self.get_rolling_metrics.emit()
 
+    # Show the results written by python -m ids.evaluation.
+    @pyqtSlot(QVariant)
+    def load_evaluation(self, file_url):
+        with open(url_to_path(file_url)) as file:
+            self._set_evaluation(json.load(file))
+
+    def _set_evaluation(self, results):
+        # Label code 0 is benign, which the malicious generator calls None.
+        self._labels = [None] + results['labels'][1:]
+        self._label_codes = {label: code for code, label in enumerate(self._labels)}
+        self._counts = np.array(results['counts'], dtype=np.int64).reshape(-1, 2)
+        self._detections = results.get('detections')
+        # The per-second bins of the results are not saved.
+        self._rolling = ids.evaluation.RollingMetrics(self._labels)
         self.get_statistics.emit()
+        self.get_rolling_metrics.emit()
 
-    @pyqtSlot(QVariant, QVariant)
-    def save_report(self, file_url, output_log):
-        output_log = output_log.toVariant()
-        if platform.system() == 'Windows':
-            file_path = file_url.toString()[8:]
-        else:
-            file_path = file_url.toString()[7:]
+    # Save the statistics to a text report. The output log is read straight
+    # from the log model a chunk at a time rather than passed in from QML.
+    # options holds the 'start' and 'stop' of the judgements to export, in
+    # seconds from the first frame of the simulation (blank for no limit),
+    # whether to also write a 'verdictFile' next to the report, and its
+    # 'compression'.
+    @pyqtSlot(QVariant, bool, QJSValue)
+    def save_report(self, file_url, include_log, options):
+        options = options.toVariant()
+        file_path = url_to_path(file_url)
+        start, stop = self._time_range(options)
 
         with open(file_path, 'w') as report_file:
             report_file.write('Statistics:\n')
@@ -143,7 +172,75 @@ class ReportManager(QObject):
                 stat, value = entry['stat'], entry['value']
                 report_file.write(f'{stat}: {value:.2%}\n')
 
-            if output_log:
+            if self._detections is not None:
+                report_file.write('\nDetections by Stage:\n')
+                labels = self.evaluation['labels']
+                for label, counts in zip(labels, self._detections['counts']):
+                    stages = ', '.join(f'{stage} {count}' for stage, count in
+                                       zip(self._detections['stages'], counts))
+                    report_file.write(f'{label}: {stages}\n')
+
+            if self._ids_manager is not None:
+                report_file.write('\nLatency (ingest to verdict):\n')
+                for path, summary in self._ids_manager._ids.latency_summary().items():
+                    if not summary['count']:
+                        continue
+                    report_file.write(
+                        f"{path}: {summary['count']} frames, "
+                        f"p50 {summary['p50'] * 1000:.3f} ms, "
+                        f"p95 {summary['p95'] * 1000:.3f} ms, "
+                        f"p99 {summary['p99'] * 1000:.3f} ms, "
+                        f"max {summary['max'] * 1000:.3f} ms\n")
+
+            if self._rolling.series()['time']:
+                report_file.write('\nRolling Metrics (per second):\n')
+                self._rolling.write_csv(report_file)
+
+            if include_log and self._output_log is not None:
                 report_file.write('\nJudgement Results:\n')
-                for line in output_log:
-                    report_file.write(f'{line}\n')
+                for chunk in self._output_log.chunks(LOG_CHUNK_SIZE):
+                    lines = [judgement_text(judgement) for judgement in chunk
+                             if self._in_time_range(judgement, start, stop)]
+                    if lines:
+                        report_file.write('\n'.join(lines) + '\n')
+
+        if options.get('verdictFile') and self._output_log is not None:
+            compression = options.get('compression') or None
+            if compression == 'none':
+                compression = None
+            extension = {None: '', 'gzip': '.gz', 'lzma': '.xz'}[compression]
+            write_verdict_log(
+                (judgement for chunk in self._output_log.chunks(LOG_CHUNK_SIZE)
+                 for judgement in chunk),
+                file_path + '.verdicts' + extension,
+                self._roster_labels,
+                list(self._ids_manager._ids.rules.roster),
+                start, stop, compression, LOG_CHUNK_SIZE)
+
+    # Turn the time range of the save options, in seconds from the first
+    # frame, into seconds of the capture.
+    def _time_range(self, options):
+        first = next(self._output_log.chunks(1), None) if self._output_log is not None else None
+        origin = first[0]['Frame']['timestamp'] / TIMESTAMPS_PER_SECOND if first else 0.0
+        start, stop = options.get('start'), options.get('stop')
+        start = origin + float(start) if start not in (None, '') else None
+        stop = origin + float(stop) if stop not in (None, '') else None
+        return start, stop
+
+    @staticmethod
+    def _in_time_range(judgement, start, stop):
+        seconds = judgement['Frame']['timestamp'] / TIMESTAMPS_PER_SECOND
+        return (start is None or seconds >= start) and (stop is None or seconds < stop)
+
+
+    # Write every per-second bin of the simulation to a CSV file.
+    @pyqtSlot(QVariant)
+    def save_rolling_metrics(self, file_url):
+        with open(url_to_path(file_url), 'w', newline='') as outfile:
+            self._rolling.write_csv(outfile)
+
+    # Write the latency histograms of the IDS to a JSON file, with the
+    # p50/p95/p99/max latency of each judging path.
+    @pyqtSlot(QVariant)
+    def save_latency_report(self, file_url):
+        self._ids_manager._ids.write_latency_report(url_to_path(file_url))
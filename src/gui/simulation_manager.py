@@ -7,10 +7,14 @@ from PyQt5.QtQml import QJSValue
 
 import os
 import platform
+import time
 
 savedata_dir = os.path.dirname(os.path.abspath(__file__)) + '/../../savedata'
 idprobs_dir = savedata_dir + '/idprobs'
 
+# How many frames are judged between updates of the profile property.
+PROFILE_UPDATE_INTERVAL = 500
+
 
 class SimulationManager(QObject):
     def __init__(self, ids_manager: TwoStageIDSManager):
@@ -23,10 +27,48 @@ class SimulationManager(QObject):
         self._current_labels = []
         self.sim_thread = None
         self._sim_paused = True
+        self._frames_since_profile = 0
 
     result = pyqtSignal(QVariant)
     simDone = pyqtSignal()
 
+    # Set up profile property, the live throughput and latency breakdown of
+    # the stages of the IDS while profiling is on.
+    get_profile = pyqtSignal()
+
+    @pyqtProperty(QVariant, notify=get_profile)
+    def profile(self):
+        profiler = self._ids_manager._ids.profiler
+        stats = profiler.stats()
+        judge_time = stats['spans'].get('judge_single_frame', {}).get('total', 0)
+        stages = []
+        for name, span in sorted(stats['spans'].items()):
+            if name == 'judge_single_frame':
+                continue
+            stages.append({
+                'stage': name,
+                'count': span['count'],
+                'mean_ms': span['mean'] * 1000,
+                'max_ms': span['max'] * 1000,
+                # Rule spans are part of the 'rules' span, so the shares of
+                # the stages add up to more than 1.
+                'share': span['total'] / judge_time if judge_time else 0.0
+            })
+        return {
+            'enabled': stats['enabled'],
+            'frames_per_sec': profiler.throughput('frames'),
+            'counters': stats['counters'],
+            'stages': stages
+        }
+
+    @pyqtSlot(bool)
+    def set_profiling(self, enabled):
+        profiler = self._ids_manager._ids.profiler
+        if enabled and not profiler.enabled:
+            profiler.reset()
+        profiler.enabled = enabled
+        self.get_profile.emit()
+
     @pyqtSlot(QJSValue)
     def adjust_malgen(self, adjustments):
         self._malgen.adjust(adjustments.toVariant())
@@ -42,13 +84,21 @@ class SimulationManager(QObject):
             else:
                 next_frame = self._current_canlist.pop(0)
                 next_label = self._current_labels.pop(0)
-            judgement_result = self._ids_manager.judge_single_frame(next_frame)
+            received = time.perf_counter_ns()
+            judgement_result = self._ids_manager.judge_single_frame(next_frame, received)
+            latency = (time.perf_counter_ns() - received) / 1e9
+            if self._ids_manager._ids.profiler.enabled:
+                self._frames_since_profile += 1
+                if self._frames_since_profile >= PROFILE_UPDATE_INTERVAL:
+                    self._frames_since_profile = 0
+                    self.get_profile.emit()
 
             self.result.emit({
                 'Frame': next_frame,
                 'Label': next_label,
                 'Judgement': judgement_result[0],
-                'Reason': judgement_result[1]
+                'Reason': judgement_result[1],
+                'Latency': latency
             })
         else:
             self.stop_simulation()
@@ -67,6 +117,10 @@ class SimulationManager(QObject):
             canlist = dp.load_canlist(file_path)
         else:
             raise ValueError(f'Unknown type of CAN frame file provided: {file_path}.')
+        # Check the capture before starting the simulation with it.
+        _, report = dp.validate_canlist(canlist)
+        if not report['valid']:
+            raise ValueError(dp.validation_summary(report))
         self._current_canlist, self._current_labels = dp.inject_malicious_packets(canlist, self._malgen)
 
         self._ids_manager._ids.change_ids_parameters('idprobs_path', idprobs_dir + '/' + idprobs_name + '.json')
@@ -95,6 +149,7 @@ class SimulationManager(QObject):
         self._sim_paused = True
         self._ids_manager.stop_simulation()
         self.simDone.emit()
+        self.get_profile.emit()
 
     @pyqtSlot()
     def pause_simulation(self):
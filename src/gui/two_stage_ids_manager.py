@@ -1,12 +1,14 @@
 from ids.two_stage_ids import TwoStageIDS
 import ids.preprocessor as dp
-from ids.dnn_ids import dnn_input_function
+from ids.dnn_ids import dnn_input_function, dnn_dataset_input_function
+from ids.dnn_params import (activation_fn_convert, activation_fn_convert_reverse,
+                             loss_reduction_convert, loss_reduction_convert_reverse,
+                             optimizer_convert, construct_optimizer)
 
 from PyQt5.QtCore import QObject, pyqtSignal, pyqtSlot, pyqtProperty, QVariant, QUrl
 from PyQt5.QtQml import QJSValue
 import os
 import shutil
-import tensorflow as tf
 from ast import literal_eval
 
 # Set up directories.
@@ -16,116 +18,6 @@ ruleprofiles_dir = savedata_dir + '/rule-profiles'
 idprobs_dir = savedata_dir + '/idprobs'
 datasets_dir = savedata_dir + '/datasets'
 
-# Set up object -> name correspondences.
-activation_fn_convert = {
-    tf.nn.relu: "ReLU",
-    tf.nn.relu6: "ReLU 6",
-    tf.nn.crelu: "CReLU",
-    tf.nn.elu: "ELU",
-    tf.nn.selu: "SELU",
-    tf.nn.softplus: "Softplus",
-    tf.nn.softsign: "Softsign",
-    tf.sigmoid: "Sigmoid",
-    tf.tanh: "Tanh"
-}
-
-activation_fn_convert_reverse = {v: k for k, v in activation_fn_convert.items()}
-
-loss_reduction_convert = {
-    tf.losses.Reduction.NONE: "None",
-    tf.losses.Reduction.MEAN: "Mean",
-    tf.losses.Reduction.SUM: "Sum",
-    tf.losses.Reduction.SUM_OVER_BATCH_SIZE: "Sum over Batch Size",
-    tf.losses.Reduction.SUM_BY_NONZERO_WEIGHTS: "Sum by Nonzero Weights"
-}
-
-loss_reduction_convert_reverse = {v: k for k, v in loss_reduction_convert.items()}
-
-optimizer_convert = {
-    tf.train.AdadeltaOptimizer: "Adadelta Optimizer",
-    tf.train.AdagradDAOptimizer: "Adagrad DA Optimizer",
-    tf.train.AdagradOptimizer: "Adagrad Optimizer",
-    tf.train.AdamOptimizer: "Adam Optimizer",
-    tf.train.FtrlOptimizer: "FTRL Optimizer",
-    tf.train.GradientDescentOptimizer: "Gradient Descent Optimizer",
-    tf.train.MomentumOptimizer: "Momentum Optimizer",
-    tf.train.ProximalAdagradOptimizer: "Proximal Adagrad Optimizer",
-    tf.train.ProximalGradientDescentOptimizer: "Proximal Gradient Descent Optimizer",
-    tf.train.RMSPropOptimizer: "RMS Prop Optimizer"
-}
-
-optimizer_convert_reverse = {v: k for k, v in optimizer_convert.items()}
-
-def construct_optimizer(name, properties):
-    optimizer_class = optimizer_convert_reverse[name]
-    if name == 'Adadelta Optimizer':
-        return optimizer_class(
-            learning_rate=properties['Learning Rate'],
-            rho=properties['Rho'],
-            epsilon=properties['Epsilon']
-        )
-    elif name == 'Adagrad DA Optimizer':
-        return optimizer_class(
-            learning_rate=properties['Learning Rate'],
-            global_step=properties['Global Step'],
-            initial_gradient_squared_accumulator_value=properties['Initial Gradient Squared Accumulator Value'],
-            l1_regularization_strength=properties['L1 Regularization Strength'],
-            l2_regularization_strength=properties['L2 Regularization Strength']
-        )
-    elif name == 'Adagrad Optimizer':
-        return optimizer_class(
-            learning_rate=properties['Learning Rate'],
-            initial_accumulator_value=properties['Initial Accumulator Value']
-        )
-    elif name == 'Adam Optimizer':
-        return optimizer_class(
-            learning_rate=properties['Learning Rate'],
-            beta1=properties['Beta_1'],
-            beta2=properties['Beta_2'],
-            epsilon=properties['Epsilon']
-        )
-    elif name == 'FTRL Optimizer':
-        return optimizer_class(
-            learning_rate=properties['Learning Rate'],
-            learning_rate_power=properties['Learning Rate Power'],
-            initial_accumulator_value=properties['Initial Accumulator Value'],
-            l1_regularization_strength=properties['L1 Regularization Strength'],
-            l2_regularization_strength=properties['L2 Regularization Strength'],
-            l2_shrinkage_regularization_strength=properties['L2 Shrinkage Regularization Strength']
-        )
-    elif name == 'Gradient Descent Optimizer':
-        return optimizer_class(
-            learning_rate=properties['Learning Rate']
-        )
-    elif name == 'Momentum Optimizer':
-        return optimizer_class(
-            learning_rate=properties['Learning Rate'],
-            momentum=properties['Momentum'],
-            use_nesterov=False
-        )
-    elif name == 'Proximal Adagrad Optimizer':
-        return optimizer_class(
-            learning_rate=properties['Learning Rate'],
-            initial_accumulator_value=properties['Initial Accumulator Value'],
-            l1_regularization_strength=properties['L1 Regularization Strength'],
-            l2_regularization_strength=properties['L2 Regularization Strength']
-        )
-    elif name == 'Proximal Gradient Descent Optimizer':
-        return optimizer_class(
-            learning_rate=properties['Learning Rate'],
-            l1_regularization_strength=properties['L1 Regularization Strength'],
-            l2_regularization_strength=properties['L2 Regularization Strength']
-        )
-    elif name == 'RMS Prop Optimizer':
-        return optimizer_class(
-            learning_rate=properties['Learning Rate'],
-            decay=properties['Decay'],
-            momentum=properties['Momentum'],
-            centered=properties['Centered']
-        )
-    else:
-        raise ValueError()
-
 
 # Inherits from QObject, which is what allows it to be used in QML.
 class TwoStageIDSManager(QObject):
@@ -216,9 +108,10 @@ class TwoStageIDSManager(QObject):
             raise ValueError()
         if model_name == self._model_name:
             raise RuntimeError()
-        params_file = dnnmodels_dir + '/' + model_name + '.params'
-        if os.path.exists(params_file):
-            os.remove(params_file)
+        for model_file in [dnnmodels_dir + '/' + model_name + '.params',
+                           dnnmodels_dir + '/' + model_name + '.training.json']:
+            if os.path.exists(model_file):
+                os.remove(model_file)
         model_dir = dnnmodels_dir + '/' + model_name
         rules_profile_dir = ruleprofiles_dir + '/' + model_name
         for dir in [model_dir, rules_profile_dir]:
@@ -228,16 +121,29 @@ class TwoStageIDSManager(QObject):
         self._available_models.remove(model_name)
         self.get_availableModels.emit()
 
-    @pyqtSlot(str)
-    def train_rules(self, dataset_name):
+    @pyqtSlot(str, bool)
+    def train_rules(self, dataset_name, incremental):
         canlist = dp.load_canlist(datasets_dir + '/' + dataset_name + '/good_canlist.json')
-        self._ids.retrain_rules(canlist)
+        self._ids.retrain_rules(canlist, incremental)
         self.get_parameters.emit()
 
-    @pyqtSlot(str, int)
-    def train_dnn(self, dataset_name, num_steps):
-        features, labels = dp.load_feature_lists(datasets_dir + '/' + dataset_name + '/features_labels.json')
-        self._ids.train_dnn(dnn_input_function(features, labels, shuffle=True), num_steps)
+    @pyqtSlot(str, int, bool)
+    def train_dnn(self, dataset_name, num_steps, incremental):
+        # Datasets made before the columnar binary feature file was added only
+        # have the JSON feature file, which has to be read into memory.
+        features_path = datasets_dir + '/' + dataset_name + '/features_labels.bin'
+        if incremental:
+            if not os.path.exists(features_path):
+                raise ValueError('Incremental training needs a dataset with a columnar binary feature file.')
+            # Fine-tune on the dataset only if the model hasn't seen it.
+            self._ids.train_dnn_incremental([features_path], num_steps)
+        elif os.path.exists(features_path):
+            input_function = dnn_dataset_input_function(features_path, shuffle=True)
+            self._ids.train_dnn(input_function, num_steps, [features_path])
+        else:
+            features, labels = dp.load_feature_lists(datasets_dir + '/' + dataset_name + '/features_labels.json')
+            input_function = dnn_input_function(features, labels, shuffle=True)
+            self._ids.train_dnn(input_function, num_steps)
         self.get_parameters.emit()
 
     # These are distinctly not a slot, because it will be called by the Simulation
@@ -245,8 +151,8 @@ class TwoStageIDSManager(QObject):
     def start_simulation(self):
         self._ids.start_simulation()
 
-    def judge_single_frame(self, can_frame):
-        result = self._ids.judge_single_frame(can_frame)
+    def judge_single_frame(self, can_frame, received=None):
+        result = self._ids.judge_single_frame(can_frame, received)
         return result
 
     def stop_simulation(self):
@@ -0,0 +1,574 @@
+"""Performance benchmark suite for the IDS pipeline
+Times each stage of the pipeline on synthetic captures of several sizes, and
+reports the throughput in frames per second and the peak memory use of each
+stage. Nothing is downloaded: every capture is generated locally by
+synthetic.SyntheticBus.
+
+Each stage runs in a fresh process, so the peak resident set size (RSS) of
+one stage is not hidden by an earlier one. Only the stage itself is timed:
+parsing or preparing its inputs is done beforehand. The peak RSS does include
+the inputs of the stage.
+
+Usage:
+    python -m ids.benchmark
+    python -m ids.benchmark --sizes 1e5 --stages parse_traffic parse_csv
+    python -m ids.benchmark --output new.json --compare old.json
+
+Functions:
+write_capture -- Generate a synthetic capture and write it in the formats the
+stages read.
+run_benchmarks -- Run the stages on captures of the given sizes and return the
+results.
+compare_results -- Compare the results of two benchmark runs.
+
+Module Constants:
+- STAGE_FORMATS: the capture formats (see write_capture) read by each stage
+  that needs more than the column file. Only the formats of the stages run
+  are written.
+- STAGES: a dictionary of the stages that can be benchmarked. Each stage is a
+  function that takes a capture (see write_capture), prepares the inputs of
+  the stage, and returns a tuple (run, num_frames): the function to time, and
+  the number of frames it processes.
+"""
+
+import argparse
+import functools
+import json
+import multiprocessing
+import os
+import os.path
+import pathlib
+import platform
+import queue
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import ids.column_store
+import ids.preprocessor as dp
+import ids.rule_abc
+import ids.synthetic as synthetic
+from ids.malicious import MaliciousGenerator
+from ids.rules_ids import RULE_ORDERS, RulesIDS
+
+try:
+    import resource
+except ImportError:  # Not available on Windows.
+    resource = None
+
+DEFAULT_SIZES = [10**5, 10**6, 10**7]
+# The formats a capture can be written in besides its column file, and the
+# stages that read each of them.
+CAPTURE_FORMATS = ('traffic', 'csv', 'canlist', 'idprobs')
+STAGE_FORMATS = {
+    'parse_traffic': ['traffic'],
+    'parse_csv': ['csv'],
+    'load_canlist': ['canlist'],
+    'generate_feature_lists': ['idprobs'],
+    'DNNBasedIDS.predict': ['idprobs'],
+    'DNNBasedIDS.train[numpy]': ['idprobs'],
+    'DNNBasedIDS.train[tf.data]': ['idprobs'],
+    'TwoStageIDS.judge_dataset': ['idprobs'],
+    'TwoStageIDS.judge_single_frame': ['idprobs'],
+    'DetectionService[unix]': ['idprobs']
+}
+# How often, in seconds, a stage process is checked on while waiting for its
+# result.
+STAGE_POLL_SECONDS = 1.0
+# The training steps timed for DNNBasedIDS.train, and their batch size.
+TRAIN_STEPS = 1000
+TRAIN_BATCH_SIZE = 128
+# The number of frames timed for RulesIDS.test, which tests one frame at a
+# time.
+RULES_TEST_LIMIT = 10**5
+# The hidden layers of the untrained DNN the service stage judges with. Its
+# weights do not change how fast it runs.
+SERVICE_HIDDEN_UNITS = [10, 20, 20, 20]
+
+
+def write_capture(workdir, num_frames, seed=0, formats=None):
+    """Generate a synthetic capture and write it in the formats the stages
+    read.
+
+    Arguments:
+    workdir -- The directory to write the files to.
+    num_frames -- The number of frames in the capture.
+    seed -- Seed for the synthetic traffic.
+    formats -- List of the formats in CAPTURE_FORMATS to write, besides the
+    column file that every capture has. Default is all of them.
+
+    Returns a capture dictionary with the number of frames, the seed, and
+    the paths of the 'columns' file and of the files of each format.
+    """
+    formats = CAPTURE_FORMATS if formats is None else formats
+    columns = synthetic.SyntheticBus.random(seed=seed).generate(num_frames)
+    base = os.path.join(str(workdir), 'capture_{}'.format(num_frames))
+    capture = {
+        'num_frames': num_frames,
+        'seed': seed,
+        'workdir': str(workdir),
+        'columns': base + '_columns.bin'
+    }
+    synthetic.write_column_file(columns, capture['columns'])
+    if 'traffic' in formats:
+        capture['traffic'] = base + '.traffic'
+        synthetic.write_traffic_file(columns, capture['traffic'])
+    if 'csv' in formats:
+        capture['csv'] = base + '.csv'
+        synthetic.write_csv_file(columns, capture['csv'])
+    if 'canlist' in formats:
+        capture['canlist'] = base + '_canlist.json'
+        dp.write_canlist(dp.columns_to_canlist(columns), capture['canlist'])
+    if 'idprobs' in formats:
+        # Counted from the column file, without a list of frames.
+        capture['idprobs'] = base + '_idprobs.json'
+        dp.write_id_probs_from_files([capture['columns']],
+                                     capture['idprobs'], processes=1)
+    return capture
+
+
+def _load_canlist(capture):
+    columns, _ = ids.column_store.load_columns(capture['columns'])
+    return dp.columns_to_canlist(columns)
+
+
+def _bad_canlist(capture):
+    """The capture with malicious frames injected, along with the labels."""
+    malgen = MaliciousGenerator()
+    malgen.adjust({'none': 0.9})
+    columns, _ = ids.column_store.load_columns(capture['columns'])
+    bad_columns, codes = dp.inject_malicious_columns(
+        columns, malgen, seed=capture['seed'])
+    labels = [malgen.labels[x] for x in codes.tolist()]
+    return dp.columns_to_canlist(bad_columns), labels
+
+
+def _flood_canlist(capture):
+    """The capture with a flood injected into most of its time windows."""
+    malgen = MaliciousGenerator()
+    malgen.adjust({'none': 0.2, 'flood': 0.8})
+    columns, _ = ids.column_store.load_columns(capture['columns'])
+    bad_columns, _ = dp.inject_malicious_columns(columns, malgen,
+                                                 seed=capture['seed'])
+    return dp.columns_to_canlist(bad_columns)
+
+
+def _prepared_rules(capture):
+    rules = RulesIDS('benchmark')
+    rules.prepare(_load_canlist(capture))
+    return rules
+
+
+def _trained_ids(capture):
+    """A TwoStageIDS with prepared rules and a briefly trained DNN, along
+    with the bad canlist and its features."""
+    from ids.dnn_ids import dnn_input_function
+    from ids.two_stage_ids import TwoStageIDS
+
+    two_stage = TwoStageIDS()
+    two_stage.change_ids_parameters(
+        'dnn_dir_path',
+        os.path.join(capture['workdir'], 'dnn_{}'.format(os.getpid())))
+    two_stage.change_ids_parameters('rules_profile', 'benchmark')
+    two_stage.change_ids_parameters('idprobs_path', capture['idprobs'])
+    two_stage.init_ids()
+    two_stage.retrain_rules(_load_canlist(capture))
+    bad_canlist, labels = _bad_canlist(capture)
+    features = dp.generate_feature_lists(bad_canlist, two_stage.idprobs)
+    two_stage.train_dnn(
+        dnn_input_function(features, labels, shuffle=True), 100)
+    return two_stage, bad_canlist, features, labels
+
+
+def _stage_parse_traffic(capture):
+    return (lambda: dp.parse_traffic(capture['traffic']),
+            capture['num_frames'])
+
+
+def _stage_parse_csv(capture):
+    return lambda: dp.parse_csv(capture['csv']), capture['num_frames']
+
+
+def _stage_load_canlist(capture):
+    return lambda: dp.load_canlist(capture['canlist']), capture['num_frames']
+
+
+def _stage_inject_malicious_packets(capture):
+    canlist = _load_canlist(capture)
+    malgen = MaliciousGenerator()
+    return (lambda: dp.inject_malicious_packets(
+        canlist, malgen, seed=capture['seed']), capture['num_frames'])
+
+
+def _stage_inject_malicious_columns(capture):
+    columns, _ = ids.column_store.load_columns(capture['columns'], mmap=False)
+    malgen = MaliciousGenerator()
+    return (lambda: dp.inject_malicious_columns(
+        columns, malgen, seed=capture['seed']), capture['num_frames'])
+
+
+def _stage_generate_feature_lists(capture):
+    canlist = _load_canlist(capture)
+    idprobs = dp.load_id_prob_table(capture['idprobs'])
+    return (lambda: dp.generate_feature_lists(canlist, idprobs),
+            capture['num_frames'])
+
+
+def _stage_rules_prepare(capture):
+    canlist = _load_canlist(capture)
+    rules = RulesIDS('benchmark')
+    return lambda: rules.prepare(canlist), capture['num_frames']
+
+
+def _stage_rules_test_series(capture):
+    rules = _prepared_rules(capture)
+    bad_canlist, _ = _bad_canlist(capture)
+    return lambda: list(rules.test_series(bad_canlist)), len(bad_canlist)
+
+
+def _stage_rules_test(traffic, rule_order, capture):
+    rules = _prepared_rules(capture)
+    rules.rule_order = rule_order
+    canlist = (_load_canlist(capture)
+               if traffic == 'clean' else _flood_canlist(capture))
+    frames = canlist[:RULES_TEST_LIMIT]
+
+    def run():
+        for frame in frames:
+            rules.test(frame)
+
+    return run, len(frames)
+
+
+def _stage_dnn_train(input_kind, capture):
+    """Train a new DNN for TRAIN_STEPS steps, reading the features of the bad
+    canlist from memory with numpy_input_fn, or streaming them from a feature
+    file with tf.data. The frames reported are the frames trained on, so
+    steps per second is frames per second over TRAIN_BATCH_SIZE."""
+    from ids.dnn_ids import (DNNBasedIDS, dnn_dataset_input_function,
+                             dnn_input_function)
+    malgen = MaliciousGenerator()
+    malgen.adjust({'none': 0.9})
+    columns, _ = ids.column_store.load_columns(capture['columns'])
+    bad_columns, codes = dp.inject_malicious_columns(columns, malgen,
+                                                     seed=capture['seed'])
+    features = dp.generate_feature_lists(
+        dp.columns_to_canlist(bad_columns),
+        dp.load_id_prob_table(capture['idprobs']))
+    if input_kind == 'numpy':
+        input_function = dnn_input_function(features, codes,
+                                            TRAIN_BATCH_SIZE, shuffle=True)
+    else:
+        path = os.path.join(capture['workdir'],
+                            'features_{}.bin'.format(os.getpid()))
+        dp.write_feature_file(features, codes, path, malgen.labels)
+        input_function = dnn_dataset_input_function(path, TRAIN_BATCH_SIZE,
+                                                    shuffle=True)
+    dnn = DNNBasedIDS()
+    dnn.new_model(os.path.join(capture['workdir'],
+                               'dnn_train_{}'.format(os.getpid())))
+    # The first steps build the graph and write the first checkpoint, which
+    # is not part of the throughput of the input function.
+    dnn.train(input_function, 10)
+    return (lambda: dnn.train(input_function, TRAIN_STEPS),
+            TRAIN_STEPS * TRAIN_BATCH_SIZE)
+
+
+def _stage_dnn_predict(capture):
+    from ids.dnn_ids import dnn_input_function
+    two_stage, bad_canlist, features, _ = _trained_ids(capture)
+    return (lambda: list(two_stage.dnn.predict(
+        dnn_input_function(features, None, num_epochs=1))), len(bad_canlist))
+
+
+def _stage_judge_dataset(capture):
+    two_stage, bad_canlist, features, _ = _trained_ids(capture)
+    return (lambda: list(two_stage.judge_dataset(bad_canlist, features)),
+            len(bad_canlist))
+
+
+def _stage_judge_single_frame(capture):
+    two_stage, bad_canlist, _, _ = _trained_ids(capture)
+    # Judging frames one at a time is slow, so only a sample is timed.
+    frames = bad_canlist[:capture.get('single_frame_limit', 1000)]
+
+    def run():
+        two_stage.start_simulation()
+        for frame in frames:
+            two_stage.judge_single_frame(frame)
+        two_stage.stop_simulation()
+
+    return run, len(frames)
+
+
+def _stage_service(capture):
+    import asyncio
+
+    import ids.service as service
+    from ids.dnn_kernel import FEATURES, DNNKernel
+    from ids.two_stage_ids import TwoStageIDS
+
+    # An untrained DNN is used, so that the stage runs without TensorFlow's
+    # Estimators.
+    rng = np.random.default_rng(capture['seed'])
+    sizes = [len(FEATURES)] + SERVICE_HIDDEN_UNITS + [1]
+    two_stage = TwoStageIDS(dnn=DNNKernel(
+        [(rng.normal(size=(inputs, outputs)), rng.normal(size=outputs))
+         for inputs, outputs in zip(sizes, sizes[1:])]))
+    two_stage.rules = _prepared_rules(capture)
+    two_stage.idprobs = dp.load_id_prob_table(capture['idprobs'])
+    two_stage.dnn_trained = two_stage.rules_trained = True
+    columns, _ = ids.column_store.load_columns(capture['columns'])
+    data = service.encode_frames(columns)
+    num_frames = len(columns['id'])
+    path = os.path.join(capture['workdir'], 'ids_{}.sock'.format(os.getpid()))
+
+    async def serve():
+        # The queue holds the whole capture, so no frame is dropped and
+        # every frame is judged.
+        detector = service.DetectionService(two_stage, queue_size=num_frames)
+        await detector.serve_unix(path)
+        runner = asyncio.ensure_future(detector.run())
+        _, writer = await asyncio.open_unix_connection(path)
+        # Sent in chunks of 4096 records, as replay does at full speed.
+        chunk = 4096 * service.RECORD_DTYPE.itemsize
+        for i in range(0, len(data), chunk):
+            writer.write(data[i:i + chunk])
+            await writer.drain()
+        writer.close()
+        while detector.stats()['judged'] < num_frames:
+            await asyncio.sleep(0.001)
+        await detector.stop()
+        runner.cancel()
+
+    def run():
+        two_stage.start_simulation()
+        asyncio.run(serve())
+        two_stage.stop_simulation()
+        os.remove(path)
+
+    return run, num_frames
+
+
+STAGES = {
+    'parse_traffic': _stage_parse_traffic,
+    'parse_csv': _stage_parse_csv,
+    'load_canlist': _stage_load_canlist,
+    'inject_malicious_packets': _stage_inject_malicious_packets,
+    'inject_malicious_columns': _stage_inject_malicious_columns,
+    'generate_feature_lists': _stage_generate_feature_lists,
+    'RulesIDS.prepare': _stage_rules_prepare,
+    'RulesIDS.test_series': _stage_rules_test_series,
+    **{
+        'RulesIDS.test[{},{}]'.format(traffic, rule_order):
+        functools.partial(_stage_rules_test, traffic, rule_order)
+        for traffic in ('clean', 'flood') for rule_order in RULE_ORDERS
+    },
+    'DNNBasedIDS.train[numpy]': functools.partial(_stage_dnn_train, 'numpy'),
+    'DNNBasedIDS.train[tf.data]': functools.partial(_stage_dnn_train,
+                                                    'tf.data'),
+    'DNNBasedIDS.predict': _stage_dnn_predict,
+    'TwoStageIDS.judge_dataset': _stage_judge_dataset,
+    'TwoStageIDS.judge_single_frame': _stage_judge_single_frame,
+    'DetectionService[unix]': _stage_service
+}
+
+
+def _peak_rss():
+    """Peak resident set size of this process in bytes, or None if it can't
+    be measured."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes.
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _run_stage(name, capture, results):
+    """Run a single stage and put its result on the results queue. Meant to
+    be the target of a fresh process."""
+    # Keep rule profiles out of the savedata directory.
+    ids.rule_abc.Rule.SAVE_PATH = pathlib.Path(
+        capture['workdir']) / 'rule-profiles'
+    result = {'stage': name, 'size': capture['num_frames']}
+    try:
+        run, num_frames = STAGES[name](capture)
+        start = time.perf_counter()
+        run()
+        seconds = time.perf_counter() - start
+        result.update({
+            'frames': num_frames,
+            'seconds': seconds,
+            'frames_per_sec': num_frames / seconds if seconds else None
+        })
+    except Exception as exc:  # pylint: disable=broad-except
+        # A stage that can't run here (for example, without TensorFlow) is
+        # reported instead of stopping the whole suite.
+        result['error'] = '{}: {}'.format(type(exc).__name__, exc)
+    result['peak_rss_bytes'] = _peak_rss()
+    results.put(result)
+
+
+def run_benchmarks(sizes=None,
+                   stages=None,
+                   workdir=None,
+                   seed=0,
+                   single_frame_limit=1000,
+                   verbose=False):
+    """Run the stages on captures of the given sizes and return the results.
+
+    Arguments:
+    sizes -- List of capture sizes in frames. Default is DEFAULT_SIZES.
+    stages -- List of names of stages in STAGES to run. Default is all of
+    them.
+    workdir -- The directory to write captures and models to. A temporary
+    directory is used if None.
+    seed -- Seed for the synthetic captures and the attack injection.
+    single_frame_limit -- The number of frames timed for
+    TwoStageIDS.judge_single_frame.
+    verbose -- Print each result as it finishes.
+
+    Returns a JSON serializable dictionary {'meta': {...}, 'results': [...]},
+    with one result per stage and size holding the number of frames, the
+    seconds taken, frames per second and the peak RSS in bytes, or an
+    'error' if the stage failed.
+    """
+    sizes = sizes if sizes is not None else DEFAULT_SIZES
+    stages = stages if stages is not None else list(STAGES)
+    for name in stages:
+        if name not in STAGES:
+            raise ValueError('{} is not a benchmark stage. Valid stages: {}'
+                             .format(name, list(STAGES)))
+
+    # Stages run in freshly spawned processes, so they do not share memory
+    # with this one or with each other.
+    context = multiprocessing.get_context('spawn')
+    output = {
+        'meta': {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+            'cpu_count': os.cpu_count(),
+            'seed': seed
+        },
+        'results': []
+    }
+    with tempfile.TemporaryDirectory() as tempdir:
+        workdir = str(workdir) if workdir is not None else tempdir
+        for size in sizes:
+            formats = {x for name in stages
+                       for x in STAGE_FORMATS.get(name, [])}
+            capture = write_capture(workdir, size, seed, formats)
+            capture['single_frame_limit'] = single_frame_limit
+            for name in stages:
+                results = context.Queue()
+                process = context.Process(target=_run_stage,
+                                          args=(name, capture, results))
+                process.start()
+                result = _wait_for_stage(name, size, process, results)
+                process.join()
+                output['results'].append(result)
+                if verbose:
+                    print(_format_result(result), flush=True)
+    return output
+
+
+def _wait_for_stage(name, size, process, results):
+    """Wait for the result of a stage process. A process that dies without
+    a result, for example when it runs out of memory, gets an error result
+    instead of hanging the suite."""
+    while True:
+        try:
+            return results.get(timeout=STAGE_POLL_SECONDS)
+        except queue.Empty:
+            if process.is_alive():
+                continue
+        # The result may have been put just before the process exited.
+        try:
+            return results.get(timeout=STAGE_POLL_SECONDS)
+        except queue.Empty:
+            return {
+                'stage': name,
+                'size': size,
+                'error': 'The stage process died with exit code {}.'.format(
+                    process.exitcode),
+                'peak_rss_bytes': None
+            }
+
+
+def _format_result(result):
+    rss = result.get('peak_rss_bytes')
+    rss = '{:8.1f} MiB'.format(rss / 2**20) if rss else '     n/a'
+    if 'error' in result:
+        return '{:32} {:>10}  failed: {}'.format(result['stage'],
+                                                 result['size'],
+                                                 result['error'])
+    return '{:32} {:>10} {:12.0f} frames/s {:10.3f} s  peak {}'.format(
+        result['stage'], result['size'], result['frames_per_sec'] or 0,
+        result['seconds'], rss)
+
+
+def compare_results(old, new):
+    """Compare the results of two benchmark runs.
+
+    Returns a list of (stage, size, old frames/sec, new frames/sec, speedup)
+    tuples for every stage and size that succeeded in both runs.
+    """
+    old_rates = {(x['stage'], x['size']): x.get('frames_per_sec')
+                 for x in old['results']}
+    comparison = []
+    for result in new['results']:
+        key = (result['stage'], result['size'])
+        old_rate, new_rate = old_rates.get(key), result.get('frames_per_sec')
+        if old_rate and new_rate:
+            comparison.append(key + (old_rate, new_rate, new_rate / old_rate))
+    return comparison
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m ids.benchmark',
+        description='Time each stage of the IDS pipeline on synthetic '
+        'captures.')
+    parser.add_argument('--sizes', nargs='+', type=float,
+                        default=DEFAULT_SIZES,
+                        help='capture sizes in frames (default: %(default)s)')
+    parser.add_argument('--stages', nargs='+', choices=list(STAGES),
+                        help='stages to run (default: all)')
+    parser.add_argument('--output', default='bench_results.json',
+                        help='file to write JSON results to '
+                        '(default: %(default)s)')
+    parser.add_argument('--compare', metavar='OLD_RESULTS',
+                        help='JSON results of an earlier run to compare to')
+    parser.add_argument('--workdir',
+                        help='directory for captures and models (default: '
+                        'a temporary directory)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--single-frame-limit', type=int, default=1000,
+                        help='frames timed for judge_single_frame '
+                        '(default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    output = run_benchmarks([int(x) for x in args.sizes], args.stages,
+                            args.workdir, args.seed, args.single_frame_limit,
+                            verbose=True)
+    with open(args.output, 'w') as file:
+        json.dump(output, file, indent=2)
+    print('Results written to {}'.format(args.output))
+
+    if args.compare:
+        with open(args.compare) as file:
+            old = json.load(file)
+        print('\nComparison with {}:'.format(args.compare))
+        for stage, size, old_rate, new_rate, speedup in compare_results(
+                old, output):
+            print('{:32} {:>10} {:12.0f} -> {:12.0f} frames/s  x{:.2f}'
+                  .format(stage, size, old_rate, new_rate, speedup))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,268 @@
+"""Columnar binary file format
+Stores a table as one contiguous, typed array per column, behind a small JSON
+header. Columns can be memory-mapped straight out of the file, so loading is
+immediate no matter how large the file is, and files can be written one chunk
+of rows at a time.
+
+File layout:
+    MAGIC -- 8 bytes identifying the file format.
+    header length -- little-endian uint64, the size of the header in bytes.
+    header -- UTF-8 JSON: {'length': number of rows, 'attrs': {...},
+        'columns': [{'name', 'dtype', 'shape', 'offset'}, ...]}. 'shape' is
+        the shape of a single row of the column, and 'offset' is the position
+        of the column's data from the start of the file.
+    column data -- the raw arrays, each starting on an ALIGNMENT boundary.
+
+A file may also be written compressed with gzip or lzma, which is the same
+layout passed through the compressor. Compressed files are recognized when
+loading, but they are decompressed into memory instead of being
+memory-mapped.
+
+Functions:
+is_column_file -- Check whether a file is a columnar binary file.
+write_columns -- Write a dictionary of arrays to a columnar binary file.
+load_columns -- Load the columns and attributes of a columnar binary file.
+
+Classes:
+ColumnWriter -- Write a columnar binary file one chunk of rows at a time.
+"""
+
+import gzip
+import json
+import lzma
+import os
+import os.path
+import shutil
+import struct
+
+import numpy as np
+
+MAGIC = b'IDSCOL\x00\x01'
+ALIGNMENT = 64
+
+# The compressions a file can be written with, by the function opening a
+# compressed file, and the magic numbers the compressed files start with.
+COMPRESSIONS = {
+    'gzip': gzip.open,
+    'lzma': lzma.open
+}
+_COMPRESSION_MAGIC = {
+    'gzip': b'\x1f\x8b',
+    'lzma': b'\xfd7zXZ\x00'
+}
+
+
+def _compression(filepath):
+    """Return the compression of a file, or None if it is not compressed."""
+    with open(filepath, 'rb') as file:
+        start = file.read(8)
+    for name, magic in _COMPRESSION_MAGIC.items():
+        if start.startswith(magic):
+            return name
+    return None
+
+
+def is_column_file(filepath):
+    """Return whether the file at filepath is a columnar binary file,
+    compressed or not."""
+    try:
+        compression = _compression(filepath)
+        opener = COMPRESSIONS.get(compression, open)
+        with opener(filepath, 'rb') as file:
+            return file.read(len(MAGIC)) == MAGIC
+    except (FileNotFoundError, IsADirectoryError, OSError, EOFError,
+            lzma.LZMAError):
+        return False
+
+
+class ColumnWriter:
+    """Write a columnar binary file one chunk of rows at a time.
+
+    Each column is spooled into its own temporary file next to the output
+    while chunks are appended, and the spools are copied into the final file
+    on close, so memory use is bounded by the chunk size.
+
+    Usage:
+        >>> with ColumnWriter('data.bin', attrs={'kind': 'features'}) as out:
+        ...     out.append({'id': ids_chunk, 'label': labels_chunk})
+    """
+
+    def __init__(self, outfilepath, attrs=None, compression=None):
+        """Arguments:
+        outfilepath -- The path to the file to write.
+        attrs -- A JSON serializable dictionary stored in the header.
+        compression -- None, or the key of COMPRESSIONS to compress the file
+        with.
+        """
+        if compression is not None and compression not in COMPRESSIONS:
+            raise ValueError('{} is not a valid compression.'.format(
+                compression))
+        self.outfilepath = str(outfilepath)
+        self.attrs = attrs if attrs is not None else {}
+        self.compression = compression
+        self.length = 0
+        self._columns = None  # name -> (dtype, row shape, spool file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._discard()
+
+    def _spool_path(self, name):
+        return '{}.{}.spool'.format(self.outfilepath, name)
+
+    def append(self, columns):
+        """Append a chunk of rows.
+
+        Arguments:
+        columns -- Dictionary of array-likes, all with the same number of
+        rows. The first chunk fixes the names, types and row shapes of the
+        columns, and every later chunk must match them.
+
+        Raises:
+        ValueError -- The chunk does not match the earlier chunks, or its
+        columns have different lengths.
+        """
+        arrays = {k: np.asarray(v) for k, v in columns.items()}
+        lengths = set(len(x) for x in arrays.values())
+        if len(lengths) > 1:
+            raise ValueError('All columns must have the same length.')
+        if self._columns is None:
+            self._columns = {
+                name: (array.dtype, array.shape[1:],
+                       open(self._spool_path(name), 'w+b'))
+                for name, array in arrays.items()
+            }
+        elif set(arrays) != set(self._columns):
+            raise ValueError('Columns {} do not match {}.'.format(
+                sorted(arrays), sorted(self._columns)))
+
+        for name, array in arrays.items():
+            dtype, shape, spool = self._columns[name]
+            if array.shape[1:] != shape:
+                raise ValueError('Column {} has row shape {}, expected {}.'
+                                 .format(name, array.shape[1:], shape))
+            spool.write(np.ascontiguousarray(array, dtype=dtype).tobytes())
+        self.length += lengths.pop() if lengths else 0
+
+    def close(self):
+        """Write the header and the spooled columns to the output file."""
+        columns = self._columns if self._columns is not None else {}
+        header = {'length': self.length, 'attrs': self.attrs, 'columns': []}
+        # The offsets depend on the header size, and the header size depends
+        # on the offsets, so use fixed-width offsets to lay it out once.
+        for name, (dtype, shape, _) in columns.items():
+            header['columns'].append({
+                'name': name,
+                'dtype': dtype.str,
+                'shape': list(shape),
+                'offset': 10**15
+            })
+        header_size = len(json.dumps(header).encode())
+        offset = _align(len(MAGIC) + 8 + header_size)
+        for entry, (_, _, spool) in zip(header['columns'], columns.values()):
+            entry['offset'] = offset
+            offset = _align(offset + spool.tell())
+        encoded = json.dumps(header).encode().ljust(header_size)
+
+        opener = COMPRESSIONS.get(self.compression, open)
+        with opener(self.outfilepath, 'wb') as file:
+            file.write(MAGIC)
+            file.write(struct.pack('<Q', len(encoded)))
+            file.write(encoded)
+            for entry, (_, _, spool) in zip(header['columns'],
+                                            columns.values()):
+                file.write(b'\x00' * (entry['offset'] - file.tell()))
+                spool.seek(0)
+                shutil.copyfileobj(spool, file)
+        self._discard()
+
+    def _discard(self):
+        """Close and remove the spool files."""
+        for name, (_, _, spool) in (self._columns or {}).items():
+            spool.close()
+            os.remove(self._spool_path(name))
+        self._columns = None
+
+
+def _align(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def write_columns(outfilepath, columns, attrs=None, chunk_size=2**20,
+                  compression=None):
+    """Write a dictionary of arrays to a columnar binary file.
+
+    Arguments:
+    outfilepath -- The path to the file to write.
+    columns -- Dictionary of array-likes, all with the same number of rows.
+    attrs -- A JSON serializable dictionary stored in the header.
+    chunk_size -- The number of rows converted and written at a time.
+    compression -- None, or the key of COMPRESSIONS to compress the file
+    with.
+    """
+    length = len(next(iter(columns.values()))) if columns else 0
+    with ColumnWriter(outfilepath, attrs, compression) as out:
+        for start in range(0, max(length, 1), chunk_size):
+            out.append({
+                k: v[start:start + chunk_size]
+                for k, v in columns.items()
+            })
+
+
+def load_columns(filepath, mmap=True):
+    """Load the columns and attributes of a columnar binary file.
+
+    Arguments:
+    filepath -- The path to the columnar binary file. A FileNotFoundError will
+    be thrown if the path given here is not valid, and a ValueError if it is
+    not a columnar binary file.
+    mmap -- If True, the columns are read-only memory maps of the file.
+    Otherwise they are read into memory. Compressed files are always read
+    into memory.
+
+    Returns a tuple (columns, attrs), where columns is a dictionary of arrays.
+    """
+    filepath = str(filepath)
+    if not os.path.exists(filepath):
+        raise FileNotFoundError(filepath + ' does not exist!')
+    elif os.path.isdir(filepath):
+        raise FileNotFoundError(filepath + ' is not a file!')
+    compression = _compression(filepath)
+    if compression is not None:
+        mmap = False
+    with COMPRESSIONS.get(compression, open)(filepath, 'rb') as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(
+                filepath + ' does not appear to be a columnar binary file.')
+        header_size, = struct.unpack('<Q', file.read(8))
+        header = json.loads(file.read(header_size).decode())
+
+        columns = {}
+        for entry in header['columns']:
+            dtype = np.dtype(entry['dtype'])
+            shape = (header['length'], ) + tuple(entry['shape'])
+            if header['length'] == 0:
+                columns[entry['name']] = np.zeros(shape, dtype=dtype)
+            elif mmap:
+                columns[entry['name']] = np.memmap(
+                    filepath, dtype=dtype, mode='r', offset=entry['offset'],
+                    shape=shape)
+            elif compression is None:
+                file.seek(entry['offset'])
+                count = int(np.prod(shape))
+                columns[entry['name']] = np.fromfile(
+                    file, dtype=dtype, count=count).reshape(shape)
+            else:
+                # Compressed files can only seek forward, which reading the
+                # columns in order does.
+                file.seek(entry['offset'])
+                count = int(np.prod(shape))
+                columns[entry['name']] = np.frombuffer(
+                    bytearray(file.read(count * dtype.itemsize)),
+                    dtype=dtype).reshape(shape)
+    return columns, header['attrs']
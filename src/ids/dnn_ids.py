@@ -1,8 +1,30 @@
+"""DNN Based IDS
+This module provides a class to judge CAN frames with a deep neural network
+built on the TensorFlow 1.x Estimator API, along with the input functions it
+trains and predicts from.
+
+Notes:
+dnn_dataset_input_function streams features from files with tf.data, so that
+training does not need every feature in memory, and is meant to keep the DNN
+from waiting on its input. Whether it trains faster than dnn_input_function
+is unverified: no steps/sec numbers have been measured. The
+DNNBasedIDS.train[numpy] and DNNBasedIDS.train[tf.data] stages of
+ids.benchmark compare them, but only run with TensorFlow 1.x, since
+TensorFlow 2 has no tf.estimator.
+"""
+
 import tensorflow as tf
 import numpy as np
+import datetime
+import json
+import math
+import os
 import os.path
 import pickle
 
+import ids.column_store
+from ids.preprocessor import FEATURE_DTYPES
+
 feature_cols = [
     tf.feature_column.numeric_column(
         'id', dtype=tf.uint16),  # Should this be a categorical column?
@@ -20,7 +42,8 @@ def dnn_input_function(features, labels, batch_size=128, shuffle=False, num_epoc
     preprocessor.generate_feature_lists.
     labels -- The list of labels associated with the feature lists generated by
     preprocessor.inject_malicious_packets. Malicious Generator returns labels
-    as strings or None. But the DNN IDS needs integers(0,1)
+    as strings or None. But the DNN IDS needs integers(0,1). An array of label
+    codes, as loaded from a columnar binary feature file, is also accepted.
     batch_size -- The size of each training batch provided to the neural
     network. Default is 128.
     shuffle -- Whether the ordering of the packets should be randomized.
@@ -36,13 +59,192 @@ def dnn_input_function(features, labels, batch_size=128, shuffle=False, num_epoc
         """Convert Malicious Packet string labels into 0 or 1,
         with 1 representing 'is malicious'
         """
+        if isinstance(labels, np.ndarray):
+            # Label codes are 0 for 'not malicious'.
+            return (labels != 0).astype(np.int64)
         return [0 if x is None else 1 for x in labels]
 
-    features = {k: np.array(v) for k, v in features.items()}
-    if labels:
-        labels = np.array(conv_labels(labels))
+    features = {k: np.asarray(v) for k, v in features.items()}
+    if labels is not None and len(labels) > 0:
+        labels = np.asarray(conv_labels(labels))
+    else:
+        labels = None
     return tf.estimator.inputs.numpy_input_fn(features, y=labels, batch_size=batch_size, shuffle=shuffle, num_epochs=num_epochs)
 
+def feature_shards(filepaths, block_size=2**13):
+    """Split columnar binary feature files into shards of block_size frames.
+
+    Returns a list of pairs (path, start), one for each shard, where start is
+    the index of the first frame of the shard in the file.
+    """
+    if isinstance(filepaths, (str, os.PathLike)):
+        filepaths = [filepaths]
+    shards = []
+    for path in filepaths:
+        columns, _ = ids.column_store.load_columns(str(path))
+        shards += [(str(path), start)
+                   for start in range(0, len(columns['id']), block_size)]
+    return shards
+
+def dnn_dataset_input_function(filepaths, batch_size=128, shuffle=False,
+                               num_epochs=None, shuffle_buffer=2**16,
+                               block_size=2**13, shards=None):
+    """An input function to the train and predict functions of the
+    DNNBasedIDS that streams features from columnar binary feature files
+    (see preprocessor.write_feature_file) with tf.data, instead of holding
+    every feature in memory.
+
+    The files are split into shards of block_size frames. Shards are read in
+    parallel from the memory-mapped files, split into frames, shuffled within
+    a bounded buffer, batched, and prefetched while the previous batch trains.
+    Memory use therefore depends on the buffer sizes and not on the size of
+    the dataset.
+
+    Arguments:
+    filepaths -- The path to a columnar binary feature file, or a list of
+    paths. Every file is one or more shards of the dataset.
+    batch_size -- The size of each training batch provided to the neural
+    network. Default is 128.
+    shuffle -- Whether the ordering of the shards and of the packets should
+    be randomized. Default is False, which keeps the order of the files.
+    num_epochs -- The number of times that the dataset should be looped over.
+    If `None` is provided, loop forever.
+    shuffle_buffer -- The number of frames held in the shuffle buffer.
+    block_size -- The number of frames in each shard.
+    shards -- The list of shards (path, start) of the files to read, as
+    returned by feature_shards, if only some of them should be read. Default
+    is every shard of filepaths.
+
+    Returns an input function for use in the train or predict methods of the
+    DNNBasedIDS. Labels are only provided if every file has label codes.
+    """
+    if isinstance(filepaths, (str, os.PathLike)):
+        filepaths = [filepaths]
+    filepaths = [str(x) for x in filepaths]
+    feature_names = list(FEATURE_DTYPES)
+
+    if shards is None:
+        shards = feature_shards(filepaths, block_size)
+    shard_paths = [str(x[0]) for x in shards]
+    shard_starts = [int(x[1]) for x in shards]
+    has_labels = all('label' in ids.column_store.load_columns(path)[0]
+                     for path in set(shard_paths))
+
+    out_types = [tf.float32] * len(feature_names)
+    if has_labels:
+        out_types.append(tf.int32)
+    open_files = {}
+
+    def read_shard(path, start):
+        """Read one shard from its memory-mapped file."""
+        path = path.decode()
+        if path not in open_files:
+            open_files[path] = ids.column_store.load_columns(path)[0]
+        columns = open_files[path]
+        stop = start + block_size
+        tensors = [
+            np.asarray(columns[k][start:stop], dtype=np.float32)
+            for k in feature_names
+        ]
+        if has_labels:
+            tensors.append(
+                (columns['label'][start:stop] != 0).astype(np.int32))
+        return tensors
+
+    def parse_shard(path, start):
+        tensors = tf.py_func(read_shard, [path, start], out_types,
+                             stateful=False)
+        for tensor in tensors:
+            tensor.set_shape([None])
+        return tuple(tensors)
+
+    def to_features_labels(*tensors):
+        features = dict(zip(feature_names, tensors))
+        if has_labels:
+            return features, tensors[-1]
+        return features
+
+    def input_function():
+        dataset = tf.data.Dataset.from_tensor_slices(
+            (tf.constant(shard_paths, dtype=tf.string),
+             tf.constant(shard_starts, dtype=tf.int64)))
+        if shuffle:
+            dataset = dataset.shuffle(max(len(shard_paths), 1))
+        dataset = dataset.repeat(num_epochs)
+        dataset = dataset.map(
+            parse_shard, num_parallel_calls=tf.data.experimental.AUTOTUNE)
+        # Split every shard back into single frames.
+        dataset = dataset.flat_map(
+            lambda *tensors: tf.data.Dataset.from_tensor_slices(tensors))
+        if shuffle:
+            dataset = dataset.shuffle(shuffle_buffer)
+        dataset = dataset.batch(batch_size)
+        dataset = dataset.map(
+            to_features_labels,
+            num_parallel_calls=tf.data.experimental.AUTOTUNE)
+        return dataset.prefetch(tf.data.experimental.AUTOTUNE)
+
+    return input_function
+
+def _file_identity(path):
+    """The absolute path, size and modification time of a file, which tell if
+    it has been trained on before."""
+    stat = os.stat(path)
+    return {
+        'path': os.path.abspath(path),
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns
+    }
+
+def plan_incremental_training(filepaths, provenance, replay_ratio=0.25,
+                              block_size=2**13, seed=None):
+    """Choose the shards to fine-tune a model on: every shard of the feature
+    files that have not been trained on, and a random replay sample of the
+    shards of the files that have.
+
+    Arguments:
+    filepaths -- The paths to the columnar binary feature files of the
+    dataset.
+    provenance -- The training provenance of the model, as returned by
+    DNNBasedIDS.training_provenance.
+    replay_ratio -- The number of replayed shards of old data, relative to
+    the number of shards of new data. Old data is sampled from every file
+    the model has been trained on that is unchanged, not only filepaths.
+    block_size -- The number of frames in each shard.
+    seed -- The seed of the replay sample.
+
+    Returns a dictionary of the 'new_files' and 'replay_files' with their
+    identities, the 'shards' to train on, and the number of 'new_shards' and
+    'replay_shards' among them.
+    """
+    trained = {x['path']: x for x in provenance['files']}
+    new_files, old_files = [], []
+    for path in filepaths:
+        identity = _file_identity(path)
+        if trained.get(identity['path']) == identity:
+            old_files.append(identity)
+        elif identity['path'] not in [x['path'] for x in new_files]:
+            new_files.append(identity)
+    for path, identity in trained.items():
+        if (identity not in old_files and os.path.exists(path) and
+                _file_identity(path) == identity):
+            old_files.append(identity)
+
+    new_shards = feature_shards([x['path'] for x in new_files], block_size)
+    old_shards = feature_shards([x['path'] for x in old_files], block_size)
+    num_replay = min(len(old_shards),
+                     math.ceil(replay_ratio * len(new_shards)))
+    rng = np.random.default_rng(seed)
+    replay = [old_shards[i] for i in sorted(
+        rng.choice(len(old_shards), num_replay, replace=False))]
+    return {
+        'new_files': new_files,
+        'replay_files': sorted({x[0] for x in replay}),
+        'shards': new_shards + replay,
+        'new_shards': len(new_shards),
+        'replay_shards': len(replay)
+    }
+
 class DNNBasedIDS:
     """A class that uses a neural network to classify packets.
 
@@ -62,7 +264,10 @@ class DNNBasedIDS:
     new_model -- Create a new model with the directory specified.
     load_model -- Load the model from the directory specified.
     train -- Train the DNN based IDS with data from the input function for a certain number of steps.
+    train_incremental -- Fine-tune the DNN based IDS on new feature files, with a replay sample of old ones.
+    training_provenance -- Return the record of what the DNN based IDS has been trained on.
     predict_frame -- Determine if a pre-processed frame is malicious or not.
+    predict_batch -- Determine if each of a batch of pre-processed frames is malicious or not.
     predict -- Take an input function for a data set and return whether the frames are malicious or not.
     """
     def __init__(self):
@@ -113,11 +318,13 @@ class DNNBasedIDS:
                 .format(key, self._params.keys()))
         self._params[key] = value
 
-    def new_model(self, model_dir):
+    def new_model(self, model_dir, config=None):
         """Create a new model with the directory specified.
 
         Arguments:
         model_dir -- The directory to which this model should be saved.
+        config -- The tf.estimator.RunConfig of the model, for example to
+        limit the number of threads it uses. Default is the Estimator default.
 
         Raises:
         FileExistsError -- A model with the same name already exists, so a new
@@ -136,13 +343,16 @@ class DNNBasedIDS:
             label_vocabulary=None,
             optimizer=self._params['optimizer'],
             activation_fn=self._params['activation_fn'],
+            loss_reduction=self._params['loss_reduction'],
+            config=config
         )
 
-    def load_model(self, model_dir):
+    def load_model(self, model_dir, config=None):
         """Load the model from the directory specified.
 
         Arguments:
         model_dir -- The directory the model should be loaded from.
+        config -- The tf.estimator.RunConfig of the model, as in new_model.
 
         Raises:
         FileNotFoundError -- There is no model with the name specified in the
@@ -162,18 +372,125 @@ class DNNBasedIDS:
             label_vocabulary=None,
             optimizer=self._params['optimizer'],
             activation_fn=self._params['activation_fn'],
-            loss_reduction=self._params['loss_reduction']
+            loss_reduction=self._params['loss_reduction'],
+            config=config
         )
 
-    def train(self, input_function, num_steps):
+    def train(self, input_function, num_steps, filepaths=None):
         """Train the DNN based IDS with data from the input function for a certain number of steps.
 
         Arguments:
         input_function -- The input function for the dataset the DNN based IDS
         should be trained on.
         num_steps -- The number of steps to take for training the DNN based IDS.
+        filepaths -- The columnar binary feature files input_function reads,
+        if any. They are recorded in the training provenance of the model as
+        trained on, so train_incremental only uses them for replay.
         """
+        start_step = self._global_step()
         self._dnn.train(input_function, steps=num_steps)
+        if filepaths is not None:
+            if isinstance(filepaths, (str, os.PathLike)):
+                filepaths = [filepaths]
+            files = [_file_identity(x) for x in filepaths]
+            self._record_training(files, {
+                'mode': 'full',
+                'start_step': start_step,
+                'num_steps': num_steps,
+                'new_files': [x['path'] for x in files]
+            })
+
+    def train_incremental(self, filepaths, num_steps=None, replay_ratio=0.25,
+                          batch_size=128, seed=None):
+        """Fine-tune the DNN based IDS, resuming from its latest checkpoint,
+        on the feature files it has not been trained on yet, mixed with a
+        replay sample of the data it has been trained on before, so it does
+        not forget it. The training is recorded in the training provenance of
+        the model.
+
+        Arguments:
+        filepaths -- The paths to the columnar binary feature files of the
+        dataset. Files that have already been trained on, and have not
+        changed since, are only used for replay.
+        num_steps -- The number of steps to train for. Default is one pass
+        over the new and replayed frames.
+        replay_ratio -- The amount of old data replayed, relative to the
+        amount of new data. See plan_incremental_training.
+        batch_size -- The size of each training batch.
+        seed -- The seed of the replay sample.
+
+        Returns the record of the training session added to the provenance,
+        or None if there were no new files to train on.
+        """
+        if not self._dnn:
+            raise RuntimeError('No DNN has been initialized!')
+        if isinstance(filepaths, (str, os.PathLike)):
+            filepaths = [filepaths]
+        plan = plan_incremental_training(filepaths,
+                                         self.training_provenance(),
+                                         replay_ratio, seed=seed)
+        if not plan['new_files']:
+            return None
+        if num_steps is None:
+            num_frames = sum(
+                len(ids.column_store.load_columns(x)[0]['id'])
+                for x in [f['path'] for f in plan['new_files']])
+            num_frames *= 1 + plan['replay_shards'] / max(
+                plan['new_shards'], 1)
+            num_steps = max(math.ceil(num_frames / batch_size), 1)
+
+        start_step = self._global_step()
+        self._dnn.train(dnn_dataset_input_function(
+            [], batch_size=batch_size, shuffle=True, shards=plan['shards']),
+                        steps=num_steps)
+        return self._record_training(plan['new_files'], {
+            'mode': 'incremental',
+            'start_step': start_step,
+            'num_steps': num_steps,
+            'new_files': [x['path'] for x in plan['new_files']],
+            'replay_files': plan['replay_files'],
+            'new_shards': plan['new_shards'],
+            'replay_shards': plan['replay_shards'],
+            'replay_ratio': replay_ratio,
+            'seed': seed
+        })
+
+    def training_provenance(self):
+        """Return the training provenance of the model: a dictionary of the
+        'files' it has been trained on, with their path, size and
+        modification time, and a list of every training 'sessions' recorded,
+        oldest first."""
+        path = self._provenance_path()
+        if not os.path.exists(path):
+            return {'files': [], 'sessions': []}
+        with open(path) as file:
+            return json.load(file)
+
+    def _provenance_path(self):
+        return self._dnn.model_dir + '.training.json'
+
+    def _global_step(self):
+        if tf.train.latest_checkpoint(self._dnn.model_dir) is None:
+            return 0
+        return int(self._dnn.get_variable_value('global_step'))
+
+    def _record_training(self, files, session):
+        """Add a training session on files to the provenance of the model."""
+        provenance = self.training_provenance()
+        paths = {x['path'] for x in files}
+        provenance['files'] = [
+            x for x in provenance['files'] if x['path'] not in paths
+        ] + files
+        session = dict(session,
+                       time=datetime.datetime.now().isoformat(
+                           timespec='seconds'),
+                       end_step=self._global_step())
+        provenance['sessions'].append(session)
+        path = self._provenance_path()
+        with open(path + '.tmp', 'w') as file:
+            json.dump(provenance, file, indent=2)
+        os.replace(path + '.tmp', path)
+        return session
 
     def predict_frame(self, processed_frame):
         """Determine if a pre-processed frame is malicious or not.
@@ -197,6 +514,30 @@ class DNNBasedIDS:
         confidence = float(prediction['probabilities'][pred_class])
         return is_malicious, confidence
 
+    def predict_batch(self, processed_frames, batch_size=None):
+        """Determine if each of a batch of pre-processed frames is malicious
+        or not, with a single call to the DNN.
+
+        Arguments:
+        processed_frames -- A dictionary of pre-processed features, with the
+        same keys as the frames given to predict_frame, and a list or array
+        of values for each.
+        batch_size -- The number of frames fed to the network at a time. If
+        None, the whole batch is fed at once.
+
+        Returns a list of pairs (is_malicious, prob_malicious), one for each
+        frame, as returned by predict_frame.
+        """
+        features = {k: np.asarray(v) for k, v in processed_frames.items()}
+        num_frames = len(next(iter(features.values()), []))
+        if not num_frames:
+            return []
+        input_function = tf.estimator.inputs.numpy_input_fn(
+            features, y=None, batch_size=batch_size or num_frames,
+            shuffle=False,
+            num_epochs=1)
+        return list(self.predict(input_function))
+
     def predict(self, input_function):
         """Take an input function for a data set and return whether the frames are malicious or not.
 
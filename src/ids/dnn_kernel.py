@@ -0,0 +1,413 @@
+"""DNN Kernel
+A NumPy implementation of the forward pass of the DNN Based IDS, for judging
+frames without TensorFlow. The weights of a trained DNNBasedIDS are exported
+from its latest checkpoint into plain arrays, which can be saved, copied into
+shared memory and used by any number of processes.
+
+A DNNKernel has the same predict_frame and predict_batch functions as a
+DNNBasedIDS, so it can take the place of the DNN in a TwoStageIDS that only
+judges frames.
+
+For hardware with little memory, the weights can be stored in reduced
+precision (see PRECISIONS): float16, or int8 with a scale for each layer, so
+that a weight is its int8 value times the scale of its layer. The weights
+are used in that format, and only the activations are computed in float32.
+precision_report compares the verdicts, speed and size of each precision
+with the float32 weights on a held-out dataset.
+
+Usage:
+    python -m ids.dnn_kernel savedata/dnn-models/NAME --eval held_out.bin
+        --export NAME.int8.npz --precision int8 --output report.json
+
+Classes:
+DNNKernel -- The weights of a trained DNN Based IDS, and its forward pass.
+
+Functions:
+activation_name -- Get the name of a TensorFlow activation function.
+precision_report -- Compare the reduced precisions of a kernel with float32.
+"""
+
+import argparse
+import json
+import time
+
+import numpy as np
+
+import ids.column_store
+
+# The inputs of the DNN, in the order the input layer of the Estimator
+# concatenates them, which is sorted by name.
+FEATURES = sorted(
+    ['id', 'occurrences_in_last_sec', 'relative_entropy',
+     'system_entropy_change'])
+
+
+def _sigmoid(x):
+    return 0.5 * (1 + np.tanh(0.5 * x))
+
+
+def _elu(x):
+    return np.where(x > 0, x, np.expm1(np.minimum(x, 0)))
+
+
+def _selu(x):
+    alpha = 1.6732632423543772
+    scale = 1.0507009873554805
+    return scale * np.where(x > 0, x, alpha * np.expm1(np.minimum(x, 0)))
+
+
+# The activation functions the GUI offers, by the name of the TensorFlow
+# function.
+ACTIVATIONS = {
+    'relu': lambda x: np.maximum(x, 0),
+    'relu6': lambda x: np.clip(x, 0, 6),
+    'crelu': lambda x: np.concatenate([np.maximum(x, 0),
+                                       np.maximum(-x, 0)], axis=-1),
+    'elu': _elu,
+    'selu': _selu,
+    'softplus': lambda x: np.logaddexp(x, 0),
+    'softsign': lambda x: x / (1 + np.abs(x)),
+    'sigmoid': _sigmoid,
+    'tanh': np.tanh
+}
+
+
+# The precisions the weights can be stored in, by the type of the weights.
+PRECISIONS = {
+    'float32': np.float32,
+    'float16': np.float16,
+    'int8': np.int8
+}
+
+# The largest magnitude of an int8 weight, so weights are symmetric around 0.
+_INT8_MAX = 127
+
+
+def activation_name(activation_fn):
+    """Get the name of a TensorFlow activation function, such as tf.nn.relu,
+    as used by ACTIVATIONS.
+
+    Raises:
+    ValueError -- There is no NumPy version of the activation function.
+    """
+    name = getattr(activation_fn, '__name__', str(activation_fn))
+    if name not in ACTIVATIONS:
+        raise ValueError(
+            'The {} activation function is not supported.'.format(name))
+    return name
+
+
+class DNNKernel:
+    """The weights of a trained DNN Based IDS, and its forward pass.
+
+    Attributes:
+        layers: list of pairs (kernel, bias), one for each hidden layer and
+        the logits layer last. The kernels are arrays of the type of the
+        precision of the weights, and the biases are float32 arrays.
+        scales: the scale of the kernel of each layer, which is 1.0 unless
+        the precision is int8.
+        activation: the name of the activation function of the hidden
+        layers, a key of ACTIVATIONS.
+    """
+
+    def __init__(self, layers, activation='relu', scales=None):
+        self.layers = []
+        for kernel, bias in layers:
+            kernel = np.asarray(kernel)
+            if kernel.dtype not in (np.float16, np.int8):
+                kernel = kernel.astype(np.float32, copy=False)
+            self.layers.append((kernel, np.asarray(bias, dtype=np.float32)))
+        if len({x[0].dtype for x in self.layers}) > 1:
+            raise ValueError('Every layer must have the same precision.')
+        self.scales = ([1.0] * len(self.layers) if scales is None else
+                       [float(x) for x in scales])
+        if activation not in ACTIVATIONS:
+            raise ValueError(
+                'The {} activation function is not supported.'.format(
+                    activation))
+        self.activation = activation
+        self._activation_fn = ACTIVATIONS[activation]
+
+    @property
+    def precision(self):
+        """The precision the weights are stored in, a key of PRECISIONS."""
+        dtype = self.layers[0][0].dtype if self.layers else np.float32
+        return next(k for k, v in PRECISIONS.items() if v == dtype)
+
+    @property
+    def memory_bytes(self):
+        """The size of the weights in bytes."""
+        return sum(kernel.nbytes + bias.nbytes
+                   for kernel, bias in self.layers)
+
+    def float_layers(self):
+        """Return the layers with the kernels converted to float32 and
+        scaled, as pairs (kernel, bias)."""
+        return [(kernel.astype(np.float32) * np.float32(scale), bias)
+                for (kernel, bias), scale in zip(self.layers, self.scales)]
+
+    def quantize(self, precision):
+        """Return a copy of the kernel with its weights stored in precision,
+        a key of PRECISIONS.
+
+        int8 weights are rounded to the nearest multiple of the scale of
+        their layer, which is the largest weight magnitude of the layer
+        divided by 127.
+        """
+        if precision not in PRECISIONS:
+            raise ValueError('{} is not a valid precision.'.format(precision))
+        layers = self.float_layers()
+        if precision != 'int8':
+            return DNNKernel([(kernel.astype(PRECISIONS[precision]), bias)
+                              for kernel, bias in layers], self.activation)
+        quantized = []
+        scales = []
+        for kernel, bias in layers:
+            # Scales are stored as float32, like the rest of the weights.
+            scale = float(np.float32(np.abs(kernel).max() / _INT8_MAX)) or 1.0
+            quantized.append((np.clip(np.rint(kernel / scale), -_INT8_MAX,
+                                      _INT8_MAX).astype(np.int8), bias))
+            scales.append(scale)
+        return DNNKernel(quantized, self.activation, scales)
+
+    @classmethod
+    def from_checkpoint(cls, model_dir, activation='relu'):
+        """Export the weights of the latest checkpoint of a DNNClassifier.
+
+        Arguments:
+        model_dir -- The directory of the model.
+        activation -- The name of the activation function of the model.
+
+        Raises:
+        ValueError -- There is no checkpoint in model_dir.
+        """
+        # TensorFlow is only needed to read the checkpoint.
+        import tensorflow as tf
+
+        reader = tf.train.load_checkpoint(model_dir)
+        names = reader.get_variable_to_shape_map()
+        layers = []
+        while 'dnn/hiddenlayer_{}/kernel'.format(len(layers)) in names:
+            prefix = 'dnn/hiddenlayer_{}/'.format(len(layers))
+            layers.append((reader.get_tensor(prefix + 'kernel'),
+                           reader.get_tensor(prefix + 'bias')))
+        layers.append((reader.get_tensor('dnn/logits/kernel'),
+                       reader.get_tensor('dnn/logits/bias')))
+        return cls(layers, activation)
+
+    @classmethod
+    def from_dnn(cls, dnn):
+        """Export the weights of a trained DNNBasedIDS.
+
+        Raises:
+        RuntimeError -- No model has been created or loaded by dnn.
+        """
+        # pylint: disable=protected-access
+        if not dnn._dnn:
+            raise RuntimeError('No DNN has been initialized!')
+        return cls.from_checkpoint(
+            dnn._dnn.model_dir, activation_name(dnn._params['activation_fn']))
+
+    def to_arrays(self):
+        """Return the weights as a dictionary of arrays, named
+        'layer<k>.kernel' and 'layer<k>.bias', and 'layer<k>.scale' for int8
+        weights."""
+        arrays = {}
+        for k, (kernel, bias) in enumerate(self.layers):
+            arrays['layer{}.kernel'.format(k)] = kernel
+            arrays['layer{}.bias'.format(k)] = bias
+            if kernel.dtype == np.int8:
+                arrays['layer{}.scale'.format(k)] = np.array(
+                    [self.scales[k]], dtype=np.float32)
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays, activation='relu'):
+        """Make a kernel from the arrays returned by to_arrays. The arrays are
+        used as they are, without being copied."""
+        layers = []
+        scales = []
+        while 'layer{}.kernel'.format(len(layers)) in arrays:
+            k = len(layers)
+            layers.append((arrays['layer{}.kernel'.format(k)],
+                           arrays['layer{}.bias'.format(k)]))
+            scale = arrays.get('layer{}.scale'.format(k))
+            scales.append(1.0 if scale is None else float(scale[0]))
+        return cls(layers, activation, scales)
+
+    def save(self, filepath):
+        """Save the weights, in their precision, and the activation function
+        to a .npz file."""
+        np.savez(filepath, activation=np.array(self.activation),
+                 **self.to_arrays())
+
+    @classmethod
+    def load(cls, filepath):
+        """Load a kernel saved with save."""
+        with np.load(filepath) as arrays:
+            return cls.from_arrays(dict(arrays), str(arrays['activation']))
+
+    def logits(self, processed_frames):
+        """Return the logits of a batch of pre-processed frames, as an (N, 1)
+        array for a binary classifier."""
+        inputs = np.column_stack([
+            np.asarray(processed_frames[name], dtype=np.float32)
+            for name in FEATURES
+        ])
+        for k in range(len(self.layers) - 1):
+            inputs = self._activation_fn(self._layer(inputs, k))
+        return self._layer(inputs, len(self.layers) - 1)
+
+    def _layer(self, inputs, k):
+        """The output of layer k before its activation function."""
+        kernel, bias = self.layers[k]
+        # Reduced precision kernels are widened to float32 by the product,
+        # and int8 products are scaled back afterwards.
+        outputs = inputs @ kernel
+        if self.scales[k] != 1.0:
+            outputs *= np.float32(self.scales[k])
+        return outputs + bias
+
+    def probabilities(self, processed_frames):
+        """Return the probability of each class, not malicious and malicious,
+        for a batch of pre-processed frames as an (N, 2) array."""
+        logits = self.logits(processed_frames)
+        if logits.shape[1] == 1:
+            # Binary classifiers have a single logit for the malicious class.
+            prob_malicious = _sigmoid(logits[:, 0])
+            return np.column_stack([1 - prob_malicious, prob_malicious])
+        logits = logits - logits.max(axis=1, keepdims=True)
+        exp = np.exp(logits)
+        return exp / exp.sum(axis=1, keepdims=True)
+
+    def predict_batch(self, processed_frames, batch_size=None):
+        """Determine if each of a batch of pre-processed frames is malicious
+        or not. See DNNBasedIDS.predict_batch.
+
+        Returns a list of pairs (is_malicious, prob_malicious), one for each
+        frame.
+        """
+        num_frames = len(processed_frames['id'])
+        batch_size = batch_size or num_frames or 1
+        results = []
+        for lo in range(0, num_frames, batch_size):
+            probs = self.probabilities({
+                k: np.asarray(v)[lo:lo + batch_size]
+                for k, v in processed_frames.items()
+            })
+            classes = probs.argmax(axis=1)
+            results.extend(
+                zip(classes.astype(bool).tolist(),
+                    probs[np.arange(len(classes)), classes].tolist()))
+        return results
+
+    def predict_frame(self, processed_frame):
+        """Determine if a pre-processed frame is malicious or not. See
+        DNNBasedIDS.predict_frame."""
+        return self.predict_batch(
+            {k: [v] for k, v in processed_frame.items()})[0]
+
+
+def precision_report(kernel, features, labels=None, precisions=None,
+                     batch_size=4096, repeat=3):
+    """Compare the reduced precisions of a kernel with its float32 weights
+    on a held-out dataset.
+
+    Arguments:
+    kernel -- The DNNKernel of the model.
+    features -- The feature lists of the held-out frames.
+    labels -- The label code of each frame, if the accuracy of each
+    precision should be reported as well.
+    precisions -- The precisions to compare. Default is every precision.
+    batch_size -- The number of frames judged at a time.
+    repeat -- The number of times the frames are judged when timing, of
+    which the fastest is reported.
+
+    Returns a dictionary of the results of each precision:
+    - 'memory_bytes': the size of the weights.
+    - 'frames_per_second': the throughput of predict_batch.
+    - 'agreement': the share of the verdicts that match the float32
+      verdicts.
+    - 'max_probability_error': the largest difference from the float32
+      probability that a frame is malicious.
+    - 'accuracy' and 'f1' against labels, if given.
+    """
+    from ids.evaluation import evaluate
+
+    features = {k: np.asarray(features[k]) for k in FEATURES}
+    num_frames = len(features['id'])
+    reference = kernel.quantize('float32')
+    reference_probs = reference.probabilities(features)[:, 1]
+    reference_verdicts = reference_probs > 0.5
+    report = {}
+    for precision in precisions or list(PRECISIONS):
+        quantized = kernel.quantize(precision)
+        probs = quantized.probabilities(features)[:, 1]
+        verdicts = probs > 0.5
+        seconds = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            quantized.predict_batch(features, batch_size)
+            seconds.append(time.perf_counter() - start)
+        result = {
+            'memory_bytes': quantized.memory_bytes,
+            'frames_per_second': (num_frames / min(seconds)
+                                  if min(seconds) else 0.0),
+            'agreement': (float(np.mean(verdicts == reference_verdicts))
+                          if num_frames else 1.0),
+            'max_probability_error': (float(np.abs(probs -
+                                                   reference_probs).max())
+                                      if num_frames else 0.0)
+        }
+        if labels is not None and len(labels):
+            malicious = (np.asarray(labels) != 0).astype(np.int8)
+            scores = evaluate(malicious, verdicts, [None, 'malicious'])
+            result['accuracy'] = scores['accuracy']
+            result['f1'] = scores['f1']
+        report[precision] = result
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m ids.dnn_kernel',
+        description='Export the weights of a trained DNN Based IDS in '
+        'reduced precision, and compare the precisions on held-out data.')
+    parser.add_argument('model_dir', help='directory of the trained model')
+    parser.add_argument('--activation', default='relu',
+                        help='activation function of the model '
+                        '(default: %(default)s)')
+    parser.add_argument('--eval', metavar='FEATURES',
+                        help='held-out feature file to compare the '
+                        'precisions on')
+    parser.add_argument('--export', metavar='PATH',
+                        help='save the weights to PATH as a .npz file')
+    parser.add_argument('--precision', choices=list(PRECISIONS),
+                        default='int8',
+                        help='precision of the exported weights '
+                        '(default: %(default)s)')
+    parser.add_argument('--output', metavar='PATH',
+                        help='write the comparison to PATH as JSON')
+    args = parser.parse_args(argv)
+
+    kernel = DNNKernel.from_checkpoint(args.model_dir, args.activation)
+    if args.export:
+        kernel.quantize(args.precision).save(args.export)
+    if args.eval:
+        columns, _ = ids.column_store.load_columns(args.eval)
+        report = precision_report(kernel, columns, columns.get('label'))
+        for precision, result in report.items():
+            print('{}: {} bytes, {:.0f} frames/s, {:.4%} agreement, '
+                  'max probability error {:.2g}{}'.format(
+                      precision, result['memory_bytes'],
+                      result['frames_per_second'], result['agreement'],
+                      result['max_probability_error'],
+                      ', F1 {:.4f}'.format(result['f1'])
+                      if 'f1' in result else ''))
+        if args.output:
+            with open(args.output, 'w') as outfile:
+                json.dump(report, outfile, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""DNN Parameters
+Correspondences between the TensorFlow objects that parameterize a DNN Based
+IDS and the names the GUI and the hyperparameter sweep use for them, so the
+parameters of a model can be written down as plain strings and numbers.
+
+Functions:
+construct_optimizer -- Create a TensorFlow optimizer from its name and
+properties.
+"""
+
+import tensorflow as tf
+
+# Set up object -> name correspondences.
+activation_fn_convert = {
+    tf.nn.relu: "ReLU",
+    tf.nn.relu6: "ReLU 6",
+    tf.nn.crelu: "CReLU",
+    tf.nn.elu: "ELU",
+    tf.nn.selu: "SELU",
+    tf.nn.softplus: "Softplus",
+    tf.nn.softsign: "Softsign",
+    tf.sigmoid: "Sigmoid",
+    tf.tanh: "Tanh"
+}
+
+activation_fn_convert_reverse = {v: k for k, v in activation_fn_convert.items()}
+
+loss_reduction_convert = {
+    tf.losses.Reduction.NONE: "None",
+    tf.losses.Reduction.MEAN: "Mean",
+    tf.losses.Reduction.SUM: "Sum",
+    tf.losses.Reduction.SUM_OVER_BATCH_SIZE: "Sum over Batch Size",
+    tf.losses.Reduction.SUM_BY_NONZERO_WEIGHTS: "Sum by Nonzero Weights"
+}
+
+loss_reduction_convert_reverse = {v: k for k, v in loss_reduction_convert.items()}
+
+optimizer_convert = {
+    tf.train.AdadeltaOptimizer: "Adadelta Optimizer",
+    tf.train.AdagradDAOptimizer: "Adagrad DA Optimizer",
+    tf.train.AdagradOptimizer: "Adagrad Optimizer",
+    tf.train.AdamOptimizer: "Adam Optimizer",
+    tf.train.FtrlOptimizer: "FTRL Optimizer",
+    tf.train.GradientDescentOptimizer: "Gradient Descent Optimizer",
+    tf.train.MomentumOptimizer: "Momentum Optimizer",
+    tf.train.ProximalAdagradOptimizer: "Proximal Adagrad Optimizer",
+    tf.train.ProximalGradientDescentOptimizer: "Proximal Gradient Descent Optimizer",
+    tf.train.RMSPropOptimizer: "RMS Prop Optimizer"
+}
+
+optimizer_convert_reverse = {v: k for k, v in optimizer_convert.items()}
+
+def construct_optimizer(name, properties):
+    """Create a TensorFlow optimizer from its name, a value of
+    optimizer_convert, and a dictionary of its properties, as entered in the
+    GUI.
+
+    Raises:
+    KeyError -- There is no optimizer with that name.
+    """
+    optimizer_class = optimizer_convert_reverse[name]
+    if name == 'Adadelta Optimizer':
+        return optimizer_class(
+            learning_rate=properties['Learning Rate'],
+            rho=properties['Rho'],
+            epsilon=properties['Epsilon']
+        )
+    elif name == 'Adagrad DA Optimizer':
+        return optimizer_class(
+            learning_rate=properties['Learning Rate'],
+            global_step=properties['Global Step'],
+            initial_gradient_squared_accumulator_value=properties['Initial Gradient Squared Accumulator Value'],
+            l1_regularization_strength=properties['L1 Regularization Strength'],
+            l2_regularization_strength=properties['L2 Regularization Strength']
+        )
+    elif name == 'Adagrad Optimizer':
+        return optimizer_class(
+            learning_rate=properties['Learning Rate'],
+            initial_accumulator_value=properties['Initial Accumulator Value']
+        )
+    elif name == 'Adam Optimizer':
+        return optimizer_class(
+            learning_rate=properties['Learning Rate'],
+            beta1=properties['Beta_1'],
+            beta2=properties['Beta_2'],
+            epsilon=properties['Epsilon']
+        )
+    elif name == 'FTRL Optimizer':
+        return optimizer_class(
+            learning_rate=properties['Learning Rate'],
+            learning_rate_power=properties['Learning Rate Power'],
+            initial_accumulator_value=properties['Initial Accumulator Value'],
+            l1_regularization_strength=properties['L1 Regularization Strength'],
+            l2_regularization_strength=properties['L2 Regularization Strength'],
+            l2_shrinkage_regularization_strength=properties['L2 Shrinkage Regularization Strength']
+        )
+    elif name == 'Gradient Descent Optimizer':
+        return optimizer_class(
+            learning_rate=properties['Learning Rate']
+        )
+    elif name == 'Momentum Optimizer':
+        return optimizer_class(
+            learning_rate=properties['Learning Rate'],
+            momentum=properties['Momentum'],
+            use_nesterov=False
+        )
+    elif name == 'Proximal Adagrad Optimizer':
+        return optimizer_class(
+            learning_rate=properties['Learning Rate'],
+            initial_accumulator_value=properties['Initial Accumulator Value'],
+            l1_regularization_strength=properties['L1 Regularization Strength'],
+            l2_regularization_strength=properties['L2 Regularization Strength']
+        )
+    elif name == 'Proximal Gradient Descent Optimizer':
+        return optimizer_class(
+            learning_rate=properties['Learning Rate'],
+            l1_regularization_strength=properties['L1 Regularization Strength'],
+            l2_regularization_strength=properties['L2 Regularization Strength']
+        )
+    elif name == 'RMS Prop Optimizer':
+        return optimizer_class(
+            learning_rate=properties['Learning Rate'],
+            decay=properties['Decay'],
+            momentum=properties['Momentum'],
+            centered=properties['Centered']
+        )
+    else:
+        raise ValueError()
@@ -0,0 +1,505 @@
+"""Evaluation
+Score the verdicts of the Two Stage IDS on a labelled dataset in one pass,
+instead of counting them a frame at a time during a simulation. Every metric
+is derived from a single count matrix, holding the number of frames of each
+label that were passed and that were judged malicious, which np.bincount
+computes for a whole dataset at once. The report manager of the GUI keeps
+the same count matrix while a simulation runs, so live and offline results
+are summarized the same way.
+
+Labels are given as label codes: indices into the labels of a
+MaliciousGenerator (see MaliciousGenerator.labels), where code 0 is a frame
+that is not malicious.
+
+Usage:
+    python -m ids.evaluation verdicts/capture.verdicts
+        datasets/NAME/features_labels.bin --output evaluation.json
+
+Functions:
+count_matrix -- Count the frames of each label that were passed and that
+were judged malicious.
+summarize -- Compute the metrics of a count matrix.
+evaluate -- Compute the metrics of the verdicts of a whole dataset.
+verdict_codes -- Convert verdict tuples of the Two Stage IDS to arrays.
+evaluate_files -- Evaluate a verdict file against a labelled feature file.
+
+Classes:
+RollingMetrics -- Detection metrics and latency in per-second bins over a
+rolling window.
+"""
+
+import argparse
+import csv
+import json
+
+import numpy as np
+
+import ids.column_store
+
+# The name of the label of frames that are not malicious.
+BENIGN = 'benign'
+
+# Frame timestamps are in units of 0.1 ms.
+TIMESTAMPS_PER_SECOND = 10000
+
+
+def _safe_div(num1, num2):
+    # 0/0 is taken to be 0, as in a rate over no frames.
+    return num1 / num2 if num2 else 0.0
+
+
+def _f1(precision, recall):
+    return _safe_div(2 * precision * recall, precision + recall)
+
+
+def count_matrix(label_codes, verdicts, num_labels):
+    """Count the frames of each label that were passed and that were judged
+    malicious.
+
+    Arguments:
+    label_codes -- Array of the label code of each frame.
+    verdicts -- Array of whether each frame was judged malicious.
+    num_labels -- The number of labels, which is the number of rows.
+
+    Returns a (num_labels, 2) int64 array, where row k holds the number of
+    frames with label code k that were passed, then that were judged
+    malicious.
+    """
+    label_codes = np.asarray(label_codes, dtype=np.int64)
+    verdicts = np.asarray(verdicts).astype(bool)
+    if label_codes.shape != verdicts.shape:
+        raise ValueError('There are {} labels for {} verdicts.'.format(
+            len(label_codes), len(verdicts)))
+    return np.bincount(label_codes * 2 + verdicts,
+                       minlength=num_labels * 2).reshape(num_labels, 2)
+
+
+def summarize(counts, labels):
+    """Compute the metrics of a count matrix.
+
+    Arguments:
+    counts -- The count matrix, as returned by count_matrix.
+    labels -- The name of each label code, from MaliciousGenerator.labels.
+    Label code 0 is named BENIGN in the results.
+
+    Returns a dictionary of
+    - 'labels': the label names, and 'counts': the count matrix as lists.
+    - 'total', 'total_benign' and 'total_malicious' frames.
+    - 'true_positive', 'true_negative', 'false_positive' and
+      'false_negative': the binary confusion matrix.
+    - 'accuracy', 'precision', 'recall' and 'f1', with malicious frames as
+      the positive class, and the 'benign_passed', 'false_positive_rate' and
+      'false_negative_rate'.
+    - 'attacks': a dictionary of the 'total', 'true_positive',
+      'false_negative', 'recall', 'precision' and 'f1' of each attack. As the
+      IDS does not tell attacks apart, the precision of an attack counts
+      every benign frame judged malicious as a false positive, which is the
+      precision the IDS would have on traffic with only that attack.
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    labels = [BENIGN] + list(labels[1:])
+    true_negative, false_positive = (int(x) for x in counts[0])
+    false_negative, true_positive = (int(x) for x in counts[1:].sum(axis=0))
+    total_benign = true_negative + false_positive
+    total_malicious = true_positive + false_negative
+    precision = _safe_div(true_positive, true_positive + false_positive)
+    recall = _safe_div(true_positive, total_malicious)
+
+    attacks = {}
+    for name, (missed, caught) in zip(labels[1:], counts[1:].tolist()):
+        attack_precision = _safe_div(caught, caught + false_positive)
+        attack_recall = _safe_div(caught, caught + missed)
+        attacks[name] = {
+            'total': caught + missed,
+            'true_positive': caught,
+            'false_negative': missed,
+            'recall': attack_recall,
+            'precision': attack_precision,
+            'f1': _f1(attack_precision, attack_recall)
+        }
+
+    return {
+        'labels': labels,
+        'counts': counts.tolist(),
+        'total': total_benign + total_malicious,
+        'total_benign': total_benign,
+        'total_malicious': total_malicious,
+        'true_positive': true_positive,
+        'true_negative': true_negative,
+        'false_positive': false_positive,
+        'false_negative': false_negative,
+        'accuracy': _safe_div(true_positive + true_negative,
+                              total_benign + total_malicious),
+        'precision': precision,
+        'recall': recall,
+        'f1': _f1(precision, recall),
+        'benign_passed': _safe_div(true_negative, total_benign),
+        'false_positive_rate': _safe_div(false_positive, total_benign),
+        'false_negative_rate': _safe_div(false_negative, total_malicious),
+        'attacks': attacks
+    }
+
+
+def evaluate(label_codes, verdicts, labels, rule_codes=None, rule_names=None):
+    """Compute the metrics of the verdicts of a whole dataset.
+
+    Arguments:
+    label_codes -- Array of the label code of each frame.
+    verdicts -- Array of whether each frame was judged malicious.
+    labels -- The name of each label code, from MaliciousGenerator.labels.
+    rule_codes -- Array of which rule rejected each frame: 0 if the frame
+    passed the rules, else 1 + the index of the rule in rule_names, as in
+    the verdict files of the judge module. If given, the results also tell
+    which stage of the IDS caught the frames of each label.
+    rule_names -- The names of the rules of rule_codes.
+
+    Returns the metrics, as returned by summarize. If rule_codes is given,
+    they also have 'detections': a dictionary of the 'stages', which are
+    'passed', 'dnn' and then each rule, and the 'counts' of the frames of
+    each label (row) that were passed or caught by each stage (column).
+    """
+    results = summarize(count_matrix(label_codes, verdicts, len(labels)),
+                        labels)
+    if rule_codes is not None:
+        rule_codes = np.asarray(rule_codes, dtype=np.int64)
+        # Column 0 is passed, 1 is caught by the DNN, and 2 + k is caught by
+        # rule k of rule_names, whose rule code is 1 + k.
+        stages = np.where(rule_codes > 0, rule_codes + 1,
+                          np.asarray(verdicts).astype(np.int64))
+        num_stages = 2 + len(rule_names)
+        detections = np.bincount(
+            np.asarray(label_codes, dtype=np.int64) * num_stages + stages,
+            minlength=len(labels) * num_stages).reshape(len(labels),
+                                                        num_stages)
+        results['detections'] = {
+            'stages': ['passed', 'dnn'] + list(rule_names),
+            'counts': detections.tolist()
+        }
+    return results
+
+
+def verdict_codes(results, rule_names):
+    """Convert verdict tuples of the Two Stage IDS, as returned by
+    TwoStageIDS.judge_batch or judge_dataset, to arrays.
+
+    Arguments:
+    results -- Iterable of the verdict tuples.
+    rule_names -- The names of the rules of the Rules Based IDS, in order.
+
+    Returns a tuple (verdicts, rule_codes, confidences): int8 arrays of
+    whether each frame was judged malicious and of which rule rejected it
+    (see evaluate), and a float32 array of the confidence of the DNN, NaN
+    for frames rejected by a rule.
+    """
+    codes = {name: i + 1 for i, name in enumerate(rule_names)}
+    verdicts, rule_codes, confidences = [], [], []
+    for is_malicious, reason in results:
+        verdicts.append(is_malicious)
+        if isinstance(reason, str):
+            rule_codes.append(codes[reason])
+            confidences.append(np.nan)
+        else:
+            rule_codes.append(0)
+            confidences.append(np.nan if reason is None else reason)
+    return (np.array(verdicts, dtype=np.int8),
+            np.array(rule_codes, dtype=np.int8),
+            np.array(confidences, dtype=np.float32))
+
+
+def evaluate_files(verdicts_path, features_path, labels=None):
+    """Evaluate a verdict file, written by the judge module, against the
+    labels of a columnar binary feature file of the same frames.
+
+    Arguments:
+    verdicts_path -- The path to the verdict file.
+    features_path -- The path to the labelled feature file.
+    labels -- The name of each label code. Default is the labels saved in
+    the feature file, or else the labels of a MaliciousGenerator.
+
+    Returns the metrics, as returned by evaluate.
+
+    Raises:
+    ValueError -- The feature file has no labels, or a different number of
+    frames than the verdict file.
+    """
+    verdicts, verdict_attrs = ids.column_store.load_columns(verdicts_path)
+    features, feature_attrs = ids.column_store.load_columns(features_path)
+    if 'label' not in features:
+        raise ValueError('{} has no labels.'.format(features_path))
+    if labels is None:
+        labels = feature_attrs.get('labels')
+    if labels is None:
+        from ids.malicious import MaliciousGenerator
+        labels = MaliciousGenerator().labels
+    return evaluate(features['label'], verdicts['verdict'], labels,
+                    verdicts['rule'], verdict_attrs['rules'])
+
+
+class RollingMetrics:
+    """Detection metrics and latency in per-second bins over a rolling
+    window, to see how the IDS does over the course of a long capture, such
+    as during a flood burst, rather than only in total.
+
+    Frames are binned by their timestamp, so the bins follow the time of the
+    capture however fast it is judged. Every bin keeps the count matrix of
+    its frames (see count_matrix), which gives its frames, attacks and the
+    true positives, false positives and false negatives of each attack, and
+    the sum and maximum of the latency of its frames. The bins are kept in
+    fixed-size ring buffers: once a frame falls in a bin more than window
+    bins after the oldest one, the oldest bin is dropped, so memory use does
+    not grow with the length of the capture. Frames too old for the window
+    are dropped and counted in dropped.
+
+    Usage:
+        >>> rolling = RollingMetrics(MaliciousGenerator().labels)
+        >>> rolling.record(frame['timestamp'], label_code, is_malicious,
+        ...                latency)
+        >>> rolling.series(last=60)['frames_per_sec']
+
+    Attributes:
+        labels: the name of each label code, from MaliciousGenerator.labels.
+        window: the number of bins kept.
+        bin_seconds: the length of each bin in seconds.
+        dropped: the number of frames too old for the window.
+    """
+
+    def __init__(self, labels, window=3600, bin_seconds=1.0):
+        self.labels = list(labels)
+        self.window = int(window)
+        self.bin_seconds = bin_seconds
+        self._bin_length = bin_seconds * TIMESTAMPS_PER_SECOND
+        self._bins = np.empty(self.window, dtype=np.int64)
+        self._counts = np.empty((self.window, len(self.labels), 2),
+                                dtype=np.int64)
+        self._latency_total = np.empty(self.window, dtype=np.float64)
+        self._latency_max = np.empty(self.window, dtype=np.float64)
+        self._latency_count = np.empty(self.window, dtype=np.int64)
+        self.reset()
+
+    def reset(self):
+        """Forget every frame recorded so far."""
+        self._bins[:] = -1
+        self._counts[:] = 0
+        self._latency_total[:] = 0
+        self._latency_max[:] = 0
+        self._latency_count[:] = 0
+        # The newest bin recorded, or None.
+        self._newest = None
+        self.dropped = 0
+
+    def _advance(self, newest):
+        """Move the window forward so it ends at bin newest. Returns whether
+        it moved."""
+        if self._newest is not None and newest <= self._newest:
+            return False
+        self._newest = newest
+        return True
+
+    def _slot(self, bin_number):
+        """The index of the buffers for bin_number, which is cleared if it
+        still holds an older bin."""
+        slot = bin_number % self.window
+        if self._bins[slot] != bin_number:
+            self._bins[slot] = bin_number
+            self._counts[slot] = 0
+            self._latency_total[slot] = 0
+            self._latency_max[slot] = 0
+            self._latency_count[slot] = 0
+        return slot
+
+    def record(self, timestamp, label_code, verdict, latency=None):
+        """Record the verdict on a single frame.
+
+        Arguments:
+        timestamp -- The timestamp of the frame, in 0.1 ms units.
+        label_code -- The label code of the frame.
+        verdict -- Whether the frame was judged malicious.
+        latency -- The time taken to judge the frame in seconds, if known.
+
+        Returns whether the frame started a new bin, which is when charts of
+        the bins need to be redrawn.
+        """
+        bin_number = int(timestamp // self._bin_length)
+        started = self._advance(bin_number)
+        if bin_number <= self._newest - self.window:
+            self.dropped += 1
+            return started
+        slot = self._slot(bin_number)
+        self._counts[slot, label_code, int(bool(verdict))] += 1
+        if latency is not None:
+            self._latency_total[slot] += latency
+            self._latency_count[slot] += 1
+            if latency > self._latency_max[slot]:
+                self._latency_max[slot] = latency
+        return started
+
+    def record_many(self, timestamps, label_codes, verdicts, latencies=None):
+        """Record the verdicts on a batch of frames at once. See record.
+
+        Arguments:
+        timestamps -- Array of the timestamp of each frame.
+        label_codes -- Array of the label code of each frame.
+        verdicts -- Array of whether each frame was judged malicious.
+        latencies -- Array of the latency of each frame in seconds, if known.
+
+        Returns whether the batch started a new bin.
+        """
+        bin_numbers = np.floor_divide(np.asarray(timestamps, dtype=np.float64),
+                                      self._bin_length).astype(np.int64)
+        if not bin_numbers.size:
+            return False
+        started = self._advance(int(bin_numbers.max()))
+        label_codes = np.asarray(label_codes, dtype=np.int64)
+        verdicts = np.asarray(verdicts).astype(np.int64)
+        if latencies is not None:
+            latencies = np.asarray(latencies, dtype=np.float64)
+
+        # Frames too old for the window, or for a bin that has already been
+        # reused by a newer one, are dropped.
+        keep = bin_numbers > self._newest - self.window
+        for bin_number in np.unique(bin_numbers[keep]).tolist():
+            slot = bin_number % self.window
+            if self._bins[slot] > bin_number:
+                keep &= bin_numbers != bin_number
+            else:
+                self._slot(bin_number)
+        self.dropped += int(np.count_nonzero(~keep))
+
+        slots = bin_numbers[keep] % self.window
+        num_cells = len(self.labels) * 2
+        self._counts += np.bincount(
+            slots * num_cells + label_codes[keep] * 2 + verdicts[keep],
+            minlength=self.window * num_cells).reshape(self._counts.shape)
+        if latencies is not None:
+            kept = latencies[keep]
+            self._latency_total += np.bincount(slots, kept,
+                                               minlength=self.window)
+            self._latency_count += np.bincount(slots, minlength=self.window)
+            np.maximum.at(self._latency_max, slots, kept)
+        return started
+
+    def _bin_range(self, last=None):
+        """The bin numbers of the window, oldest first, or of its last bins.
+        Bins before the first frame recorded are left out."""
+        if self._newest is None:
+            return np.zeros(0, dtype=np.int64)
+        recorded = self._bins[self._bins >= 0]
+        first = max(int(recorded.min()), self._newest - self.window + 1)
+        if last is not None:
+            first = max(first, self._newest - last + 1)
+        return np.arange(first, self._newest + 1, dtype=np.int64)
+
+    def series(self, last=None):
+        """Return the bins of the window as time series, for charts.
+
+        Arguments:
+        last -- The number of most recent bins to return. Default is every
+        bin of the window.
+
+        Returns a dictionary of lists, one value for each bin, oldest first,
+        with a bin for every bin_seconds even if no frames fell in it:
+        - 'time': the start of the bin in seconds.
+        - 'frames', 'attacks', 'true_positive', 'false_positive' and
+          'false_negative' of the bin.
+        - 'attack_counts': the 'true_positive' and 'false_negative' lists of
+          each attack.
+        - 'frames_per_sec': the rate of frames in the capture.
+        - 'recall' and 'precision' of the bin, 0.0 for a bin without any.
+        - 'latency_mean' and 'latency_max': the latency in seconds of the
+          frames of the bin with a known latency.
+        It also has the 'bin_seconds' and the label names in 'labels'.
+        """
+        bin_numbers = self._bin_range(last)
+        slots = bin_numbers % self.window
+        valid = self._bins[slots] == bin_numbers
+        counts = np.where(valid[:, None, None], self._counts[slots], 0)
+        latency_count = np.where(valid, self._latency_count[slots], 0)
+        latency_total = np.where(valid, self._latency_total[slots], 0.0)
+        latency_max = np.where(valid, self._latency_max[slots], 0.0)
+
+        true_negative, false_positive = counts[:, 0, 0], counts[:, 0, 1]
+        false_negative = counts[:, 1:, 0].sum(axis=1)
+        true_positive = counts[:, 1:, 1].sum(axis=1)
+        frames = counts.sum(axis=(1, 2))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            recall = np.nan_to_num(true_positive /
+                                   (true_positive + false_negative))
+            precision = np.nan_to_num(true_positive /
+                                      (true_positive + false_positive))
+            latency_mean = np.nan_to_num(latency_total / latency_count)
+        labels = [BENIGN] + self.labels[1:]
+        return {
+            'bin_seconds': self.bin_seconds,
+            'labels': labels,
+            'time': (bin_numbers * self.bin_seconds).tolist(),
+            'frames': frames.tolist(),
+            'attacks': (true_positive + false_negative).tolist(),
+            'true_positive': true_positive.tolist(),
+            'true_negative': true_negative.tolist(),
+            'false_positive': false_positive.tolist(),
+            'false_negative': false_negative.tolist(),
+            'attack_counts': {
+                name: {
+                    'true_positive': counts[:, code, 1].tolist(),
+                    'false_negative': counts[:, code, 0].tolist()
+                } for code, name in enumerate(labels) if code
+            },
+            'frames_per_sec': (frames / self.bin_seconds).tolist(),
+            'recall': recall.tolist(),
+            'precision': precision.tolist(),
+            'latency_mean': latency_mean.tolist(),
+            'latency_max': latency_max.tolist()
+        }
+
+    def summary(self):
+        """Return the metrics of every frame in the window together, as
+        returned by summarize."""
+        bin_numbers = self._bin_range()
+        slots = bin_numbers % self.window
+        valid = slots[self._bins[slots] == bin_numbers]
+        return summarize(self._counts[valid].sum(axis=0), self.labels)
+
+    def write_csv(self, outfile, last=None):
+        """Write the series of the window to an open text file as CSV, one
+        row for each bin."""
+        series = self.series(last)
+        columns = ['time', 'frames', 'attacks', 'true_positive',
+                   'false_positive', 'false_negative', 'frames_per_sec',
+                   'recall', 'precision', 'latency_mean', 'latency_max']
+        attacks = list(series['attack_counts'])
+        writer = csv.writer(outfile)
+        writer.writerow(columns + [
+            '{}_{}'.format(name, key) for name in attacks
+            for key in ['true_positive', 'false_negative']
+        ])
+        for i in range(len(series['time'])):
+            writer.writerow([series[k][i] for k in columns] + [
+                series['attack_counts'][name][key][i] for name in attacks
+                for key in ['true_positive', 'false_negative']
+            ])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m ids.evaluation',
+        description='Evaluate a verdict file against a labelled feature '
+        'file.')
+    parser.add_argument('verdicts', help='verdict file from ids.judge')
+    parser.add_argument('features', help='labelled feature file')
+    parser.add_argument('--output', help='JSON file to write the results to')
+    args = parser.parse_args(argv)
+
+    results = evaluate_files(args.verdicts, args.features)
+    if args.output:
+        with open(args.output, 'w') as outfile:
+            json.dump(results, outfile, indent=2)
+    print('Accuracy {:.2%}, precision {:.2%}, recall {:.2%}, F1 {:.4f}'.format(
+        results['accuracy'], results['precision'], results['recall'],
+        results['f1']))
+    for name, attack in results['attacks'].items():
+        print('{}: {} of {} caught ({:.2%})'.format(
+            name, attack['true_positive'], attack['total'], attack['recall']))
+
+
+if __name__ == '__main__':
+    main()
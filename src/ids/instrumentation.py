@@ -0,0 +1,342 @@
+"""Instrumentation
+Low-overhead timing of the stages of the IDS, to find out where the time goes
+when judging is slow.
+
+A Profiler records spans: the time taken by a named stage, measured with the
+monotonic performance counter. The spans of each stage are aggregated into a
+LatencyHistogram, so memory use does not grow with the number of frames.
+Counters keep count of named events, like the number of frames rejected by
+the rules.
+
+Profiling can be switched on and off at any time. While it is off, starting
+and stopping a span costs a single attribute check.
+
+Usage:
+    >>> profiler = Profiler(enabled=True)
+    >>> start = profiler.start()
+    >>> ...  # The work to time.
+    >>> profiler.stop('rules', start)
+    >>> with profiler.span('dnn'):
+    ...     ...
+    >>> profiler.count('frames')
+    >>> profiler.stats()['spans']['rules']['mean']
+
+Functions:
+write_latency_report -- Write a dictionary of named LatencyHistograms to a
+JSON file.
+
+Classes:
+LatencyHistogram -- Record latencies in a log-bucketed histogram and report
+percentiles of them.
+Profiler -- Record spans and counters.
+"""
+
+import json
+import threading
+import time
+
+import numpy as np
+
+
+class LatencyHistogram:
+    """Record latencies in a log-bucketed histogram, in the style of an HDR
+    histogram, and report percentiles of them.
+
+    Latencies are recorded as whole nanoseconds. Values below 2**PRECISION_BITS
+    nanoseconds get a bucket each. Above that, every power of two range is
+    split into 2**(PRECISION_BITS - 1) equal buckets, so the value reported
+    for a bucket is within 1 / 2**(PRECISION_BITS - 1) of every value in it,
+    and memory use is fixed no matter how many values are recorded. Values
+    above MAX_NANOSECONDS share the last bucket, but the exact largest value
+    is kept.
+
+    Usage:
+        >>> latency = LatencyHistogram()
+        >>> latency.record(1500)  # 1.5 microseconds
+        >>> latency.record_many(np.array([2000, 3000]))
+        >>> latency.summary()['p99']
+    """
+
+    PRECISION_BITS = 8
+    # About 18 minutes.
+    MAX_NANOSECONDS = 2**40
+
+    _SUB_BUCKETS = 2**PRECISION_BITS
+    _HALF = 2**(PRECISION_BITS - 1)
+    _NUM_BUCKETS = _SUB_BUCKETS + (MAX_NANOSECONDS.bit_length() -
+                                   PRECISION_BITS) * _HALF
+
+    def __init__(self):
+        self.counts = np.zeros(self._NUM_BUCKETS, dtype=np.int64)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def reset(self):
+        """Forget every value recorded so far."""
+        self.counts[:] = 0
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    @classmethod
+    def _index(cls, nanoseconds):
+        if nanoseconds < cls._SUB_BUCKETS:
+            return nanoseconds
+        shift = min(nanoseconds, cls.MAX_NANOSECONDS - 1).bit_length() - \
+            cls.PRECISION_BITS
+        mantissa = min(nanoseconds, cls.MAX_NANOSECONDS - 1) >> shift
+        return cls._SUB_BUCKETS + (shift - 1) * cls._HALF + mantissa - \
+            cls._HALF
+
+    @classmethod
+    def _lowest(cls, index):
+        """The lowest value of each bucket in index (an array)."""
+        index = np.asarray(index, dtype=np.int64)
+        shift = np.maximum((index - cls._SUB_BUCKETS) // cls._HALF + 1, 0)
+        mantissa = np.where(index < cls._SUB_BUCKETS, index,
+                            (index - cls._SUB_BUCKETS) % cls._HALF +
+                            cls._HALF)
+        return mantissa << shift
+
+    def record(self, nanoseconds):
+        """Record a single latency of nanoseconds."""
+        nanoseconds = max(int(nanoseconds), 0)
+        self.counts[self._index(nanoseconds)] += 1
+        self.count += 1
+        self.total += nanoseconds
+        if self.min is None or nanoseconds < self.min:
+            self.min = nanoseconds
+        if nanoseconds > self.max:
+            self.max = nanoseconds
+
+    def record_many(self, nanoseconds):
+        """Record an array of latencies in nanoseconds at once."""
+        values = np.maximum(np.asarray(nanoseconds, dtype=np.int64), 0)
+        if not values.size:
+            return
+        clipped = np.minimum(values, self.MAX_NANOSECONDS - 1)
+        # frexp gives the bit length of each value as its exponent.
+        bits = np.frexp(clipped.astype(np.float64))[1]
+        shift = np.maximum(bits - self.PRECISION_BITS, 0)
+        index = np.where(
+            clipped < self._SUB_BUCKETS, clipped,
+            self._SUB_BUCKETS + (shift - 1) * self._HALF +
+            (clipped >> shift) - self._HALF)
+        self.counts += np.bincount(index, minlength=self._NUM_BUCKETS)
+        self.count += int(values.size)
+        self.total += int(values.sum())
+        low, high = int(values.min()), int(values.max())
+        self.min = low if self.min is None else min(self.min, low)
+        self.max = max(self.max, high)
+
+    def merge(self, other):
+        """Add the values recorded by another LatencyHistogram to this
+        one."""
+        self.counts += other.counts
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(
+                self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def percentile(self, percent):
+        """Return the latency in seconds that percent of the recorded values
+        are at or below, or 0.0 if nothing has been recorded."""
+        if not self.count:
+            return 0.0
+        rank = max(int(np.ceil(percent / 100 * self.count)), 1)
+        index = int(np.searchsorted(np.cumsum(self.counts), rank))
+        # Report the middle of the bucket, but never beyond the extremes.
+        low = int(self._lowest(index))
+        high = int(self._lowest(index + 1)) - 1
+        value = min(max((low + high) // 2, self.min), self.max)
+        return value / 1e9
+
+    def summary(self):
+        """Return a dictionary of the count, and the mean, min, p50, p95, p99
+        and max latency in seconds."""
+        return {
+            'count': self.count,
+            'mean': self.total / self.count / 1e9 if self.count else 0.0,
+            'min': (self.min or 0) / 1e9,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+            'max': self.max / 1e9
+        }
+
+    def check(self, limits):
+        """Check the latencies against limits, like an SLO.
+
+        Arguments:
+        limits -- Dictionary of the keys of summary() (for example 'p99') to
+        the largest allowed latency in seconds.
+
+        Returns a dictionary {key: (latency, limit, within limit)}.
+        """
+        summary = self.summary()
+        return {
+            k: (summary[k], v, summary[k] <= v)
+            for k, v in limits.items()
+        }
+
+    def to_dict(self):
+        """Return a JSON serializable dictionary of the histogram, which
+        from_dict turns back into a LatencyHistogram."""
+        nonzero = np.flatnonzero(self.counts)
+        return dict(
+            self.summary(),
+            precision_bits=self.PRECISION_BITS,
+            total_ns=self.total,
+            min_ns=self.min,
+            max_ns=self.max,
+            buckets=[[int(self._lowest(i)), int(self.counts[i])]
+                     for i in nonzero])
+
+    @classmethod
+    def from_dict(cls, data):
+        """Make a LatencyHistogram from the output of to_dict.
+
+        Raises:
+        ValueError -- The histogram was recorded with a different precision.
+        """
+        if data['precision_bits'] != cls.PRECISION_BITS:
+            raise ValueError('The histogram has a precision of {} bits, '
+                             'expected {}.'.format(data['precision_bits'],
+                                                   cls.PRECISION_BITS))
+        histogram = cls()
+        for lowest, count in data['buckets']:
+            histogram.counts[cls._index(lowest)] += count
+        histogram.count = int(histogram.counts.sum())
+        histogram.total = data['total_ns']
+        histogram.min = data['min_ns']
+        histogram.max = data['max_ns']
+        return histogram
+
+
+def write_latency_report(histograms, outfilepath):
+    """Write a dictionary of named LatencyHistograms to a JSON file, with the
+    percentiles and buckets of each."""
+    with open(outfilepath, 'w') as outfile:
+        json.dump({k: v.to_dict() for k, v in histograms.items()},
+                  outfile,
+                  indent=2)
+
+
+class _Span:
+    """Context manager for Profiler.span."""
+
+    __slots__ = ('_profiler', '_name', '_start')
+
+    def __init__(self, profiler, name):
+        self._profiler = profiler
+        self._name = name
+        self._start = None
+
+    def __enter__(self):
+        self._start = self._profiler.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._profiler.stop(self._name, self._start)
+
+
+class Profiler:
+    """Record spans and counters.
+
+    Attributes:
+    - enabled: Whether spans and counters are being recorded. Can be changed
+        at any time.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.reset()
+
+    @property
+    def enabled(self):
+        return self._enabled
+
+    @enabled.setter
+    def enabled(self, val):
+        self._enabled = bool(val)
+        if self._enabled:
+            # Throughput is measured from the moment profiling is switched
+            # on.
+            self._started = time.perf_counter()
+
+    def reset(self):
+        """Forget every span and counter recorded so far."""
+        with self._lock:
+            self._spans = {}
+            self._counters = {}
+            self._started = time.perf_counter()
+
+    def start(self):
+        """Start a span. Returns a token to pass to stop, or None if
+        profiling is off."""
+        if not self._enabled:
+            return None
+        return time.perf_counter_ns()
+
+    def stop(self, name, start):
+        """End a span of the stage called name, started with start."""
+        if start is None or not self._enabled:
+            return
+        self.record(name, time.perf_counter_ns() - start)
+
+    def span(self, name):
+        """Return a context manager that records the time spent in it as a
+        span of the stage called name."""
+        return _Span(self, name)
+
+    def record(self, name, nanoseconds):
+        """Record a span of the stage called name that took nanoseconds."""
+        with self._lock:
+            histogram = self._spans.get(name)
+            if histogram is None:
+                histogram = self._spans[name] = LatencyHistogram()
+            histogram.record(nanoseconds)
+
+    def count(self, name, amount=1):
+        """Add amount to the counter called name."""
+        if not self._enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def stats(self):
+        """Return the spans and counters recorded so far.
+
+        Returns a dictionary:
+        {
+            'enabled': whether profiling is on,
+            'elapsed': seconds since profiling was switched on or reset,
+            'counters': {name: count},
+            'spans': {name: {'count', 'total', 'mean', 'min', 'p50', 'p95',
+                'p99', 'max'}},
+        }
+        Times are in seconds.
+        """
+        with self._lock:
+            return {
+                'enabled': self._enabled,
+                'elapsed': time.perf_counter() - self._started,
+                'counters': dict(self._counters),
+                'spans': {
+                    k: dict(v.summary(), total=v.total / 1e9)
+                    for k, v in self._spans.items()
+                }
+            }
+
+    def throughput(self, counter='frames'):
+        """Return the rate per second of the counter called counter since
+        profiling was switched on or reset."""
+        stats = self.stats()
+        elapsed = stats['elapsed']
+        return stats['counters'].get(counter, 0) / elapsed if elapsed else 0.0
@@ -0,0 +1,290 @@
+"""Batch Judging
+Judge archived CAN captures without the GUI, across a pool of worker
+processes. Each worker loads the Two Stage IDS once, and then judges whole
+capture files with TwoStageIDS.judge_batch, the same way the simulation
+judges frames.
+
+Every capture gets a verdict file: a columnar binary file (see column_store)
+with one row per frame, holding
+- verdict: 1 if the frame was judged malicious, else 0.
+- rule: 0 if the frame passed the rules, else 1 + the index of the rule that
+  rejected it in the 'rules' list of the file attributes.
+- confidence: the confidence of the DNN in its verdict, or NaN for frames
+  rejected by a rule.
+The attributes of the file also hold the summary of the capture. A verdict
+file is only moved into place once it is complete, so a job that is stopped
+can be resumed by running the same command again: captures that already have
+a verdict file are skipped. A summary of every capture is written to
+summary.json in the output directory.
+
+Usage:
+    python -m ids.judge MODEL_NAME captures/ more.traffic --idprobs NAME
+        --output verdicts/ --processes 32
+
+Functions:
+find_captures -- Find the capture files in a list of files and directories.
+judge_capture -- Judge a single capture file and write its verdict file.
+judge_captures -- Judge capture files across a pool of worker processes.
+load_verdicts -- Load a verdict file.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import os.path
+import time
+
+import numpy as np
+
+import ids.column_store
+import ids.evaluation
+import ids.preprocessor as dp
+
+savedata_dir = os.path.dirname(os.path.abspath(__file__)) + '/../../savedata'
+dnnmodels_dir = savedata_dir + '/dnn-models'
+idprobs_dir = savedata_dir + '/idprobs'
+
+CAPTURE_EXTENSIONS = ('.traffic', '.csv', '.json')
+VERDICT_EXTENSION = '.verdicts'
+
+# The Two Stage IDS of a worker process, loaded once by _init_worker.
+_WORKER_IDS = None
+
+
+def find_captures(paths):
+    """Find the capture files in a list of files and directories.
+
+    Directories are searched recursively for .traffic, .csv and .json files
+    and columnar binary capture files.
+
+    Returns a list of pairs (filepath, name), where name is the path of the
+    capture relative to the directory it was found in, or its file name if
+    it was given directly.
+    """
+    captures = []
+    for path in paths:
+        path = str(path)
+        if os.path.isdir(path):
+            for root, _, filenames in sorted(os.walk(path)):
+                for filename in sorted(filenames):
+                    filepath = os.path.join(root, filename)
+                    if (filename.endswith(CAPTURE_EXTENSIONS) or
+                            ids.column_store.is_column_file(filepath)):
+                        captures.append(
+                            (filepath, os.path.relpath(filepath, path)))
+        elif os.path.exists(path):
+            captures.append((path, os.path.basename(path)))
+        else:
+            raise FileNotFoundError(path + ' does not exist!')
+    return captures
+
+
+def verdict_path(outdir, name):
+    """The path of the verdict file of the capture called name."""
+    return os.path.join(str(outdir), name + VERDICT_EXTENSION)
+
+
+def load_verdicts(filepath):
+    """Load a verdict file.
+
+    Returns a tuple (columns, attrs): a dictionary of the 'verdict', 'rule'
+    and 'confidence' arrays, and the attributes of the file, including the
+    'rules' names and the 'summary' of the capture.
+    """
+    return ids.column_store.load_columns(filepath)
+
+
+def load_two_stage_ids(model_name, idprobs_name):
+    """Load a trained Two Stage IDS by model name, the same way the GUI
+    does.
+
+    Raises:
+    RuntimeError -- The model does not exist or is not trained.
+    """
+    # TensorFlow is only imported by the processes that judge.
+    from ids.two_stage_ids import TwoStageIDS
+
+    if not os.path.exists(dnnmodels_dir + '/' + model_name + '.params'):
+        raise RuntimeError('There is no model named {}.'.format(model_name))
+    two_stage = TwoStageIDS()
+    two_stage.change_ids_parameters('dnn_dir_path',
+                                    dnnmodels_dir + '/' + model_name)
+    two_stage.change_ids_parameters('rules_profile', model_name)
+    two_stage.change_ids_parameters('idprobs_path',
+                                    idprobs_dir + '/' + idprobs_name + '.json')
+    two_stage.init_ids()
+    if not (two_stage.dnn_trained and two_stage.rules_trained):
+        raise RuntimeError('The model {} is not trained.'.format(model_name))
+    return two_stage
+
+
+def _init_worker(model_name, idprobs_name):
+    global _WORKER_IDS  # pylint: disable=global-statement
+    _WORKER_IDS = load_two_stage_ids(model_name, idprobs_name)
+
+
+def judge_capture(two_stage, filepath, outfilepath, batch_size=4096,
+                  attrs=None):
+    """Judge a single capture file and write its verdict file.
+
+    The simulation of two_stage is restarted for the capture, so the feature
+    calculators start from scratch, and the frames are judged in batches of
+    batch_size with TwoStageIDS.judge_batch. The verdict file is written next
+    to outfilepath and renamed into place once complete.
+
+    Returns the summary of the capture: a dictionary of the number of
+    'frames', 'malicious' frames, frames rejected by each rule in
+    'rule_counts', frames found malicious by the DNN in 'dnn_detections', and
+    the 'seconds' taken.
+    """
+    start = time.perf_counter()
+    canlist = dp.parse_can_file(filepath)
+    rule_names = list(two_stage.rules.roster)
+
+    results = []
+    if two_stage.in_simulation:
+        two_stage.stop_simulation()
+    two_stage.start_simulation()
+    try:
+        for lo in range(0, len(canlist), batch_size):
+            results += two_stage.judge_batch(canlist[lo:lo + batch_size])
+    finally:
+        two_stage.stop_simulation()
+    verdict, rule, confidence = ids.evaluation.verdict_codes(results,
+                                                             rule_names)
+
+    rule_counts = np.bincount(rule, minlength=len(rule_names) + 1)
+    summary = {
+        'frames': len(canlist),
+        'malicious': int(verdict.sum()),
+        'rule_counts': dict(zip(rule_names, rule_counts[1:].tolist())),
+        'dnn_detections': int(np.count_nonzero(verdict[rule == 0])),
+        'seconds': time.perf_counter() - start
+    }
+    attrs = dict(attrs or {}, kind='verdicts', source=str(filepath),
+                 rules=rule_names, summary=summary)
+
+    os.makedirs(os.path.dirname(os.path.abspath(outfilepath)), exist_ok=True)
+    partial = outfilepath + '.partial'
+    ids.column_store.write_columns(partial, {
+        'verdict': verdict,
+        'rule': rule,
+        'confidence': confidence
+    }, attrs)
+    os.replace(partial, outfilepath)
+    return summary
+
+
+def _judge_job(job):
+    filepath, outfilepath, batch_size, attrs = job
+    try:
+        summary = judge_capture(_WORKER_IDS, filepath, outfilepath,
+                                batch_size, attrs)
+    except Exception as exc:  # pylint: disable=broad-except
+        # One bad capture should not stop the whole job.
+        return filepath, {'error': '{}: {}'.format(type(exc).__name__, exc)}
+    return filepath, summary
+
+
+def judge_captures(model_name,
+                   paths,
+                   outdir,
+                   idprobs_name,
+                   processes=None,
+                   batch_size=4096,
+                   verbose=False):
+    """Judge capture files across a pool of worker processes, skipping the
+    captures that already have a verdict file in outdir.
+
+    Arguments:
+    model_name -- The name of the Two Stage IDS model, as in the GUI.
+    paths -- List of capture files and directories, see find_captures.
+    outdir -- The directory to write the verdict files and summary.json to.
+    idprobs_name -- The name of the ID probabilities file to use.
+    processes -- The number of worker processes. If None, os.cpu_count().
+    batch_size -- The number of frames judged at a time.
+    verbose -- Print the progress as each capture finishes.
+
+    Returns the summary written to summary.json: a dictionary of the
+    per-capture summaries under 'captures', and the sums of them under
+    'total'.
+    """
+    captures = find_captures(paths)
+    summaries = {}
+    jobs = []
+    for filepath, name in captures:
+        outfilepath = verdict_path(outdir, name)
+        if ids.column_store.is_column_file(outfilepath):
+            # Finished by an earlier run.
+            summaries[filepath] = load_verdicts(outfilepath)[1]['summary']
+        else:
+            jobs.append((filepath, outfilepath, batch_size, {
+                'model': model_name,
+                'idprobs': idprobs_name
+            }))
+    if verbose:
+        print('{} captures, {} already judged'.format(
+            len(captures), len(captures) - len(jobs)), flush=True)
+
+    if jobs:
+        # Each worker loads the model once, and then judges whole captures.
+        with multiprocessing.Pool(processes, _init_worker,
+                                  (model_name, idprobs_name)) as pool:
+            for done, (filepath, summary) in enumerate(
+                    pool.imap_unordered(_judge_job, jobs), 1):
+                summaries[filepath] = summary
+                if verbose:
+                    print('[{}/{}] {}: {}'.format(done, len(jobs), filepath,
+                                                  summary), flush=True)
+
+    output = {
+        'model': model_name,
+        'captures': {x[0]: summaries[x[0]] for x in captures},
+        'total': _total(summaries.values())
+    }
+    os.makedirs(str(outdir), exist_ok=True)
+    with open(os.path.join(str(outdir), 'summary.json'), 'w') as outfile:
+        json.dump(output, outfile, indent=2)
+    return output
+
+
+def _total(summaries):
+    total = {'frames': 0, 'malicious': 0, 'dnn_detections': 0, 'errors': 0,
+             'rule_counts': {}}
+    for summary in summaries:
+        if 'error' in summary:
+            total['errors'] += 1
+            continue
+        for key in ['frames', 'malicious', 'dnn_detections']:
+            total[key] += summary[key]
+        for name, count in summary['rule_counts'].items():
+            total['rule_counts'][name] = total['rule_counts'].get(name,
+                                                                  0) + count
+    return total
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m ids.judge',
+        description='Judge capture files with a trained Two Stage IDS.')
+    parser.add_argument('model', help='name of the Two Stage IDS model')
+    parser.add_argument('paths', nargs='+',
+                        help='capture files, or directories of them')
+    parser.add_argument('--idprobs', required=True,
+                        help='name of the ID probabilities file')
+    parser.add_argument('--output', default='verdicts',
+                        help='directory for the verdict files '
+                        '(default: %(default)s)')
+    parser.add_argument('--processes', type=int,
+                        help='worker processes (default: one per CPU)')
+    parser.add_argument('--batch-size', type=int, default=4096)
+    args = parser.parse_args(argv)
+
+    output = judge_captures(args.model, args.paths, args.output, args.idprobs,
+                            args.processes, args.batch_size, verbose=True)
+    print('Total: {}'.format(output['total']))
+
+
+if __name__ == '__main__':
+    main()
@@ -12,10 +12,14 @@ Attributes:
     execution of arbitrary code.
 """
 
-import random
+import functools
+import inspect
 from math import isclose  # used to compare floats
 
+import numpy as np
+
 import ids.malicious_generators
+import ids.preprocessor
 
 NONE_ROSTER = {'none': {'attack': None, 'probability': 0.5}}
 
@@ -33,12 +37,21 @@ class MaliciousGenerator:
         The sum of all probabilities should be == 1.
         - attack: a function pointer to a malicious generator
             Usage: *func(scale)*
+        - batch (optional): a function pointer to the batch form of the
+            malicious generator. Used by get_batch in place of attack.
+            Usage: *func(time_windows, rng)*
         - probability: float
+    - rng: numpy.random.Generator used by get and get_attack. Seed it
+        through the constructor to make their output reproducible.
     """
 
-    def __init__(self):
+    def __init__(self, seed=None):
         """Initializes class by importing roster from malicious_generators.
 
+        Arguments:
+        - seed: seed for the random Generator used by get and get_attack.
+            If None, fresh entropy is used.
+
         Raises:
             AssertionError:: roster probabilities not set correctly; need == 1
         """
@@ -46,9 +59,20 @@ class MaliciousGenerator:
         self.roster = ids.malicious_generators.ROSTER
         self.roster.update(NONE_ROSTER)  # add to roster
         self._normalize_roster()
+        self.rng = np.random.default_rng(seed)
 
         self.check_roster()
 
+    @property
+    def labels(self):
+        """List of frame labels, indexed by label code. Code 0 is None (not
+        malicious), and every other code is the name of an attack in the
+        roster.
+        """
+        return [None] + [
+            x for x in self.roster if self.roster[x]['attack'] is not None
+        ]
+
     def check_roster(self):
         """Checks roster attribute for validity
 
@@ -146,12 +170,14 @@ class MaliciousGenerator:
                 'data': [145, 49, 247, 135, 200, 57, 54, 214]}]
         """
         choices = list(self.roster.keys())
-        chances = [self.roster[x]['probability'] for x in self.roster]
-        chosen = random.choices(choices, weights=chances)[0]
+        chances = np.array([self.roster[x]['probability'] for x in choices])
+        chosen = choices[self.rng.choice(len(choices),
+                                         p=chances / chances.sum())]
         if self.roster[chosen]['attack'] is None:
             return
         for _ in range(repeat):
-            for packet in self.roster[chosen]['attack'](time_window):
+            for packet in _run_attack(self.roster[chosen]['attack'],
+                                      time_window, self.rng):
                 yield packet, chosen
 
     def get_attack(self, time_window, attack_name, repeat=1):
@@ -179,5 +205,93 @@ class MaliciousGenerator:
             KeyError:  when attack_name doesn't match any keys in the roster
         """
         for _ in range(repeat):
-            for packet in self.roster[attack_name]['attack'](time_window):
+            for packet in _run_attack(self.roster[attack_name]['attack'],
+                                      time_window, self.rng):
                 yield packet
+
+    def get_batch(self, time_windows, rng=None):
+        """Bulk version of get. Draws an attack (or no attack) for every time
+        window at once, then asks each chosen attack for the packets of all of
+        its windows in a single call.
+
+        Arguments:
+          - time_windows: a pair (prev, next) of columnar canlists of equal
+            length N. Window i lies between prev frame i and next frame i.
+          - rng: numpy.random.Generator to draw attacks with, and to pass on
+            to the malicious generators. If None, the rng attribute is used.
+
+        Returns:
+            Tuple (frames, windows, codes), where frames is a columnar canlist
+            of the malicious packets, windows is an array of the window index
+            each packet belongs in, and codes is an array of the label code of
+            each packet (see labels). Packets of the same window are in order.
+        """
+        if rng is None:
+            rng = self.rng
+        prev, nxt = time_windows
+        num_windows = len(prev['id'])
+
+        names = list(self.roster.keys())
+        chances = np.array([self.roster[x]['probability'] for x in names])
+        chosen = rng.choice(len(names), size=num_windows,
+                            p=chances / chances.sum())
+
+        labels = self.labels
+        frames, windows, codes = [], [], []
+        for index, name in enumerate(names):
+            if self.roster[name]['attack'] is None:
+                continue
+            selected = np.flatnonzero(chosen == index)
+            if selected.size == 0:
+                continue
+            attack_frames, owners = self._attack_batch(
+                name, (ids.preprocessor.take_columns(prev, selected),
+                       ids.preprocessor.take_columns(nxt, selected)), rng)
+            frames.append(attack_frames)
+            windows.append(selected[owners])
+            codes.append(np.full(len(owners), labels.index(name), np.int8))
+
+        if not frames:
+            return (ids.preprocessor.empty_columns(),
+                    np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.int8))
+        return (ids.preprocessor.concatenate_columns(frames),
+                np.concatenate(windows), np.concatenate(codes))
+
+    def _attack_batch(self, attack_name, time_windows, rng):
+        """Run a malicious generator over a batch of time windows. The batch
+        form of the generator is used if the roster has one, else the
+        generator is run once per window.
+
+        Returns a tuple (frames, owners), where frames is a columnar canlist
+        and owners is the index of the window each frame was made for.
+        """
+        batch = self.roster[attack_name].get('batch')
+        if batch is not None:
+            return batch(time_windows, rng)
+
+        attack = self.roster[attack_name]['attack']
+        prev = ids.preprocessor.columns_to_canlist(time_windows[0])
+        nxt = ids.preprocessor.columns_to_canlist(time_windows[1])
+        packets, owners = [], []
+        for window, time_window in enumerate(zip(prev, nxt)):
+            for packet in _run_attack(attack, time_window, rng):
+                packets.append(packet)
+                owners.append(window)
+        return (ids.preprocessor.canlist_to_columns(packets),
+                np.array(owners, dtype=np.intp))
+
+
+def _run_attack(attack, time_window, rng):
+    """Run a malicious generator on a time window, with rng if it accepts
+    one. Generators written before rng was added are run without it."""
+    if _accepts_rng(attack):
+        return attack(time_window, rng=rng)
+    return attack(time_window)
+
+
+@functools.lru_cache(maxsize=None)
+def _accepts_rng(attack):
+    """Whether a malicious generator takes the rng keyword argument"""
+    parameters = inspect.signature(attack).parameters
+    return 'rng' in parameters or any(
+        x.kind == inspect.Parameter.VAR_KEYWORD for x in parameters.values())
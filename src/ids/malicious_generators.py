@@ -4,7 +4,8 @@ class.
 
 Module Constants:
 - ROSTER: a dictionary containing references to each malicious generator
-  contained in this module, and the default probabilities associated with each.
+  contained in this module, its batch form if it has one, and the default
+  probabilities associated with each.
   MaliciousGenerator will use this when importing this module.
 
 Notes:
@@ -16,32 +17,50 @@ Notes:
     Any malicous generator must be a function that accepts a "time_window",
     and returns a CAN packet. This “time_window” is merely a tuple
     of two CAN packets representing the space in which a malicious packet
-    will be inserted.
+    will be inserted. It should also accept a keyword argument "rng", a
+    numpy.random.Generator to draw all of its random values from, so that
+    generated datasets can be reproduced from a seed. Generators without an
+    "rng" argument are still supported, and are called with the time window
+    alone, but their packets can not be reproduced from a seed.
+
+    A malicious generator may also have a batch form, registered under the
+    'batch' key of its ROSTER entry. The batch form accepts "time_windows", a
+    pair (prev, next) of columnar canlists (see
+    preprocessor.canlist_to_columns) holding the packets around N windows, and
+    a numpy.random.Generator. It returns a tuple (frames, owners): a columnar
+    canlist of the new packets, and the index of the window each packet
+    belongs in, with the packets of each window in order.
 """
 
 # TODO: need a way to communicate with IDS to get info about the CAN bus.
 
-import random
+import numpy as np
 
+import ids.preprocessor
 
-def random_packet(time_window):
+
+def random_packet(time_window, rng=None):
     """Produces a CAN packet of random ID with random contents
     Args:
         time_window: subscriptable object containing two CAN packets
+        rng: numpy.random.Generator; a fresh one is made if None
     """
-    new_id = random.getrandbits(11)
+    if rng is None:
+        rng = np.random.default_rng()
+    new_id = int(rng.integers(0, 2**11))
     # new packet timestamp halfway between previous and next
     timestamp = int(
         (time_window[0]['timestamp'] + time_window[1]['timestamp']) / 2)
-    data = bytes([random.getrandbits(8) for _ in range(8)])
+    data = rng.integers(0, 2**8, 8, dtype=np.uint8).tobytes()
     packet = {'timestamp': timestamp, 'id': new_id, 'data': data}
     yield packet
 
 
-def flood(time_window):
+def flood(time_window, rng=None):  # pylint: disable=unused-argument
     """Produces a long series of CAN packets
     Args:
         time_window: subscriptable object containing two CAN packets
+        rng: numpy.random.Generator; unused
     """
     new_id = 0
     n_to_make = 21
@@ -54,18 +73,20 @@ def flood(time_window):
         yield packet
 
 
-def replay(time_window):
+def replay(time_window, rng=None):  # pylint: disable=unused-argument
     """Reproduces the previous packet on the CAN bus
     Args:
         time_window: subscriptable object containing two CAN packets
+        rng: numpy.random.Generator; unused
     """
     yield time_window[0]
 
 
-def spoof(time_window):
+def spoof(time_window, rng=None):  # pylint: disable=unused-argument
     """Create plausible message data of a known ID
     Args:
         time_window: subscriptable object containing two CAN packets
+        rng: numpy.random.Generator; unused
     """
     # TODO: which ID?
     #       what data?
@@ -78,22 +99,91 @@ def spoof(time_window):
     yield packet
 
 
+def _midpoints(time_windows):
+    """Timestamps halfway between the previous and next packets of each
+    window, rounded the same way as int() would."""
+    start = time_windows[0]['timestamp']
+    end = time_windows[1]['timestamp']
+    return ((start + end) / 2).astype(np.int64)
+
+
+def random_packet_batch(time_windows, rng):
+    """Batch form of random_packet
+    Args:
+        time_windows: pair of columnar canlists (prev, next)
+        rng: numpy.random.Generator
+    """
+    num_windows = len(time_windows[0]['id'])
+    frames = ids.preprocessor.empty_columns(num_windows)
+    frames['timestamp'] = _midpoints(time_windows)
+    frames['id'] = rng.integers(0, 2**11, num_windows, dtype=np.int32)
+    frames['dlc'][:] = 8
+    frames['data'] = rng.integers(0, 2**8, (num_windows, 8), dtype=np.uint8)
+    return frames, np.arange(num_windows)
+
+
+def flood_batch(time_windows, rng):  # pylint: disable=unused-argument
+    """Batch form of flood
+    Args:
+        time_windows: pair of columnar canlists (prev, next)
+        rng: numpy.random.Generator
+    """
+    n_to_make = 21
+    num_windows = len(time_windows[0]['id'])
+    start = time_windows[0]['timestamp']
+    timestamp_step = (time_windows[1]['timestamp'] - start) / n_to_make
+    # Row i holds the n_to_make timestamps for window i.
+    timestamps = start[:, None] + timestamp_step[:, None] * np.arange(
+        n_to_make)
+    frames = ids.preprocessor.empty_columns(num_windows * n_to_make)
+    frames['timestamp'] = timestamps.astype(np.int64).ravel()
+    frames['dlc'][:] = 8
+    return frames, np.repeat(np.arange(num_windows), n_to_make)
+
+
+def replay_batch(time_windows, rng):  # pylint: disable=unused-argument
+    """Batch form of replay
+    Args:
+        time_windows: pair of columnar canlists (prev, next)
+        rng: numpy.random.Generator
+    """
+    frames = {k: v.copy() for k, v in time_windows[0].items()}
+    return frames, np.arange(len(frames['id']))
+
+
+def spoof_batch(time_windows, rng):  # pylint: disable=unused-argument
+    """Batch form of spoof
+    Args:
+        time_windows: pair of columnar canlists (prev, next)
+        rng: numpy.random.Generator
+    """
+    num_windows = len(time_windows[0]['id'])
+    frames = ids.preprocessor.empty_columns(num_windows)
+    frames['timestamp'] = _midpoints(time_windows)
+    frames['dlc'][:] = 8
+    return frames, np.arange(num_windows)
+
+
 # Register Malicious Generators here
 ROSTER = {
     'random': {
         'attack': random_packet,
+        'batch': random_packet_batch,
         'probability': 0.25
     },
     'flood': {
         'attack': flood,
+        'batch': flood_batch,
         'probability': 0.25
     },
     'replay': {
         'attack': replay,
+        'batch': replay_batch,
         'probability': 0.25
     },
     'spoof': {
         'attack': spoof,
+        'batch': spoof_batch,
         'probability': 0.25
     }
 }
@@ -0,0 +1,479 @@
+"""Multi-Bus Detection
+Judge the traffic of several CAN buses at once, with a worker process for
+each bus. Every worker keeps its own feature calculator and rule state, as
+each bus has its own stream of frames, but the model itself is loaded once:
+the supervisor exports the DNN weights (see dnn_kernel), the working data of
+the rules and the ID probabilities into a single block of shared memory,
+which every worker maps read-only instead of loading its own copy.
+
+The verdicts of every bus are merged into one stream, each tagged with the
+bus it came from, and the supervisor keeps the throughput of each bus.
+
+Usage:
+    python -m ids.multibus MODEL_NAME --idprobs NAME
+        --bus can0=capture0.traffic --bus can1=capture1.bin
+
+Example:
+    >>> supervisor = BusSupervisor.from_ids(two_stage)
+    >>> supervisor.add_bus('can0')
+    >>> supervisor.add_bus('can1', 'captures/can1.traffic')
+    >>> with supervisor:
+    ...     supervisor.feed('can0', frames)
+    ...     supervisor.close_bus('can0')
+    ...     for verdict in supervisor.verdicts():
+    ...         print(verdict['bus'], verdict['malicious'])
+
+Classes:
+SharedArrays -- NumPy arrays and metadata packed into one block of shared
+memory.
+BusSupervisor -- Run a judging worker process for each CAN bus.
+"""
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import queue
+import time
+import traceback
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import ids.preprocessor as dp
+from ids.dnn_kernel import PRECISIONS, DNNKernel
+
+# Frames are sent between processes a chunk at a time.
+DEFAULT_CHUNK_SIZE = 4096
+# How often, in seconds, the workers are checked on while waiting for their
+# verdicts.
+WORKER_POLL_SECONDS = 1.0
+
+
+class SharedArrays:
+    """NumPy arrays and JSON serializable metadata packed into one block of
+    shared memory, which other processes can attach to by name.
+
+    The block starts with the length of a JSON header, followed by the
+    header, which holds the metadata and the dtype, shape and offset of each
+    array, and then the arrays.
+
+    Attributes:
+        arrays: dict of the arrays, as read-only views of the shared memory.
+        meta: the metadata.
+    """
+    # Arrays start on cache line boundaries.
+    ALIGNMENT = 64
+
+    def __init__(self, shm, arrays, meta):
+        self._shm = shm
+        self.arrays = arrays
+        self.meta = meta
+
+    @property
+    def name(self):
+        """The name to attach to the shared memory by."""
+        return self._shm.name
+
+    @classmethod
+    def create(cls, arrays, meta=None):
+        """Copy arrays and metadata into a new block of shared memory. The
+        block must be freed with unlink once it is no longer needed."""
+        arrays = {k: np.ascontiguousarray(v) for k, v in arrays.items()}
+        layout = {}
+        offset = 0
+        for name, array in arrays.items():
+            layout[name] = [array.dtype.str, list(array.shape), offset]
+            offset += -(-array.nbytes // cls.ALIGNMENT) * cls.ALIGNMENT
+        header = json.dumps({'meta': meta, 'arrays': layout}).encode()
+        start = -(-(8 + len(header)) // cls.ALIGNMENT) * cls.ALIGNMENT
+
+        shm = shared_memory.SharedMemory(create=True,
+                                         size=max(start + offset, 1))
+        shm.buf[:8] = len(header).to_bytes(8, 'little')
+        shm.buf[8:8 + len(header)] = header
+        for name, array in arrays.items():
+            view = np.ndarray(array.shape, array.dtype, shm.buf,
+                              start + layout[name][2])
+            view[...] = array
+        return cls._attach(shm)
+
+    @classmethod
+    def attach(cls, name):
+        """Attach to a block of shared memory made by create."""
+        return cls._attach(shared_memory.SharedMemory(name))
+
+    @classmethod
+    def _attach(cls, shm):
+        length = int.from_bytes(bytes(shm.buf[:8]), 'little')
+        header = json.loads(bytes(shm.buf[8:8 + length]))
+        start = -(-(8 + length) // cls.ALIGNMENT) * cls.ALIGNMENT
+        arrays = {}
+        for name, (dtype, shape, offset) in header['arrays'].items():
+            array = np.ndarray(shape, np.dtype(dtype), shm.buf, start + offset)
+            array.flags.writeable = False
+            arrays[name] = array
+        return cls(shm, arrays, header['meta'])
+
+    def close(self):
+        """Detach from the shared memory. The arrays can't be used after."""
+        self.arrays = {}
+        self._shm.close()
+
+    def unlink(self):
+        """Detach from and free the shared memory."""
+        self.close()
+        self._shm.unlink()
+
+
+def share_model(kernel, profile_id, profile_data, idprobs):
+    """Copy a model into a new block of shared memory.
+
+    Arguments:
+    kernel -- The DNNKernel of the model.
+    profile_id -- The name of the rules profile of the model.
+    profile_data -- The working data of the rules, as returned by
+    RulesIDS.read_profile_data.
+    idprobs -- The ID_ProbTable of the model.
+
+    Returns a SharedArrays.
+    """
+    arrays = kernel.to_arrays()
+    arrays['idprobs'] = idprobs.probs
+    return SharedArrays.create(
+        arrays, {
+            'activation': kernel.activation,
+            'profile_id': profile_id,
+            'profile_data': profile_data
+        })
+
+
+def attach_model(shared):
+    """Make a TwoStageIDS from a model in shared memory, ready to judge
+    frames. The DNN weights are used from the shared memory as they are."""
+    from ids.two_stage_ids import TwoStageIDS
+
+    kernel = DNNKernel.from_arrays(shared.arrays, shared.meta['activation'])
+    two_stage = TwoStageIDS(dnn=kernel)
+    two_stage.rules.prepare(set_profile_id=shared.meta['profile_id'],
+                            profile_data=shared.meta['profile_data'])
+    two_stage.idprobs = dp.ID_ProbTable(shared.arrays['idprobs'])
+    two_stage.dnn_trained = True
+    two_stage.rules_trained = True
+    return two_stage
+
+
+def _queued_frames(inqueue):
+    """Generator yielding the frames fed to a bus, until it is closed."""
+    while True:
+        chunk = inqueue.get()
+        if chunk is None:
+            return
+        yield from chunk
+
+
+def _bus_worker(bus, shared_name, source, inqueue, outqueue, chunk_size):
+    """Judge the frames of one bus, and put the verdicts in outqueue."""
+    try:
+        shared = SharedArrays.attach(shared_name)
+    except Exception:  # pylint: disable=broad-except
+        outqueue.put(('error', bus, traceback.format_exc()))
+        return
+    try:
+        _judge_bus(bus, shared, source, inqueue, outqueue, chunk_size)
+    except Exception:  # pylint: disable=broad-except
+        outqueue.put(('error', bus, traceback.format_exc()))
+    finally:
+        shared.close()
+
+
+def _judge_bus(bus, shared, source, inqueue, outqueue, chunk_size):
+    two_stage = attach_model(shared)
+    two_stage.start_simulation()
+    if source is not None:
+        frames = dp.iter_can_file(source)
+    else:
+        frames = _queued_frames(inqueue)
+
+    seq = 0
+    busy = 0
+    while True:
+        chunk = list(itertools.islice(frames, chunk_size))
+        if not chunk:
+            break
+        start = time.perf_counter_ns()
+        results = two_stage.judge_batch(chunk, start)
+        busy += time.perf_counter_ns() - start
+        outqueue.put(('verdicts', bus, {
+            'seq': seq,
+            'timestamp': [x['timestamp'] for x in chunk],
+            'id': [x['id'] for x in chunk],
+            'results': results,
+            'busy': busy
+        }))
+        seq += len(chunk)
+    two_stage.stop_simulation()
+    outqueue.put(('done', bus, {
+        'latency': two_stage.latency['judge_batch'].summary()
+    }))
+
+
+class BusSupervisor:
+    """Run a judging worker process for each CAN bus, all sharing one copy of
+    the model in shared memory, and merge their verdicts into one stream.
+
+    Each verdict is a dictionary of the 'bus' and 'seq' (the index of the
+    frame on its bus) of the frame, its 'timestamp' and 'id', whether it is
+    'malicious', the 'rule' that rejected it or None, and the 'confidence' of
+    the DNN or None.
+    """
+
+    def __init__(self, kernel, profile_id, profile_data, idprobs,
+                 chunk_size=DEFAULT_CHUNK_SIZE, queue_size=16):
+        """Arguments:
+        kernel -- The DNNKernel of the model.
+        profile_id -- The name of the rules profile of the model.
+        profile_data -- The working data of the rules, as returned by
+        RulesIDS.read_profile_data.
+        idprobs -- The ID_ProbTable of the model.
+        chunk_size -- The number of frames judged at a time by the workers.
+        queue_size -- The number of chunks fed to a bus that can wait to be
+        judged before feed blocks.
+        """
+        self._model = (kernel, profile_id, profile_data, idprobs)
+        self.chunk_size = chunk_size
+        self.queue_size = queue_size
+        self._context = multiprocessing.get_context('spawn')
+        self._sources = {}
+        self._inqueues = {}
+        self._outqueue = None
+        self._processes = {}
+        self._shared = None
+        self._stats = {}
+        self._start_time = None
+
+    @classmethod
+    def from_ids(cls, two_stage, precision='float32', **kwargs):
+        """Make a supervisor for the model of a trained TwoStageIDS, with the
+        weights of its DNN stored in precision (see dnn_kernel.PRECISIONS)."""
+        dnn = two_stage.dnn
+        if not isinstance(dnn, DNNKernel):
+            dnn = DNNKernel.from_dnn(dnn)
+        if dnn.precision != precision:
+            dnn = dnn.quantize(precision)
+        return cls(dnn, two_stage.rules.profile_id,
+                   two_stage.rules.read_profile_data(), two_stage.idprobs,
+                   **kwargs)
+
+    def add_bus(self, bus, source=None):
+        """Add a bus to judge, before the supervisor is started.
+
+        Arguments:
+        bus -- The name of the bus, which its verdicts are tagged with.
+        source -- The path to a capture file that the worker reads the frames
+        of the bus from, see preprocessor.iter_can_file. If None, the frames
+        are given with feed.
+        """
+        if self._processes:
+            raise RuntimeError('Buses must be added before starting.')
+        if bus in self._sources:
+            raise ValueError('There already is a bus named {}.'.format(bus))
+        self._sources[bus] = None if source is None else str(source)
+
+    def start(self):
+        """Share the model and start a worker process for each bus."""
+        if self._processes:
+            raise RuntimeError('The supervisor has already been started.')
+        self._shared = share_model(*self._model)
+        self._outqueue = self._context.Queue()
+        self._start_time = time.perf_counter()
+        for bus, source in self._sources.items():
+            self._inqueues[bus] = self._context.Queue(self.queue_size)
+            self._stats[bus] = {
+                'frames': 0,
+                'malicious': 0,
+                'rule_rejections': 0,
+                'busy_seconds': 0.0,
+                'finished': False
+            }
+            process = self._context.Process(
+                target=_bus_worker,
+                args=(bus, self._shared.name, source, self._inqueues[bus],
+                      self._outqueue, self.chunk_size),
+                daemon=True)
+            process.start()
+            self._processes[bus] = process
+
+    def feed(self, bus, frames):
+        """Give frames to a bus without a source file. Blocks while the
+        worker of the bus is too far behind."""
+        if self._sources[bus] is not None:
+            raise ValueError('The bus {} reads from {}.'.format(
+                bus, self._sources[bus]))
+        for lo in range(0, len(frames), self.chunk_size):
+            self._inqueues[bus].put(frames[lo:lo + self.chunk_size])
+
+    def close_bus(self, bus):
+        """Mark the end of the frames given to a bus with feed."""
+        self._inqueues[bus].put(None)
+
+    def verdicts(self, timeout=None):
+        """Generator yielding the verdicts of every bus as they are judged,
+        until every worker has finished.
+
+        Arguments:
+        timeout -- The seconds to wait for the next verdicts before raising
+        queue.Empty, or None to wait as long as the workers are alive.
+
+        Raises:
+        RuntimeError -- A worker failed, or died without finishing.
+        """
+        while not all(x['finished'] for x in self._stats.values()):
+            kind, bus, message = self._next_message(timeout)
+            stats = self._stats[bus]
+            if kind == 'error':
+                raise RuntimeError('The worker of bus {} failed:\n{}'.format(
+                    bus, message))
+            elif kind == 'done':
+                stats['finished'] = True
+                stats['latency'] = message['latency']
+                continue
+            stats['busy_seconds'] = message['busy'] / 1e9
+            for seq, timestamp, can_id, result in zip(
+                    itertools.count(message['seq']), message['timestamp'],
+                    message['id'], message['results']):
+                is_rule = isinstance(result[1], str)
+                stats['frames'] += 1
+                stats['malicious'] += result[0]
+                stats['rule_rejections'] += is_rule
+                yield {
+                    'bus': bus,
+                    'seq': seq,
+                    'timestamp': timestamp,
+                    'id': can_id,
+                    'malicious': result[0],
+                    'rule': result[1] if is_rule else None,
+                    'confidence': None if is_rule else result[1]
+                }
+
+    def _next_message(self, timeout=None):
+        """Get the next message of the workers, checking that the workers
+        that have not finished are still alive while waiting."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = WORKER_POLL_SECONDS
+            if deadline is not None:
+                wait = min(wait, max(deadline - time.monotonic(), 0))
+            try:
+                return self._outqueue.get(timeout=wait)
+            except queue.Empty:
+                pass
+            dead = [
+                bus for bus, process in self._processes.items()
+                if not self._stats[bus]['finished'] and
+                not process.is_alive()
+            ]
+            if dead:
+                # The last messages of a worker may arrive just after it
+                # exits.
+                try:
+                    return self._outqueue.get(timeout=WORKER_POLL_SECONDS)
+                except queue.Empty:
+                    raise RuntimeError(
+                        'The worker of bus {} died with exit code {}.'.format(
+                            dead[0], self._processes[dead[0]].exitcode))
+            if deadline is not None and time.monotonic() >= deadline:
+                raise queue.Empty
+
+    def stats(self):
+        """Return the throughput of each bus, as a dictionary {bus: stats}.
+        The stats of a bus hold the number of 'frames' judged, 'malicious'
+        frames and 'rule_rejections', the 'frames_per_sec' since the start,
+        the 'judge_frames_per_sec' of the worker while it was judging, and
+        whether it has 'finished'."""
+        elapsed = time.perf_counter() - (self._start_time or
+                                         time.perf_counter())
+        stats = {}
+        for bus, bus_stats in self._stats.items():
+            stats[bus] = dict(bus_stats)
+            stats[bus]['frames_per_sec'] = (bus_stats['frames'] / elapsed
+                                            if elapsed else 0.0)
+            stats[bus]['judge_frames_per_sec'] = (
+                bus_stats['frames'] / bus_stats['busy_seconds']
+                if bus_stats['busy_seconds'] else 0.0)
+        return stats
+
+    def stop(self):
+        """Stop the workers, and free the shared model."""
+        for process in self._processes.values():
+            process.join(timeout=1)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        self._processes = {}
+        if self._shared is not None:
+            self._shared.unlink()
+            self._shared = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def main(argv=None):
+    # The model is loaded the same way as for batch judging.
+    from ids.judge import load_two_stage_ids
+
+    parser = argparse.ArgumentParser(
+        prog='python -m ids.multibus',
+        description='Judge the captures of several CAN buses at once.')
+    parser.add_argument('model', help='name of the Two Stage IDS model')
+    parser.add_argument('--idprobs', required=True,
+                        help='name of the ID probabilities file')
+    parser.add_argument('--bus', action='append', required=True,
+                        metavar='NAME=CAPTURE',
+                        help='a bus and the capture file of its traffic')
+    parser.add_argument('--output', metavar='PATH',
+                        help='write the verdicts to PATH as JSON lines')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument('--precision', choices=list(PRECISIONS),
+                        default='float32',
+                        help='precision of the DNN weights shared with the '
+                        'workers (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    supervisor = BusSupervisor.from_ids(
+        load_two_stage_ids(args.model, args.idprobs),
+        precision=args.precision, chunk_size=args.chunk_size)
+    for bus in args.bus:
+        name, _, source = bus.partition('=')
+        supervisor.add_bus(name, source)
+
+    outfile = open(args.output, 'w') if args.output else None
+    try:
+        with supervisor:
+            last_report = time.perf_counter()
+            for verdict in supervisor.verdicts():
+                if outfile:
+                    outfile.write(json.dumps(verdict) + '\n')
+                if time.perf_counter() - last_report > 5:
+                    last_report = time.perf_counter()
+                    _print_stats(supervisor.stats())
+            _print_stats(supervisor.stats())
+    finally:
+        if outfile:
+            outfile.close()
+
+
+def _print_stats(stats):
+    for bus, bus_stats in stats.items():
+        print('{}: {} frames, {} malicious, {:.0f} frames/s'.format(
+            bus, bus_stats['frames'], bus_stats['malicious'],
+            bus_stats['frames_per_sec']), flush=True)
+
+
+if __name__ == '__main__':
+    main()
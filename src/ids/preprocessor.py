@@ -10,22 +10,43 @@ write_canlist -- Take a list of CAN frames along with a path to write a file to,
 and write the list of CAN frames to a file.
 load_canlist -- Take the path to a CAN frame list file and return the CAN list
 from the file.
+parse_can_file -- Take the path to a .traffic, .csv or CAN frame list file and
+return the list of CAN messages in it.
+iter_can_file -- Take the path to a CAN frame file and return a generator
+yielding the CAN messages in it one at a time.
+canlist_to_columns -- Take a list of CAN messages and convert it to a columnar
+canlist, a dictionary of NumPy arrays.
+columns_to_canlist -- Take a columnar canlist and convert it back to a list of
+CAN messages.
 validate_can_data -- Take in a list of CAN messages, determine if the list
 of messages is valid or not, and print all errors that are found to the
 screen.
+validate_columns -- Take in a columnar canlist, check every frame at once,
+and return a report of the errors found.
+validate_canlist -- Take in a list of CAN messages, convert it to a columnar
+canlist and return it along with a report of the errors found.
 write_id_probs -- Take a list of CAN frames along with a path to write a
 file to, and generate a dictionary of the probabilities of each ID
 occurring, and write it to a file. Return the dictionary of ID
 probabilities.
+write_id_probs_from_files -- Take a list of CAN frame files along with a path
+to write a file to, count the IDs of each file in parallel, and write the ID
+probabilities to a file. Return the dictionary of ID probabilities.
 load_id_probs -- Take the path to an ID probabilities file and return the ID
 probability dictionary from the file.
+load_id_prob_table -- Take the path to an ID probabilities file and return an
+ID_ProbTable of the probabilities in the file.
 inject_malicious_packets -- Take in a list of CAN messages and a malicious
 generator and inject malicious packets into the list.
+inject_malicious_columns -- Take in a columnar canlist and a malicious
+generator and inject malicious packets into it in bulk.
 generate_feature_lists -- Take in a list of CAN messages along with an ID
 probabilities dictionary and generate the feature lists required for the DNN
 based IDS.
 write_feature_lists -- Take in a list of features and the path to a file to
 write, and write a file containing the feature list to disk.
+write_feature_file -- Take in a list of features, label codes and the path
+to a file to write, and write the features to a columnar binary file.
 load_feature_lists -- Take the path to a feature list file and return the
 feature lists from the file.
 """
@@ -33,6 +54,7 @@ feature lists from the file.
 import collections
 import csv
 import json
+import multiprocessing
 import os.path
 import re
 import struct
@@ -40,6 +62,8 @@ from copy import deepcopy
 
 import numpy as np
 
+import ids.column_store
+
 
 def parse_traffic(filepath):
     """Take in the path to a .traffic file, parse the file, and return a list
@@ -59,7 +83,12 @@ def parse_traffic(filepath):
     elif os.path.isdir(filepath):
         raise FileNotFoundError(filepath + ' is not a file!')
 
-    messages = []
+    return list(_iter_traffic(filepath))
+
+
+def _iter_traffic(filepath):
+    """Generator parsing the CAN messages of a .traffic file one line at a
+    time. See parse_traffic."""
     with open(filepath) as file:
         for line in file:
             # Surround instances of hex numbers with quotes: 0x9A -> "0x9A".
@@ -102,9 +131,7 @@ def parse_traffic(filepath):
             # which is an immutable representation of a series of bytes.
             data = bytes(data)
 
-            messages.append({'id': id, 'timestamp': ts, 'data': data})
-
-    return messages
+            yield {'id': id, 'timestamp': ts, 'data': data}
 
 
 def parse_csv(filepath):
@@ -125,7 +152,12 @@ def parse_csv(filepath):
     elif os.path.isdir(filepath):
         raise FileNotFoundError(filepath + ' is not a file!')
 
-    messages = []
+    return list(_iter_csv(filepath))
+
+
+def _iter_csv(filepath):
+    """Generator parsing the CAN messages of a CAN frame .csv file one line
+    at a time. See parse_csv."""
     with open(filepath) as file:
         reader = csv.DictReader(file)
         for line in reader:
@@ -146,9 +178,7 @@ def parse_csv(filepath):
                 data.append(int(hexnum, 16))
             data = bytes(data)
 
-            messages.append({'id': id, 'timestamp': ts, 'data': data})
-
-    return messages
+            yield {'id': id, 'timestamp': ts, 'data': data}
 
 
 def write_canlist(canlist, outfilepath):
@@ -198,6 +228,156 @@ def load_canlist(filepath):
     return canlist
 
 
+def parse_can_file(filepath):
+    """Take the path to a .traffic, .csv or CAN frame list (.json) file and
+    return the list of CAN messages in it, using parse_traffic, parse_csv or
+    load_canlist depending on the extension. Columnar binary files of CAN
+    frames (see synthetic.write_column_file) are read as well, whatever their
+    extension.
+
+    Raises:
+    ValueError -- The file does not have one of the three extensions, and is
+    not a columnar binary file.
+    """
+    filepath = str(filepath)
+    if ids.column_store.is_column_file(filepath):
+        columns, _ = ids.column_store.load_columns(filepath)
+        return columns_to_canlist(columns)
+    elif filepath.endswith('.traffic'):
+        return parse_traffic(filepath)
+    elif filepath.endswith('.csv'):
+        return parse_csv(filepath)
+    elif filepath.endswith('.json'):
+        return load_canlist(filepath)
+    raise ValueError(f'Unknown type of CAN frame file provided: {filepath}.')
+
+
+def iter_can_file(filepath, chunk_size=2**16):
+    """Take the path to a CAN frame file, as for parse_can_file, and return
+    a generator yielding the CAN messages in it one at a time, without
+    holding the whole file in memory. .traffic and .csv files are parsed
+    one line at a time, and columnar binary files are memory mapped and
+    converted chunk_size frames at a time. CAN frame list (.json) files
+    can only be loaded whole.
+
+    Raises:
+    FileNotFoundError -- The file does not exist.
+    ValueError -- The file is not a known type of CAN frame file.
+    """
+    filepath = str(filepath)
+    if not os.path.exists(filepath):
+        raise FileNotFoundError(filepath + ' does not exist!')
+    elif os.path.isdir(filepath):
+        raise FileNotFoundError(filepath + ' is not a file!')
+    if ids.column_store.is_column_file(filepath):
+        return _iter_column_file(filepath, chunk_size)
+    elif filepath.endswith('.traffic'):
+        return _iter_traffic(filepath)
+    elif filepath.endswith('.csv'):
+        return _iter_csv(filepath)
+    elif filepath.endswith('.json'):
+        return iter(load_canlist(filepath))
+    raise ValueError(f'Unknown type of CAN frame file provided: {filepath}.')
+
+
+def _iter_column_file(filepath, chunk_size):
+    columns, _ = ids.column_store.load_columns(filepath, mmap=True)
+    for lo in range(0, len(columns['id']), chunk_size):
+        yield from columns_to_canlist(
+            {k: v[lo:lo + chunk_size] for k, v in columns.items()})
+
+
+# The number of possible 11-bit CAN IDs.
+NUM_IDS = 2048
+
+# The columns of a columnar canlist, along with the type of each column. 'data'
+# is an (N, 8) block of payload bytes, padded with zeros past 'dlc'.
+COLUMN_DTYPES = {
+    'timestamp': np.int64,
+    'id': np.int32,
+    'dlc': np.uint8,
+    'data': np.uint8
+}
+
+
+def empty_columns(length=0):
+    """Return a columnar canlist of `length` zeroed frames."""
+    columns = {
+        k: np.zeros(length, dtype=v)
+        for k, v in COLUMN_DTYPES.items() if k != 'data'
+    }
+    columns['data'] = np.zeros((length, 8), dtype=COLUMN_DTYPES['data'])
+    return columns
+
+
+def canlist_to_columns(canlist):
+    """Take a list of CAN messages and convert it to a columnar canlist.
+
+    Arguments:
+    canlist -- A list of CAN messages produced from parse_csv or
+    parse_traffic.
+
+    Returns a dictionary {'timestamp': array, 'id': array, 'dlc': array,
+    'data': array}, where 'data' is an (N, 8) array of bytes and every other
+    entry is a 1-D array of length N. Data longer than 8 bytes is truncated in
+    'data', but 'dlc' keeps the real length.
+    """
+    length = len(canlist)
+    columns = {
+        'timestamp': np.fromiter((x['timestamp'] for x in canlist),
+                                 dtype=COLUMN_DTYPES['timestamp'],
+                                 count=length),
+        'id': np.fromiter((x['id'] for x in canlist),
+                          dtype=COLUMN_DTYPES['id'],
+                          count=length),
+        'dlc': np.fromiter((min(len(x['data']), 255) for x in canlist),
+                           dtype=COLUMN_DTYPES['dlc'],
+                           count=length)
+    }
+    # Pad every payload to exactly 8 bytes so the whole block can be read in
+    # with a single frombuffer.
+    payload = b''.join(x['data'][:8].ljust(8, b'\x00') for x in canlist)
+    columns['data'] = np.frombuffer(
+        payload, dtype=COLUMN_DTYPES['data']).reshape(length, 8).copy()
+    return columns
+
+
+def columns_to_canlist(columns):
+    """Take a columnar canlist and convert it back to a list of CAN messages.
+
+    Arguments:
+    columns -- A columnar canlist, generated by canlist_to_columns.
+
+    Returns a list of CAN messages in the format {'id': 1, 'timestamp': 1,
+    'data': b'\\x00\\x11'}.
+    """
+    payload = np.ascontiguousarray(columns['data']).tobytes()
+    dlcs = np.minimum(columns['dlc'], 8).tolist()
+    return [{
+        'id': id,
+        'timestamp': ts,
+        'data': payload[8 * i:8 * i + dlc]
+    } for i, (id, ts, dlc) in enumerate(
+        zip(columns['id'].tolist(), columns['timestamp'].tolist(), dlcs))]
+
+
+def take_columns(columns, indices):
+    """Return the frames of a columnar canlist at the given indices (or
+    boolean mask) as a new columnar canlist."""
+    return {k: v[indices] for k, v in columns.items()}
+
+
+def concatenate_columns(column_sets):
+    """Join a sequence of columnar canlists end to end."""
+    column_sets = list(column_sets)
+    if not column_sets:
+        return empty_columns()
+    return {
+        k: np.concatenate([x[k] for x in column_sets])
+        for k in COLUMN_DTYPES
+    }
+
+
 
 def validate_can_data(canlist):
     """Take in a list of CAN messages, determine if the list of messages is
@@ -277,6 +457,146 @@ def validate_can_data(canlist):
     return valid
 
 
+# The error classes checked by validate_columns, with a description of each.
+VALIDATION_ERRORS = {
+    'empty': 'The list provided is empty',
+    'unconvertible': 'Frame is missing a field, or a field has the wrong '
+    'type or is too large',
+    'id_out_of_range': 'ID is outside the range 0-2047',
+    'negative_timestamp': 'Timestamp is negative',
+    'timestamp_decreasing': 'Timestamp is earlier than the previous frame',
+    'dlc_too_long': 'Data field is longer than 8 bytes'
+}
+
+
+def validate_columns(columns, max_indices=10):
+    """Take in a columnar canlist, check every frame at once, and return a
+    report of the errors found. Unlike validate_can_data, nothing is printed,
+    so this can be used as a fast check before processing a capture.
+
+    This function checks:
+        - If the list is empty
+        - If the ID is in the range 0-2047
+        - If the timestamp is positive
+        - If the timestamps never go backwards
+        - If the data is at most 8 bytes long
+    The types of the fields do not need to be checked, since they are fixed
+    by the columns.
+
+    Arguments:
+    columns -- The columnar canlist to validate. Generated by
+    canlist_to_columns.
+    max_indices -- The number of offending frame indices to report for each
+    error class.
+
+    Returns a dictionary {'valid': bool, 'num_frames': int, 'errors':
+    {error class: {'count': int, 'indices': [...]}}}, with an entry in
+    'errors' for every class in VALIDATION_ERRORS. 'indices' holds the first
+    max_indices frames with that error. For 'timestamp_decreasing', these are
+    the frames whose timestamp is earlier than the one before them.
+    """
+    can_ids = np.asarray(columns['id'])
+    timestamps = np.asarray(columns['timestamp'])
+    num_frames = len(can_ids)
+    masks = {
+        'id_out_of_range': (can_ids < 0) | (can_ids >= NUM_IDS),
+        'negative_timestamp': timestamps < 0,
+        'timestamp_decreasing':
+        np.r_[False, timestamps[1:] < timestamps[:-1]],
+        'dlc_too_long': np.asarray(columns['dlc']) > 8
+    }
+
+    errors = {
+        'empty': {'count': int(num_frames == 0), 'indices': []},
+        # Every frame of a columnar canlist was converted.
+        'unconvertible': {'count': 0, 'indices': []}
+    }
+    for name, mask in masks.items():
+        indices = np.flatnonzero(mask)
+        errors[name] = {
+            'count': len(indices),
+            'indices': indices[:max_indices].tolist()
+        }
+    return {
+        'valid': not any(x['count'] for x in errors.values()),
+        'num_frames': num_frames,
+        'errors': errors
+    }
+
+
+# The errors canlist_to_columns raises on a frame that is missing a field, or
+# has a field of the wrong type or too large for its column.
+_CONVERSION_ERRORS = (KeyError, TypeError, ValueError, OverflowError,
+                      AttributeError)
+
+
+def _convertible(frame):
+    try:
+        canlist_to_columns([frame])
+    except _CONVERSION_ERRORS:
+        return False
+    return True
+
+
+def validate_canlist(canlist, max_indices=10):
+    """Take in a list of CAN messages, convert it to a columnar canlist and
+    check it with validate_columns.
+
+    The frames that cannot be converted are reported as 'unconvertible'
+    errors instead of raising, and the other frames are checked without
+    them.
+
+    Arguments:
+    canlist -- The list of CAN messages to validate.
+    max_indices -- The number of offending frame indices to report for each
+    error class.
+
+    Returns a tuple (columns, report): the columnar canlist, or None if some
+    frames could not be converted, and a report as returned by
+    validate_columns, with the indices of the frames in canlist.
+    """
+    try:
+        columns = canlist_to_columns(canlist)
+    except _CONVERSION_ERRORS:
+        pass
+    else:
+        return columns, validate_columns(columns, max_indices)
+
+    convertible = np.array(
+        [i for i, frame in enumerate(canlist) if _convertible(frame)],
+        dtype=np.int64)
+    report = validate_columns(
+        canlist_to_columns([canlist[i] for i in convertible]), max_indices)
+    errors = report['errors']
+    # Map the indices back to the frames of canlist.
+    for name, error in errors.items():
+        error['indices'] = convertible[error['indices']].tolist()
+    unconvertible = np.setdiff1d(np.arange(len(canlist)), convertible)
+    errors['empty']['count'] = 0
+    errors['unconvertible'] = {
+        'count': len(unconvertible),
+        'indices': unconvertible[:max_indices].tolist()
+    }
+    report['valid'] = False
+    report['num_frames'] = len(canlist)
+    return None, report
+
+
+def validation_summary(report):
+    """Take a report from validate_columns and return a short, readable
+    description of it."""
+    if report['valid']:
+        return 'This dataset of {} frames is valid!'.format(
+            report['num_frames'])
+    lines = ['This dataset of {} frames is invalid!'.format(
+        report['num_frames'])]
+    for name, error in report['errors'].items():
+        if error['count']:
+            lines.append('{}: {} frames, first at indices {}'.format(
+                VALIDATION_ERRORS[name], error['count'], error['indices']))
+    return '\n'.join(lines)
+
+
 def write_id_probs(canlist, outfilepath=None):
     """Take a list of CAN frames along with a path to write a file to, and
     generate a dictionary of the probabilities of each ID occurring, and write
@@ -301,6 +621,100 @@ def write_id_probs(canlist, outfilepath=None):
     if outfilepath:
         with open(outfilepath, 'w+') as file:
             json.dump(probs, file, indent=2)
+        # Raw counts can only be stored for valid 11-bit IDs.
+        if all(isinstance(k, int) and 0 <= k < NUM_IDS for k in idcounts):
+            counts = np.zeros(NUM_IDS, dtype=np.int64)
+            counts[list(idcounts)] = list(idcounts.values())
+            _write_id_probs_sidecar(outfilepath, counts, probs)
+    return probs
+
+
+def id_probs_sidecar_path(filepath):
+    """Return the path of the binary (.npz) file stored next to the ID
+    probabilities file at filepath. It holds the raw ID counts the
+    probabilities were made from under the key 'counts', and the
+    probabilities as a NUM_IDS long array under the key 'probs'.
+    """
+    return os.path.splitext(str(filepath))[0] + '.npz'
+
+
+def _write_id_probs_sidecar(filepath, counts, probs):
+    table = ID_ProbTable.from_dict(probs)
+    np.savez(id_probs_sidecar_path(filepath), counts=counts, probs=table.probs)
+
+
+def count_ids(filepath):
+    """Take the path to a CAN frame file (see parse_can_file) and return an
+    array of length NUM_IDS holding the number of frames with each ID.
+
+    Raises:
+    ValueError -- The file has a frame with an ID outside the range 0-2047.
+    """
+    if ids.column_store.is_column_file(filepath):
+        columns, _ = ids.column_store.load_columns(filepath)
+        can_ids = columns['id'].astype(np.int64)
+    else:
+        can_ids = np.fromiter((x['id'] for x in parse_can_file(filepath)),
+                              dtype=np.int64)
+    if can_ids.size and (can_ids.min() < 0 or can_ids.max() >= NUM_IDS):
+        raise ValueError(f'{filepath} has IDs outside the range 0-2047.')
+    return np.bincount(can_ids, minlength=NUM_IDS)
+
+
+def write_id_probs_from_files(filepaths,
+                              outfilepath=None,
+                              processes=None,
+                              update=False):
+    """Take a list of CAN frame files along with a path to write a file to,
+    count the IDs of each file in parallel, and write the ID probabilities to
+    a file. Return the dictionary of ID probabilities.
+
+    Each file is parsed in a worker process and reduced to an array of ID
+    counts (see count_ids), and the counts are summed, so only one file is
+    held in memory per worker. The summed counts are written next to the
+    probabilities (see id_probs_sidecar_path), so that the file can be
+    updated with more files later.
+
+    Arguments:
+    filepaths -- A list of paths to .traffic, .csv or CAN frame list files.
+    outfilepath -- A string containing the path to the file you want to
+    write. The file will be created by this function.
+    processes -- The number of worker processes to use. If None, the number
+    of CPUs is used.
+    update -- If True, the counts already stored for outfilepath are added to
+    the counts of the new files, instead of being overwritten.
+
+    Raises:
+    ValueError -- update is True, but the ID probabilities file at
+    outfilepath has no raw counts stored next to it.
+
+    This will write the dictionary of ID probabilities to the file specified
+    in outfilepath in a JSON format, as well as return a dictionary where
+    the key value pairs are id: probability of that id occurring.
+    """
+    counts = np.zeros(NUM_IDS, dtype=np.int64)
+    if update and outfilepath and os.path.exists(outfilepath):
+        sidecar = id_probs_sidecar_path(outfilepath)
+        if not os.path.exists(sidecar):
+            raise ValueError(
+                f'{outfilepath} has no raw ID counts, and cannot be updated.')
+        with np.load(sidecar) as stored:
+            counts += stored['counts']
+
+    filepaths = [str(x) for x in filepaths]
+    with multiprocessing.Pool(processes) as pool:
+        for file_counts in pool.imap_unordered(count_ids, filepaths):
+            counts += file_counts
+
+    numframes = counts.sum()
+    probs = {
+        int(k): int(counts[k]) / int(numframes)
+        for k in np.flatnonzero(counts)
+    }
+    if outfilepath:
+        with open(outfilepath, 'w+') as file:
+            json.dump(probs, file, indent=2)
+        _write_id_probs_sidecar(outfilepath, counts, probs)
     return probs
 
 
@@ -326,7 +740,70 @@ def load_id_probs(filepath):
     return {int(k): v for k, v in id_probs.items()}
 
 
-def inject_malicious_packets(canlist, malgen):
+def load_id_prob_table(filepath):
+    """Take the path to an ID probabilities file and return an ID_ProbTable of
+    the probabilities in the file. The binary file next to it (see
+    id_probs_sidecar_path) is read if it exists, otherwise the JSON file is.
+
+    Arguments:
+    filepath -- The path to the ID probability file. A
+    FileNotFoundError will be thrown if the path given here is not valid.
+    """
+    if not os.path.exists(filepath):
+        raise FileNotFoundError(str(filepath) + ' does not exist!')
+    elif os.path.isdir(filepath):
+        raise FileNotFoundError(str(filepath) + ' is not a file!')
+    sidecar = id_probs_sidecar_path(filepath)
+    if os.path.exists(sidecar):
+        with np.load(sidecar) as stored:
+            if 'probs' in stored:
+                return ID_ProbTable(stored['probs'])
+    return ID_ProbTable.from_dict(load_id_probs(filepath))
+
+
+class ID_ProbTable:  # pylint: disable=invalid-name
+    """The probability of each ID occurring, as a dense array indexed by ID.
+    This is the array form of an ID probabilities dictionary, and lets
+    ID_Entropy work on a whole batch of frames at once.
+
+    Attributes:
+        probs: float64 array of length NUM_IDS, the probability of each ID.
+        log_probs: the natural log of probs, 0 where the ID is unknown.
+        unknown: boolean array, True for IDs that have probability 0.
+    """
+
+    def __init__(self, probs):
+        self.probs = np.array(probs, dtype=np.float64)
+        if self.probs.shape != (NUM_IDS, ):
+            raise ValueError(
+                'An ID probability table needs {} entries.'.format(NUM_IDS))
+        self.unknown = self.probs == 0
+        self.log_probs = np.log(np.where(self.unknown, 1.0, self.probs))
+
+    @classmethod
+    def from_dict(cls, idprobs):
+        """Make a table from an ID probabilities dictionary, as returned by
+        write_id_probs or load_id_probs."""
+        probs = np.zeros(NUM_IDS, dtype=np.float64)
+        for can_id, prob in idprobs.items():
+            probs[can_id] = prob
+        return cls(probs)
+
+    def to_dict(self):
+        """Return the table as an ID probabilities dictionary."""
+        return {
+            int(k): float(self.probs[k])
+            for k in np.flatnonzero(~self.unknown)
+        }
+
+    def get(self, can_id, default=0):
+        """Look up the probability of an ID, like dict.get."""
+        if 0 <= can_id < NUM_IDS and not self.unknown[can_id]:
+            return float(self.probs[can_id])
+        return default
+
+
+def inject_malicious_packets(canlist, malgen, seed=None):
     """Take in a list of CAN messages and a malicious generator and inject
     malicious packets into the list.
 
@@ -335,26 +812,98 @@ def inject_malicious_packets(canlist, malgen):
     and parse_csv.
     malgen -- A MaliciousGenerator used to generate malicious packets to
     inject.
+    seed -- Seed for the random streams. See inject_malicious_columns.
 
     Returns a tuple (newcanlist, labels), where newcanlist is the list of
     messages, and labels is a list of the labels for each message. Labels are
     'attack_name' if malicious, else None.
     """
-    newcanlist = []
-    # The labels for the frames. 0 means the packet is not malicious, and 1
-    # means the packet is malicious. This is used later in the DNN based
-    # IDS.
-    labels = []
-    for i in range(len(canlist) - 1):
-        newcanlist.append(canlist[i])
-        labels.append(None)
-        malicious_frames = malgen.get((canlist[i], canlist[i + 1]))
-        for frame, name in malicious_frames:
-            newcanlist.append(frame)
-            labels.append(name)
-    newcanlist.append(canlist[-1])
-    labels.append(None)
-    return newcanlist, labels
+    columns, label_codes = inject_malicious_columns(
+        canlist_to_columns(canlist), malgen, seed)
+    names = malgen.labels
+    labels = [names[x] for x in label_codes.tolist()]
+    return columns_to_canlist(columns), labels
+
+
+def inject_malicious_columns(columns,
+                             malgen,
+                             seed=None,
+                             chunk_size=2**16,
+                             processes=None):
+    """Take in a columnar canlist and a malicious generator and inject
+    malicious packets into it in bulk.
+
+    Every gap between two adjacent frames is a time window, and the attack (or
+    lack of one) for every window is drawn at once. Each attack then produces
+    the frames for all of its windows in a single call, and the new frames are
+    merged in after the frame that starts their window.
+
+    The windows are split into chunks of chunk_size, and every chunk draws
+    from its own random stream, spawned from the seed with
+    numpy.random.SeedSequence. The output therefore depends only on the seed
+    and chunk_size, and not on how many processes are used.
+
+    Arguments:
+    columns -- The columnar canlist to use. Generated by canlist_to_columns.
+    malgen -- A MaliciousGenerator used to generate malicious packets to
+    inject.
+    seed -- Seed for the random streams. If None, fresh entropy is used.
+    chunk_size -- The number of time windows given to each random stream.
+    processes -- The number of worker processes to inject chunks in. If
+    None, all chunks are injected in this process.
+
+    Returns a tuple (newcolumns, label_codes), where newcolumns is the new
+    columnar canlist, and label_codes is an int8 array holding, for each
+    frame, the index of its label in malgen.labels (0 means not malicious).
+    """
+    length = len(columns['id'])
+    if length < 2:
+        return ({k: v.copy() for k, v in columns.items()},
+                np.zeros(length, dtype=np.int8))
+
+    # Window i lies between frame i and frame i + 1, so each chunk also needs
+    # the first frame of the next chunk.
+    num_windows = length - 1
+    bounds = range(0, num_windows, chunk_size)
+    streams = np.random.SeedSequence(seed).spawn(len(bounds))
+    jobs = [(take_columns(columns, slice(lo, min(lo + chunk_size,
+                                                 num_windows) + 1)),
+             malgen, stream) for lo, stream in zip(bounds, streams)]
+    if processes is None:
+        results = [_inject_chunk(*job) for job in jobs]
+    else:
+        with multiprocessing.Pool(processes) as pool:
+            results = pool.starmap(_inject_chunk, jobs)
+
+    last = slice(length - 1, length)
+    newcolumns = concatenate_columns([x[0] for x in results] +
+                                     [take_columns(columns, last)])
+    label_codes = np.concatenate([x[1] for x in results] +
+                                 [np.zeros(1, dtype=np.int8)])
+    return newcolumns, label_codes
+
+
+def _inject_chunk(columns, malgen, stream):
+    """Inject malicious packets into the windows between the frames of a
+    chunk. The last frame of the chunk only closes the last window, and is
+    left out of the result.
+    """
+    rng = np.random.default_rng(stream)
+    length = len(columns['id']) - 1
+    windows = (take_columns(columns, slice(0, length)),
+               take_columns(columns, slice(1, length + 1)))
+    injected, owners, codes = malgen.get_batch(windows, rng)
+
+    # Original frame i sorts at position i, and the frames injected into
+    # window i sort right after it. The sort is stable and the original
+    # frames come first, so ordering inside each window is kept.
+    positions = np.concatenate([np.arange(length), owners])
+    order = np.argsort(positions, kind='stable')
+    merged = concatenate_columns([windows[0], injected])
+    label_codes = np.concatenate(
+        [np.zeros(length, dtype=np.int8),
+         codes.astype(np.int8)])[order]
+    return take_columns(merged, order), label_codes
 
 
 class ID_Past:  # pylint: disable=too-few-public-methods,invalid-name
@@ -414,15 +963,30 @@ class ID_Entropy:  # pylint: disable=too-few-public-methods,invalid-name
     def __init__(self):
         self.observed_idcounts = collections.Counter()
         self.observed_system_entropy = 0
+        self.count = 0
+        # Running state of feed_batch: the count of each ID, and the sum of
+        # c * log(c) over those counts.
+        self._id_counts = np.zeros(NUM_IDS, dtype=np.int64)
+        self._count_log_count = 0.0
 
     def feed(self, canlist, idprobs):
         """feed CAN packets into entropy calculator
         Args:
             canlist: list of CAN packets; any length > 0
+            idprobs: ID probabilities dictionary, or an ID_ProbTable. With a
+                table, the whole list is calculated at once by feed_batch.
+                The same kind of idprobs should be used for every feed.
         Returns:
             python generator yielding tuples (e_relative, e_system)
         """
-        for count, frame in enumerate(canlist, 1):
+        if isinstance(idprobs, ID_ProbTable):
+            ids = np.fromiter((x['id'] for x in canlist), dtype=np.int64)
+            yield from zip(*self.feed_batch(ids, idprobs))
+            return
+
+        for frame in canlist:
+            self.count += 1
+            count = self.count
             self.observed_idcounts[frame['id']] += 1
             # Calculate relative entropy of message ID
             p = self.observed_idcounts[frame['id']] / count
@@ -442,6 +1006,61 @@ class ID_Entropy:  # pylint: disable=too-few-public-methods,invalid-name
             e_system = self.observed_system_entropy - old_system_entropy
             yield e_relative, e_system
 
+    def feed_batch(self, ids, idprobs):
+        """feed the IDs of a batch of CAN packets into the entropy calculator,
+        and calculate the entropies of every packet with array operations.
+
+        With c_i the count of ID i after t packets, the system entropy is
+        H_t = log(t) - sum(c_i * log(c_i)) / t, and each packet only changes
+        one term of the sum, so the sum can be kept with a cumulative sum.
+
+        Args:
+            ids: array of CAN IDs, in the order the packets were seen.
+            idprobs: an ID_ProbTable.
+        Returns:
+            Tuple of arrays (e_relative, e_system)
+        Raises:
+            ValueError: an ID is outside the range 0-2047.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        length = len(ids)
+        if length == 0:
+            return np.zeros(0), np.zeros(0)
+        if ids.min() < 0 or ids.max() >= NUM_IDS:
+            raise ValueError('CAN IDs must be in the range 0-2047.')
+
+        # The number of earlier packets with the same ID, for every packet:
+        # a running count within each group of equal IDs, plus the count
+        # from earlier batches.
+        order = np.argsort(ids, kind='stable')
+        group_starts = np.flatnonzero(np.r_[True, np.diff(ids[order]) != 0])
+        group_sizes = np.diff(np.r_[group_starts, length])
+        running = np.arange(length) - np.repeat(group_starts, group_sizes)
+        before = np.empty(length, dtype=np.int64)
+        before[order] = running
+        before += self._id_counts[ids]
+        after = before + 1
+        totals = self.count + np.arange(1, length + 1)
+
+        # Calculate relative entropy of message IDs
+        p = after / totals
+        e_relative = np.where(idprobs.unknown[ids], 100.0,
+                              p * (np.log(p) - idprobs.log_probs[ids]))
+
+        # Calculate change in system entropy. 0 * log(0) is taken as 0.
+        with np.errstate(divide='ignore', invalid='ignore'):
+            before_term = np.where(before > 0, before * np.log(before), 0.0)
+        count_log_count = self._count_log_count + np.cumsum(
+            after * np.log(after) - before_term)
+        entropy = np.log(totals) - count_log_count / totals
+        e_system = np.diff(np.r_[self.observed_system_entropy, entropy])
+
+        self._id_counts += np.bincount(ids, minlength=NUM_IDS)
+        self._count_log_count = float(count_log_count[-1])
+        self.observed_system_entropy = float(entropy[-1])
+        self.count += length
+        return e_relative, e_system
+
 
 def generate_feature_lists(canlist, idprobs):
     """Take in a list of CAN messages along with an ID probabilities dictionary
@@ -451,7 +1070,7 @@ def generate_feature_lists(canlist, idprobs):
     canlist -- The list of CAN messages to use. Generated by parse_traffic
     and parse_csv.
     idprobs -- An ID probabilities list, generated by write_id_probs or
-    load_id_probs.
+    load_id_probs, or an ID_ProbTable, which is much faster for long lists.
 
     Returns a list of features, with the format {'id': [...],
     'occurrences_in_last_sec': [...], 'relative_entropy': [...],
@@ -465,6 +1084,13 @@ def generate_feature_lists(canlist, idprobs):
     }
 
     featurelist['occurrences_in_last_sec'] = list(ID_Past().feed(canlist))
+    if isinstance(idprobs, ID_ProbTable):
+        e_relative, e_system = ID_Entropy().feed_batch(
+            featurelist['id'], idprobs)
+        featurelist['relative_entropy'] = e_relative.tolist()
+        featurelist['system_entropy_change'] = e_system.tolist()
+        return featurelist
+
     # zip(*iterable) separates an iterable of length-N tuples into N tuples
     e_relative, e_system = zip(*ID_Entropy().feed(canlist, idprobs))
     featurelist['relative_entropy'] = list(e_relative)
@@ -490,22 +1116,75 @@ def write_feature_lists(featurelist, labels, outfilepath):
         json.dump(featureslabels, file, indent=2)
 
 
+# The type each feature is stored as in a columnar binary feature file.
+FEATURE_DTYPES = {
+    'id': np.uint16,
+    'occurrences_in_last_sec': np.float64,
+    'relative_entropy': np.float64,
+    'system_entropy_change': np.float64
+}
+
+
+def write_feature_file(featurelist,
+                       label_codes,
+                       outfilepath,
+                       label_names,
+                       chunk_size=2**20):
+    """Take in a list of features with their label codes and the path to a
+    file to write, and write the features to a columnar binary file (see the
+    column_store module). The features are converted and written chunk_size
+    frames at a time.
+
+    Arguments:
+    featurelist -- The list of features to write. Generated by
+    generate_feature_lists.
+    label_codes -- The label code of each frame. Generated by
+    inject_malicious_columns. May be empty if the frames are unlabeled.
+    outfilepath -- A string containing the path to the file you want to
+    write. The file will be created by this function.
+    label_names -- The label of each label code, from
+    MaliciousGenerator.labels.
+    chunk_size -- The number of frames written at a time.
+    """
+    length = len(featurelist['id'])
+    attrs = {'kind': 'features', 'labels': list(label_names)}
+    with ids.column_store.ColumnWriter(outfilepath, attrs) as out:
+        for start in range(0, max(length, 1), chunk_size):
+            stop = start + chunk_size
+            chunk = {
+                k: np.asarray(featurelist[k][start:stop], dtype=v)
+                for k, v in FEATURE_DTYPES.items()
+            }
+            if len(label_codes):
+                chunk['label'] = np.asarray(label_codes[start:stop],
+                                            dtype=np.int8)
+            out.append(chunk)
+
+
 def load_feature_lists(filepath):
     """Take the path to a feature list file and return the feature lists from
-    the file.
+    the file. Both JSON feature files (from write_feature_lists) and columnar
+    binary feature files (from write_feature_file) can be read.
 
     Arguments:
     filepath -- The path to the feature list file. A FileNotFoundError will
     be thrown if the path given here is not valid.
 
-    This will return feature lists dictionary in the format {'id': [...],
-    'occurrences_in_last_sec': [...], 'relative_entropy': [...],
-    'system_entropy_change': [...]}.
+    This will return a tuple (features, labels), where features is a feature
+    lists dictionary in the format {'id': [...], 'occurrences_in_last_sec':
+    [...], 'relative_entropy': [...], 'system_entropy_change': [...]}. For a
+    JSON file, labels is the list of labels. For a columnar binary file, each
+    feature is a read-only memory-mapped array, and labels is an array of
+    label codes (empty if the file has no labels).
     """
     if not os.path.exists(filepath):
-        raise FileNotFoundError(filepath + ' does not exist!')
+        raise FileNotFoundError(str(filepath) + ' does not exist!')
     elif os.path.isdir(filepath):
-        raise FileNotFoundError(filepath + ' is not a file!')
+        raise FileNotFoundError(str(filepath) + ' is not a file!')
+    if ids.column_store.is_column_file(filepath):
+        columns, _ = ids.column_store.load_columns(filepath)
+        labels = columns.pop('label', np.zeros(0, dtype=np.int8))
+        return columns, labels
     with open(filepath) as file:
         featurelist = json.load(file)
     return featurelist['features'], featurelist['labels']
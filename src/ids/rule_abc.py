@@ -20,6 +20,11 @@ class Rule(ABC):
         algorithm’s operation.  These attributes are to be private, defined by
         each child class as needed. As such, this abstract class will not
         provide declarations for these items.
+
+        profile_data: dict of saved working data, as returned by
+        read_profile. If set, prepare loads the working data from it instead
+        of from the profile file, once: it is cleared when it is loaded, so
+        later calls to prepare read the profile file again. Default None.
     """
 
     # use this file as path reference
@@ -36,6 +41,7 @@ class Rule(ABC):
             raise ValueError("profile_id needs to be valid python identifier")
         self.__profile_id = profile_id
         self._is_prepared = False
+        self.profile_data = None
         super().__init__()
 
     @property
@@ -112,18 +118,56 @@ class Rule(ABC):
         {'whitelist': self.whitelist}.
         Deriving classes should set __is_prepared to True, after preparation.
 
+        Rules whose working data can be merged should also accept an
+        "incremental" argument, and implement the "merge" method.
+
         Args:
             canlist: default = None
             A list of CAN packets to analyze. If this argument is present, this
             function should analyze the data accordingly and save it,
             overwriting any existing data for that profile.
             Else, the function should attempt to load saved profile data.
+
+            incremental: default = False
+            If True, fold the analysis of canlist into the existing working
+            data of the profile, instead of overwriting it. This should only
+            take time proportional to the length of canlist.
         Raises:
             FileNotFoundError: If data required, but not found. If data
             not required, this method should not be implemented.
         """
         pass
 
+    def merge(self, other):
+        """Merge working data of another rule of the same class
+        This method should be implemented by rules with working data, so that
+        profiles built from different CAN data (e.g. on different machines)
+        can be combined, as if the rule had been prepared incrementally with
+        the data of both. The merged working data should be saved to this
+        rule's profile.
+
+        Args:
+            other: a prepared rule of the same class.
+        """
+        self._is_prepared = True
+
+    def _load_profile(self):
+        """Load saved working data, converting it back from JSON types
+        Rules should override this if their working data needs converting.
+        """
+        self._load()
+
+    def _fold_start(self, incremental):
+        """Get the working data ready for preparing with new CAN data
+        Resets the working data, or for incremental preparation, loads the
+        saved working data of the profile, if there is any.
+        """
+        if incremental and (self.profile_data is not None or
+                            self.save_path.exists()):
+            self._load_profile()
+        else:
+            self._reset()
+
     def _load(self):
         """Load saved profile state
         This method loads data from a JSON file previously stored by
@@ -139,12 +183,27 @@ class Rule(ABC):
         Raises:
             FileNotFoundError
         """
-        with self.save_path.open() as prof:
-            attr_dict = json.load(prof)
+        if self.profile_data is not None:
+            attr_dict = self.profile_data
+            # Only used once, so it does not hide later changes to the
+            # profile file.
+            self.profile_data = None
+        else:
+            attr_dict = self.read_profile()
         # unpack loaded JSON into class instance
         for name, val in attr_dict.items():
             setattr(self, name, val)
 
+    def read_profile(self):
+        """Read the working data saved by Rule.prepare for the profile
+        Returns:
+            dict of the saved class attributes, {attr_name: data}
+        Raises:
+            FileNotFoundError
+        """
+        with self.save_path.open() as prof:
+            return json.load(prof)
+
     def _save(self, savedata):
         """Helper function to save class data, and automatically create parent
         directories if not existant.
@@ -12,7 +12,6 @@ Notes:
     Test Results are bools representing "is_malicious" for each CAN frame
 """
 import collections
-from statistics import mean, stdev
 
 import numpy as np
 
@@ -39,24 +38,39 @@ class ID_Whitelist(Rule):
         for pak in canlist:
             yield pak['id'] not in self.whitelist
 
-    def prepare(self, canlist=None):
+    def prepare(self, canlist=None, incremental=False):
         """Compile whitelist from CAN data, or import existing profile.
+        Incremental preparation adds the ID's of canlist to the whitelist.
         See Rule.prepare
         """
         if canlist:
-            self._reset()
-            # make new set of valid ID's
-            self.whitelist = set(x['id'] for x in canlist)
-            savedata = {'whitelist': list(self.whitelist)}
-            super()._save(savedata)
+            self._fold_start(incremental)
+            # add to set of valid ID's
+            self.whitelist.update(x['id'] for x in canlist)
+            self._save_profile()
         else:
             # load existing profile data
-            super()._load()
-            # JSON doesn't support sets
-            self.whitelist = set(self.whitelist)
+            self._load_profile()
 
         self._is_prepared = True
 
+    def merge(self, other):
+        """Merge whitelists: the union of both.
+        See Rule.merge
+        """
+        self.whitelist |= other.whitelist
+        self._save_profile()
+        self._is_prepared = True
+
+    def _load_profile(self):
+        super()._load()
+        # JSON doesn't support sets
+        self.whitelist = set(self.whitelist)
+
+    def _save_profile(self):
+        savedata = {'whitelist': list(self.whitelist)}
+        super()._save(savedata)
+
 
 class TimeInterval(Rule):
     """Examines time interval between occurrence of known ID's
@@ -73,26 +87,37 @@ class TimeInterval(Rule):
         coverage: ratio of data held by the indices of valid_bins to data
         observed in histogram.
 
+        max_bins: the most bins a histogram may grow to, when its range is
+        extended to take in new data. Past this, the width of the bins is
+        multiplied until they fit.
+
         Working Data:
         bins: array where each value represents the edge of a bin for the
-        histogram.
+        histogram. The bins of a histogram all have the same width.
+        counts: the number of time intervals in each bin of the histogram.
         valid_bins: a list of integers corresponding to indices of `bins`.
 
     Notes:
         num_bins and num_selections are only valid before prepare() is run.
+        The histograms of incremental preparation and merged profiles keep
+        the bins of the first data seen for each ID, extended with bins of
+        the same width as needed.
     """
 
     def __init__(self, profile_id):
         super().__init__(profile_id)
         self.num_bins = 'auto'
+        self.max_bins = 1000
         self.__coverage = 1.0
         # init empty working data
         self.bins = {}
+        self.counts = {}
         self.valid_bins = collections.defaultdict(set)
 
     def _reset(self):
         """Reset rule's working data"""
         self.bins = {}
+        self.counts = {}
         self.valid_bins = collections.defaultdict(set)
 
     @property
@@ -143,18 +168,23 @@ class TimeInterval(Rule):
             else:
                 yield True
 
-    def prepare(self, canlist=None):
+    def prepare(self, canlist=None, incremental=False):
         """Calculate acceptable delay values
         Working Data:
             bins: list representing ranges to sort time intervals into.
 
+            counts: list of the number of time intervals in each range.
+
             valid_bins: a list of indices, corresponding to `bins` that are
             considered valid time intervals.
 
+        Incremental preparation adds the time intervals of canlist to the
+        histograms of the profile.
         see Rule.prepare
         """
         if canlist:
-            self._reset()
+            self._fold_start(incremental)
+            self._check_mergeable()
             # Sort time intervals by packet ID
             id_delays = collections.defaultdict(list)
             delays = self._delays(canlist)
@@ -163,39 +193,138 @@ class TimeInterval(Rule):
 
             # Make histograms for each ID's delay list
             for can_id, delays in id_delays.items():
-                hist, hist_bins = np.histogram(delays, self.num_bins)
-                # JSON can't handle numpy datatypes
-                self.bins[can_id] = [float(x) for x in hist_bins]
-
-                # Add indicies of the histogram, from largest to smallest,
-                # until a suitable level of data coverage is reached.
-                hist_inds = hist.argsort()  # sorts in order (small to big)
-                valid_bins_coverage = 0.0
-                for ind in reversed(hist_inds):
-                    if valid_bins_coverage >= self.coverage:
-                        break
-                    self.valid_bins[can_id].add(int(ind))
-                    valid_bins_coverage += hist[ind] / sum(hist)
-                # JSON can't handle numpy datatypes
-
-            savedata = {
-                'bins': self.bins,
-                'valid_bins': {x: list(y)
-                               for x, y in self.valid_bins.items()},
-            }
-            super()._save(savedata)
+                if can_id not in self.counts:
+                    hist, hist_bins = np.histogram(delays, self.num_bins)
+                    # JSON can't handle numpy datatypes
+                    self.bins[can_id] = [float(x) for x in hist_bins]
+                    self.counts[can_id] = [int(x) for x in hist]
+                else:
+                    self._extend_bins(can_id, min(delays), max(delays))
+                    hist, _ = np.histogram(delays, self.bins[can_id])
+                    self.counts[can_id] = [
+                        int(x) + y for x, y in zip(hist, self.counts[can_id])
+                    ]
+                self._select_bins(can_id)
+            self._save_profile()
         else:
-            super()._load()
-            # JSON doesn't support python sets
-            # JSON saves all keys as strings
-            self.bins = {int(x): y for x, y in self.bins.items()}
-            self.valid_bins = {
-                int(x): set(y)
-                for x, y in self.valid_bins.items()
-            }
+            self._load_profile()
 
         self._is_prepared = True
 
+    def merge(self, other):
+        """Merge histograms of time intervals, ID by ID.
+        Histograms with the same bins are added exactly. Otherwise, the bins
+        of this rule's histogram are widened and extended to cover the other,
+        and the counts of the other are added by the center of their bins.
+        See Rule.merge
+        """
+        self._check_mergeable()
+        other._check_mergeable()  # pylint: disable=protected-access
+        for can_id, counts in other.counts.items():
+            bins = other.bins[can_id]
+            if can_id not in self.counts:
+                self.bins[can_id] = list(bins)
+                self.counts[can_id] = list(counts)
+            elif self.bins[can_id] == bins:
+                self.counts[can_id] = [
+                    x + y for x, y in zip(self.counts[can_id], counts)
+                ]
+            else:
+                width = (bins[-1] - bins[0]) / (len(bins) - 1)
+                self._coarsen(can_id, width)
+                self._extend_bins(can_id, bins[0], bins[-1])
+                centers = (np.asarray(bins[:-1]) + np.asarray(bins[1:])) / 2
+                hist, _ = np.histogram(centers, self.bins[can_id],
+                                       weights=counts)
+                self.counts[can_id] = [
+                    int(x) + y for x, y in zip(hist, self.counts[can_id])
+                ]
+            self._select_bins(can_id)
+        self._save_profile()
+        self._is_prepared = True
+
+    def _check_mergeable(self):
+        """Raise a ValueError if the working data has no histogram counts."""
+        if self.bins and not self.counts:
+            raise ValueError(
+                'The profile {} was saved without histogram counts, so it '
+                'can not be added to. Prepare it again from CAN data.'.format(
+                    self.profile_id))
+
+    def _select_bins(self, can_id):
+        """Choose the valid bins of an ID from its histogram."""
+        hist = np.asarray(self.counts[can_id])
+        self.valid_bins[can_id] = set()
+        # Add indicies of the histogram, from largest to smallest,
+        # until a suitable level of data coverage is reached.
+        hist_inds = hist.argsort()  # sorts in order (small to big)
+        valid_bins_coverage = 0.0
+        for ind in reversed(hist_inds):
+            if valid_bins_coverage >= self.coverage:
+                break
+            self.valid_bins[can_id].add(int(ind))
+            valid_bins_coverage += hist[ind] / sum(hist)
+
+    def _extend_bins(self, can_id, low, high):
+        """Add bins of the same width to a histogram until it covers the
+        range from low to high. Widen the bins if there would be more than
+        max_bins."""
+        bins = self.bins[can_id]
+        width = (bins[-1] - bins[0]) / (len(bins) - 1)
+        below = max(int(np.ceil((bins[0] - low) / width)), 0)
+        above = max(int(np.ceil((high - bins[-1]) / width)), 0)
+        total = len(bins) - 1 + below + above
+        if total > self.max_bins:
+            self._coarsen(can_id, width * np.ceil(total / self.max_bins))
+            self._extend_bins(can_id, low, high)
+            return
+        self.bins[can_id] = ([bins[0] - width * k
+                              for k in range(below, 0, -1)] + bins +
+                             [bins[-1] + width * k
+                              for k in range(1, above + 1)])
+        self.counts[can_id] = ([0] * below + self.counts[can_id] +
+                               [0] * above)
+
+    def _coarsen(self, can_id, width):
+        """Widen the bins of a histogram to at least width, by merging
+        neighbouring bins."""
+        bins = self.bins[can_id]
+        counts = self.counts[can_id]
+        factor = int(np.ceil(
+            width / ((bins[-1] - bins[0]) / (len(bins) - 1)) - 1e-9))
+        if factor <= 1:
+            return
+        # Pad the histogram with empty bins to a multiple of factor.
+        width = (bins[-1] - bins[0]) / (len(bins) - 1)
+        padding = -len(counts) % factor
+        bins = bins + [bins[-1] + width * k for k in range(1, padding + 1)]
+        counts = counts + [0] * padding
+        self.bins[can_id] = bins[::factor]
+        self.counts[can_id] = [
+            sum(counts[i:i + factor]) for i in range(0, len(counts), factor)
+        ]
+
+    def _load_profile(self):
+        self._reset()
+        super()._load()
+        # JSON doesn't support python sets
+        # JSON saves all keys as strings
+        self.bins = {int(x): y for x, y in self.bins.items()}
+        self.counts = {int(x): y for x, y in self.counts.items()}
+        self.valid_bins = {
+            int(x): set(y)
+            for x, y in self.valid_bins.items()
+        }
+
+    def _save_profile(self):
+        savedata = {
+            'bins': self.bins,
+            'counts': self.counts,
+            'valid_bins': {x: list(y)
+                           for x, y in self.valid_bins.items()},
+        }
+        super()._save(savedata)
+
 
 class MessageFrequency(Rule):
     """Rule to detect DOS attacks
@@ -206,6 +335,13 @@ class MessageFrequency(Rule):
     Attributes:
         time_frame: a float value in seconds, representing the calculation
         window for message frequencies.
+
+        Working Data:
+        frequencies: dict of the acceptable (low, high) frequency range of
+        each ID.
+        moments: dict of the streaming moments of the frequencies of each ID,
+        [count, mean, sum of squared deviations from the mean], which can be
+        merged exactly.
     """
 
     def __init__(self, profile_id):
@@ -215,10 +351,12 @@ class MessageFrequency(Rule):
         super().__init__(profile_id)
         self.time_frame = 1
         self.frequencies = collections.defaultdict(list)
+        self.moments = {}
 
     def _reset(self):
         """Resets rule working data."""
         self.frequencies = collections.defaultdict(list)
+        self.moments = {}
 
     def test(self, canlist):
         """Check that packet occurrence is within acceptable frequencies.
@@ -244,45 +382,110 @@ class MessageFrequency(Rule):
             else:
                 yield True
 
-    def prepare(self, canlist=None):
+    def prepare(self, canlist=None, incremental=False):
         """Create frequency range dictionary
         Frequency dict keys are CAN packet ID's.
         Frequemcy range is Observed range +- Std.Dev. This is stored as a
         tuple.
 
+        Incremental preparation adds the frequencies observed in canlist to
+        the moments of the profile.
+
         if no CAN data provided, load existing profile data.
         see Rule.prepare
         """
         if canlist:
-            self._reset()
-            id_counts = ids.preprocessor.ID_Past(self.time_frame).feed(canlist)
-            for count, pak in zip(id_counts, canlist):
-                can_id = pak['id']
-                self.frequencies[can_id].append(count)
-
-            new_freq = collections.defaultdict(list)
-            for can_id, c_list in self.frequencies.items():
-                if len(c_list) > 1:
-                    c_std = stdev(c_list)
-                    c_mean = mean(c_list)
-                    new_freq[can_id] = (c_mean - 2 * c_std, c_mean + 2 * c_std)
-            self.frequencies = new_freq
-
-            savedata = {
-                'frequencies': self.frequencies,
-                'time_frame': self.time_frame
-            }
-            super()._save(savedata)
+            time_frame = self.time_frame
+            self._fold_start(incremental)
+            self._check_mergeable(time_frame)
+            id_counts = np.fromiter(
+                ids.preprocessor.ID_Past(self.time_frame).feed(canlist),
+                dtype=np.float64, count=len(canlist))
+            can_ids, inverse = np.unique([x['id'] for x in canlist],
+                                         return_inverse=True)
+            # Moments of the frequencies of each ID in canlist
+            num = np.bincount(inverse)
+            means = np.bincount(inverse, id_counts) / num
+            sq_devs = np.bincount(inverse, (id_counts - means[inverse])**2)
+            for can_id, moments in zip(can_ids.tolist(),
+                                       zip(num.tolist(), means.tolist(),
+                                           sq_devs.tolist())):
+                self._add_moments(can_id, moments)
+            self._update_frequencies()
+            self._save_profile()
         else:
-            super()._load()
-            # JSON saves all keys as strings
-            self.frequencies = {
-                int(x): tuple(y)
-                for x, y in self.frequencies.items()
-            }
+            self._load_profile()
 
         self._is_prepared = True
 
+    def merge(self, other):
+        """Merge the streaming moments of the frequencies of each ID.
+        See Rule.merge
+        """
+        other._check_mergeable(other.time_frame)  # pylint: disable=protected-access
+        self._check_mergeable(other.time_frame)
+        for can_id, moments in other.moments.items():
+            self._add_moments(can_id, moments)
+        self._update_frequencies()
+        self._save_profile()
+        self._is_prepared = True
+
+    def _check_mergeable(self, time_frame):
+        """Raise a ValueError if the working data can't be added to with
+        frequencies over time_frame."""
+        if self.frequencies and not self.moments:
+            raise ValueError(
+                'The profile {} was saved without frequency moments, so it '
+                'can not be added to. Prepare it again from CAN data.'.format(
+                    self.profile_id))
+        if self.moments and time_frame != self.time_frame:
+            raise ValueError(
+                'Frequencies over {}s can not be merged with frequencies over '
+                '{}s.'.format(time_frame, self.time_frame))
+        self.time_frame = time_frame
+
+    def _add_moments(self, can_id, moments):
+        """Combine moments [count, mean, squared deviations] into the
+        moments of an ID (Chan et al.'s parallel algorithm)."""
+        if can_id not in self.moments:
+            self.moments[can_id] = list(moments)
+            return
+        num_a, mean_a, sq_dev_a = self.moments[can_id]
+        num_b, mean_b, sq_dev_b = moments
+        num = num_a + num_b
+        delta = mean_b - mean_a
+        self.moments[can_id] = [
+            num, mean_a + delta * num_b / num,
+            sq_dev_a + sq_dev_b + delta**2 * num_a * num_b / num
+        ]
+
+    def _update_frequencies(self):
+        """Calculate the frequency ranges from the moments."""
+        new_freq = collections.defaultdict(list)
+        for can_id, (num, c_mean, sq_dev) in self.moments.items():
+            if num > 1:
+                c_std = (sq_dev / (num - 1))**0.5
+                new_freq[can_id] = (c_mean - 2 * c_std, c_mean + 2 * c_std)
+        self.frequencies = new_freq
+
+    def _load_profile(self):
+        self._reset()
+        super()._load()
+        # JSON saves all keys as strings
+        self.frequencies = {
+            int(x): tuple(y)
+            for x, y in self.frequencies.items()
+        }
+        self.moments = {int(x): y for x, y in self.moments.items()}
+
+    def _save_profile(self):
+        savedata = {
+            'frequencies': self.frequencies,
+            'moments': self.moments,
+            'time_frame': self.time_frame
+        }
+        super()._save(savedata)
+
 
 class MessageSequence(Rule):
     """Examines sequences of CAN packet ID's
@@ -334,32 +537,58 @@ class MessageSequence(Rule):
                 seq.pop()
                 yield True
 
-    def prepare(self, canlist=None):
+    def prepare(self, canlist=None, incremental=False):
         """Create set of allowed sequences
         The set will be represented as a python set containing tuples.
+        Incremental preparation adds the sequences of canlist to the set.
         """
         if canlist:
-            self._reset()
+            length = self.length
+            self._fold_start(incremental)
+            if self.sequences and length != self.length:
+                raise ValueError(
+                    'Sequences of {} can not be added to sequences of {}.'.
+                    format(length, self.length))
+            self.length = length
             for ii, _ in enumerate(canlist):
                 if ii < self.length:
                     continue
                 seq = tuple(canlist[ii - x]['id']
                             for x in reversed(range(0, self.length)))
                 self.sequences.add(seq)
-
-            savedata = {
-                # can't save a set with JSON
-                'sequences': list(self.sequences),
-                'length': self.length
-            }
-            super()._save(savedata)
+            self._save_profile()
         else:
-            super()._load()
-            # set lookups are much faster than lists: O(1) vs O(n)
-            self.sequences = set(tuple(x) for x in self.sequences)
+            self._load_profile()
+
+        self._is_prepared = True
 
+    def merge(self, other):
+        """Merge sets of sequences: the union of both.
+        See Rule.merge
+        """
+        if self.sequences and other.sequences and self.length != other.length:
+            raise ValueError(
+                'Sequences of {} can not be merged with sequences of {}.'.
+                format(other.length, self.length))
+        if other.sequences:
+            self.length = other.length
+        self.sequences |= other.sequences
+        self._save_profile()
         self._is_prepared = True
 
+    def _load_profile(self):
+        super()._load()
+        # set lookups are much faster than lists: O(1) vs O(n)
+        self.sequences = set(tuple(x) for x in self.sequences)
+
+    def _save_profile(self):
+        savedata = {
+            # can't save a set with JSON
+            'sequences': list(self.sequences),
+            'length': self.length
+        }
+        super()._save(savedata)
+
 
 ROSTER = {
     'ID_Whitelist': ID_Whitelist,
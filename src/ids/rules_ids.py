@@ -9,28 +9,81 @@ Notes:
     The rule implementations are being imported from a separate module to allow
     for easy plug-in ability for rules. Note that this allows for execution of
     arbitrary code.
+
+    A frame is malicious if any rule fails it, so the order the rules are
+    tested in only changes how long it takes, and which failing rule is
+    reported. RulesIDS.test can order the rules adaptively (see RULE_ORDERS),
+    so the rules most likely to fail a frame for the least time are tested
+    first.
 """
 
 import ids.rules
 import ids.rule_abc
 import collections.abc
+import inspect
+import time
+from ids.instrumentation import Profiler
+
+# How RulesIDS.test orders the rules:
+# - 'fixed': the order of the roster. This is the default, and the fastest
+#   when the roster already lists the cheap, often failing rules first.
+# - 'adaptive': by the cost and rejection rate of each rule, measured while
+#   testing frames. The first failing rule in that order is reported, so it
+#   can depend on the timing of the rules. Only faster than 'fixed' when the
+#   order of the roster is poor for the traffic.
+# - 'canonical': adaptively, but the rules that come earlier in the roster
+#   are still tested whenever a frame fails, so the rule reported is the same
+#   as with 'fixed'. It never tests fewer rules than 'fixed', and is slower
+#   than it because of the bookkeeping.
+RULE_ORDERS = ('fixed', 'adaptive', 'canonical')
 
 
 class RulesIDS:
-    """Examine CAN packets according to a set of rules."""
+    """Examine CAN packets according to a set of rules.
+
+    Attributes:
+        profiler: an instrumentation.Profiler. While it is enabled, the time
+        taken by each rule is recorded as a span named 'rule.<name>'.
+        rule_order: how test orders the rules, one of RULE_ORDERS.
+        reorder_interval: the number of frames tested between reorderings of
+        the rules, when the order is adaptive.
+    """
 
-    def __init__(self, profile_id=None):
+    # The cost of a rule is timed on one in this many frames, so timing does
+    # not cost more than it saves.
+    COST_SAMPLE_INTERVAL = 8
+    # The weight kept by the statistics of the rules each time they are
+    # reordered, so the order follows changes in the traffic.
+    STATISTICS_DECAY = 0.5
+
+    def __init__(self, profile_id=None, rule_order='fixed',
+                 reorder_interval=4096):
         """Init IDS
         """
+        if rule_order not in RULE_ORDERS:
+            raise ValueError('{} is not a valid rule order.'.format(
+                rule_order))
         self.profile_id = profile_id
         self.roster = ids.rules.ROSTER
         self.__is_prepared = False
+        self.profiler = Profiler()
+        self.rule_order = rule_order
+        self.reorder_interval = reorder_interval
 
     @property
     def is_prepared(self):
         return self.__is_prepared
     # is_prepared does not have a setter
 
+    @property
+    def roster(self):
+        return self.__roster
+
+    @roster.setter
+    def roster(self, val):
+        self.__roster = val
+        self.reset_statistics()
+
     @property
     def profile_id(self):
         return self.__profile_id
@@ -40,7 +93,11 @@ class RulesIDS:
         self.__is_prepared = False
         self.__profile_id = val
 
-    def prepare(self, canlist=None, set_profile_id=None):
+    def prepare(self,
+                canlist=None,
+                set_profile_id=None,
+                profile_data=None,
+                incremental=False):
         """Prepare rule heuristics with working data
         Some rules require whitelists or other such data for their operation.
         This function will instantiate the classes provided in self.roster, and
@@ -57,6 +114,16 @@ class RulesIDS:
             be set in __init__, through direct assignment, or as an argument in
             this call.
 
+            profile_data (optional): dict of the saved working data of each
+            rule, as returned by read_profile_data. If set, and canlist is
+            not, the rules load their working data from it instead of from
+            the profile files.
+
+            incremental (optional): if True, the analysis of canlist is
+            folded into the existing profile data instead of replacing it,
+            in time proportional to the length of canlist. Rules that do not
+            support incremental preparation are prepared from canlist alone.
+
         Raises:
             ValueError: when profile_id is not set
             ValueError: when a value in self.roster is not a Rule
@@ -77,13 +144,20 @@ class RulesIDS:
             if not isinstance(rule, ids.rule_abc.Rule):
                 rule = rule(self.profile_id)
             rule.profile_id = self.profile_id
-            rule.prepare(canlist)
+            if profile_data is not None and not canlist:
+                rule.profile_data = profile_data.get(name)
+            if incremental and canlist and _accepts_incremental(rule):
+                rule.prepare(canlist, incremental=True)
+            else:
+                rule.prepare(canlist)
             new_roster[name] = rule
         self.roster = new_roster
         self.__is_prepared = True
 
     def test(self, can_frame):
         """Examine single CAN packet according to rules in the roster
+        The rules are tested in the order given by self.rule_order.
+
         Args:
             can_frame: a single CAN packet
 
@@ -102,13 +176,169 @@ class RulesIDS:
         if not isinstance(can_frame, collections.abc.Mapping):
             raise TypeError('can_frame must be like a dictionary')
 
-        for name, rule in self.roster.items():
-            # Each rule is a generator yielding booleans for a list sent in.
-            result = next(rule.test([can_frame]))
+        profiler = self.profiler
+        if self.rule_order == 'fixed':
+            for name, rule in self.roster.items():
+                start = profiler.start()
+                # Each rule is a generator yielding booleans for a list sent
+                # in.
+                result = next(rule.test([can_frame]))
+                profiler.stop('rule.' + name, start)
+                if result:
+                    return True, name
+            return False, None
+
+        entries = self.__entries
+        if len(entries) != len(self.roster):
+            # Rules were added to or removed from the roster.
+            self.reset_statistics()
+            entries = self.__entries
+        if self.__frames_tested >= self.reorder_interval:
+            self.reorder()
+            entries = self.__entries
+        self.__frames_tested += 1
+        if self.__frames_tested % self.COST_SAMPLE_INTERVAL == 0:
+            return self.__test_timed(can_frame)
+
+        frame = [can_frame]
+        for position, (name, rule) in enumerate(entries):
+            start = profiler.start()
+            result = next(rule.test(frame))
+            profiler.stop('rule.' + name, start)
             if result:
-                return True, name
+                return self.__rejected(position, frame)
         return False, None
 
+    def __test_timed(self, can_frame):
+        """test, timing the cost of each rule tested"""
+        profiler = self.profiler
+        frame = [can_frame]
+        for position, (name, rule) in enumerate(self.__entries):
+            start = profiler.start()
+            timer = time.perf_counter_ns()
+            result = next(rule.test(frame))
+            stats = self.__statistics[name]
+            stats[3] += time.perf_counter_ns() - timer
+            stats[2] += 1
+            profiler.stop('rule.' + name, start)
+            if result:
+                return self.__rejected(position, frame)
+        return False, None
+
+    def __rejected(self, position, frame):
+        """Count a frame rejected by the rule at position in the order rules
+        are tested, and find the rule to report"""
+        self.__rejections[position] += 1
+        if self.rule_order == 'canonical':
+            # Rules that come first in the roster, but have not been tested
+            # yet, take precedence.
+            profiler = self.profiler
+            for name, rule in self.__earlier[position]:
+                start = profiler.start()
+                result = next(rule.test(frame))
+                profiler.stop('rule.' + name, start)
+                stats = self.__statistics[name]
+                stats[0] += 1
+                if result:
+                    stats[1] += 1
+                    return True, name
+        return True, self.__entries[position][0]
+
+    def reorder(self):
+        """Reorder the rules tested by test to minimize the expected time
+        taken per frame
+        Rules are sorted by their mean cost over their rejection rate, which
+        is the best order for rules that fail frames independently of each
+        other. The statistics are then decayed, so later traffic outweighs
+        earlier traffic.
+
+        Returns:
+            list of the names of the rules, in the order they are tested.
+        """
+        statistics = self.__current_statistics()
+
+        def expected_cost(name):
+            tested, rejected, timed, nanoseconds = statistics[name]
+            # Untimed rules cost nothing, so they are tested and timed soon.
+            cost = nanoseconds / timed if timed else 0.0
+            # Laplace smoothing keeps rules that never failed a frame in the
+            # running.
+            return cost * (tested + 2) / (rejected + 1)
+
+        self.__statistics = {
+            name: [x * self.STATISTICS_DECAY for x in stats]
+            for name, stats in statistics.items()
+        }
+        self.__set_order(
+            sorted(self.__order,
+                   key=lambda x: (expected_cost(x), self.__ranks[x])))
+        return list(self.__order)
+
+    def reset_statistics(self):
+        """Forget the statistics of the rules, and test them in the order of
+        the roster again"""
+        self.__ranks = {name: rank for rank, name in enumerate(self.roster)}
+        # [tested, rejected, timed, nanoseconds timed] for each rule
+        self.__statistics = {name: [0, 0, 0, 0] for name in self.roster}
+        self.__set_order(list(self.roster))
+
+    def __set_order(self, order):
+        """Test the rules in order from now on"""
+        ranks = self.__ranks
+        self.__order = order
+        self.__entries = [(name, self.roster[name]) for name in order]
+        # The rules that come before each rule in the roster, but after it in
+        # order, in the order of the roster.
+        self.__earlier = [[(x, self.roster[x])
+                           for x in sorted(order[position + 1:],
+                                           key=ranks.get)
+                           if ranks[x] < ranks[name]]
+                          for position, name in enumerate(order)]
+        # The frames tested since the order was set, and the number of them
+        # rejected by the rule at each position. The rule at a position is
+        # tested on every frame not rejected before it.
+        self.__frames_tested = 0
+        self.__rejections = [0] * len(order)
+
+    def __current_statistics(self):
+        """The statistics of each rule, including the frames tested since
+        the order was set"""
+        statistics = {}
+        remaining = self.__frames_tested
+        for name, rejected in zip(self.__order, self.__rejections):
+            tested, total_rejected, timed, nanoseconds = \
+                self.__statistics[name]
+            statistics[name] = [
+                tested + remaining, total_rejected + rejected, timed,
+                nanoseconds
+            ]
+            remaining -= rejected
+        return statistics
+
+    def rule_statistics(self):
+        """The statistics test keeps of each rule, when the rule order is
+        adaptive
+        The statistics are decayed each time the rules are reordered, so they
+        are weighted averages rather than exact counts.
+
+        Returns:
+            dict {rule name: dict} of the 'position' of the rule in the order
+            the rules are tested in, and its 'tested' and 'rejected' frame
+            counts, 'rejection_rate' and 'mean_cost_ns'.
+        """
+        statistics = {}
+        current = self.__current_statistics()
+        for position, name in enumerate(self.__order):
+            tested, rejected, timed, nanoseconds = current[name]
+            statistics[name] = {
+                'position': position,
+                'tested': tested,
+                'rejected': rejected,
+                'rejection_rate': rejected / tested if tested else 0.0,
+                'mean_cost_ns': nanoseconds / timed if timed else None
+            }
+        return statistics
+
     def test_series(self, canlist):
         """Examine list of CAN packets according to rules in the roster
         Args:
@@ -135,13 +365,100 @@ class RulesIDS:
             for name, rule in self.roster.items()
         }
 
+        profiler = self.profiler
+        span_names = {name: 'rule.' + name for name in results}
         for _ in canlist:
             yielded = False
             for name, rule in results.items():
+                start = profiler.start()
                 # next() returns next generator item
-                if next(rule):
+                result = next(rule)
+                profiler.stop(span_names[name], start)
+                if result:
                     yielded = True
                     yield True, name
                     break
             if not yielded:
                 yield False, None
+
+    def read_profile_data(self):
+        """Read the saved working data of every rule in the roster
+        The working data can be passed to prepare, to prepare rules for the
+        same profile without reading the profile files again, for example in
+        another process.
+
+        Returns:
+            dict {rule name: saved working data}, for every rule that has
+            saved working data for self.profile_id.
+
+        Raises:
+            ValueError: when profile_id is not set
+        """
+        if not self.profile_id:
+            raise ValueError("IDS Profile not set")
+        profile_data = {}
+        for name, rule in self.roster.items():
+            if not isinstance(rule, ids.rule_abc.Rule):
+                rule = rule(self.profile_id)
+            rule.profile_id = self.profile_id
+            if rule.save_path.exists():
+                profile_data[name] = rule.read_profile()
+        return profile_data
+
+    def merge(self, other):
+        """Merge the working data of another RulesIDS into this one
+        Each rule merges the working data of the rule with the same name in
+        other, and saves the result to this profile. Rules that are not
+        prepared yet start from empty working data, so merging several
+        profiles into a new profile combines them.
+
+        Args:
+            other: a prepared RulesIDS, e.g. for a profile built from CAN
+            data collected on another machine.
+
+        Raises:
+            ValueError: when profile_id is not set, or other is not prepared.
+        """
+        if not self.profile_id:
+            raise ValueError("IDS Profile not set")
+        if not other.is_prepared:
+            raise ValueError("Rules are not prepared.")
+        new_roster = {}
+        for name, rule in self.roster.items():
+            if not isinstance(rule, ids.rule_abc.Rule):
+                rule = rule(self.profile_id)
+            if rule.profile_id != self.profile_id:
+                rule.profile_id = self.profile_id
+            if name in other.roster:
+                rule.merge(other.roster[name])
+            new_roster[name] = rule
+        self.roster = new_roster
+        self.__is_prepared = True
+
+
+def merge_profiles(profile_ids, merged_profile_id, roster=None):
+    """Merge saved rule profiles into a new profile
+    Args:
+        profile_ids: list of the profiles to merge.
+        merged_profile_id: the profile to save the merged working data to.
+        roster (optional): the roster of rules to merge. Default is
+        ids.rules.ROSTER.
+
+    Returns:
+        The RulesIDS of the merged profile, prepared.
+    """
+    if roster is None:
+        roster = ids.rules.ROSTER
+    merged = RulesIDS(merged_profile_id)
+    merged.roster = roster
+    for profile_id in profile_ids:
+        rules = RulesIDS(profile_id)
+        rules.roster = roster
+        rules.prepare()
+        merged.merge(rules)
+    return merged
+
+
+def _accepts_incremental(rule):
+    """Whether the prepare method of a rule takes the incremental argument"""
+    return 'incremental' in inspect.signature(rule.prepare).parameters
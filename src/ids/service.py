@@ -0,0 +1,465 @@
+"""Live Detection Service
+A headless service that judges CAN frames as they arrive, instead of running
+the Qt simulation over a pre-loaded file.
+
+Frames are sent to the service over a Unix domain socket or UDP, as packed
+binary records (see RECORD_DTYPE). The service queues them, judges them with
+TwoStageIDS.judge_batch in micro-batches, and pushes the verdicts of every
+batch to its subscribers. A replay client streams any capture file to the
+service at real-time or accelerated speed, standing in for the bus.
+
+The service keeps count of the frames it could not keep up with:
+- dropped: frames thrown away because the queue was full.
+- lost: frames that never arrived, found from gaps in the sequence numbers
+  of each sender.
+- late: frames whose verdict came more than late_after seconds after they
+  were received.
+
+Usage:
+    python -m ids.service serve --dnn-dir DIR --rules-profile PROFILE
+        --idprobs FILE --unix /tmp/ids.sock --verdicts /tmp/ids-verdicts.sock
+    python -m ids.service replay capture.traffic --unix /tmp/ids.sock
+        --speed 10
+
+Functions:
+encode_frames -- Pack a columnar canlist into binary records.
+decode_frames -- Unpack binary records into a structured array.
+replay -- Stream a capture file to a running service.
+
+Classes:
+DetectionService -- Judge frames received over a socket in micro-batches.
+"""
+
+import argparse
+import asyncio
+import collections
+import json
+import time
+
+import numpy as np
+
+import ids.preprocessor as dp
+from ids.instrumentation import LatencyHistogram
+
+# The binary record of one frame: a per-sender sequence number, the timestamp
+# in 0.1ms units, the ID, the DLC and 8 data bytes. 23 bytes, little-endian.
+RECORD_DTYPE = np.dtype([('seq', '<u4'), ('timestamp', '<i8'), ('id', '<u2'),
+                         ('dlc', 'u1'), ('data', 'u1', (8, ))])
+# Sequence numbers wrap around to 0 after SEQ_MODULUS - 1.
+SEQ_MODULUS = 2**32
+# Records per UDP datagram, to stay under a typical MTU.
+UDP_RECORDS = 60
+
+
+def encode_frames(columns, first_seq=0):
+    """Pack a columnar canlist into binary records, numbered from
+    first_seq."""
+    length = len(columns['id'])
+    records = np.empty(length, dtype=RECORD_DTYPE)
+    records['seq'] = np.arange(first_seq, first_seq + length) % SEQ_MODULUS
+    records['timestamp'] = columns['timestamp']
+    records['id'] = columns['id']
+    records['dlc'] = np.minimum(columns['dlc'], 8)
+    records['data'] = columns['data']
+    return records.tobytes()
+
+
+def decode_frames(buffer):
+    """Unpack binary records into a structured array of RECORD_DTYPE.
+
+    Raises:
+    ValueError -- The buffer does not hold a whole number of records.
+    """
+    if len(buffer) % RECORD_DTYPE.itemsize:
+        raise ValueError('The buffer does not hold a whole number of '
+                         'records.')
+    return np.frombuffer(buffer, dtype=RECORD_DTYPE)
+
+
+class DetectionService:
+    """Judge frames received over a socket in micro-batches.
+
+    Usage:
+        >>> service = DetectionService(two_stage_ids)
+        >>> verdicts = service.subscribe()
+        >>> await service.serve_unix('/tmp/ids.sock')
+        >>> asyncio.ensure_future(service.run())
+        >>> batch = await verdicts.get()
+    """
+
+    def __init__(self,
+                 ids,
+                 max_batch=4096,
+                 batch_timeout=0.002,
+                 queue_size=2**16,
+                 late_after=0.1):
+        """Arguments:
+        ids -- The TwoStageIDS to judge frames with, in a simulation. Any
+        object with a compatible judge_batch method will do.
+        max_batch -- The most frames judged in one batch.
+        batch_timeout -- Seconds to wait for a batch to fill up once frames
+        are waiting, trading latency for larger batches.
+        queue_size -- The most frames waiting to be judged. Frames that
+        arrive when the queue is full are dropped.
+        late_after -- Seconds after which a verdict counts as late.
+        """
+        self.ids = ids
+        self.max_batch = max_batch
+        self.batch_timeout = batch_timeout
+        self.queue_size = queue_size
+        self.late_after = late_after
+        # Ingest-to-verdict latency, including the time spent queued.
+        self.latency = LatencyHistogram()
+
+        self._queue = collections.deque()  # (records, received) chunks
+        self._queued = 0
+        self._ready = asyncio.Event()
+        self._next_seq = {}  # sender -> next expected sequence number
+        self._subscribers = []
+        self._servers = []
+        self._running = False
+        self._counters = dict.fromkeys([
+            'received', 'judged', 'dropped', 'lost', 'late', 'batches',
+            'subscriber_drops'
+        ], 0)
+
+    def subscribe(self, maxsize=256):
+        """Return an asyncio.Queue that receives the verdicts of every batch
+        judged from now on, as a list of dictionaries {'seq', 'timestamp',
+        'id', 'malicious', 'rule', 'confidence'}. Batches are dropped for a
+        subscriber whose queue is full."""
+        queue = asyncio.Queue(maxsize)
+        self._subscribers.append(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        """Stop sending verdicts to a queue returned by subscribe."""
+        self._subscribers.remove(queue)
+
+    def stats(self):
+        """Return the counters of the service, the number of frames waiting
+        to be judged, and the ingest-to-verdict latency summary."""
+        return dict(self._counters,
+                    queued=self._queued,
+                    latency=self.latency.summary())
+
+    def ingest(self, records, sender=None):
+        """Queue decoded records from a sender for judging."""
+        received = time.perf_counter_ns()
+        count = len(records)
+        if not count:
+            return
+        self._counters['received'] += count
+        self._count_lost(records['seq'], sender)
+
+        room = self.queue_size - self._queued
+        if count > room:
+            self._counters['dropped'] += count - room
+            records = records[:max(room, 0)]
+        if len(records):
+            self._queue.append((records, received))
+            self._queued += len(records)
+            self._ready.set()
+
+    def _count_lost(self, seqs, sender):
+        # Sequence numbers wrap around at 2**32, so gaps are taken modulo
+        # 2**32, and gaps of half the range or more are frames arriving out
+        # of order rather than lost frames.
+        expected = self._next_seq.get(sender)
+        seqs = seqs.astype(np.int64)
+        if expected is not None:
+            seqs = np.concatenate([[expected - 1], seqs])
+        gaps = np.diff(seqs) % SEQ_MODULUS
+        skipped = gaps[(gaps > 1) & (gaps < SEQ_MODULUS // 2)]
+        self._counters['lost'] += int(skipped.sum() - len(skipped))
+        next_seq = (int(seqs[-1]) + 1) % SEQ_MODULUS
+        if expected is None or \
+                (next_seq - expected) % SEQ_MODULUS < SEQ_MODULUS // 2:
+            # Late frames do not move the expected number back.
+            self._next_seq[sender] = next_seq
+
+    def _next_batch(self):
+        """Take up to max_batch queued frames, as records and the time each
+        was received."""
+        chunks, receipts, size = [], [], 0
+        while self._queue and size < self.max_batch:
+            records, received = self._queue.popleft()
+            if size + len(records) > self.max_batch:
+                rest = records[self.max_batch - size:]
+                records = records[:self.max_batch - size]
+                self._queue.appendleft((rest, received))
+            chunks.append(records)
+            receipts.append(np.full(len(records), received, dtype=np.int64))
+            size += len(records)
+        self._queued -= size
+        if not self._queue:
+            self._ready.clear()
+        return np.concatenate(chunks), np.concatenate(receipts)
+
+    def judge_next_batch(self):
+        """Judge the next batch of queued frames and push the verdicts to the
+        subscribers. Returns the number of frames judged."""
+        if not self._queued:
+            return 0
+        records, received = self._next_batch()
+        columns = {
+            'timestamp': records['timestamp'].astype(np.int64),
+            'id': records['id'].astype(np.int32),
+            'dlc': records['dlc'],
+            'data': records['data']
+        }
+        frames = dp.columns_to_canlist(columns)
+        results = self.ids.judge_batch(frames, received)
+
+        latencies = time.perf_counter_ns() - received
+        self.latency.record_many(latencies)
+        self._counters['late'] += int(
+            np.count_nonzero(latencies > self.late_after * 1e9))
+        self._counters['judged'] += len(frames)
+        self._counters['batches'] += 1
+
+        if self._subscribers:
+            verdicts = [{
+                'seq': seq,
+                'timestamp': frame['timestamp'],
+                'id': frame['id'],
+                'malicious': result[0],
+                'rule': result[1] if isinstance(result[1], str) else None,
+                'confidence': None if isinstance(result[1], str) else
+                result[1]
+            } for seq, frame, result in zip(records['seq'].tolist(), frames,
+                                            results)]
+            for queue in self._subscribers:
+                try:
+                    queue.put_nowait(verdicts)
+                except asyncio.QueueFull:
+                    self._counters['subscriber_drops'] += 1
+        return len(frames)
+
+    async def run(self):
+        """Judge queued frames until stop is called."""
+        self._running = True
+        while self._running:
+            await self._ready.wait()
+            if self._queued < self.max_batch and self.batch_timeout:
+                # Let more frames arrive before judging.
+                await asyncio.sleep(self.batch_timeout)
+            self.judge_next_batch()
+            # Judging blocks the event loop, so give the readers a turn.
+            await asyncio.sleep(0)
+
+    async def stop(self):
+        """Stop judging and close the servers. Frames still queued are left
+        unjudged."""
+        self._running = False
+        self._ready.set()
+        for server in self._servers:
+            server.close()
+            if hasattr(server, 'wait_closed'):
+                await server.wait_closed()
+        self._servers = []
+
+    async def serve_unix(self, path):
+        """Start accepting frames on a Unix domain stream socket at path."""
+
+        async def handle(reader, writer):
+            sender = object()
+            pending = b''
+            size = RECORD_DTYPE.itemsize
+            try:
+                while True:
+                    data = await reader.read(2**16)
+                    if not data:
+                        break
+                    pending += data
+                    whole = len(pending) - len(pending) % size
+                    self.ingest(decode_frames(pending[:whole]), sender)
+                    pending = pending[whole:]
+            finally:
+                # Each connection is a new sender, so forget its sequence
+                # numbers once it is gone.
+                self._next_seq.pop(sender, None)
+                writer.close()
+
+        self._servers.append(await asyncio.start_unix_server(handle, path))
+
+    async def serve_udp(self, host, port):
+        """Start accepting frames on a UDP socket. Every datagram must hold a
+        whole number of records."""
+        loop = asyncio.get_running_loop()
+        transport, _ = await loop.create_datagram_endpoint(
+            lambda: _UDPProtocol(self), local_addr=(host, port))
+        self._servers.append(transport)
+
+    async def serve_verdicts_unix(self, path):
+        """Start pushing verdicts to every client that connects to a Unix
+        domain stream socket at path, as one JSON object per line."""
+
+        async def handle(reader, writer):  # pylint: disable=unused-argument
+            queue = self.subscribe()
+            try:
+                while not writer.is_closing():
+                    verdicts = await queue.get()
+                    writer.write(''.join(json.dumps(x) + '\n'
+                                         for x in verdicts).encode())
+                    await writer.drain()
+            except ConnectionError:
+                pass
+            finally:
+                self.unsubscribe(queue)
+                writer.close()
+
+        self._servers.append(await asyncio.start_unix_server(handle, path))
+
+
+class _UDPProtocol(asyncio.DatagramProtocol):
+
+    def __init__(self, service):
+        self.service = service
+
+    def datagram_received(self, data, addr):
+        try:
+            records = decode_frames(data)
+        except ValueError:
+            return
+        self.service.ingest(records, addr)
+
+
+async def replay(filepath, unix_path=None, udp_address=None, speed=1.0):
+    """Stream a capture file to a running service.
+
+    Arguments:
+    filepath -- A CAN frame file, see preprocessor.parse_can_file.
+    unix_path -- The Unix domain socket of the service.
+    udp_address -- The (host, port) of the service, if unix_path is None.
+    speed -- How many times faster than real time to send the frames. If 0,
+    frames are sent as fast as possible.
+
+    Returns the number of frames sent.
+    """
+    columns = dp.canlist_to_columns(dp.parse_can_file(filepath))
+    records = np.frombuffer(encode_frames(columns), dtype=RECORD_DTYPE)
+    size = RECORD_DTYPE.itemsize
+
+    if unix_path is not None:
+        _, writer = await asyncio.open_unix_connection(unix_path)
+
+        async def send(chunk):
+            writer.write(chunk.tobytes())
+            await writer.drain()
+    else:
+        loop = asyncio.get_running_loop()
+        transport, _ = await loop.create_datagram_endpoint(
+            asyncio.DatagramProtocol, remote_addr=udp_address)
+
+        async def send(chunk):
+            data = chunk.tobytes()
+            for i in range(0, len(data), UDP_RECORDS * size):
+                transport.sendto(data[i:i + UDP_RECORDS * size])
+            # Let the datagrams out before sending more.
+            await asyncio.sleep(0)
+
+    timestamps = records['timestamp']
+    sent = 0
+    start = time.perf_counter()
+    while sent < len(records):
+        if speed:
+            # Send every frame that is due by now.
+            now = timestamps[0] + (time.perf_counter() - start) * speed * 1e4
+            due = int(np.searchsorted(timestamps, now, side='right'))
+            if due <= sent:
+                wait = (timestamps[sent] - now) / 1e4 / speed
+                await asyncio.sleep(max(wait, 0.001))
+                continue
+        else:
+            due = min(sent + 4096, len(records))
+        await send(records[sent:due])
+        sent = due
+
+    if unix_path is not None:
+        writer.close()
+    else:
+        transport.close()
+    return sent
+
+
+def _address(text):
+    host, port = text.rsplit(':', 1)
+    return host, int(port)
+
+
+async def _serve(args):
+    # TensorFlow is only needed to serve, not to replay.
+    from ids.two_stage_ids import TwoStageIDS
+
+    two_stage = TwoStageIDS()
+    two_stage.change_ids_parameters('dnn_dir_path', args.dnn_dir)
+    two_stage.change_ids_parameters('rules_profile', args.rules_profile)
+    two_stage.change_ids_parameters('idprobs_path', args.idprobs)
+    two_stage.init_ids()
+    two_stage.start_simulation()
+
+    service = DetectionService(two_stage, args.max_batch, args.batch_timeout,
+                               args.queue_size, args.late_after)
+    if args.unix:
+        await service.serve_unix(args.unix)
+    else:
+        await service.serve_udp(*_address(args.udp))
+    if args.verdicts:
+        await service.serve_verdicts_unix(args.verdicts)
+    runner = asyncio.ensure_future(service.run())
+
+    last_judged = 0
+    while not runner.done():
+        await asyncio.sleep(args.stats_interval)
+        stats = service.stats()
+        rate = (stats['judged'] - last_judged) / args.stats_interval
+        last_judged = stats['judged']
+        print('{:.0f} frames/s, received {received}, judged {judged}, '
+              'dropped {dropped}, lost {lost}, late {late}, p99 {p99:.2f} ms'
+              .format(rate, p99=stats['latency']['p99'] * 1000, **stats),
+              flush=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m ids.service',
+        description='Judge CAN frames received over a socket, or replay a '
+        'capture to a running service.')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    serve = commands.add_parser('serve', help='run the detection service')
+    serve.add_argument('--dnn-dir', required=True)
+    serve.add_argument('--rules-profile', required=True)
+    serve.add_argument('--idprobs', required=True)
+    serve.add_argument('--verdicts', metavar='PATH',
+                       help='Unix socket to push verdicts to as JSON lines')
+    serve.add_argument('--max-batch', type=int, default=4096)
+    serve.add_argument('--batch-timeout', type=float, default=0.002)
+    serve.add_argument('--queue-size', type=int, default=2**16)
+    serve.add_argument('--late-after', type=float, default=0.1)
+    serve.add_argument('--stats-interval', type=float, default=5.0)
+
+    send = commands.add_parser('replay', help='replay a capture file')
+    send.add_argument('filepath')
+    send.add_argument('--speed', type=float, default=1.0,
+                      help='times real time, or 0 for as fast as possible')
+
+    for command in [serve, send]:
+        group = command.add_mutually_exclusive_group(required=True)
+        group.add_argument('--unix', metavar='PATH')
+        group.add_argument('--udp', metavar='HOST:PORT')
+    args = parser.parse_args(argv)
+
+    if args.command == 'serve':
+        asyncio.run(_serve(args))
+    else:
+        sent = asyncio.run(
+            replay(args.filepath, args.unix,
+                   _address(args.udp) if args.udp else None, args.speed))
+        print('Sent {} frames'.format(sent))
+
+
+if __name__ == '__main__':
+    main()
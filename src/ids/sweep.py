@@ -0,0 +1,510 @@
+"""Hyperparameter Sweep
+Train and compare many DNN Based IDS models at once, instead of creating and
+training them one at a time in the GUI. A search space gives the choices for
+each parameter of the DNN, by the names the GUI uses for them (see
+dnn_params):
+
+    {
+        "hidden_units": [[10, 20, 20, 20], [32, 32]],
+        "activation_fn": ["ReLU", "ELU"],
+        "loss_reduction": ["Sum"],
+        "optimizer": [
+            {"name": "Adam Optimizer", "Learning Rate": [0.001, 0.01]},
+            {"name": "Proximal Adagrad Optimizer", "Learning Rate": 0.1,
+             "L1 Regularization Strength": 0.001,
+             "L2 Regularization Strength": 3.0}
+        ]
+    }
+
+An optimizer property may also be a list of choices, and the properties
+that are left out take the defaults of the GUI. The candidates are either
+every combination of the choices (a grid search), or a number of them drawn
+at random.
+
+Every candidate is trained in a pool of worker processes on columnar binary
+feature files (see preprocessor.write_feature_file), with the threads of
+each worker capped so the workers don't compete for the same cores. It is
+then evaluated on a held-out feature file, and the results of every
+candidate are ranked into a leaderboard, written to leaderboard.json and
+leaderboard.csv in the output directory next to the trained models.
+
+Usage:
+    python -m ids.sweep space.json --train a.bin b.bin --eval held_out.bin
+        --output sweep/ --search random --candidates 20 --processes 4
+
+Functions:
+expand_grid -- Every combination of the choices of a search space.
+sample_random -- Candidates drawn at random from a search space.
+score -- The accuracy, precision, recall and F1 score of a set of verdicts.
+rank -- Rank the results of a sweep.
+run_sweep -- Train and evaluate every candidate of a search space.
+"""
+
+import argparse
+import csv
+import itertools
+import json
+import multiprocessing
+import os
+import os.path
+import random
+import time
+
+import numpy as np
+
+import ids.column_store
+
+PARAMETERS = ['hidden_units', 'activation_fn', 'loss_reduction', 'optimizer']
+
+# The default properties of each optimizer, as offered by the GUI.
+OPTIMIZER_DEFAULTS = {
+    'Adadelta Optimizer': {
+        'Learning Rate': 0.001,
+        'Rho': 0.95,
+        'Epsilon': 1e-08
+    },
+    'Adagrad DA Optimizer': {
+        'Learning Rate': 0.001,
+        'Global Step': 0,
+        'Initial Gradient Squared Accumulator Value': 0.1,
+        'L1 Regularization Strength': 0.0,
+        'L2 Regularization Strength': 0.0
+    },
+    'Adagrad Optimizer': {
+        'Learning Rate': 0.001,
+        'Initial Accumulator Value': 0.1
+    },
+    'Adam Optimizer': {
+        'Learning Rate': 0.001,
+        'Beta_1': 0.9,
+        'Beta_2': 0.999,
+        'Epsilon': 1e-08
+    },
+    'FTRL Optimizer': {
+        'Learning Rate': 0.001,
+        'Learning Rate Power': -0.5,
+        'Initial Accumulator Value': 0.1,
+        'L1 Regularization Strength': 0.0,
+        'L2 Regularization Strength': 0.0,
+        'L2 Shrinkage Regularization Strength': 0.0
+    },
+    'Gradient Descent Optimizer': {
+        'Learning Rate': 0.001
+    },
+    'Momentum Optimizer': {
+        'Learning Rate': 0.001,
+        'Momentum': 0
+    },
+    'Proximal Adagrad Optimizer': {
+        'Learning Rate': 0.001,
+        'Initial Accumulator Value': 0.1,
+        'L1 Regularization Strength': 0.0,
+        'L2 Regularization Strength': 0.0
+    },
+    'Proximal Gradient Descent Optimizer': {
+        'Learning Rate': 0.001,
+        'L1 Regularization Strength': 0.0,
+        'L2 Regularization Strength': 0.0
+    },
+    'RMS Prop Optimizer': {
+        'Learning Rate': 0.001,
+        'Decay': 0.9,
+        'Momentum': 0.0,
+        'Centered': False
+    }
+}
+
+# The columns of leaderboard.csv, in order.
+LEADERBOARD_FIELDS = [
+    'rank', 'name', 'accuracy', 'f1', 'precision', 'recall', 'train_seconds',
+    'frames_per_second', 'hidden_units', 'activation_fn', 'loss_reduction',
+    'optimizer', 'optimizer_properties', 'error'
+]
+
+
+def _choices(space, key):
+    """The list of choices for a parameter of the search space."""
+    if key not in space:
+        raise ValueError('The search space has no {} choices.'.format(key))
+    choices = space[key]
+    if not isinstance(choices, list) or not choices:
+        raise ValueError('The {} choices must be a non-empty list.'.format(key))
+    return choices
+
+
+def _optimizer_choices(optimizer):
+    """Every combination of the property choices of an optimizer in the
+    search space.
+
+    Returns a list of pairs (name, properties).
+    """
+    name = optimizer['name']
+    if name not in OPTIMIZER_DEFAULTS:
+        raise ValueError('There is no optimizer named {}.'.format(name))
+    properties = dict(OPTIMIZER_DEFAULTS[name])
+    properties.update({k: v for k, v in optimizer.items() if k != 'name'})
+    keys = sorted(properties)
+    values = [properties[k] if isinstance(properties[k], list)
+              else [properties[k]] for k in keys]
+    return [(name, dict(zip(keys, combination)))
+            for combination in itertools.product(*values)]
+
+
+def _candidate(hidden_units, activation_fn, loss_reduction, optimizer):
+    name, properties = optimizer
+    return {
+        'hidden_units': list(hidden_units),
+        'activation_fn': activation_fn,
+        'loss_reduction': loss_reduction,
+        'optimizer': name,
+        'optimizer_properties': properties
+    }
+
+
+def expand_grid(space):
+    """Every combination of the choices of a search space.
+
+    Arguments:
+    space -- A dictionary of the list of choices of each parameter in
+    PARAMETERS. See the module documentation.
+
+    Returns a list of candidates: dictionaries of the 'hidden_units',
+    'activation_fn', 'loss_reduction', 'optimizer' name and
+    'optimizer_properties' of a DNN.
+
+    Raises:
+    ValueError -- The search space is missing a parameter, or names an
+    optimizer that does not exist.
+    """
+    optimizers = [x for optimizer in _choices(space, 'optimizer')
+                  for x in _optimizer_choices(optimizer)]
+    return [_candidate(*x) for x in itertools.product(
+        _choices(space, 'hidden_units'), _choices(space, 'activation_fn'),
+        _choices(space, 'loss_reduction'), optimizers)]
+
+
+def sample_random(space, num_candidates, seed=None):
+    """Candidates drawn at random from a search space, each choice being
+    equally likely. Unlike a grid search, the number of candidates does not
+    grow with the number of choices.
+
+    Arguments:
+    space -- The search space, as in expand_grid.
+    num_candidates -- The number of candidates to draw. Duplicates are only
+    drawn once the space has fewer distinct candidates than this.
+    seed -- The seed of the draw.
+
+    Returns a list of candidates, as in expand_grid.
+    """
+    rng = random.Random(seed)
+    optimizers = _choices(space, 'optimizer')
+    for optimizer in optimizers:
+        _optimizer_choices(optimizer)
+
+    def draw():
+        optimizer = rng.choice(optimizers)
+        name, properties = _optimizer_choices({
+            k: rng.choice(v) if isinstance(v, list) else v
+            for k, v in optimizer.items()
+        })[0]
+        return _candidate(rng.choice(_choices(space, 'hidden_units')),
+                          rng.choice(_choices(space, 'activation_fn')),
+                          rng.choice(_choices(space, 'loss_reduction')),
+                          (name, properties))
+
+    candidates = []
+    seen = set()
+    # Give up on distinct candidates once the draws stop finding new ones.
+    attempts = 0
+    while len(candidates) < num_candidates:
+        candidate = draw()
+        key = json.dumps(candidate, sort_keys=True)
+        attempts += 1
+        if key not in seen or attempts > 100 * num_candidates:
+            seen.add(key)
+            candidates.append(candidate)
+    return candidates
+
+
+def score(labels, verdicts):
+    """The accuracy, precision, recall and F1 score of a set of verdicts,
+    with malicious frames as the positive class.
+
+    Arguments:
+    labels -- Array of whether each frame is malicious.
+    verdicts -- Array of whether each frame was judged malicious.
+
+    Returns a dictionary of the 'accuracy', 'precision', 'recall' and 'f1'.
+    """
+    labels = np.asarray(labels, dtype=bool)
+    verdicts = np.asarray(verdicts, dtype=bool)
+    true_pos = int(np.count_nonzero(labels & verdicts))
+    false_pos = int(np.count_nonzero(~labels & verdicts))
+    false_neg = int(np.count_nonzero(labels & ~verdicts))
+    precision = true_pos / (true_pos + false_pos) if true_pos + false_pos else 0.0
+    recall = true_pos / (true_pos + false_neg) if true_pos + false_neg else 0.0
+    return {
+        'accuracy': float(np.mean(labels == verdicts)) if len(labels) else 0.0,
+        'precision': precision,
+        'recall': recall,
+        'f1': (2 * precision * recall / (precision + recall)
+               if precision + recall else 0.0)
+    }
+
+
+def rank(results, key='f1'):
+    """Rank the results of a sweep, best first, by key, then accuracy, then
+    the shortest training time. Candidates that failed are ranked last.
+
+    Returns a new list of the results, each with its 'rank' added.
+    """
+    def sort_key(result):
+        if result.get('error'):
+            return (1, 0, 0, 0)
+        return (0, -result[key], -result['accuracy'], result['train_seconds'])
+
+    return [dict(result, rank=i)
+            for i, result in enumerate(sorted(results, key=sort_key), 1)]
+
+
+def _limit_threads(threads):
+    """Cap the number of threads used by the libraries of this process. Has
+    to run before TensorFlow or NumPy start their thread pools."""
+    for var in ['OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS',
+                'TF_NUM_INTRAOP_THREADS']:
+        os.environ[var] = str(threads)
+    os.environ['TF_NUM_INTEROP_THREADS'] = '1'
+    os.environ.setdefault('TF_CPP_MIN_LOG_LEVEL', '2')
+
+
+def train_candidate(candidate, model_dir, train_paths, eval_path, num_steps,
+                    batch_size=128, threads=None):
+    """Train a candidate on feature files and evaluate it on a held-out
+    feature file.
+
+    Arguments:
+    candidate -- The parameters of the DNN, as returned by expand_grid.
+    model_dir -- The directory to save the model to. It must not exist yet.
+    train_paths -- The paths to the columnar binary feature files to train
+    on.
+    eval_path -- The path to the labelled columnar binary feature file to
+    evaluate on.
+    num_steps -- The number of steps to train for.
+    batch_size -- The size of each training batch.
+    threads -- The number of threads TensorFlow may use. Default is
+    TensorFlow's default.
+
+    Returns a dictionary of the candidate, its scores (see score), the
+    'train_seconds' taken, and the 'frames_per_second' judged when
+    evaluating.
+    """
+    # TensorFlow is only imported by the processes that train.
+    import tensorflow as tf
+    from ids.dnn_ids import DNNBasedIDS, dnn_dataset_input_function
+    import ids.dnn_params as params
+
+    config = None
+    if threads:
+        config = tf.estimator.RunConfig(session_config=tf.ConfigProto(
+            intra_op_parallelism_threads=threads,
+            inter_op_parallelism_threads=1))
+    dnn = DNNBasedIDS()
+    dnn.change_param('hidden_units', candidate['hidden_units'])
+    dnn.change_param('activation_fn', params.activation_fn_convert_reverse[
+        candidate['activation_fn']])
+    dnn.change_param('loss_reduction', params.loss_reduction_convert_reverse[
+        candidate['loss_reduction']])
+    dnn.change_param('optimizer', params.construct_optimizer(
+        candidate['optimizer'], candidate['optimizer_properties']))
+    dnn.new_model(model_dir, config)
+
+    start = time.perf_counter()
+    dnn.train(dnn_dataset_input_function(train_paths, batch_size=batch_size,
+                                         shuffle=True),
+              num_steps, train_paths)
+    train_seconds = time.perf_counter() - start
+
+    columns, _ = ids.column_store.load_columns(eval_path)
+    if 'label' not in columns:
+        raise ValueError('{} has no labels to evaluate on.'.format(eval_path))
+    features = {k: v for k, v in columns.items() if k != 'label'}
+    start = time.perf_counter()
+    verdicts = [x[0] for x in dnn.predict_batch(features,
+                                                batch_size=4096)]
+    predict_seconds = time.perf_counter() - start
+
+    return dict(candidate,
+                **score(columns['label'] != 0, verdicts),
+                train_seconds=train_seconds,
+                frames_per_second=(len(verdicts) / predict_seconds
+                                   if predict_seconds else 0.0))
+
+
+def _init_worker(threads):
+    if threads:
+        _limit_threads(threads)
+
+
+def _train_job(job):
+    name, candidate, model_dir, train_paths, eval_path, num_steps, \
+        batch_size, threads = job
+    try:
+        result = train_candidate(candidate, model_dir, train_paths, eval_path,
+                                 num_steps, batch_size, threads)
+    except Exception as exc:  # pylint: disable=broad-except
+        # One bad candidate should not stop the whole sweep.
+        result = dict(candidate,
+                      error='{}: {}'.format(type(exc).__name__, exc))
+    return dict(result, name=name, model_dir=model_dir)
+
+
+def write_leaderboard(results, outdir):
+    """Write ranked results to leaderboard.json and leaderboard.csv in
+    outdir."""
+    os.makedirs(str(outdir), exist_ok=True)
+    with open(os.path.join(str(outdir), 'leaderboard.json'), 'w') as outfile:
+        json.dump(results, outfile, indent=2)
+    with open(os.path.join(str(outdir), 'leaderboard.csv'), 'w',
+              newline='') as outfile:
+        writer = csv.DictWriter(outfile, LEADERBOARD_FIELDS,
+                                extrasaction='ignore')
+        writer.writeheader()
+        for result in results:
+            writer.writerow(dict(
+                result,
+                hidden_units=json.dumps(result['hidden_units']),
+                optimizer_properties=json.dumps(
+                    result['optimizer_properties'], sort_keys=True)))
+
+
+def run_sweep(space,
+              train_paths,
+              eval_path,
+              outdir,
+              search='grid',
+              num_candidates=None,
+              num_steps=1000,
+              batch_size=128,
+              processes=None,
+              threads_per_process=None,
+              seed=None,
+              verbose=False):
+    """Train and evaluate the candidates of a search space across a pool of
+    worker processes, and write the ranked leaderboard.
+
+    Arguments:
+    space -- The search space. See expand_grid.
+    train_paths -- The columnar binary feature files to train on.
+    eval_path -- The labelled columnar binary feature file to evaluate on,
+    which should not be one of train_paths.
+    outdir -- The directory to save the models and leaderboard to. The
+    model of the candidate called name is saved as a model of the GUI would
+    be, to name and name.params.
+    search -- 'grid' to train every combination of the search space, or
+    'random' to train num_candidates drawn at random.
+    num_candidates -- The number of candidates of a random search, or the
+    most candidates of a grid search to train.
+    num_steps -- The number of steps to train each candidate for.
+    batch_size -- The size of each training batch.
+    processes -- The number of candidates trained at once. If None,
+    os.cpu_count().
+    threads_per_process -- The number of threads each worker may use. If
+    None, the cores are split evenly between the workers.
+    seed -- The seed of a random search.
+    verbose -- Print the results as each candidate finishes.
+
+    Returns the ranked results, as written to leaderboard.json.
+
+    Raises:
+    ValueError -- The search is not 'grid' or 'random', or outdir already
+    has a leaderboard.
+    """
+    if search == 'grid':
+        candidates = expand_grid(space)[:num_candidates]
+    elif search == 'random':
+        if not num_candidates:
+            raise ValueError('A random search needs a number of candidates.')
+        candidates = sample_random(space, num_candidates, seed)
+    else:
+        raise ValueError('{} is not a valid search.'.format(search))
+    outdir = os.path.abspath(str(outdir))
+    if os.path.exists(os.path.join(outdir, 'leaderboard.json')):
+        raise ValueError('{} already has a leaderboard.'.format(outdir))
+    os.makedirs(outdir, exist_ok=True)
+
+    train_paths = [os.path.abspath(str(x)) for x in train_paths]
+    eval_path = os.path.abspath(str(eval_path))
+    processes = max(min(processes or os.cpu_count(), len(candidates)), 1)
+    threads = threads_per_process or max(os.cpu_count() // processes, 1)
+    jobs = []
+    for i, candidate in enumerate(candidates):
+        name = 'candidate-{:03d}'.format(i)
+        jobs.append((name, candidate, os.path.join(outdir, name), train_paths,
+                     eval_path, num_steps, batch_size, threads))
+    if verbose:
+        print('{} candidates, {} at a time with {} threads each'.format(
+            len(jobs), processes, threads), flush=True)
+
+    # Workers are spawned rather than forked, so each starts its own
+    # TensorFlow with the capped thread counts.
+    context = multiprocessing.get_context('spawn')
+    results = []
+    with context.Pool(processes, _init_worker, (threads,),
+                      maxtasksperchild=1) as pool:
+        for done, result in enumerate(pool.imap_unordered(_train_job, jobs),
+                                      1):
+            results.append(result)
+            if verbose:
+                print('[{}/{}] {}: {}'.format(
+                    done, len(jobs), result['name'],
+                    result.get('error') or 'F1 {:.4f}, accuracy {:.4f}'.format(
+                        result['f1'], result['accuracy'])), flush=True)
+
+    results = rank(results)
+    write_leaderboard(results, outdir)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m ids.sweep',
+        description='Train and rank DNN Based IDS models over a search '
+        'space of parameters.')
+    parser.add_argument('space', help='JSON file of the search space')
+    parser.add_argument('--train', nargs='+', required=True,
+                        help='feature files to train on')
+    parser.add_argument('--eval', required=True,
+                        help='held-out feature file to evaluate on')
+    parser.add_argument('--output', default='sweep',
+                        help='directory for the models and leaderboard '
+                        '(default: %(default)s)')
+    parser.add_argument('--search', choices=['grid', 'random'],
+                        default='grid')
+    parser.add_argument('--candidates', type=int,
+                        help='candidates of a random search, or the most '
+                        'candidates of a grid search')
+    parser.add_argument('--steps', type=int, default=1000,
+                        help='training steps per candidate')
+    parser.add_argument('--batch-size', type=int, default=128)
+    parser.add_argument('--processes', type=int,
+                        help='candidates trained at once (default: one per '
+                        'CPU)')
+    parser.add_argument('--threads', type=int,
+                        help='threads per process (default: CPUs / '
+                        'processes)')
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args(argv)
+
+    with open(args.space) as file:
+        space = json.load(file)
+    results = run_sweep(space, args.train, args.eval, args.output,
+                        args.search, args.candidates, args.steps,
+                        args.batch_size, args.processes, args.threads,
+                        args.seed, verbose=True)
+    best = results[0]
+    print('Best: {} (F1 {}, accuracy {})'.format(
+        best['name'], best.get('f1'), best.get('accuracy')))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,471 @@
+"""Synthetic CAN Traffic
+Generates CAN bus captures of any length, for testing the parsers, the rule
+profiling and the rest of the pipeline at scale without sharing real vehicle
+logs.
+
+The bus is modelled as a set of periodic messages, each sent by an ECU at its
+own period with some jitter, and a set of event-driven messages that are sent
+at random times. The payload of a periodic message holds a slowly changing
+16-bit signal, a rolling counter and a checksum, like the messages of a real
+vehicle. Arbitration is not modelled: frames are sent at the time they are
+scheduled, so two frames can share a timestamp.
+
+Frames are generated as columnar canlists (see
+preprocessor.canlist_to_columns), one chunk at a time, so captures of any
+length can be written with bounded memory. The writers here build whole
+chunks of lines with NumPy instead of formatting every frame.
+
+Functions:
+write_traffic_file -- Write columnar canlists to a .traffic file.
+write_csv_file -- Write columnar canlists to a CAN frame .csv file.
+write_column_file -- Write columnar canlists to a columnar binary file.
+
+Classes:
+PeriodicMessage -- A message sent at a fixed period.
+EventMessage -- A message sent at random times.
+SyntheticBus -- Generate the traffic of a CAN bus.
+
+Notes:
+    Timestamps are in 0.1 millisecond units, like the rest of the IDS.
+"""
+
+import collections
+import os.path
+
+import numpy as np
+
+import ids.column_store
+import ids.preprocessor as dp
+
+# Timestamp units per second.
+TICKS_PER_SECOND = 10000
+# Bits per second of a high speed CAN bus.
+BITRATE = 500000
+
+PeriodicMessage = collections.namedtuple(
+    'PeriodicMessage',
+    ['id', 'period', 'jitter', 'dlc', 'payload', 'signal', 'counter',
+     'checksum'])
+PeriodicMessage.__doc__ = """A message sent at a fixed period.
+
+Fields:
+id -- The CAN ID of the message.
+period -- The time between two frames of the message, in 0.1ms units.
+jitter -- The largest amount a frame is sent early or late, in 0.1ms units.
+dlc -- The number of data bytes, 1-8.
+payload -- The 8 bytes the payload starts from. Bytes past dlc are unused.
+signal -- Index of the first of two bytes holding a big-endian 16-bit signal
+that changes over time, or None.
+counter -- Index of the byte whose low nibble counts the frames sent, or None.
+checksum -- Index of the byte holding the sum of the other bytes, modulo 256,
+or None.
+"""
+
+EventMessage = collections.namedtuple('EventMessage', ['id', 'rate', 'dlc'])
+EventMessage.__doc__ = """A message sent at random times, with random data.
+
+Fields:
+id -- The CAN ID of the message.
+rate -- The average number of frames sent per second.
+dlc -- The number of data bytes, 1-8.
+"""
+
+# Periods of periodic messages in milliseconds, and how common each one is.
+_PERIODS_MS = [10, 20, 50, 100, 200, 500, 1000]
+_PERIOD_WEIGHTS = [0.15, 0.2, 0.2, 0.2, 0.1, 0.1, 0.05]
+
+
+def frame_bits(dlc):
+    """The number of bits a standard data frame with dlc data bytes takes up
+    on the bus, including the interframe space but not stuff bits."""
+    return 47 + 8 * np.asarray(dlc)
+
+
+class SyntheticBus:
+    """Generate the traffic of a CAN bus.
+
+    Usage:
+        >>> bus = SyntheticBus.random(bus_load=0.4, seed=1)
+        >>> columns = bus.generate(10**6)
+        >>> bus.write('capture.traffic', 10**8)
+    """
+
+    def __init__(self, periodic, events=(), seed=None, start_time=0):
+        """Arguments:
+        periodic -- A list of PeriodicMessages.
+        events -- A list of EventMessages.
+        seed -- Seed for the jitter, phases and event times. If None, fresh
+        entropy is used.
+        start_time -- The timestamp of the start of the capture.
+
+        Raises:
+        ValueError -- Two messages share an ID, or a message has a DLC
+        outside 1-8.
+        """
+        self.periodic = list(periodic)
+        self.events = list(events)
+        self.start_time = start_time
+        all_ids = [x.id for x in self.periodic + self.events]
+        if len(set(all_ids)) != len(all_ids):
+            raise ValueError('Every message must have its own ID.')
+        if any(not 1 <= x.dlc <= 8 for x in self.periodic + self.events):
+            raise ValueError('Every message must have a DLC of 1-8.')
+        # Keep the seed even if it is fresh entropy, so reset can replay it.
+        self.seed = seed if seed is not None else np.random.SeedSequence()
+        self.reset()
+
+    @classmethod
+    def random(cls,
+               num_periodic=50,
+               num_events=10,
+               bus_load=0.3,
+               bitrate=BITRATE,
+               seed=None,
+               start_time=0):
+        """Make a bus of random messages.
+
+        Periods are drawn from the common periods of 10ms to 1s, with lower
+        IDs getting the shorter periods, and then scaled so the bus is
+        bus_load busy.
+
+        Arguments:
+        num_periodic -- The number of periodic messages.
+        num_events -- The number of event-driven messages.
+        bus_load -- The fraction of the bus bandwidth to use, greater than 0
+        and at most 1.
+        bitrate -- The bitrate of the bus in bits per second.
+        seed -- Seed for the messages, and for the traffic of the bus.
+        start_time -- The timestamp of the start of the capture.
+
+        Raises:
+        ValueError -- bus_load is outside (0, 1], or the event messages alone
+        use more than bus_load.
+        """
+        if not 0 < bus_load <= 1:
+            raise ValueError('bus_load must be greater than 0 and at most 1.')
+        seed_seq = np.random.SeedSequence(seed)
+        rng = np.random.default_rng(seed_seq.spawn(1)[0])
+
+        can_ids = rng.choice(np.arange(0x010, 0x7F0),
+                             size=num_periodic + num_events,
+                             replace=False)
+        periodic_ids = np.sort(can_ids[:num_periodic])
+        event_ids = can_ids[num_periodic:]
+        periods = np.sort(rng.choice(_PERIODS_MS, size=num_periodic,
+                                     p=_PERIOD_WEIGHTS)) * 10
+        periodic_dlcs = rng.choice([2, 4, 6, 8, 8, 8], size=num_periodic)
+        event_dlcs = rng.integers(1, 9, size=num_events)
+        rates = rng.uniform(0.1, 10, size=num_events)
+
+        event_load = (rates * frame_bits(event_dlcs)).sum() / bitrate
+        periodic_load = (frame_bits(periodic_dlcs) * TICKS_PER_SECOND /
+                         periods).sum() / bitrate
+        if event_load >= bus_load:
+            raise ValueError('The event messages alone use more than the '
+                             'bus load.')
+        if num_periodic:
+            periods = np.maximum(
+                np.round(periods * periodic_load /
+                         (bus_load - event_load)), 1).astype(np.int64)
+
+        periodic = []
+        for can_id, period, dlc in zip(periodic_ids.tolist(),
+                                       periods.tolist(),
+                                       periodic_dlcs.tolist()):
+            periodic.append(
+                PeriodicMessage(
+                    id=can_id,
+                    period=period,
+                    jitter=int(rng.integers(0, period // 20 + 1)),
+                    dlc=dlc,
+                    payload=rng.integers(0, 256, size=8).tolist(),
+                    signal=0 if dlc >= 4 else None,
+                    counter=dlc - 2 if dlc >= 4 else None,
+                    checksum=dlc - 1 if dlc >= 4 else None))
+        events = [
+            EventMessage(id=can_id, rate=rate, dlc=dlc)
+            for can_id, rate, dlc in zip(event_ids.tolist(), rates.tolist(),
+                                         event_dlcs.tolist())
+        ]
+        return cls(periodic, events, seed_seq.spawn(1)[0], start_time)
+
+    def reset(self):
+        """Go back to the start of the capture, so the next frames generated
+        are the same as the first ones."""
+        self._rng = np.random.default_rng(self.seed)
+        self._time = self.start_time
+        # Offset of the first frame of each periodic message from the start.
+        self._phases = np.array([
+            self._rng.integers(0, x.period) for x in self.periodic
+        ], dtype=np.int64)
+
+    @property
+    def frame_rate(self):
+        """The average number of frames sent per second."""
+        return (sum(TICKS_PER_SECOND / x.period for x in self.periodic) +
+                sum(x.rate for x in self.events))
+
+    def bus_load(self, bitrate=BITRATE):
+        """The average fraction of the bandwidth of the bus that is used."""
+        bits = sum(frame_bits(x.dlc) * TICKS_PER_SECOND / x.period
+                   for x in self.periodic)
+        bits += sum(frame_bits(x.dlc) * x.rate for x in self.events)
+        return float(bits) / bitrate
+
+    def _periodic_frames(self, message, phase, end):
+        """The frames of a periodic message scheduled from the current time
+        up to end."""
+        start = self.start_time + phase
+        first = max(-(-(self._time - start) // message.period), 0)
+        last = max(-(-(end - start) // message.period), first)
+        count = np.arange(first, last, dtype=np.int64)
+        timestamps = start + count * message.period
+        if message.jitter:
+            timestamps += self._rng.integers(-message.jitter,
+                                             message.jitter + 1,
+                                             size=len(count))
+            # Keep frames inside the chunk so chunks stay in order.
+            np.clip(timestamps, self._time, end - 1, out=timestamps)
+
+        data = np.zeros((len(count), 8), dtype=np.uint8)
+        data[:, :message.dlc] = message.payload[:message.dlc]
+        if message.signal is not None:
+            seconds = timestamps / TICKS_PER_SECOND
+            # Each signal moves at its own pace, taken from the ID.
+            signal = 32768 + 30000 * np.sin(
+                seconds * (0.05 + message.id % 97 / 97))
+            signal = signal.astype(np.uint16)
+            data[:, message.signal] = signal >> 8
+            data[:, message.signal + 1] = signal & 0xFF
+        if message.counter is not None:
+            data[:, message.counter] = \
+                (data[:, message.counter] & 0xF0) | (count & 0x0F)
+        if message.checksum is not None:
+            data[:, message.checksum] = 0
+            data[:, message.checksum] = data[:, :message.dlc].sum(
+                axis=1, dtype=np.uint64) & 0xFF
+        return timestamps, data
+
+    def _event_frames(self, message, end):
+        """The frames of an event-driven message sent from the current time
+        up to end."""
+        seconds = (end - self._time) / TICKS_PER_SECOND
+        num_frames = self._rng.poisson(message.rate * seconds)
+        timestamps = self._rng.integers(self._time, end, size=num_frames)
+        data = np.zeros((num_frames, 8), dtype=np.uint8)
+        data[:, :message.dlc] = self._rng.integers(
+            0, 256, size=(num_frames, message.dlc), dtype=np.uint8)
+        return timestamps, data
+
+    def _next_chunk(self, duration):
+        """Generate the frames of the next duration 0.1ms units, sorted by
+        time."""
+        end = self._time + duration
+        parts = []
+        for message, phase in zip(self.periodic, self._phases.tolist()):
+            parts.append((message, ) + self._periodic_frames(
+                message, phase, end))
+        for message in self.events:
+            parts.append((message, ) + self._event_frames(message, end))
+        self._time = end
+
+        none = np.zeros(0, dtype=np.int64)
+        columns = {
+            'timestamp': np.concatenate([x[1] for x in parts] + [none]),
+            'id': np.concatenate([np.full(len(x[1]), x[0].id)
+                                  for x in parts] + [none]),
+            'dlc': np.concatenate([np.full(len(x[1]), x[0].dlc)
+                                   for x in parts] + [none]),
+            'data': np.concatenate([x[2] for x in parts] +
+                                   [np.zeros((0, 8), dtype=np.uint8)])
+        }
+        order = np.argsort(columns['timestamp'], kind='stable')
+        return {
+            k: v[order].astype(dp.COLUMN_DTYPES[k], copy=False)
+            for k, v in columns.items()
+        }
+
+    def chunks(self, num_frames, chunk_size=2**20):
+        """Generate the next num_frames frames of the bus, in columnar
+        canlists of about chunk_size frames each. The jitter and event times
+        are drawn a chunk at a time, so the frames depend on chunk_size as
+        well as the seed.
+
+        Raises:
+        ValueError -- The bus has no messages to send.
+        """
+        if self.frame_rate <= 0:
+            raise ValueError('The bus has no messages to send.')
+        # The time it takes to send chunk_size frames, on average.
+        duration = max(
+            int(chunk_size / self.frame_rate * TICKS_PER_SECOND), 1)
+        remaining = num_frames
+        while remaining > 0:
+            chunk = self._next_chunk(duration)
+            if len(chunk['id']) > remaining:
+                # Cut the chunk between two timestamps and continue from the
+                # cut, so the frames after it are generated again next time
+                # instead of being lost.
+                cut = chunk['timestamp'][remaining]
+                keep = np.searchsorted(chunk['timestamp'], cut)
+                if keep:
+                    self._time = int(cut)
+                else:
+                    keep = remaining
+                chunk = dp.take_columns(chunk, slice(0, keep))
+            remaining -= len(chunk['id'])
+            if len(chunk['id']):
+                yield chunk
+
+    def generate(self, num_frames):
+        """Generate the next num_frames frames of the bus as one columnar
+        canlist."""
+        return dp.concatenate_columns(self.chunks(num_frames))
+
+    def write(self, outfilepath, num_frames, chunk_size=2**20):
+        """Generate the next num_frames frames of the bus and write them to a
+        file, a chunk at a time.
+
+        Arguments:
+        outfilepath -- The file to write. The format is taken from the
+        extension: .traffic, .csv, or anything else for a columnar binary
+        file.
+        num_frames -- The number of frames to write.
+        chunk_size -- The number of frames generated and written at a time.
+        """
+        _, extension = os.path.splitext(str(outfilepath))
+        writer = {
+            '.traffic': write_traffic_file,
+            '.csv': write_csv_file
+        }.get(extension, write_column_file)
+        writer(self.chunks(num_frames, chunk_size), outfilepath)
+
+
+_HEX = np.frombuffer(b'0123456789ABCDEF', dtype=np.uint8)
+
+
+def _hex_chars(values, width):
+    """The upper case hex digits of values, as an (N, width) array of
+    characters."""
+    shifts = 4 * np.arange(width - 1, -1, -1)
+    return _HEX[(np.asarray(values, dtype=np.int64)[:, None] >> shifts)
+                & 0xF]
+
+
+def _dec_chars(values, width):
+    """The zero padded decimal digits of values, as an (N, width) array of
+    characters."""
+    powers = 10**np.arange(width - 1, -1, -1, dtype=np.int64)
+    digits = np.asarray(values, dtype=np.int64)[:, None] // powers % 10
+    return (digits + ord('0')).astype(np.uint8)
+
+
+def _width(values, base):
+    """The number of digits needed to write the largest of values."""
+    largest = int(values.max()) if len(values) else 0
+    return max(len(np.base_repr(largest, base)), 1)
+
+
+def _lines(parts, length):
+    """Join fixed width parts, each bytes or an (N, width) array of
+    characters, into N lines."""
+    arrays = [
+        np.broadcast_to(np.frombuffer(x, dtype=np.uint8), (length, len(x)))
+        if isinstance(x, bytes) else x for x in parts
+    ]
+    return np.concatenate(arrays, axis=1).tobytes()
+
+
+def _as_chunks(columns):
+    """Accept a single columnar canlist as well as an iterable of them."""
+    return [columns] if isinstance(columns, dict) else columns
+
+
+def write_traffic_file(chunks, outfilepath):
+    """Write columnar canlists to a .traffic file, which parse_traffic can
+    read.
+
+    IDs and data bytes are written in hex, and timestamps are written in
+    milliseconds, so they lose their last digit.
+
+    Arguments:
+    chunks -- A columnar canlist, or an iterable of them to write one after
+    the other.
+    outfilepath -- The path to the file to write.
+    """
+    with open(outfilepath, 'wb') as file:
+        for columns in _as_chunks(chunks):
+            length = len(columns['id'])
+            dlc = np.minimum(columns['dlc'], 8).astype(np.int64)
+            # Every byte as "0xHH," with the comma after the last byte
+            # replaced by "]" and the rest blanked out.
+            data = np.empty((length, 8, 5), dtype=np.uint8)
+            data[:, :, 0:2] = np.frombuffer(b'0x', dtype=np.uint8)
+            data[:, :, 2:4] = _hex_chars(columns['data'].ravel(),
+                                         2).reshape(length, 8, 2)
+            data[:, :, 4] = ord(',')
+            data = data.reshape(length, 40)
+            data[np.arange(40) >= 5 * dlc[:, None]] = ord(' ')
+            data[np.arange(length), np.maximum(5 * dlc - 1, 0)] = ord(']')
+
+            ms = columns['timestamp'] // 10
+            file.write(_lines([
+                b'{"timestamp":"', _dec_chars(ms, _width(ms, 10)),
+                b'","seq":0,"id":0x', _hex_chars(columns['id'], 3),
+                b',"dlc":', _dec_chars(dlc, 1), b',"data":[', data, b'}\n'
+            ], length))
+
+
+def write_csv_file(chunks, outfilepath):
+    """Write columnar canlists to a CAN frame .csv file, which parse_csv can
+    read.
+
+    Arguments:
+    chunks -- A columnar canlist, or an iterable of them to write one after
+    the other.
+    outfilepath -- The path to the file to write.
+    """
+    index = 0
+    with open(outfilepath, 'wb') as file:
+        file.write(b'Index,System Time,Time Stamp,Channel,Direction,'
+                   b'Frame ID,Type,Format,DLC,Data\n')
+        for columns in _as_chunks(chunks):
+            length = len(columns['id'])
+            dlc = np.minimum(columns['dlc'], 8).astype(np.int64)
+            # Every byte as "HH " with the bytes past the DLC blanked out.
+            data = np.empty((length, 8, 3), dtype=np.uint8)
+            data[:, :, 0:2] = _hex_chars(columns['data'].ravel(),
+                                         2).reshape(length, 8, 2)
+            data[:, :, 2] = ord(' ')
+            data[np.arange(8) >= dlc[:, None]] = ord(' ')
+
+            indices = np.arange(index, index + length)
+            index += length
+            ms = columns['timestamp'] // 10 % (24 * 3600 * 1000)
+            file.write(_lines([
+                _dec_chars(indices, _width(indices, 10)), b',="',
+                _dec_chars(ms // 3600000, 2), b':',
+                _dec_chars(ms // 60000 % 60, 2), b':',
+                _dec_chars(ms // 1000 % 60, 2), b'.',
+                _dec_chars(ms % 1000, 3), b'",0x',
+                _hex_chars(columns['timestamp'],
+                           _width(columns['timestamp'], 16)),
+                b',ch1,Receive,0x', _hex_chars(columns['id'], 4),
+                b',Data,Standard,0x', _hex_chars(dlc, 2), b',x| ',
+                data.reshape(length, 24), b'\n'
+            ], length))
+
+
+def write_column_file(chunks, outfilepath):
+    """Write columnar canlists to a columnar binary file, which
+    preprocessor.parse_can_file can read.
+
+    Arguments:
+    chunks -- A columnar canlist, or an iterable of them to write one after
+    the other.
+    outfilepath -- The path to the file to write.
+    """
+    with ids.column_store.ColumnWriter(outfilepath,
+                                       attrs={'kind': 'canlist'}) as out:
+        for columns in _as_chunks(chunks):
+            out.append(columns)
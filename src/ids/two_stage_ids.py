@@ -1,19 +1,46 @@
 from ids.dnn_ids import DNNBasedIDS
+from ids.instrumentation import (LatencyHistogram, Profiler,
+                                 write_latency_report)
 from ids.rules_ids import RulesIDS
 import ids.preprocessor as dp
 from numpy import log
+import numpy as np
+import itertools
 import os.path
+import queue
+import threading
+import time
 
 class TwoStageIDS:  # pylint: disable=too-many-instance-attributes
     """A class that uses both the set of rules (Rules Based IDS) and a trained deep neural network (DNN Based IDS) for classification."""
-    def __init__(self):
+    # The number of frames fed to the DNN at a time by judge_dataset.
+    DATASET_BATCH_SIZE = 4096
+
+    def __init__(self, dnn=None):
+        """Arguments:
+        dnn -- The DNN stage to use. If None, a new DNNBasedIDS. An already
+        trained stand-in with the same predict functions, such as a
+        dnn_kernel.DNNKernel, can be given to judge frames without TensorFlow.
+        """
         self.dnn_trained = False
         self.rules_trained = False
         self.in_simulation = False
 
-        self.dnn = DNNBasedIDS()
+        self.dnn = DNNBasedIDS() if dnn is None else dnn
         self.rules = RulesIDS()
-        self.idprobs = {}
+        # Timing of the stages of judge_single_frame, shared with the Rules
+        # Based IDS so it records the time taken by each rule as well.
+        self.profiler = Profiler()
+        self.rules.profiler = self.profiler
+        # Ingest-to-verdict latency of every frame judged, by judging path.
+        # judge_dataset is not tracked: it judges the whole dataset at once,
+        # so every frame would have the same latency, the total run time.
+        self.latency = {
+            'judge_single_frame': LatencyHistogram(),
+            'judge_batch': LatencyHistogram(),
+            'judge_stream': LatencyHistogram()
+        }
+        self.idprobs = dp.ID_ProbTable.from_dict({})
 
         self.params = {
             'dnn_dir_path': None,
@@ -59,7 +86,7 @@ class TwoStageIDS:  # pylint: disable=too-many-instance-attributes
                 print('Creating new Rules IDS profile')
                 self.rules_trained = False
         if self.params['idprobs_path']:
-            self.idprobs = dp.load_id_probs(self.params['idprobs_path'])
+            self.idprobs = dp.load_id_prob_table(self.params['idprobs_path'])
 
     def change_ids_parameters(self, key, value):
         """Change the parameters of the Two Stage IDS.
@@ -87,18 +114,21 @@ class TwoStageIDS:  # pylint: disable=too-many-instance-attributes
         """
         self.dnn.change_param(key, value)
 
-    def retrain_rules(self, canlist):
+    def retrain_rules(self, canlist, incremental=False):
         """Take a list of CAN frames and retrain the Rules Based IDS based on the list provided.
 
         Arguments:
         canlist -- List of CAN frames to be used to retrain the Rules Based IDS.
+        incremental -- If True, add what the rules learn from canlist to the
+        existing rules profile, instead of replacing it.
 
         Returns nothing, but marks the Rules Based IDS as trained.
         """
-        self.rules.prepare(canlist, self.params['rules_profile'])
+        self.rules.prepare(canlist, self.params['rules_profile'],
+                           incremental=incremental)
         self.rules_trained = True
 
-    def train_dnn(self, input_function, num_steps):
+    def train_dnn(self, input_function, num_steps, filepaths=None):
         """Train the DNN based part of the Two Stage IDS with data from the
         input function for a certain number of steps.
 
@@ -106,35 +136,72 @@ class TwoStageIDS:  # pylint: disable=too-many-instance-attributes
         input_function -- The input function for the dataset the DNN should be
         trained on.
         num_steps -- The number of steps to take for training the DNN.
+        filepaths -- The columnar binary feature files input_function reads,
+        if any, to record in the training provenance of the DNN.
 
         Returns nothing, but marks the DNN Based IDS as trained.
         """
         if not self.dnn._dnn:
             raise RuntimeError('No DNN has been initialized!')
-        self.dnn.train(input_function, num_steps)
+        self.dnn.train(input_function, num_steps, filepaths)
         self.dnn_trained = True
 
-    def _judge_dataset(self, canlist, input_function):
+    def train_dnn_incremental(self, filepaths, num_steps=None,
+                              replay_ratio=0.25):
+        """Fine-tune the DNN based part of the Two Stage IDS on the feature
+        files it has not been trained on yet, with a replay sample of older
+        data. See DNNBasedIDS.train_incremental.
+
+        Returns the record of the training session, or None if there was no
+        new data, and marks the DNN Based IDS as trained.
+        """
+        if not self.dnn._dnn:
+            raise RuntimeError('No DNN has been initialized!')
+        session = self.dnn.train_incremental(filepaths, num_steps,
+                                             replay_ratio)
+        self.dnn_trained = self.dnn_trained or session is not None
+        return session
+
+    def _judge_dataset(self, canlist, features):
         """Helper function for judge_dataset that creates the actual generator returned. Should never be used normally.
         """
-        rules_results = self.rules.test_series(canlist)
-        dnn_results = self.dnn.predict(input_function)
-        for rule_result, dnn_result in zip(rules_results, dnn_results):
-            if not rule_result[0]:
-                yield rule_result
-            else:
-                yield dnn_result
+        results = list(self.rules.test_series(canlist))
+        passed = [i for i, result in enumerate(results) if not result[0]]
+        if callable(features):
+            # An input function can't be gathered from, so the DNN predicts
+            # every frame and only the predictions for the frames that
+            # passed the rules are kept. The input function may loop
+            # forever, so only one prediction per frame is taken.
+            dnn_results = list(itertools.islice(self.dnn.predict(features),
+                                                len(canlist)))
+            dnn_results = [dnn_results[i] for i in passed]
+        elif passed:
+            # Gather the features of the frames that passed the rules, and
+            # run them through the DNN in one go.
+            indices = np.asarray(passed)
+            dnn_results = self.dnn.predict_batch(
+                {k: np.asarray(v)[indices] for k, v in features.items()},
+                batch_size=self.DATASET_BATCH_SIZE)
+        else:
+            dnn_results = []
+        # Scatter the DNN results back in the order of the frames.
+        for i, result in zip(passed, dnn_results):
+            results[i] = result
+        yield from results
+
+    def judge_dataset(self, canlist, features):
+        """Take a list of CAN frames as well as their features, and run the frames through the Two Stage IDS and get the classifications of each frame. The Two Stage IDS must not be in a simulation in order for this function to work.
 
-    def judge_dataset(self, canlist, input_function):
-        """Take a list of CAN frames as well as an input function, and run the frames through the Two Stage IDS and get the classifications of each frame. The Two Stage IDS must not be in a simulation in order for this function to work.
+        The frames are tested against the rules first, and only the features
+        of the frames that passed the rules are run through the DNN, in a
+        single batched call.
 
         Arguments:
         canlist -- The list of CAN frames to run against the Two Stage IDS.
-        input_function -- An input function containing the processed frames.
-        One should use the dnn_input_function() from the dnn_ids module, and
-        pass it a list of processed frames from
-        preprocessor.generate_feature_lists() and labels from
-        preprocessor.inject_malicious_packets().
+        features -- The feature lists of the frames, from
+        preprocessor.generate_feature_lists(). An input function containing
+        the processed frames, from dnn_input_function() in the dnn_ids module,
+        is accepted as well, but then the DNN has to predict every frame.
 
         Raises:
         RuntimeError -- A simulation has been started with the function
@@ -155,8 +222,116 @@ class TwoStageIDS:  # pylint: disable=too-many-instance-attributes
         elif not self.rules_trained:
             raise RuntimeError('The Rules Based IDS must be prepared before judging a dataset.')
         else:
-            return self._judge_dataset(canlist, input_function)
+            return self._judge_dataset(canlist, features)
+
+
+    def judge_stream(self, frames, chunk_size=4096, queue_size=4):
+        """Take an iterable of CAN frames, such as the generator returned by
+        preprocessor.iter_can_file, and judge the frames the same way
+        judge_batch would judge them in a simulation, computing the features
+        of the frames on the fly. The Two Stage IDS must not be in a
+        simulation in order for this function to work, and the simulation
+        state is left untouched.
 
+        The frames are read chunk_size at a time, and each chunk goes
+        through a pipeline of threads connected by queues of at most
+        queue_size chunks: reading the frames, testing them against the
+        rules, computing the features of the frames that passed the rules,
+        and the DNN in the thread iterating the generator. The stages work
+        on different chunks at the same time, and only a bounded number of
+        chunks are held in memory however long frames is. The latency of
+        each frame, from when its chunk was read until it is yielded, is
+        recorded in self.latency['judge_stream'].
+
+        Arguments:
+        frames -- An iterable of CAN frames.
+        chunk_size -- The number of frames read and judged at a time.
+        queue_size -- The maximum number of chunks waiting between stages.
+
+        Raises:
+        RuntimeError -- A simulation has been started with the function
+        start_simulation, or the Rules Based IDS or DNN Based IDS have not been
+        trained.
+
+        Returns a generator yielding one tuple for each frame, of the types
+        returned by judge_single_frame. An exception raised by a stage,
+        including one raised by frames, is raised by the generator.
+        """
+        if self.in_simulation:
+            raise RuntimeError('The TwoStageIDS must not be in a simulation in order to judge a stream.')
+        elif not self.dnn_trained:
+            raise RuntimeError('The DNN must be trained before judging a stream.')
+        elif not self.rules_trained:
+            raise RuntimeError('The Rules Based IDS must be prepared before judging a stream.')
+        return self._judge_stream(frames, chunk_size, queue_size)
+
+    def _judge_stream(self, frames, chunk_size, queue_size):
+        """Helper function for judge_stream that creates the actual generator returned."""
+        id_freq = dp.ID_Past()
+        id_entr = dp.ID_Entropy()
+
+        def read():
+            iterator = iter(frames)
+            while True:
+                chunk = list(itertools.islice(iterator, chunk_size))
+                if not chunk:
+                    return
+                yield chunk, time.perf_counter_ns()
+
+        def test_rules(item):
+            chunk, received = item
+            results = [self.rules.test(frame) for frame in chunk]
+            passed = [i for i, result in enumerate(results) if not result[0]]
+            return received, results, [chunk[i] for i in passed], passed
+
+        def compute_features(item):
+            received, results, passed_frames, passed = item
+            processed = None
+            if passed_frames:
+                processed = {
+                    'id': [x['id'] for x in passed_frames],
+                    'occurrences_in_last_sec': list(
+                        id_freq.feed(passed_frames))
+                }
+                entropies = list(id_entr.feed(passed_frames, self.idprobs))
+                processed['relative_entropy'] = [x[0] for x in entropies]
+                processed['system_entropy_change'] = [x[1] for x in entropies]
+            return received, results, passed, processed
+
+        stop = threading.Event()
+        read_queue = queue.Queue(queue_size)
+        rules_queue = queue.Queue(queue_size)
+        features_queue = queue.Queue(queue_size)
+        threads = [
+            threading.Thread(target=_run_stage,
+                             args=(read(), None, read_queue, stop)),
+            threading.Thread(target=_run_stage,
+                             args=(_drain(read_queue, stop), test_rules,
+                                   rules_queue, stop)),
+            threading.Thread(target=_run_stage,
+                             args=(_drain(rules_queue, stop),
+                                   compute_features, features_queue, stop))
+        ]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        latency = self.latency['judge_stream']
+        try:
+            for received, results, passed, processed in _drain(
+                    features_queue, stop):
+                if processed is not None:
+                    dnn_results = self.dnn.predict_batch(processed)
+                    for i, result in zip(passed, dnn_results):
+                        results[i] = result
+                latency.record_many(
+                    np.full(len(results), time.perf_counter_ns() - received))
+                yield from results
+        finally:
+            # Stop the stages as well if the generator is closed early.
+            stop.set()
+            for thread in threads:
+                thread.join()
 
     def start_simulation(self):
         """Start a simulation of the Two Stage IDS, which allows the ability to feed the Two Stage IDS single CAN frames at a time in order to be classified, instead of having to preprocess the frames. Both the Rules Based IDS and DNN Based IDS must be trained before this can be started.
@@ -174,6 +349,8 @@ class TwoStageIDS:  # pylint: disable=too-many-instance-attributes
         self.in_simulation = True
         self.id_freq = dp.ID_Past()
         self.id_entr = dp.ID_Entropy()
+        self.latency['judge_single_frame'].reset()
+        self.latency['judge_batch'].reset()
 
     def stop_simulation(self):
         """Stop a simulation of the Two Stage IDS.
@@ -185,18 +362,18 @@ class TwoStageIDS:  # pylint: disable=too-many-instance-attributes
             raise RuntimeError('The TwoStageIDS is not currently in a simulation.')
         self.in_simulation = False
 
-    def judge_single_frame(self, frame):
+    def judge_single_frame(self, frame, received=None):
         """Take a single CAN frame, and run the frames through the Two Stage
         IDS and get the classification of the frame. The Two Stage IDS must be
         in a simulation in order for this function to work.
 
+        The time from when the frame was received until its judgement is
+        recorded in self.latency['judge_single_frame'].
+
         Arguments:
-        canlist -- The list of CAN frames to run against the Two Stage IDS.
-        input_function -- An input function containing the processed frames.
-        One should use the dnn_input_function() from the dnn_ids module, and
-        pass it a list of processed frames from
-        preprocessor.generate_feature_lists() and labels from
-        preprocessor.inject_malicious_packets().
+        frame -- The CAN frame to judge.
+        received -- The time.perf_counter_ns() time the frame was received.
+        If None, the time this function is called is used.
 
         Raises:
         RuntimeError -- A simulation has not been started with the function
@@ -212,17 +389,174 @@ class TwoStageIDS:  # pylint: disable=too-many-instance-attributes
         """
         if not self.in_simulation:
             raise RuntimeError('The TwoStageIDS is not currently in a simulation.')
+        if received is None:
+            received = time.perf_counter_ns()
+        result = self._judge_frame(frame)
+        self.latency['judge_single_frame'].record(
+            time.perf_counter_ns() - received)
+        return result
+
+    def _judge_frame(self, frame):
+        """Helper function for judge_single_frame that judges the frame."""
+        profiler = self.profiler
+        profiler.count('frames')
+        frame_start = start = profiler.start()
         is_malicious = self.rules.test(frame)
+        profiler.stop('rules', start)
         if is_malicious[0]: # is_malicious is a pair (is_malicious, rule_name)
+            profiler.count('rule_rejections')
+            profiler.stop('judge_single_frame', frame_start)
             return is_malicious
         else:  # Passed RuleBasedIDS, test against DNNBasedIDS.
+            start = profiler.start()
             processed_frame = {'id': frame['id']}
             processed_frame['occurrences_in_last_sec'] = next(
                 self.id_freq.feed([frame]))
+            profiler.stop('features.id_past', start)
 
+            start = profiler.start()
             e_relative, e_system = next(
                 self.id_entr.feed([frame], self.idprobs))
             processed_frame['relative_entropy'] = e_relative
             processed_frame['system_entropy_change'] = e_system
+            profiler.stop('features.id_entropy', start)
+
+            start = profiler.start()
+            result = self.dnn.predict_frame(processed_frame)
+            profiler.stop('dnn', start)
+            if result[0]:
+                profiler.count('dnn_detections')
+            profiler.stop('judge_single_frame', frame_start)
+            return result
+
+    def judge_batch(self, frames, received=None):
+        """Take a micro-batch of CAN frames, and judge them the same way
+        judge_single_frame would judge them one after the other, but with a
+        single call to the DNN for the whole batch. The Two Stage IDS must be
+        in a simulation in order for this function to work.
+
+        Every frame is tested against the rules on its own. Only the frames
+        that pass the rules are fed to the feature calculators, in order, and
+        then to the DNN.
+
+        Arguments:
+        frames -- The list of CAN frames to judge.
+        received -- The time.perf_counter_ns() time each frame was received,
+        as a single time for the whole batch or a sequence of one per frame.
+        If None, the time this function is called is used. The latency of
+        each frame is recorded in self.latency['judge_batch'].
+
+        Raises:
+        RuntimeError -- A simulation has not been started with the function
+        start_simulation.
+
+        Returns a list with one tuple for each frame, of the types returned by
+        judge_single_frame.
+        """
+        if not self.in_simulation:
+            raise RuntimeError('The TwoStageIDS is not currently in a simulation.')
+        if received is None:
+            received = time.perf_counter_ns()
+        profiler = self.profiler
+        profiler.count('frames', len(frames))
+
+        start = profiler.start()
+        results = [self.rules.test(frame) for frame in frames]
+        passed = [i for i, result in enumerate(results) if not result[0]]
+        profiler.stop('rules', start)
+        profiler.count('rule_rejections', len(frames) - len(passed))
+
+        if passed:
+            passed_frames = [frames[i] for i in passed]
+            start = profiler.start()
+            processed = {
+                'id': [x['id'] for x in passed_frames],
+                'occurrences_in_last_sec': list(
+                    self.id_freq.feed(passed_frames))
+            }
+            profiler.stop('features.id_past', start)
+
+            start = profiler.start()
+            entropies = list(self.id_entr.feed(passed_frames, self.idprobs))
+            processed['relative_entropy'] = [x[0] for x in entropies]
+            processed['system_entropy_change'] = [x[1] for x in entropies]
+            profiler.stop('features.id_entropy', start)
+
+            start = profiler.start()
+            dnn_results = self.dnn.predict_batch(processed)
+            profiler.stop('dnn', start)
+            profiler.count('dnn_detections', sum(x[0] for x in dnn_results))
+            for i, result in zip(passed, dnn_results):
+                results[i] = result
+
+        received = np.broadcast_to(np.asarray(received, dtype=np.int64),
+                                   (len(frames), ))
+        self.latency['judge_batch'].record_many(time.perf_counter_ns() -
+                                                received)
+        return results
+
+    def latency_summary(self):
+        """Return the p50/p95/p99/max latency summary of every judging path,
+        as a dictionary {path: LatencyHistogram.summary()}."""
+        return {k: v.summary() for k, v in self.latency.items()}
+
+    def write_latency_report(self, outfilepath):
+        """Write the latency histograms of every judging path to a JSON file.
+        """
+        write_latency_report(self.latency, outfilepath)
+
+
+class _StageError:  # pylint: disable=too-few-public-methods
+    """Passed down a judge_stream pipeline in place of an item when a stage
+    raises an exception, to be raised again by the last stage."""
+
+    def __init__(self, exception):
+        self.exception = exception
+
+
+# Passed down a judge_stream pipeline after the last item.
+_STAGE_END = object()
+
+# How often the threads of a judge_stream pipeline waiting on a queue check
+# whether the pipeline has been stopped, in seconds.
+_STAGE_POLL = 0.1
+
+
+def _put(outqueue, item, stop):
+    """Put item in outqueue, unless the pipeline is stopped first. Returns
+    whether the item was put."""
+    while not stop.is_set():
+        try:
+            outqueue.put(item, timeout=_STAGE_POLL)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _drain(inqueue, stop):
+    """Generator yielding the items put in inqueue by the previous stage,
+    until the end of the pipeline or until it is stopped."""
+    while not stop.is_set():
+        try:
+            item = inqueue.get(timeout=_STAGE_POLL)
+        except queue.Empty:
+            continue
+        if item is _STAGE_END:
+            return
+        elif isinstance(item, _StageError):
+            raise item.exception
+        yield item
+
 
-            return self.dnn.predict_frame(processed_frame)
+def _run_stage(source, func, outqueue, stop):
+    """Run one stage of a judge_stream pipeline: put func(item) in outqueue
+    for each item of source, or the item itself if func is None."""
+    try:
+        for item in source:
+            if not _put(outqueue, item if func is None else func(item), stop):
+                return
+    except BaseException as exc:  # pylint: disable=broad-except
+        _put(outqueue, _StageError(exc), stop)
+        return
+    _put(outqueue, _STAGE_END, stop)
@@ -0,0 +1,126 @@
+"""Verdict Logs
+Export the judgements of a simulation as a verdict file: a columnar binary
+file (see column_store) with the same 'verdict', 'rule' and 'confidence'
+columns as the verdict files of the judge module, along with the
+'timestamp', 'id' and 'label' code of each frame, and its 'latency' in
+seconds (NaN if unknown). The file can be compressed with gzip or lzma, and
+can be loaded with judge.load_verdicts and scored with the evaluation
+module.
+
+The judgements are converted and written a chunk at a time, so exporting
+millions of them does not need a second copy of the whole log in memory,
+and only the judgements of frames within a time range can be exported.
+
+Functions:
+in_time_range -- Find the timestamps that lie within a time range.
+judgement_columns -- Convert judgements to the columns of a verdict file.
+write_verdict_log -- Write judgements to a verdict file.
+"""
+
+import itertools
+
+import numpy as np
+
+import ids.column_store
+from ids.evaluation import TIMESTAMPS_PER_SECOND, verdict_codes
+
+# The number of judgements converted and written at a time.
+DEFAULT_CHUNK_SIZE = 2**16
+
+
+def in_time_range(timestamps, start=None, stop=None):
+    """Find the timestamps that lie within a time range.
+
+    Arguments:
+    timestamps -- Array of timestamps, in 0.1 ms units.
+    start -- The start of the range in seconds, or None for no start.
+    stop -- The end of the range in seconds, which is not part of the
+    range, or None for no end.
+
+    Returns a boolean array of whether each timestamp is within the range.
+    """
+    seconds = np.asarray(timestamps, dtype=np.float64) / TIMESTAMPS_PER_SECOND
+    keep = np.ones(len(seconds), dtype=bool)
+    if start is not None:
+        keep &= seconds >= start
+    if stop is not None:
+        keep &= seconds < stop
+    return keep
+
+
+def judgement_columns(judgements, labels, rule_names):
+    """Convert judgements to the columns of a verdict file.
+
+    Arguments:
+    judgements -- List of the judgements of frames, as emitted by the
+    simulation of the GUI: dictionaries of the 'Frame', its 'Label' (None
+    if benign, else the name of the attack), the 'Judgement' and 'Reason'
+    of the Two Stage IDS, and optionally the 'Latency' in seconds.
+    labels -- The name of each label code, from MaliciousGenerator.labels.
+    rule_names -- The names of the rules of the Rules Based IDS, in order.
+
+    Returns a dictionary of the columns.
+    """
+    label_codes = {label: code for code, label in enumerate(labels)}
+    verdicts, rules, confidences = verdict_codes(
+        ((x['Judgement'], x['Reason']) for x in judgements), rule_names)
+    return {
+        'timestamp': np.array([x['Frame']['timestamp'] for x in judgements],
+                              dtype=np.int64),
+        'id': np.array([x['Frame']['id'] for x in judgements],
+                       dtype=np.int32),
+        'label': np.array([label_codes[x['Label'] or None]
+                           for x in judgements], dtype=np.int8),
+        'verdict': verdicts,
+        'rule': rules,
+        'confidence': confidences,
+        'latency': np.array([
+            np.nan if x.get('Latency') is None else x['Latency']
+            for x in judgements
+        ], dtype=np.float32)
+    }
+
+
+def write_verdict_log(judgements,
+                      outfilepath,
+                      labels,
+                      rule_names,
+                      start=None,
+                      stop=None,
+                      compression=None,
+                      chunk_size=DEFAULT_CHUNK_SIZE,
+                      attrs=None):
+    """Write judgements to a verdict file, chunk_size judgements at a time.
+
+    Arguments:
+    judgements -- Iterable of judgements, see judgement_columns. It is only
+    read chunk_size judgements at a time.
+    outfilepath -- The path to the verdict file to write.
+    labels -- The name of each label code, from MaliciousGenerator.labels.
+    rule_names -- The names of the rules of the Rules Based IDS, in order.
+    start -- Only write the frames from start seconds on. See in_time_range.
+    stop -- Only write the frames before stop seconds.
+    compression -- None, 'gzip' or 'lzma'.
+    chunk_size -- The number of judgements converted at a time.
+    attrs -- More attributes to store in the file.
+
+    Returns the number of judgements written.
+    """
+    attrs = dict(attrs or {}, kind='verdicts', rules=list(rule_names),
+                 labels=list(labels), time_range=[start, stop])
+    judgements = iter(judgements)
+    written = 0
+    with ids.column_store.ColumnWriter(outfilepath, attrs,
+                                       compression) as out:
+        while True:
+            chunk = list(itertools.islice(judgements, chunk_size))
+            if not chunk:
+                break
+            columns = judgement_columns(chunk, labels, rule_names)
+            keep = in_time_range(columns['timestamp'], start, stop)
+            out.append({k: v[keep] for k, v in columns.items()})
+            written += int(np.count_nonzero(keep))
+        if not written:
+            # Fix the columns of an empty file.
+            out.append(judgement_columns([], labels, rule_names))
+    return written
@@ -0,0 +1,60 @@
+"""Testing for the benchmark suite"""
+
+import multiprocessing
+import os
+
+import pytest
+
+import ids.benchmark as bench
+import ids.preprocessor as dp
+
+
+def test_write_capture(tmp_path):
+    capture = bench.write_capture(tmp_path, 300)
+    traffic = dp.parse_traffic(capture['traffic'])
+    csv = dp.parse_csv(capture['csv'])
+    canlist = dp.load_canlist(capture['canlist'])
+    assert len(traffic) == len(csv) == len(canlist) == 300
+    assert [x['id'] for x in traffic] == [x['id'] for x in canlist]
+    assert csv == canlist
+    # .traffic files only hold whole milliseconds.
+    assert [x['timestamp'] // 10 for x in canlist] == \
+        [x['timestamp'] // 10 for x in traffic]
+    assert [x['data'] for x in traffic] == [x['data'] for x in canlist]
+
+
+def test_write_capture_formats(tmp_path):
+    assert set(bench.STAGE_FORMATS) <= set(bench.STAGES)
+    capture = bench.write_capture(tmp_path, 300, formats=['idprobs'])
+    assert 'canlist' not in capture and 'traffic' not in capture
+    assert sorted(os.listdir(tmp_path)) == [
+        'capture_300_columns.bin', 'capture_300_idprobs.json',
+        'capture_300_idprobs.npz']
+    assert sum(dp.load_id_probs(capture['idprobs']).values()) == \
+        pytest.approx(1)
+
+
+def test_wait_for_dead_stage():
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    # Exits without a result, like a stage killed for running out of memory.
+    process = context.Process(target=os._exit, args=(3,))
+    process.start()
+    result = bench._wait_for_stage('parse_csv', 300, process, results)
+    process.join()
+    assert result['stage'] == 'parse_csv' and result['size'] == 300
+    assert 'exit code 3' in result['error']
+
+
+def test_run_benchmarks(tmp_path):
+    output = bench.run_benchmarks([500], ['parse_csv', 'RulesIDS.prepare'],
+                                  tmp_path)
+    assert [x['stage'] for x in output['results']] == \
+        ['parse_csv', 'RulesIDS.prepare']
+    for result in output['results']:
+        assert 'error' not in result
+        assert result['frames'] == 500
+        assert result['frames_per_sec'] > 0
+
+    comparison = bench.compare_results(output, output)
+    assert [x[4] for x in comparison] == [1.0, 1.0]
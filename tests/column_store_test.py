@@ -0,0 +1,72 @@
+"""Testing for the columnar binary file format"""
+
+import numpy as np
+import pytest
+
+import ids.column_store as cs
+
+
+def test_write_load_columns(tmp_path):
+    path = tmp_path / 'columns.bin'
+    columns = {
+        'a': np.arange(1000, dtype=np.int64),
+        'b': np.linspace(0, 1, 1000),
+        'c': np.arange(8000, dtype=np.uint8).reshape(1000, 8)
+    }
+    cs.write_columns(path, columns, attrs={'name': 'test'}, chunk_size=300)
+    assert cs.is_column_file(path)
+
+    for mmap in [True, False]:
+        loaded, attrs = cs.load_columns(path, mmap=mmap)
+        assert attrs == {'name': 'test'}
+        for key, value in columns.items():
+            assert loaded[key].dtype == value.dtype
+            assert np.array_equal(loaded[key], value)
+
+
+def test_column_writer_checks(tmp_path):
+    path = tmp_path / 'columns.bin'
+    with pytest.raises(ValueError):
+        with cs.ColumnWriter(path) as out:
+            out.append({'a': np.zeros(3), 'b': np.zeros(2)})
+    with pytest.raises(ValueError):
+        with cs.ColumnWriter(path) as out:
+            out.append({'a': np.zeros(3)})
+            out.append({'b': np.zeros(3)})
+    # Spool files are cleaned up after a failed write.
+    assert list(tmp_path.iterdir()) == []
+
+    with cs.ColumnWriter(path) as out:
+        pass
+    columns, _ = cs.load_columns(path)
+    assert columns == {}
+
+
+def test_not_column_file(tmp_path):
+    path = tmp_path / 'file.json'
+    path.write_text('{}')
+    assert not cs.is_column_file(path)
+    with pytest.raises(ValueError):
+        cs.load_columns(path)
+    with pytest.raises(FileNotFoundError):
+        cs.load_columns(tmp_path / 'does_not_exist')
+
+
+@pytest.mark.parametrize('compression', ['gzip', 'lzma'])
+def test_compressed_columns(tmp_path, compression):
+    path = tmp_path / 'columns.bin'
+    columns = {
+        'a': np.arange(5000, dtype=np.int64),
+        'c': np.zeros((5000, 8), dtype=np.uint8)
+    }
+    cs.write_columns(path, columns, {'name': 'test'}, chunk_size=1500,
+                     compression=compression)
+    assert cs.is_column_file(path)
+    assert path.stat().st_size < 5000 * 16
+    loaded, attrs = cs.load_columns(path)
+    assert attrs == {'name': 'test'}
+    for key, value in columns.items():
+        assert np.array_equal(loaded[key], value)
+
+    with pytest.raises(ValueError):
+        cs.ColumnWriter(path, compression='zip')
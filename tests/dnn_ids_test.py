@@ -0,0 +1,57 @@
+"""Testing for the DNN Based IDS helpers that don't need a trained model"""
+
+import numpy as np
+
+import ids.preprocessor as dp
+from ids.dnn_ids import _file_identity, feature_shards, plan_incremental_training
+
+
+def write_features(path, num_frames, seed=0):
+    rng = np.random.default_rng(seed)
+    features = {
+        'id': rng.integers(0, 2048, num_frames),
+        'occurrences_in_last_sec': rng.integers(0, 100, num_frames),
+        'relative_entropy': rng.random(num_frames),
+        'system_entropy_change': rng.normal(size=num_frames)
+    }
+    dp.write_feature_file(features, rng.integers(0, 2, num_frames), path,
+                          [None, 'attack'])
+    return str(path)
+
+
+def test_feature_shards(tmp_path):
+    first = write_features(tmp_path / 'a.bin', 250)
+    second = write_features(tmp_path / 'b.bin', 100)
+    assert feature_shards([first, second], block_size=100) == [
+        (first, 0), (first, 100), (first, 200), (second, 0)
+    ]
+
+
+def test_plan_incremental_training(tmp_path):
+    old = [write_features(tmp_path / 'old{}.bin'.format(i), 1000, i)
+           for i in range(4)]
+    new = write_features(tmp_path / 'new.bin', 500)
+    provenance = {'files': [_file_identity(x) for x in old], 'sessions': []}
+
+    # Files already trained on are only replayed, from every trained file,
+    # whether it was given or not.
+    plan = plan_incremental_training([old[0], new], provenance,
+                                     replay_ratio=0.5, block_size=100,
+                                     seed=0)
+    assert [x['path'] for x in plan['new_files']] == [str(tmp_path / 'new.bin')]
+    assert plan['new_shards'] == 5
+    assert plan['replay_shards'] == 3
+    assert plan['shards'][:5] == [(new, x) for x in range(0, 500, 100)]
+    assert all(x[0] in old for x in plan['shards'][5:])
+    assert set(plan['replay_files']) <= set(old)
+
+    # A file that changed since it was trained on counts as new.
+    write_features(old[1], 300, 10)
+    plan = plan_incremental_training(old, provenance, block_size=100)
+    assert [x['path'] for x in plan['new_files']] == [old[1]]
+
+    # Nothing is new once every file has been trained on.
+    provenance['files'].append(_file_identity(new))
+    provenance['files'][1] = _file_identity(old[1])
+    plan = plan_incremental_training(old + [new], provenance)
+    assert plan['new_files'] == [] and plan['shards'] == []
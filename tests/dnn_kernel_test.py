@@ -0,0 +1,144 @@
+"""Testing for the NumPy forward pass of the DNN Based IDS"""
+
+import numpy as np
+import pytest
+
+from ids.dnn_kernel import (ACTIVATIONS, FEATURES, PRECISIONS, DNNKernel,
+                             precision_report)
+
+
+def random_kernel(hidden_units, activation='relu', logits=1, seed=0):
+    rng = np.random.default_rng(seed)
+    sizes = [len(FEATURES)] + hidden_units + [logits]
+    layers = []
+    for k, (inputs, outputs) in enumerate(zip(sizes, sizes[1:])):
+        if activation == 'crelu' and k > 0:
+            inputs *= 2
+        layers.append((rng.normal(size=(inputs, outputs)),
+                       rng.normal(size=outputs)))
+    return DNNKernel(layers, activation)
+
+
+def random_features(num_frames, seed=0):
+    rng = np.random.default_rng(seed)
+    return {
+        'id': rng.integers(0, 2048, num_frames),
+        'occurrences_in_last_sec': rng.integers(0, 100, num_frames),
+        'relative_entropy': rng.random(num_frames),
+        'system_entropy_change': rng.normal(size=num_frames)
+    }
+
+
+def test_forward_pass():
+    kernel = random_kernel([10, 20])
+    features = random_features(100)
+    inputs = np.column_stack([features[x] for x in FEATURES])
+    hidden = inputs
+    for weights, bias in kernel.layers[:-1]:
+        hidden = np.maximum(hidden @ weights + bias, 0)
+    logits = hidden @ kernel.layers[-1][0] + kernel.layers[-1][1]
+    prob_malicious = 0.5 * (1 + np.tanh(logits[:, 0] / 2))
+
+    results = kernel.predict_batch(features)
+    assert [x[0] for x in results] == (logits[:, 0] > 0).tolist()
+    expected = np.where(logits[:, 0] > 0, prob_malicious, 1 - prob_malicious)
+    assert np.allclose([x[1] for x in results], expected, atol=1e-5)
+    # Feeding the frames in smaller batches, or one at a time, gives the
+    # same results.
+    assert kernel.predict_batch(features, batch_size=7) == results
+    frame = {k: v[3] for k, v in features.items()}
+    assert kernel.predict_frame(frame) == pytest.approx(results[3])
+
+
+@pytest.mark.parametrize('activation', sorted(ACTIVATIONS))
+def test_activations(activation):
+    kernel = random_kernel([8, 8], activation, logits=2)
+    probs = kernel.probabilities(random_features(50))
+    assert probs.shape == (50, 2)
+    assert np.allclose(probs.sum(axis=1), 1)
+
+    arrays = kernel.to_arrays()
+    copy = DNNKernel.from_arrays(arrays, activation)
+    assert np.array_equal(copy.probabilities(random_features(50)), probs)
+
+
+def test_from_checkpoint(tmp_path):
+    tf = pytest.importorskip('tensorflow')
+    kernel = random_kernel([10, 20, 20])
+    graph = tf.Graph()
+    with graph.as_default():
+        for k, (weights, bias) in enumerate(kernel.layers):
+            scope = ('dnn/logits' if k == len(kernel.layers) - 1 else
+                     'dnn/hiddenlayer_{}'.format(k))
+            tf.compat.v1.Variable(weights, name=scope + '/kernel')
+            tf.compat.v1.Variable(bias, name=scope + '/bias')
+        saver = tf.compat.v1.train.Saver()
+        with tf.compat.v1.Session() as session:
+            session.run(tf.compat.v1.global_variables_initializer())
+            saver.save(session, str(tmp_path / 'model.ckpt'))
+
+    exported = DNNKernel.from_checkpoint(str(tmp_path))
+    assert len(exported.layers) == 4
+    for (weights, bias), (expected_weights, expected_bias) in zip(
+            exported.layers, kernel.layers):
+        assert np.array_equal(weights, expected_weights)
+        assert np.array_equal(bias, expected_bias)
+
+
+@pytest.mark.parametrize('precision,tolerance', [('float16', 1e-2),
+                                                 ('int8', 1e-1)])
+def test_reduced_precision(precision, tolerance):
+    kernel = random_kernel([32, 16], 'tanh', logits=2)
+    quantized = kernel.quantize(precision)
+    assert quantized.precision == precision
+    assert kernel.precision == 'float32'
+    assert quantized.memory_bytes < kernel.memory_bytes
+    assert quantized.layers[0][0].dtype == np.dtype(precision)
+    # Biases stay float32.
+    assert quantized.layers[0][1].dtype == np.float32
+
+    # Inputs on the scale of the hidden layers, so rounding the weights only
+    # moves the probabilities a little.
+    features = {k: v / [2048, 100, 1, 1][i] for i, (k, v) in
+                enumerate(random_features(500).items())}
+    expected = kernel.probabilities(features)
+    assert quantized.probabilities(features) == pytest.approx(
+        expected, abs=tolerance)
+    # Quantizing again from reduced precision works from the scaled weights.
+    assert quantized.quantize('float32').probabilities(features) == \
+        pytest.approx(quantized.probabilities(features), abs=1e-5)
+    with pytest.raises(ValueError):
+        kernel.quantize('int4')
+
+
+def test_reduced_precision_arrays(tmp_path):
+    kernel = random_kernel([10, 20]).quantize('int8')
+    arrays = kernel.to_arrays()
+    assert arrays['layer1.scale'][0] == pytest.approx(kernel.scales[1])
+    features = random_features(100)
+    copy = DNNKernel.from_arrays(arrays, 'relu')
+    assert copy.scales == kernel.scales
+    assert (copy.probabilities(features) ==
+            kernel.probabilities(features)).all()
+
+    path = str(tmp_path / 'kernel.npz')
+    kernel.save(path)
+    loaded = DNNKernel.load(path)
+    assert loaded.precision == 'int8' and loaded.activation == 'relu'
+    assert (loaded.probabilities(features) ==
+            kernel.probabilities(features)).all()
+
+
+def test_precision_report():
+    kernel = random_kernel([10, 20], logits=2)
+    features = random_features(1000)
+    labels = (kernel.probabilities(features)[:, 1] > 0.5).astype(np.int8)
+    report = precision_report(kernel, features, labels, repeat=1)
+    assert list(report) == list(PRECISIONS)
+    assert report['float32']['agreement'] == 1.0
+    assert report['float32']['max_probability_error'] == 0.0
+    assert report['float32']['f1'] == 1.0
+    assert report['int8']['memory_bytes'] < \
+        report['float16']['memory_bytes'] < report['float32']['memory_bytes']
+    assert all(0 < x['agreement'] <= 1 and x['frames_per_second'] > 0
+               for x in report.values())
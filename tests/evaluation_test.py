@@ -0,0 +1,146 @@
+"""Testing for the evaluation of verdicts on labelled datasets"""
+
+import io
+
+import numpy as np
+import pytest
+
+import ids.column_store
+import ids.evaluation as ev
+
+LABELS = [None, 'random', 'flood']
+
+
+def test_evaluate():
+    label_codes = np.array([0, 0, 0, 0, 1, 1, 1, 2, 2, 0])
+    verdicts = np.array([0, 0, 1, 0, 1, 0, 1, 1, 1, 0])
+    counts = ev.count_matrix(label_codes, verdicts, len(LABELS))
+    assert counts.tolist() == [[4, 1], [1, 2], [0, 2]]
+
+    results = ev.evaluate(label_codes, verdicts, LABELS)
+    assert results['labels'] == ['benign', 'random', 'flood']
+    assert (results['true_positive'], results['true_negative'],
+            results['false_positive'], results['false_negative']) == \
+        (4, 4, 1, 1)
+    assert results['accuracy'] == pytest.approx(0.8)
+    assert results['precision'] == pytest.approx(0.8)
+    assert results['recall'] == pytest.approx(0.8)
+    assert results['f1'] == pytest.approx(0.8)
+    assert results['benign_passed'] == pytest.approx(0.8)
+    assert results['attacks']['random']['recall'] == pytest.approx(2 / 3)
+    assert results['attacks']['random']['precision'] == pytest.approx(2 / 3)
+    assert results['attacks']['flood']['recall'] == 1.0
+    assert results['attacks']['flood']['f1'] == pytest.approx(
+        2 * (2 / 3) / (1 + 2 / 3))
+
+    # No frames at all is all zeros, not a division error.
+    empty = ev.evaluate([], [], LABELS)
+    assert empty['total'] == 0 and empty['f1'] == 0.0
+    with pytest.raises(ValueError):
+        ev.count_matrix([0, 1], [1], len(LABELS))
+
+
+def test_evaluate_matches_frame_counting():
+    rng = np.random.default_rng(0)
+    label_codes = rng.integers(0, len(LABELS), 5000)
+    verdicts = rng.random(5000) < np.where(label_codes > 0, 0.9, 0.05)
+    results = ev.evaluate(label_codes, verdicts, LABELS)
+
+    for code, name in enumerate(['benign', 'random', 'flood']):
+        frames = label_codes == code
+        if code:
+            assert results['attacks'][name]['total'] == frames.sum()
+            assert results['attacks'][name]['true_positive'] == \
+                (frames & verdicts).sum()
+    assert results['false_positive'] == ((label_codes == 0) & verdicts).sum()
+    assert results['total'] == 5000
+
+
+def test_evaluate_files(tmp_path):
+    rule_names = ['ID_Whitelist', 'MessageFrequency']
+    results = [(False, 0.9), (True, 'ID_Whitelist'), (True, 0.8),
+               (True, 'MessageFrequency'), (False, None), (True, 0.6)]
+    verdicts, rule_codes, confidences = ev.verdict_codes(results, rule_names)
+    assert verdicts.tolist() == [0, 1, 1, 1, 0, 1]
+    assert rule_codes.tolist() == [0, 1, 0, 2, 0, 0]
+    assert np.isnan(confidences[[1, 3, 4]]).all()
+    assert confidences[0] == pytest.approx(0.9)
+
+    verdicts_path = str(tmp_path / 'capture.verdicts')
+    ids.column_store.write_columns(verdicts_path, {
+        'verdict': verdicts, 'rule': rule_codes, 'confidence': confidences
+    }, {'rules': rule_names})
+    features_path = str(tmp_path / 'features.bin')
+    ids.column_store.write_columns(features_path, {
+        'id': np.arange(6, dtype=np.uint16),
+        'label': np.array([0, 1, 2, 1, 2, 0], dtype=np.int8)
+    }, {'labels': LABELS})
+
+    evaluation = ev.evaluate_files(verdicts_path, features_path)
+    assert evaluation['detections']['stages'] == \
+        ['passed', 'dnn'] + rule_names
+    assert evaluation['detections']['counts'] == [
+        [1, 1, 0, 0],
+        [0, 0, 1, 1],
+        [1, 1, 0, 0]
+    ]
+    assert evaluation['attacks']['random']['recall'] == 1.0
+    assert evaluation['attacks']['flood']['recall'] == 0.5
+
+
+def test_rolling_metrics():
+    rng = np.random.default_rng(1)
+    # 20 seconds of frames, with a gap at seconds 10 and 11.
+    timestamps = np.sort(rng.integers(0, 20 * 10000, 3000))
+    timestamps = timestamps[(timestamps < 100000) | (timestamps >= 120000)]
+    label_codes = rng.integers(0, len(LABELS), len(timestamps))
+    verdicts = rng.random(len(timestamps)) < 0.5
+    latencies = rng.random(len(timestamps)) / 1000
+
+    single = ev.RollingMetrics(LABELS, window=8)
+    new_bins = sum(single.record(*x) for x in zip(
+        timestamps.tolist(), label_codes.tolist(), verdicts.tolist(),
+        latencies.tolist()))
+    assert new_bins == 18
+    batch = ev.RollingMetrics(LABELS, window=8)
+    for lo in range(0, len(timestamps), 500):
+        batch.record_many(timestamps[lo:lo + 500], label_codes[lo:lo + 500],
+                          verdicts[lo:lo + 500], latencies[lo:lo + 500])
+    series = single.series()
+    batch_series = batch.series()
+    # Latencies are summed in a different order.
+    assert series['latency_mean'] == pytest.approx(
+        batch_series.pop('latency_mean'))
+    assert {k: v for k, v in series.items() if k != 'latency_mean'} == \
+        batch_series
+    assert single.summary() == batch.summary()
+
+    # Only the last 8 seconds are kept.
+    assert series['time'] == [float(x) for x in range(12, 20)]
+    recent = timestamps >= 120000
+    assert sum(series['frames']) == recent.sum()
+    assert series['frames_per_sec'] == series['frames']
+    assert series['attack_counts']['flood']['true_positive'][0] == \
+        ((timestamps // 10000 == 12) & (label_codes == 2) & verdicts).sum()
+    assert max(series['latency_max']) == pytest.approx(latencies[recent].max())
+    assert single.summary()['total'] == recent.sum()
+
+    # Empty bins are still part of the series.
+    gap = ev.RollingMetrics(LABELS, window=30)
+    gap.record_many(timestamps, label_codes, verdicts)
+    gap_series = gap.series()
+    assert gap_series['frames'][10:12] == [0, 0]
+    assert gap_series['latency_mean'][0] == 0.0
+    assert len(gap.series(last=5)['time']) == 5
+
+    # Frames older than the window are dropped.
+    single.record(0, 1, True)
+    assert single.dropped == 1
+    assert single.series() == series
+
+    output = io.StringIO()
+    single.write_csv(output)
+    rows = output.getvalue().splitlines()
+    assert len(rows) == 9
+    assert rows[0].startswith('time,frames,attacks')
+    assert rows[0].endswith('flood_true_positive,flood_false_negative')
@@ -0,0 +1,91 @@
+"""Testing for the instrumentation of the IDS"""
+
+import json
+import time
+
+import numpy as np
+import pytest
+
+import tests.rule_abc_test
+from ids.instrumentation import (LatencyHistogram, Profiler,
+                                 write_latency_report)
+from ids.rules_ids import RulesIDS
+
+
+def test_profiler():
+    profiler = Profiler()
+    profiler.stop('off', profiler.start())
+    profiler.count('frames')
+    assert profiler.stats()['spans'] == {}
+    assert profiler.stats()['counters'] == {}
+
+    profiler.enabled = True
+    for _ in range(3):
+        with profiler.span('sleep'):
+            time.sleep(0.001)
+        profiler.count('frames')
+    stats = profiler.stats()
+    assert stats['counters'] == {'frames': 3}
+    span = stats['spans']['sleep']
+    assert span['count'] == 3
+    assert 0.001 <= span['min'] <= span['mean'] <= span['max']
+    assert abs(span['total'] - span['mean'] * 3) < 1e-9
+    assert span['min'] <= span['p50'] <= span['p99'] <= span['max']
+    assert profiler.throughput() > 0
+
+    profiler.reset()
+    assert profiler.stats()['spans'] == {}
+
+
+def test_latency_histogram(tmp_path):
+    rng = np.random.default_rng(0)
+    values = rng.lognormal(11, 1.5, size=5000).astype(np.int64)
+    single, bulk = LatencyHistogram(), LatencyHistogram()
+    for value in values.tolist():
+        single.record(value)
+    bulk.record_many(values[:2000])
+    bulk.record_many(values[2000:])
+    assert np.array_equal(single.counts, bulk.counts)
+    assert single.summary() == bulk.summary()
+
+    summary = bulk.summary()
+    assert summary['count'] == 5000
+    assert summary['max'] == values.max() / 1e9
+    for percent in [50, 95, 99]:
+        expected = np.percentile(values, percent, method='inverted_cdf')
+        assert summary['p' + str(percent)] == pytest.approx(expected / 1e9,
+                                                             rel=0.01)
+    assert bulk.check({'p99': 1.0, 'max': 0.0}) == {
+        'p99': (summary['p99'], 1.0, True),
+        'max': (summary['max'], 0.0, False)
+    }
+
+    write_latency_report({'bulk': bulk}, tmp_path / 'latency.json')
+    with open(tmp_path / 'latency.json') as file:
+        loaded = LatencyHistogram.from_dict(json.load(file)['bulk'])
+    assert np.array_equal(loaded.counts, bulk.counts)
+    assert loaded.summary() == summary
+
+    merged = LatencyHistogram()
+    merged.merge(single)
+    merged.merge(bulk)
+    assert merged.count == 10000
+    assert merged.percentile(50) == summary['p50']
+
+
+def test_rules_ids_profiling(canlist_good):
+    rules = RulesIDS('test_preload')
+    rules.roster = {
+        'load': tests.rule_abc_test.LoadCl,
+        'dummy': tests.rule_abc_test.DummyCl
+    }
+    rules.prepare(canlist_good)
+    rules.profiler.enabled = True
+    results = list(rules.test_series(canlist_good[:100]))
+    assert all(x == (True, 'dummy') for x in results)
+    spans = rules.profiler.stats()['spans']
+    assert spans['rule.load']['count'] == 100
+    assert spans['rule.dummy']['count'] == 100
+
+    rules.test(canlist_good[0])
+    assert rules.profiler.stats()['spans']['rule.dummy']['count'] == 101
@@ -0,0 +1,91 @@
+"""Testing for batch judging"""
+
+import json
+
+import numpy as np
+
+import ids.judge as judge
+import ids.preprocessor as dp
+import ids.synthetic as synthetic
+
+
+class FakeRules:
+    roster = {'even': None, 'big': None}
+
+
+class FakeIDS:
+    """Rejects frames with an even ID, and frames with an ID over 0x400."""
+
+    def __init__(self):
+        self.rules = FakeRules()
+        self.in_simulation = False
+        self.simulations = 0
+
+    def start_simulation(self):
+        self.in_simulation = True
+        self.simulations += 1
+
+    def stop_simulation(self):
+        self.in_simulation = False
+
+    def judge_batch(self, frames, received=None):
+        assert self.in_simulation
+        results = []
+        for frame in frames:
+            if frame['id'] % 2 == 0:
+                results.append((True, 'even'))
+            elif frame['id'] > 0x400:
+                results.append((True, 'big'))
+            else:
+                results.append((frame['id'] % 3 == 0, 0.75))
+        return results
+
+
+def test_judge_capture(tmp_path):
+    capture = tmp_path / 'capture.traffic'
+    synthetic.SyntheticBus.random(seed=0).write(capture, 1000)
+    can_ids = np.array([x['id'] for x in dp.parse_can_file(capture)])
+
+    summary = judge.judge_capture(FakeIDS(), str(capture),
+                                  str(tmp_path / 'out' / 'capture.verdicts'),
+                                  batch_size=100)
+    columns, attrs = judge.load_verdicts(tmp_path / 'out' / 'capture.verdicts')
+    assert attrs['rules'] == ['even', 'big']
+    assert attrs['summary'] == summary
+    even = can_ids % 2 == 0
+    big = ~even & (can_ids > 0x400)
+    passed = ~even & ~big
+    assert np.array_equal(columns['rule'][even], np.full(even.sum(), 1))
+    assert np.array_equal(columns['rule'][big], np.full(big.sum(), 2))
+    assert np.array_equal(columns['rule'][passed], np.zeros(passed.sum()))
+    assert np.array_equal(columns['verdict'][passed],
+                          can_ids[passed] % 3 == 0)
+    assert np.all(np.isnan(columns['confidence'][~passed]))
+    assert np.all(columns['confidence'][passed] == 0.75)
+    assert summary['frames'] == 1000
+    assert summary['rule_counts'] == {'even': even.sum(), 'big': big.sum()}
+    assert summary['malicious'] == columns['verdict'].sum()
+
+
+def test_resume(tmp_path):
+    captures = tmp_path / 'captures'
+    (captures / 'day1').mkdir(parents=True)
+    synthetic.SyntheticBus.random(seed=0).write(captures / 'day1' / 'a.csv',
+                                                500)
+    synthetic.SyntheticBus.random(seed=1).write(captures / 'b.bin', 300)
+    (captures / 'notes.txt').write_text('not a capture')
+    found = judge.find_captures([captures])
+    assert [x[1] for x in found] == ['b.bin', 'day1/a.csv']
+
+    # Every capture has already been judged, so no workers are started and
+    # the summary is rebuilt from the verdict files.
+    outdir = tmp_path / 'verdicts'
+    two_stage = FakeIDS()
+    for filepath, name in found:
+        judge.judge_capture(two_stage, filepath,
+                            judge.verdict_path(outdir, name))
+    assert two_stage.simulations == 2
+    output = judge.judge_captures('model', [captures], outdir, 'idprobs')
+    assert output['total']['frames'] == 800
+    with open(outdir / 'summary.json') as infile:
+        assert json.load(infile) == output
@@ -0,0 +1,61 @@
+"""Testing for the Malicious Generator and its attack library"""
+# pylint: disable = redefined-outer-name
+
+import numpy as np
+import pytest
+
+import ids.malicious_generators
+import ids.preprocessor as dp
+from ids.malicious import MaliciousGenerator
+
+
+@pytest.fixture
+def time_windows(canlist_good):
+    """Columnar (prev, next) pairs for the first 200 gaps of canlist_good"""
+    columns = dp.canlist_to_columns(canlist_good[:201])
+    return (dp.take_columns(columns, slice(0, 200)),
+            dp.take_columns(columns, slice(1, 201)))
+
+
+@pytest.mark.parametrize('name', ['flood', 'replay', 'spoof'])
+def test_batch_matches_generator(name, time_windows):
+    """Deterministic attacks give the same packets in batch form as they do
+    one window at a time."""
+    entry = ids.malicious_generators.ROSTER[name]
+    frames, owners = entry['batch'](time_windows, np.random.default_rng(0))
+
+    expected = []
+    expected_owners = []
+    prev = dp.columns_to_canlist(time_windows[0])
+    nxt = dp.columns_to_canlist(time_windows[1])
+    for window, time_window in enumerate(zip(prev, nxt)):
+        for packet in entry['attack'](time_window):
+            expected.append(packet)
+            expected_owners.append(window)
+    assert dp.columns_to_canlist(frames) == expected
+    assert owners.tolist() == expected_owners
+
+
+def test_random_packet_batch(time_windows):
+    frames, owners = ids.malicious_generators.random_packet_batch(
+        time_windows, np.random.default_rng(0))
+    assert frames['data'].shape == (200, 8)
+    assert frames['data'].dtype == np.uint8
+    assert np.all(frames['id'] < 2048)
+    assert np.array_equal(owners, np.arange(200))
+
+
+def legacy_attack(time_window):
+    """A malicious generator from before the rng argument"""
+    yield dict(time_window[0], id=0x7ff)
+
+
+def test_generator_without_rng(time_windows):
+    malgen = MaliciousGenerator(seed=0)
+    malgen.roster = {'legacy': {'attack': legacy_attack, 'probability': 1.0}}
+    window = dp.columns_to_canlist(time_windows[0])[:2]
+    assert next(malgen.get_attack(window, 'legacy'))['id'] == 0x7ff
+    assert next(malgen.get(window)) == (dict(window[0], id=0x7ff), 'legacy')
+    frames, windows, codes = malgen.get_batch(time_windows)
+    assert (frames['id'] == 0x7ff).all() and len(windows) == 200
+    assert (codes == 1).all()
@@ -0,0 +1,99 @@
+"""Testing for multi-bus detection"""
+
+import multiprocessing
+
+import numpy as np
+import pytest
+
+import ids.preprocessor as dp
+import ids.synthetic as synthetic
+from ids.multibus import BusSupervisor, SharedArrays
+from ids.two_stage_ids import TwoStageIDS
+from tests.dnn_kernel_test import random_kernel
+
+
+def _read_shared(name, outqueue):
+    shared = SharedArrays.attach(name)
+    outqueue.put((shared.meta, shared.arrays['a'].sum(),
+                  shared.arrays['a'].flags.writeable))
+    shared.close()
+
+
+def test_shared_arrays():
+    arrays = {'a': np.arange(100, dtype=np.int64),
+              'b': np.ones((3, 5), dtype=np.float32)}
+    shared = SharedArrays.create(arrays, {'name': 'test'})
+    try:
+        assert np.array_equal(shared.arrays['b'], arrays['b'])
+        context = multiprocessing.get_context('spawn')
+        outqueue = context.Queue()
+        process = context.Process(target=_read_shared,
+                                  args=(shared.name, outqueue))
+        process.start()
+        assert outqueue.get(timeout=60) == ({'name': 'test'}, 4950, False)
+        process.join()
+    finally:
+        shared.unlink()
+
+
+def trained_ids():
+    bus = synthetic.SyntheticBus.random(seed=0)
+    clean = dp.columns_to_canlist(bus.generate(30000))
+    two_stage = TwoStageIDS(dnn=random_kernel([10, 20]))
+    two_stage.rules.prepare(clean, set_profile_id='multibus')
+    two_stage.idprobs = dp.ID_ProbTable.from_dict(dp.write_id_probs(clean))
+    two_stage.dnn_trained = two_stage.rules_trained = True
+    return two_stage
+
+
+def test_supervisor(monkeypatch, tmp_path):
+    monkeypatch.setattr('ids.rules.Rule.SAVE_PATH', tmp_path)
+    two_stage = trained_ids()
+
+    captures = {}
+    # More frames than the reorder interval of the rules, whose reordering
+    # must not change the rules reported.
+    for seed in [1, 2]:
+        frames = dp.columns_to_canlist(
+            synthetic.SyntheticBus.random(seed=seed).generate(5000))
+        two_stage.start_simulation()
+        captures['can{}'.format(seed)] = (frames,
+                                          two_stage.judge_batch(frames))
+        two_stage.stop_simulation()
+    synthetic.write_column_file(dp.canlist_to_columns(captures['can2'][0]),
+                                tmp_path / 'can2.bin')
+
+    supervisor = BusSupervisor.from_ids(two_stage, chunk_size=500)
+    supervisor.add_bus('can1')
+    supervisor.add_bus('can2', tmp_path / 'can2.bin')
+    verdicts = {'can1': [], 'can2': []}
+    with supervisor:
+        supervisor.feed('can1', captures['can1'][0])
+        supervisor.close_bus('can1')
+        for verdict in supervisor.verdicts(timeout=120):
+            verdicts[verdict['bus']].append(verdict)
+
+    for name, (frames, expected) in captures.items():
+        assert [x['seq'] for x in verdicts[name]] == list(range(len(frames)))
+        assert [x['id'] for x in verdicts[name]] == [x['id'] for x in frames]
+        assert [x['malicious'] for x in verdicts[name]] == [
+            x[0] for x in expected
+        ]
+        assert [x['rule'] or x['confidence'] for x in verdicts[name]] == [
+            x[1] for x in expected
+        ]
+    stats = supervisor.stats()
+    assert stats['can1']['frames'] == 5000 and stats['can1']['finished']
+    assert stats['can2']['judge_frames_per_sec'] > 0
+
+
+def test_supervisor_dead_worker(monkeypatch, tmp_path):
+    monkeypatch.setattr('ids.rules.Rule.SAVE_PATH', tmp_path)
+    monkeypatch.setattr('ids.multibus.WORKER_POLL_SECONDS', 0.1)
+    supervisor = BusSupervisor.from_ids(trained_ids())
+    supervisor.add_bus('can1')
+    with supervisor:
+        # Killed without reporting an error, like the OOM killer would.
+        supervisor._processes['can1'].kill()
+        with pytest.raises(RuntimeError, match='bus can1 died'):
+            list(supervisor.verdicts())
@@ -103,3 +103,15 @@ def test_load(tmp_path):
     # remove sample file (check out pytest fixtures for this)
     sample_path.unlink()
     sample_path.parent.rmdir()
+
+
+def test_profile_data_used_once(tmp_path):
+    rul = LoadCl('test_profile_data')
+    rul.SAVE_PATH = tmp_path
+    rul.prepare(SAMPLE)
+    rul.profile_data = {'asdf': [-1]}
+    rul.prepare()
+    assert rul.asdf == [-1] and rul.profile_data is None
+    # Preparing again reads the profile file.
+    rul.prepare()
+    assert rul.asdf == [x['id'] for x in SAMPLE]
@@ -8,7 +8,8 @@ Note:
 import pytest
 
 import tests.rule_abc_test
-from ids.rules_ids import RulesIDS
+from ids.rule_abc import Rule
+from ids.rules_ids import RulesIDS, merge_profiles
 
 TEST_ROSTER = {
     'dummy': tests.rule_abc_test.DummyCl,
@@ -82,3 +83,107 @@ def test_test(prepared_rules_ids, canlist_good):
 
     for res in prepared_rules_ids.test_series(canlist_good):
         assert res == (False, None)
+
+
+def test_merge_profiles(canlist_good, tmp_path, monkeypatch):
+    monkeypatch.setattr('ids.rules.Rule.SAVE_PATH', tmp_path)
+    half = len(canlist_good) // 2
+    RulesIDS('first').prepare(canlist_good[:half])
+    RulesIDS('second').prepare(canlist_good[half:])
+    merged = merge_profiles(['first', 'second'], 'merged')
+    assert merged.is_prepared
+    assert merged.roster['ID_Whitelist'].whitelist == set(
+        x['id'] for x in canlist_good)
+
+    # The merged profile is saved, and matches incremental preparation.
+    loaded = RulesIDS('merged')
+    loaded.prepare()
+    incremental = RulesIDS('incremental')
+    incremental.prepare(canlist_good[:half])
+    incremental.prepare(canlist_good[half:], incremental=True)
+    for name in ['ID_Whitelist', 'MessageFrequency']:
+        assert loaded.read_profile_data()[name].keys() == \
+            incremental.read_profile_data()[name].keys()
+    assert loaded.roster['MessageFrequency'].frequencies.keys() == \
+        incremental.roster['MessageFrequency'].frequencies.keys()
+    # Histograms with different bins are merged approximately, but every
+    # time interval is still counted.
+    assert {k: sum(v) for k, v in loaded.roster['TimeInterval'].counts.items()} \
+        == {k: sum(v) for k, v in incremental.roster['TimeInterval'].counts.items()}
+
+
+class SlowPass(Rule):
+    """Passes every frame, slowly"""
+
+    def test(self, canlist):
+        for pak in canlist:
+            sum(range(2000))
+            yield False
+
+
+class HighID(Rule):
+    """Fails frames with an ID of 1000 or more"""
+
+    def test(self, canlist):
+        for pak in canlist:
+            yield pak['id'] >= 1000
+
+
+class OddID(Rule):
+    """Fails frames with an odd ID"""
+
+    def test(self, canlist):
+        for pak in canlist:
+            yield pak['id'] % 2 == 1
+
+
+def ordered_rules_ids(rule_order, reorder_interval=500):
+    rul = RulesIDS('test_order', rule_order, reorder_interval)
+    rul.roster = {'slow': SlowPass, 'high': HighID, 'odd': OddID}
+    rul.prepare()
+    return rul
+
+
+def test_rule_order():
+    frames = [{'id': x % 2000, 'timestamp': x, 'data': b''}
+              for x in range(5000)]
+    fixed = [ordered_rules_ids('fixed').test(x) for x in frames]
+    adaptive = ordered_rules_ids('adaptive')
+    canonical = ordered_rules_ids('canonical')
+
+    # The verdicts never depend on the order, and the canonical order
+    # reports the same rule as the order of the roster.
+    adaptive_results = [adaptive.test(x) for x in frames]
+    assert [x[0] for x in adaptive_results] == [x[0] for x in fixed]
+    assert [canonical.test(x) for x in frames] == fixed
+    assert {x[1] for x in fixed} == {None, 'high', 'odd'}
+
+    # The rules that fail frames cheaply are tested first.
+    statistics = adaptive.rule_statistics()
+    assert statistics['slow']['position'] == 2
+    assert statistics['slow']['rejection_rate'] == 0.0
+    assert statistics['slow']['mean_cost_ns'] > \
+        statistics['odd']['mean_cost_ns']
+    assert canonical.rule_statistics()['slow']['position'] == 2
+    # Until reordering, the first rule in the roster to fail is reported.
+    assert adaptive_results[:500] == fixed[:500]
+
+    # Changing the roster starts over in its order.
+    del adaptive.roster['high']
+    assert adaptive.test(frames[1]) == (True, 'odd')
+    assert list(adaptive.rule_statistics()) == ['slow', 'odd']
+
+    with pytest.raises(ValueError):
+        RulesIDS('test_order', 'random')
+
+
+def test_canonical_rule_order_reordered():
+    assert RulesIDS().rule_order == 'fixed'
+    # More frames than the default reorder interval, so the rules are
+    # reordered while testing them.
+    frames = [{'id': x % 2000, 'timestamp': x, 'data': b''}
+              for x in range(10000)]
+    rul = ordered_rules_ids('canonical', RulesIDS().reorder_interval)
+    fixed = ordered_rules_ids('fixed')
+    assert [rul.test(x) for x in frames] == [fixed.test(x) for x in frames]
+    assert rul.rule_statistics()['slow']['position'] == 2
@@ -9,9 +9,12 @@
 # separately, for each rule.
 
 import collections
+import statistics
 
+import numpy as np
 import pytest
 
+import ids.preprocessor
 import ids.rules
 
 # False positive/negative rates to be considered passing.
@@ -144,3 +147,84 @@ def test_sequence(canlist_good, canlist_bad, tmp_path):
 
     # check save & load is correct
     assert presave == postsave
+
+
+def test_incremental_prepare(canlist_good, tmp_path):
+    """Testing incremental preparation and merging of rule profiles"""
+    first, second = canlist_good[:len(canlist_good) // 2], \
+        canlist_good[len(canlist_good) // 2:]
+
+    def prepared_rule(cls, profile_id, *canlists):
+        rul = cls(profile_id)
+        rul.SAVE_PATH = tmp_path
+        rul.prepare(canlists[0])
+        for canlist in canlists[1:]:
+            rul.prepare(canlist, incremental=True)
+        return rul
+
+    # Whitelists are the union of the ID's seen.
+    whitelist = prepared_rule(ids.rules.ID_Whitelist, 'inc', first, second)
+    assert whitelist.whitelist == set(x['id'] for x in canlist_good)
+    merged = prepared_rule(ids.rules.ID_Whitelist, 'merged', first)
+    merged.merge(prepared_rule(ids.rules.ID_Whitelist, 'other', second))
+    assert merged.whitelist == whitelist.whitelist
+
+    # Frequency ranges match those calculated from every frequency seen.
+    frequency = prepared_rule(ids.rules.MessageFrequency, 'inc', first,
+                              second)
+    observed = collections.defaultdict(list)
+    for canlist in [first, second]:
+        id_counts = ids.preprocessor.ID_Past().feed(canlist)
+        for count, pak in zip(id_counts, canlist):
+            observed[pak['id']].append(count)
+    for can_id, counts in observed.items():
+        if len(counts) > 1:
+            low, high = frequency.frequencies[can_id]
+            assert (low + high) / 2 == pytest.approx(statistics.mean(counts))
+            assert (high - low) / 4 == pytest.approx(statistics.stdev(counts))
+    merged = prepared_rule(ids.rules.MessageFrequency, 'merged', first)
+    merged.merge(prepared_rule(ids.rules.MessageFrequency, 'other', second))
+    assert merged.frequencies.keys() == frequency.frequencies.keys()
+    for can_id, (low, high) in merged.frequencies.items():
+        assert low == pytest.approx(frequency.frequencies[can_id][0])
+        assert high == pytest.approx(frequency.frequencies[can_id][1])
+
+    # Time interval histograms count every interval seen, and are saved.
+    interval = prepared_rule(ids.rules.TimeInterval, 'inc', first, second)
+    assert sum(sum(x) for x in interval.counts.values()) == len(canlist_good)
+    loaded = ids.rules.TimeInterval('inc')
+    loaded.SAVE_PATH = tmp_path
+    loaded.prepare()
+    assert loaded.counts == interval.counts
+    assert loaded.valid_bins == interval.valid_bins
+    merged = prepared_rule(ids.rules.TimeInterval, 'merged', first)
+    merged.merge(prepared_rule(ids.rules.TimeInterval, 'other', second))
+    assert sum(sum(x) for x in merged.counts.values()) == len(canlist_good)
+    for can_id, bins in merged.bins.items():
+        assert len(bins) == len(merged.counts[can_id]) + 1
+
+    # Profiles saved without mergeable working data can't be added to.
+    old = prepared_rule(ids.rules.MessageFrequency, 'old', first)
+    old.moments = {}
+    old._save({'frequencies': old.frequencies, 'time_frame': 1})
+    with pytest.raises(ValueError):
+        old.prepare(second, incremental=True)
+
+
+def test_time_interval_bins(tmp_path):
+    """Testing re-binning of TimeInterval histograms"""
+    rul = ids.rules.TimeInterval('bins')
+    rul.SAVE_PATH = tmp_path
+    rul.max_bins = 20
+    rul.num_bins = 10
+    rul.prepare([{'id': 1, 'timestamp': x * 10, 'data': b''}
+                 for x in range(100)])
+    assert len(rul.bins[1]) == 11
+    # Much longer intervals extend the histogram, widening its bins to stay
+    # within max_bins.
+    rul.prepare([{'id': 1, 'timestamp': x * 100, 'data': b''}
+                 for x in range(100)], incremental=True)
+    assert len(rul.bins[1]) <= 21
+    assert rul.bins[1][0] <= -1 and rul.bins[1][-1] >= 100
+    assert sum(rul.counts[1]) == 200
+    assert np.allclose(np.diff(rul.bins[1]), rul.bins[1][1] - rul.bins[1][0])
@@ -0,0 +1,116 @@
+"""Testing for the live detection service"""
+
+import asyncio
+
+import numpy as np
+
+import ids.preprocessor as dp
+import ids.service as service
+import ids.synthetic as synthetic
+
+
+class FakeIDS:
+    """Judges every frame with an even ID as malicious."""
+
+    def __init__(self):
+        self.batches = []
+
+    def judge_batch(self, frames, received=None):
+        self.batches.append(len(frames))
+        return [(True, 'even') if x['id'] % 2 == 0 else (False, 0.25)
+                for x in frames]
+
+
+def test_encode_decode():
+    columns = synthetic.SyntheticBus.random(seed=0).generate(100)
+    records = service.decode_frames(service.encode_frames(columns, 10))
+    assert records['seq'].tolist() == list(range(10, 110))
+    assert np.array_equal(records['timestamp'], columns['timestamp'])
+    assert np.array_equal(records['id'], columns['id'])
+    assert np.array_equal(records['data'], columns['data'])
+
+
+def test_ingest_counts():
+    async def run():
+        detector = service.DetectionService(FakeIDS(), queue_size=50)
+        columns = synthetic.SyntheticBus.random(seed=0).generate(100)
+        records = service.decode_frames(service.encode_frames(columns))
+        detector.ingest(records[:20], 'a')
+        # Frames 20-29 never arrive.
+        detector.ingest(records[30:60], 'a')
+        # The queue only has room for 50 frames.
+        detector.ingest(records[:10], 'b')
+        stats = detector.stats()
+        assert stats['received'] == 60
+        assert stats['lost'] == 10
+        assert stats['dropped'] == 10
+        assert stats['queued'] == 50
+        assert detector.judge_next_batch() == 50
+        assert detector.stats()['judged'] == 50
+
+    asyncio.run(run())
+
+
+def test_lost_frames_across_wrap():
+    async def run():
+        detector = service.DetectionService(FakeIDS())
+        columns = synthetic.SyntheticBus.random(seed=0).generate(120)
+        # Numbered from 2**32 - 50, so the numbers wrap to 0 halfway.
+        records = service.decode_frames(
+            service.encode_frames(columns, service.SEQ_MODULUS - 50))
+        assert records['seq'][50] == 0
+        detector.ingest(records[:40], 'a')
+        # Frames 40-44 never arrive, and 45-64 arrive in one batch that
+        # wraps around.
+        detector.ingest(records[45:65], 'a')
+        assert detector.stats()['lost'] == 5
+        # Frames 65-69 never arrive either, and a late frame arrives.
+        detector.ingest(records[70:100], 'a')
+        detector.ingest(records[42:43], 'a')
+        detector.ingest(records[100:], 'a')
+        assert detector.stats()['lost'] == 10
+
+    asyncio.run(run())
+
+
+def test_replay_unix(tmp_path):
+    bus = synthetic.SyntheticBus.random(seed=1)
+    capture = tmp_path / 'capture.bin'
+    bus.write(capture, 5000)
+    expected = dp.parse_can_file(capture)
+
+    async def run():
+        fake = FakeIDS()
+        detector = service.DetectionService(fake, max_batch=1000)
+        verdicts = detector.subscribe(maxsize=0)
+        await detector.serve_unix(str(tmp_path / 'ids.sock'))
+        runner = asyncio.ensure_future(detector.run())
+        sent = await service.replay(capture, str(tmp_path / 'ids.sock'),
+                                    speed=0)
+        assert sent == 5000
+        judged = []
+        while len(judged) < sent:
+            judged += await asyncio.wait_for(verdicts.get(), 10)
+        # Give the connection handler a moment to see the end of the stream.
+        for _ in range(100):
+            if not detector._next_seq:
+                break
+            await asyncio.sleep(0.01)
+        await detector.stop()
+        runner.cancel()
+        return fake, detector.stats(), judged, len(detector._next_seq)
+
+    fake, stats, judged, senders = asyncio.run(run())
+    # The sequence numbers of the closed connection are forgotten.
+    assert senders == 0
+    assert max(fake.batches) <= 1000
+    assert stats['judged'] == 5000
+    assert stats['lost'] == stats['dropped'] == 0
+    assert stats['latency']['count'] == 5000
+    assert [x['seq'] for x in judged] == list(range(5000))
+    assert [x['id'] for x in judged] == [x['id'] for x in expected]
+    for verdict in judged:
+        if verdict['id'] % 2 == 0:
+            assert verdict['malicious'] and verdict['rule'] == 'even'
+        else:
+            assert verdict['confidence'] == 0.25
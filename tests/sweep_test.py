@@ -0,0 +1,86 @@
+"""Testing for the hyperparameter sweep helpers that don't train a model"""
+
+import csv
+import json
+
+import pytest
+
+from ids.sweep import (OPTIMIZER_DEFAULTS, expand_grid, rank, sample_random,
+                       score, write_leaderboard)
+
+SPACE = {
+    'hidden_units': [[10, 20], [32, 32, 32]],
+    'activation_fn': ['ReLU', 'Tanh'],
+    'loss_reduction': ['Sum'],
+    'optimizer': [
+        {'name': 'Adam Optimizer', 'Learning Rate': [0.001, 0.01, 0.1]},
+        {'name': 'Gradient Descent Optimizer'}
+    ]
+}
+
+
+def test_expand_grid():
+    candidates = expand_grid(SPACE)
+    # 2 hidden units * 2 activations * (3 Adam + 1 gradient descent)
+    assert len(candidates) == 16
+    assert len({json.dumps(x, sort_keys=True) for x in candidates}) == 16
+    adam = [x for x in candidates if x['optimizer'] == 'Adam Optimizer']
+    assert {x['optimizer_properties']['Learning Rate'] for x in adam} == \
+        {0.001, 0.01, 0.1}
+    # Properties that are left out take the defaults.
+    assert all(x['optimizer_properties']['Beta_2'] == 0.999 for x in adam)
+    descent = [x for x in candidates if x['optimizer'] != 'Adam Optimizer']
+    assert all(x['optimizer_properties'] ==
+               OPTIMIZER_DEFAULTS['Gradient Descent Optimizer']
+               for x in descent)
+
+    with pytest.raises(ValueError):
+        expand_grid(dict(SPACE, optimizer=[{'name': 'Nope'}]))
+    with pytest.raises(ValueError):
+        expand_grid(dict(SPACE, activation_fn=[]))
+
+
+def test_sample_random():
+    candidates = sample_random(SPACE, 10, seed=1)
+    assert candidates == sample_random(SPACE, 10, seed=1)
+    grid = [json.dumps(x, sort_keys=True) for x in expand_grid(SPACE)]
+    keys = [json.dumps(x, sort_keys=True) for x in candidates]
+    assert len(set(keys)) == 10
+    assert set(keys) <= set(grid)
+    # Once every distinct candidate is drawn, the rest are repeats.
+    assert len(sample_random(SPACE, 20, seed=1)) == 20
+
+
+def test_score():
+    result = score([1, 1, 0, 0, 1], [1, 0, 0, 1, 1])
+    assert result['accuracy'] == pytest.approx(0.6)
+    assert result['precision'] == pytest.approx(2 / 3)
+    assert result['recall'] == pytest.approx(2 / 3)
+    assert result['f1'] == pytest.approx(2 / 3)
+    assert score([0, 0], [0, 0])['f1'] == 0.0
+
+
+def test_rank(tmp_path):
+    candidate = expand_grid(SPACE)[0]
+    results = [
+        dict(candidate, name='slow', f1=0.9, accuracy=0.95, train_seconds=20),
+        dict(candidate, name='failed', error='ValueError: bad'),
+        dict(candidate, name='fast', f1=0.9, accuracy=0.95, train_seconds=10),
+        dict(candidate, name='worse', f1=0.5, accuracy=0.99, train_seconds=1),
+        dict(candidate, name='sharper', f1=0.9, accuracy=0.97,
+             train_seconds=30)
+    ]
+    ranked = rank(results)
+    assert [x['name'] for x in ranked] == \
+        ['sharper', 'fast', 'slow', 'worse', 'failed']
+    assert [x['rank'] for x in ranked] == [1, 2, 3, 4, 5]
+    assert [x['name'] for x in rank(results, 'accuracy')][0] == 'worse'
+
+    write_leaderboard(ranked, tmp_path)
+    with open(tmp_path / 'leaderboard.json') as file:
+        assert json.load(file) == ranked
+    with open(tmp_path / 'leaderboard.csv', newline='') as file:
+        rows = list(csv.DictReader(file))
+    assert [x['name'] for x in rows] == [x['name'] for x in ranked]
+    assert json.loads(rows[0]['hidden_units']) == candidate['hidden_units']
+    assert rows[-1]['error'] == 'ValueError: bad'
@@ -0,0 +1,70 @@
+"""Testing for the synthetic CAN traffic generator"""
+
+import numpy as np
+import pytest
+
+import ids.preprocessor as dp
+import ids.synthetic as synthetic
+
+
+def test_random_bus():
+    bus = synthetic.SyntheticBus.random(bus_load=0.4, seed=3)
+    assert bus.bus_load() == pytest.approx(0.4, rel=0.02)
+
+    columns = bus.generate(20000)
+    assert len(columns['id']) == 20000
+    assert np.all(np.diff(columns['timestamp']) >= 0)
+    assert dp.validate_columns(columns)['valid']
+    # Frames are sent at about the rate the bus was built for.
+    seconds = columns['timestamp'][-1] / synthetic.TICKS_PER_SECOND
+    assert 20000 / seconds == pytest.approx(bus.frame_rate, rel=0.05)
+
+    bus.reset()
+    again = bus.generate(20000)
+    for key in columns:
+        assert np.array_equal(columns[key], again[key])
+
+    with pytest.raises(ValueError):
+        synthetic.SyntheticBus.random(bus_load=1.5)
+
+
+def test_periodic_message():
+    message = synthetic.PeriodicMessage(id=0x100, period=100, jitter=5, dlc=8,
+                                        payload=[0x30] * 8, signal=0,
+                                        counter=6, checksum=7)
+    bus = synthetic.SyntheticBus([message], seed=0)
+    columns = bus.generate(500)
+    gaps = np.diff(columns['timestamp'])
+    assert np.all((gaps >= 90) & (gaps <= 110))
+    data = columns['data']
+    assert np.array_equal(data[:, 6] & 0x0F, np.arange(500) % 16)
+    assert np.array_equal(data[:, 7],
+                          data[:, :7].sum(axis=1, dtype=np.int64) % 256)
+    assert np.all(data[:, 2:6] == 0x30)
+
+
+def test_write_files(tmp_path):
+    bus = synthetic.SyntheticBus.random(seed=5)
+    columns = bus.generate(3000)
+    columns['dlc'][:8] = np.arange(1, 9)
+    expected = dp.columns_to_canlist(columns)
+
+    synthetic.write_csv_file(
+        [dp.take_columns(columns, slice(0, 1000)),
+         dp.take_columns(columns, slice(1000, None))], tmp_path / 'bus.csv')
+    assert dp.parse_csv(str(tmp_path / 'bus.csv')) == expected
+
+    synthetic.write_traffic_file(columns, tmp_path / 'bus.traffic')
+    traffic = dp.parse_traffic(str(tmp_path / 'bus.traffic'))
+    # .traffic timestamps are in whole milliseconds.
+    for frame in expected:
+        frame['timestamp'] -= frame['timestamp'] % 10
+    assert traffic == expected
+
+    bus.reset()
+    bus.write(tmp_path / 'bus.bin', 3000, chunk_size=700)
+    frames = dp.parse_can_file(tmp_path / 'bus.bin')
+    assert len(frames) == 3000
+    assert np.array_equal(dp.count_ids(tmp_path / 'bus.bin'),
+                          np.bincount([x['id'] for x in frames],
+                                      minlength=dp.NUM_IDS))
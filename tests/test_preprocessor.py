@@ -5,8 +5,10 @@ import pathlib
 import sys
 from ast import literal_eval
 
+import numpy as np
 import pytest
 
+import ids.column_store
 import ids.preprocessor as dp
 from ids.malicious import MaliciousGenerator
 
@@ -155,3 +157,189 @@ def test_inject_malicious_packets():
     assert not all(x is None for x in labels)
     assert len(frames) > prev_len
     assert dp.validate_can_data(frames)
+
+
+def test_columns_round_trip():
+    frames = dp.parse_csv(
+        SAMPLE_PATH /
+        'csv/2006 Ford Fusion/Test Data/2006 Ford Fusion Test.csv')
+    frames[3]['data'] = b'\x01\x02'
+    columns = dp.canlist_to_columns(frames)
+    assert columns['data'].shape == (len(frames), 8)
+    assert columns['dlc'][3] == 2
+    assert dp.columns_to_canlist(columns) == frames
+
+
+def test_inject_malicious_columns():
+    frames = dp.parse_csv(
+        SAMPLE_PATH /
+        'csv/2006 Ford Fusion/Test Data/2006 Ford Fusion Test.csv')
+    columns = dp.canlist_to_columns(frames)
+    mg = MaliciousGenerator()
+    new_columns, codes = dp.inject_malicious_columns(columns, mg, seed=1)
+    assert codes.dtype == np.int8
+    assert len(codes) == len(new_columns['id']) > len(frames)
+    # Benign frames keep their original order.
+    assert np.array_equal(new_columns['id'][codes == 0], columns['id'])
+    # Every flood attack injects 21 frames.
+    assert np.sum(codes == mg.labels.index('flood')) % 21 == 0
+
+    # The same seed gives the same dataset.
+    again_columns, again_codes = dp.inject_malicious_columns(columns, mg, seed=1)
+    assert np.array_equal(codes, again_codes)
+    assert np.array_equal(new_columns['timestamp'], again_columns['timestamp'])
+
+
+def test_inject_malicious_columns_parallel():
+    frames = dp.parse_csv(
+        SAMPLE_PATH /
+        'csv/2006 Ford Fusion/Test Data/2006 Ford Fusion Test.csv')
+    columns = dp.canlist_to_columns(frames)
+    mg = MaliciousGenerator()
+    serial = dp.inject_malicious_columns(columns, mg, seed=7, chunk_size=1000)
+    parallel = dp.inject_malicious_columns(
+        columns, mg, seed=7, chunk_size=1000, processes=2)
+    assert np.array_equal(serial[1], parallel[1])
+    for key in dp.COLUMN_DTYPES:
+        assert np.array_equal(serial[0][key], parallel[0][key])
+
+
+def test_feature_file(tmp_path):
+    frames = dp.parse_csv(
+        SAMPLE_PATH /
+        'csv/2006 Ford Fusion/Test Data/2006 Ford Fusion Test.csv')
+    idprobs = dp.write_id_probs(frames)
+    mg = MaliciousGenerator()
+    columns, codes = dp.inject_malicious_columns(
+        dp.canlist_to_columns(frames[:2000]), mg, seed=3)
+    feature_lists = dp.generate_feature_lists(
+        dp.columns_to_canlist(columns), idprobs)
+
+    feat_file = tmp_path / 'features_labels.bin'
+    dp.write_feature_file(feature_lists, codes, feat_file, mg.labels,
+                          chunk_size=500)
+    loaded, loaded_codes = dp.load_feature_lists(feat_file)
+    assert np.array_equal(loaded_codes, codes)
+    for key, value in feature_lists.items():
+        assert np.array_equal(loaded[key], value)
+
+
+def test_id_probs_from_files(tmp_path):
+    csv_path = (SAMPLE_PATH /
+                'csv/2006 Ford Fusion/Test Data/2006 Ford Fusion Test.csv')
+    traffic_path = SAMPLE_PATH / 'traffic/asia_train.traffic'
+    frames = dp.parse_csv(csv_path) + dp.parse_traffic(traffic_path)
+    expected = dp.write_id_probs(frames)
+
+    probs_file = tmp_path / 'idprobs.json'
+    idprobs = dp.write_id_probs_from_files([csv_path, traffic_path],
+                                           probs_file, processes=2)
+    assert idprobs.keys() == expected.keys()
+    assert all(np.isclose(idprobs[k], expected[k]) for k in expected)
+    assert dp.load_id_probs(probs_file) == idprobs
+
+    # Counting the files one at a time gives the same result.
+    dp.write_id_probs_from_files([csv_path], probs_file, processes=1)
+    updated = dp.write_id_probs_from_files([traffic_path], probs_file,
+                                           processes=1, update=True)
+    assert updated == idprobs
+
+
+def test_id_prob_table(tmp_path):
+    frames = dp.parse_csv(
+        SAMPLE_PATH /
+        'csv/2006 Ford Fusion/Test Data/2006 Ford Fusion Test.csv')
+    probs_file = tmp_path / 'idprobs.json'
+    # Leave some IDs out of the probabilities, so unknown IDs are tested.
+    idprobs = dp.write_id_probs(frames[:3000], probs_file)
+    table = dp.load_id_prob_table(probs_file)
+    assert table.to_dict() == idprobs
+    assert table.get(1072) == idprobs[1072]
+    assert table.get(5) == 0
+
+    feature_lists = dp.generate_feature_lists(frames, idprobs)
+    table_lists = dp.generate_feature_lists(frames, table)
+    for key, value in feature_lists.items():
+        assert np.allclose(table_lists[key], value, rtol=0, atol=1e-12)
+
+    # Feeding in batches carries the state over between them.
+    entropy = dp.ID_Entropy()
+    results = [
+        entropy.feed_batch([x['id'] for x in frames[i:i + 1000]], table)
+        for i in range(0, len(frames), 1000)
+    ]
+    assert np.allclose(np.concatenate([x[1] for x in results]),
+                       feature_lists['system_entropy_change'],
+                       rtol=0,
+                       atol=1e-12)
+
+
+def test_validate_columns():
+    frames = dp.parse_csv(
+        SAMPLE_PATH /
+        'csv/2006 Ford Fusion/Test Data/2006 Ford Fusion Test.csv')
+    report = dp.validate_columns(dp.canlist_to_columns(frames))
+    assert report['valid']
+    assert report['num_frames'] == len(frames)
+
+    frames[124]['id'] = 3999
+    frames[32]['data'] = b'aaaaaaaaaaaa'
+    frames[32]['timestamp'] = -1
+    frames[40]['id'] = 2048
+    report = dp.validate_columns(dp.canlist_to_columns(frames),
+                                 max_indices=1)
+    assert not report['valid']
+    errors = report['errors']
+    assert errors['id_out_of_range'] == {'count': 2, 'indices': [40]}
+    assert errors['negative_timestamp'] == {'count': 1, 'indices': [32]}
+    assert errors['timestamp_decreasing'] == {'count': 1, 'indices': [32]}
+    assert errors['dlc_too_long'] == {'count': 1, 'indices': [32]}
+    assert errors['empty']['count'] == 0
+    assert 'ID is outside the range 0-2047: 2 frames' in \
+        dp.validation_summary(report)
+
+    report = dp.validate_columns(dp.empty_columns())
+    assert not report['valid'] and report['errors']['empty']['count'] == 1
+
+
+def test_validate_canlist():
+    frames = dp.parse_csv(
+        SAMPLE_PATH /
+        'csv/2006 Ford Fusion/Test Data/2006 Ford Fusion Test.csv')
+    columns, report = dp.validate_canlist(frames)
+    assert report['valid']
+    assert np.array_equal(columns['id'], dp.canlist_to_columns(frames)['id'])
+
+    frames[10]['id'] = 'abc'
+    frames[20]['id'] = 2**40
+    frames[30]['data'] = [1, 2, 3]
+    del frames[35]['timestamp']
+    frames[40]['id'] = 2048
+    columns, report = dp.validate_canlist(frames)
+    assert columns is None
+    assert not report['valid']
+    assert report['num_frames'] == len(frames)
+    errors = report['errors']
+    assert errors['unconvertible'] == {'count': 4, 'indices': [10, 20, 30, 35]}
+    # The other frames are still checked, with their own indices.
+    assert errors['id_out_of_range'] == {'count': 1, 'indices': [40]}
+    assert errors['empty']['count'] == 0
+    assert 'wrong type or is too large: 4 frames' in \
+        dp.validation_summary(report)
+
+
+def test_iter_can_file(tmp_path):
+    traffic = SAMPLE_PATH / 'traffic/asia_train.traffic'
+    frames = dp.parse_traffic(traffic)
+    assert list(dp.iter_can_file(traffic)) == frames
+
+    dp.write_canlist(frames, tmp_path / 'canlist.json')
+    assert list(dp.iter_can_file(tmp_path / 'canlist.json')) == frames
+
+    columns = dp.canlist_to_columns(frames)
+    ids.column_store.write_columns(tmp_path / 'frames.bin', columns)
+    assert list(dp.iter_can_file(tmp_path / 'frames.bin',
+                                 chunk_size=1000)) == frames
+
+    with pytest.raises(FileNotFoundError):
+        dp.iter_can_file(tmp_path / 'missing.traffic')
@@ -146,4 +146,87 @@ def test_simulation(prepared_ids: TwoStageIDS, bad_canlist):
     for frame in bad_canlist[:100]:
         result = ids.judge_single_frame(frame)
         assert isinstance(result, tuple) and isinstance(result[0], bool) and (isinstance(result[1], float) or isinstance(result[1], str))
-    ids.stop_simulation()
\ No newline at end of file
+    ids.stop_simulation()
+
+def test_judge_batch(prepared_ids: TwoStageIDS, bad_canlist):
+    ids = prepared_ids
+    with pytest.raises(RuntimeError, match='not currently in a simulation'):
+        ids.judge_batch(bad_canlist[:10])
+
+    # Judging a batch gives the same results as judging the frames one by
+    # one.
+    ids.start_simulation()
+    expected = [ids.judge_single_frame(frame) for frame in bad_canlist[:100]]
+    ids.stop_simulation()
+    ids.start_simulation()
+    results = ids.judge_batch(bad_canlist[:50]) + ids.judge_batch(bad_canlist[50:100])
+    ids.stop_simulation()
+    assert [x[0] for x in results] == [x[0] for x in expected]
+    for result, single in zip(results, expected):
+        if isinstance(single[1], str):
+            assert result[1] == single[1]
+        else:
+            assert result[1] == pytest.approx(single[1], abs=1e-5)
+    assert ids.latency['judge_batch'].count == 100
+
+def test_judge_stream(prepared_ids: TwoStageIDS, bad_canlist):
+    ids = prepared_ids
+    ids.start_simulation()
+    with pytest.raises(RuntimeError, match='must not be in a simulation'):
+        ids.judge_stream(bad_canlist)
+    expected = ids.judge_batch(bad_canlist[:1000])
+    ids.stop_simulation()
+
+    # Judging a stream gives the same results as judging a batch.
+    results = list(ids.judge_stream(iter(bad_canlist[:1000]), chunk_size=64))
+    assert [x[0] for x in results] == [x[0] for x in expected]
+    for result, batch in zip(results, expected):
+        if isinstance(batch[1], str):
+            assert result[1] == batch[1]
+        else:
+            assert result[1] == pytest.approx(batch[1], abs=1e-5)
+    assert ids.latency['judge_stream'].count == 1000
+
+    # An error reading the frames is raised by the generator.
+    def broken_frames():
+        yield from bad_canlist[:100]
+        raise ValueError('broken capture')
+    with pytest.raises(ValueError, match='broken capture'):
+        list(ids.judge_stream(broken_frames(), chunk_size=64))
+
+class CountingDNN:
+    """Stands in for the DNN Based IDS, calling every frame with an odd ID
+    malicious, and counting the frames it predicts."""
+
+    def __init__(self):
+        self.predicted = 0
+
+    @staticmethod
+    def _predict(can_id):
+        return bool(can_id % 2), 0.5 + (can_id % 100) / 200
+
+    def predict_batch(self, processed_frames, batch_size=None):
+        self.predicted += len(processed_frames['id'])
+        return [self._predict(x) for x in processed_frames['id']]
+
+def test_judge_dataset_gather(monkeypatch, tmp_path, canlist_bad):
+    monkeypatch.setattr('ids.rules.Rule.SAVE_PATH', tmp_path)
+    monkeypatch.setattr('ids.two_stage_ids.DNNBasedIDS', CountingDNN)
+    badlist, _ = canlist_bad
+    canlist = badlist[:20000]
+    ids = TwoStageIDS()
+    ids.rules.prepare(badlist[20000:], set_profile_id='gather')
+    ids.rules_trained = True
+    ids.dnn_trained = True
+    features = dp.generate_feature_lists(canlist, {})
+
+    # Reference: the DNN judges every frame that passed the rules.
+    reference = []
+    for rule_result, can_id in zip(ids.rules.test_series(canlist), features['id']):
+        reference.append(rule_result if rule_result[0] else CountingDNN._predict(can_id))
+
+    results = list(ids.judge_dataset(canlist, features))
+    assert results == reference
+    # Only the frames that passed the rules were run through the DNN.
+    num_passed = sum(not isinstance(x[1], str) for x in results)
+    assert ids.dnn.predicted == num_passed < len(canlist)
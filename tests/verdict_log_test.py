@@ -0,0 +1,73 @@
+"""Testing for the export of simulation judgements to verdict files"""
+
+import numpy as np
+import pytest
+
+from ids.judge import load_verdicts
+from ids.verdict_log import in_time_range, write_verdict_log
+
+LABELS = [None, 'random', 'flood']
+RULES = ['ID_Whitelist', 'MessageFrequency']
+
+
+def judgements(num_frames):
+    """Judgements of one frame every 0.1 s, as emitted by the simulation."""
+    reasons = [0.75, 'ID_Whitelist', None, 'MessageFrequency']
+    for i in range(num_frames):
+        reason = reasons[i % 4]
+        yield {
+            'Frame': {'id': i % 2048, 'timestamp': 1000 * i, 'data': b''},
+            'Label': LABELS[i % 3],
+            'Judgement': isinstance(reason, str) or i % 5 == 0,
+            'Reason': reason,
+            'Latency': 0.001 if i % 2 else None
+        }
+
+
+def test_in_time_range():
+    timestamps = np.array([0, 5000, 10000, 15000, 20000])
+    assert in_time_range(timestamps).all()
+    assert in_time_range(timestamps, 0.5, 2).tolist() == \
+        [False, True, True, True, False]
+    assert in_time_range(timestamps, stop=1).tolist() == \
+        [True, True, False, False, False]
+
+
+@pytest.mark.parametrize('compression', [None, 'gzip', 'lzma'])
+def test_write_verdict_log(tmp_path, compression):
+    path = str(tmp_path / 'report.verdicts')
+    written = write_verdict_log(judgements(1000), path, LABELS, RULES,
+                                compression=compression, chunk_size=128)
+    assert written == 1000
+    columns, attrs = load_verdicts(path)
+    assert attrs['rules'] == RULES and attrs['labels'] == LABELS
+    expected = list(judgements(1000))
+    assert columns['timestamp'].tolist() == [
+        x['Frame']['timestamp'] for x in expected]
+    assert columns['label'].tolist() == [i % 3 for i in range(1000)]
+    assert columns['verdict'].tolist() == [
+        int(x['Judgement']) for x in expected]
+    assert columns['rule'].tolist() == [[0, 1, 0, 2][i % 4]
+                                        for i in range(1000)]
+    assert columns['confidence'][0] == pytest.approx(0.75)
+    assert np.isnan(columns['confidence'][1:4]).all()
+    assert np.isnan(columns['latency'][0]) and columns['latency'][1] == \
+        pytest.approx(0.001)
+
+
+def test_write_verdict_log_time_range(tmp_path):
+    path = str(tmp_path / 'report.verdicts')
+    # Frames from 10 s up to, but not including, 25.5 s.
+    written = write_verdict_log(judgements(1000), path, LABELS, RULES,
+                                start=10, stop=25.5, chunk_size=64)
+    assert written == 155
+    columns, attrs = load_verdicts(path)
+    assert columns['timestamp'][0] == 100000
+    assert columns['timestamp'][-1] == 254000
+    assert attrs['time_range'] == [10, 25.5]
+
+    # Nothing in range still writes a valid, empty file.
+    assert write_verdict_log(judgements(10), path, LABELS, RULES,
+                             start=100) == 0
+    columns, _ = load_verdicts(path)
+    assert len(columns['verdict']) == 0 and 'latency' in columns